@@ -7,6 +7,7 @@ from an IoT device.
 from .iothub import *
 from .provisioning import *
 from .common import *
+from .common import MQTTNetworkLoop, HandlerExecutor
 from . import iothub
 from . import provisioning
 from . import common
@@ -24,4 +25,4 @@ if sys.version_info > (3, 5):  # This only works for python 3.5+ at present
 
 # iothub and common subpackages are still showing up in intellisense
 
-__all__ = iothub.__all__ + provisioning.__all__
+__all__ = iothub.__all__ + provisioning.__all__ + ["MQTTNetworkLoop", "HandlerExecutor"]
@@ -6,5 +6,7 @@ INTERNAL USAGE ONLY
 """
 
 from .models import X509
+from .mqtt_network_loop import MQTTNetworkLoop
+from .handler_executor import HandlerExecutor
 
-__all__ = ["X509"]
+__all__ = ["X509", "MQTTNetworkLoop", "HandlerExecutor"]
@@ -69,12 +69,10 @@ class AwaitableCallback(object):
                 result = None
 
             if exception:
-                logger.error(
-                    "Callback completed with error {}".format(exception), exc_info=exception
-                )
+                logger.error("Callback completed with error %s", exception, exc_info=exception)
                 loop.call_soon_threadsafe(self.future.set_exception, exception)
             else:
-                logger.debug("Callback completed with result {}".format(result))
+                logger.debug("Callback completed with result %s", result)
                 loop.call_soon_threadsafe(self.future.set_result, result)
 
         self.callback = wrapping_callback
@@ -0,0 +1,624 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an MQTT transport which runs on an asyncio event loop instead of Paho.
+
+AsyncMQTTTransport speaks MQTT 3.1.1 directly over asyncio streams, so any number of
+connections can be serviced by a single event loop without adding threads to the process.
+
+Python 3.5+ only.
+"""
+
+import asyncio
+import logging
+import ssl
+import struct
+import threading
+import traceback
+from . import mqtt_transport
+from . import transport_exceptions as exceptions
+from .mqtt_transport import MQTTTransport, OperationManager
+
+logger = logging.getLogger(__name__)
+
+# MQTT control packet types (the upper 4 bits of the fixed header)
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PUBREC = 0x50
+PUBREL = 0x60
+PUBCOMP = 0x70
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA0
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+# Flag set in the fixed header of a PUBLISH which is being sent again
+PUBLISH_DUP = 0x08
+
+# Largest payload that fits in an MQTT packet, as enforced by Paho
+MAX_PAYLOAD_SIZE = 268435455
+
+# CONNACK return codes, which are the same for MQTT 3.1.1 and Paho
+conack_rc_to_error = mqtt_transport.paho_conack_rc_to_error
+
+
+def encode_remaining_length(length):
+    """
+    Encode the remaining length field of an MQTT fixed header
+    """
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_packet(first_byte, body=b""):
+    """
+    Encode an MQTT packet from the first byte of its fixed header and its body
+    """
+    return bytes([first_byte]) + encode_remaining_length(len(body)) + body
+
+
+def encode_string(value):
+    """
+    Encode a string, or bytes, as an MQTT length-prefixed UTF-8 string
+    """
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return struct.pack("!H", len(value)) + value
+
+
+def encode_payload(payload):
+    """
+    Convert a payload to bytes, using the same conversions as Paho
+    """
+    if isinstance(payload, bytes):
+        return payload
+    elif isinstance(payload, str):
+        return payload.encode("utf-8")
+    elif isinstance(payload, (int, float)):
+        return str(payload).encode("ascii")
+    elif payload is None:
+        return b""
+    else:
+        raise TypeError("payload must be a string, bytearray, int, float or None.")
+
+
+def _validate_topic(topic, allow_wildcards):
+    if topic is None or len(topic) == 0:
+        raise ValueError("Invalid topic.")
+    if not allow_wildcards and ("+" in topic or "#" in topic):
+        raise ValueError("Publish topic cannot contain wildcards.")
+
+
+def _validate_qos(qos):
+    if qos < 0 or qos > 2:
+        raise ValueError("Invalid QoS level.")
+
+
+class AsyncMQTTTransport(object):
+    """
+    An MQTT transport with the same interface as MQTTTransport, which runs its connection on an
+    asyncio event loop.
+
+    The methods of this class do not block, and can be called from any thread.  The work is done on
+    the event loop, and the handler callbacks are called on the event loop thread.
+
+    :ivar on_mqtt_connected_handler: Event handler callback, called upon establishing a connection.
+    :type on_mqtt_connected_handler: Function
+    :ivar on_mqtt_disconnected_handler: Event handler callback, called upon a disconnection.
+    :type on_mqtt_disconnected_handler: Function
+    :ivar on_mqtt_message_received_handler: Event handler callback, called upon receiving a message.
+    :type on_mqtt_message_received_handler: Function
+    :ivar on_mqtt_connection_failure_handler: Event handler callback, called upon a connection failure.
+    :type on_mqtt_connection_failure_handler: Function
+    """
+
+    # TLS settings are handled exactly as for MQTTTransport, including sharing cached SSLContexts
+    _create_ssl_context = MQTTTransport._create_ssl_context
+    _build_ssl_context = MQTTTransport._build_ssl_context
+
+    def __init__(
+        self,
+        client_id,
+        hostname,
+        username,
+        ca_cert=None,
+        x509_cert=None,
+        websockets=False,
+        loop=None,
+        operation_timeout=None,
+        quiet_logging=False,
+    ):
+        """
+        Constructor to instantiate an asyncio MQTT protocol wrapper.
+        :param str client_id: The id of the client connecting to the broker.
+        :param str hostname: Hostname or IP address of the remote broker.
+        :param str username: Username for login to the remote broker.
+        :param str ca_cert: Certificate which can be used to validate a server-side TLS connection (optional).
+        :param x509_cert: Certificate which can be used to authenticate connection to a server in lieu of a password (optional).
+        :param bool websockets: Not supported.  Must be False.
+        :param loop: The event loop to run the connection on.  The loop must be running for the
+          transport to make progress.
+        :type loop: :class:`asyncio.AbstractEventLoop`
+        :param float operation_timeout: Number of seconds to wait for a PUBACK, SUBACK or UNSUBACK
+          before failing the operation with an OperationTimeoutError (optional).
+        :param bool quiet_logging: If True, log each message published or received at DEBUG
+          rather than INFO level (optional).
+
+        :raises: ValueError if websockets is True.
+        :raises: ValueError if loop is not provided.
+        """
+        if websockets:
+            raise ValueError("AsyncMQTTTransport does not support websockets")
+        if loop is None:
+            raise ValueError("AsyncMQTTTransport requires an event loop")
+
+        self._client_id = client_id
+        self._hostname = hostname
+        self._username = username
+        self._ca_cert = ca_cert
+        self._x509_cert = x509_cert
+        self._websockets = websockets
+        self._loop = loop
+        self._keepalive = mqtt_transport.DEFAULT_KEEPALIVE
+        self._message_log_level = logging.DEBUG if quiet_logging else logging.INFO
+
+        self.on_mqtt_connected_handler = None
+        self.on_mqtt_disconnected_handler = None
+        self.on_mqtt_message_received_handler = None
+        self.on_mqtt_connection_failure_handler = None
+
+        self._op_manager = OperationManager(operation_timeout=operation_timeout)
+        self._ssl_context = self._create_ssl_context()
+
+        # The following are only used on the event loop thread
+        self._password = None
+        self._connection_task = None
+        self._keepalive_task = None
+        self._writer = None
+        self._disconnecting = False
+        self._last_sent = 0
+        self._last_received = 0
+        # Maps mid->PUBLISH packet for QoS 1 messages which have not been acknowledged.  These are
+        # sent again when the transport reconnects, as Paho does for sessions which are not clean,
+        # unless they have since timed out.
+        self._unacknowledged_publishes = {}
+
+        # The following are used from any thread
+        self._connected = False
+        self._mid_lock = threading.Lock()
+        self._last_mid = 0
+
+    def connect(self, password=None):
+        """
+        Connect to the MQTT broker, using hostname and username set at instantiation.
+
+        The connection is made on the event loop.  On success on_mqtt_connected_handler is called,
+        and on failure on_mqtt_connection_failure_handler is called.
+
+        The password is not required if the transport was instantiated with an x509 certificate.
+
+        :param str password: The password for connecting with the MQTT broker (Optional).
+        """
+        logger.info("connecting to mqtt broker")
+        self._run_on_loop(self._connect, password)
+
+    def reconnect(self, password=None):
+        """
+        Reconnect to the MQTT broker, using username set at instantiation.
+
+        Any existing connection is closed first.  Unacknowledged QoS 1 publishes are sent again
+        once the new connection is established.
+
+        The password is not required if the transport was instantiated with an x509 certificate.
+
+        :param str password: The password for reconnecting with the MQTT broker (Optional).
+        """
+        logger.info("reconnecting MQTT client")
+        self._run_on_loop(self._connect, password)
+
+    def disconnect(self):
+        """
+        Disconnect from the MQTT broker.
+
+        Once the connection has closed, on_mqtt_disconnected_handler is called with no cause.
+        """
+        logger.info("disconnecting MQTT client")
+        self._run_on_loop(self._disconnect)
+
+    def subscribe(self, topic, qos=1, callback=None):
+        """
+        This method subscribes the client to one or more topics from the MQTT broker.
+
+        :param topic: a single string specifying the subscription topic to subscribe to, or a
+            list of topic strings to subscribe to with a single SUBSCRIBE packet.
+        :type topic: str or list(str)
+        :param int qos: the desired quality of service level for the subscription. Defaults to 1.
+        :param callback: A callback to be triggered upon completion (Optional). If the operation
+            times out, it is triggered with an OperationTimeoutError as the error keyword argument.
+
+        :raises: ValueError if qos is not 0, 1 or 2.
+        :raises: ValueError if topic is None, has zero string length, or is an empty list.
+        :raises: ConnectionDroppedError if the transport is not connected.
+        """
+        logger.info("subscribing to %s with qos %s", topic, qos)
+        _validate_qos(qos)
+        topics = topic if isinstance(topic, list) else [topic]
+        if not topics:
+            raise ValueError("Invalid topic.")
+        for t in topics:
+            _validate_topic(t, allow_wildcards=True)
+        mid = self._get_mid()
+        body = struct.pack("!H", mid) + b"".join(encode_string(t) + bytes([qos]) for t in topics)
+        self._send_operation(mid, encode_packet(SUBSCRIBE | 0x02, body), callback)
+
+    def unsubscribe(self, topic, callback=None):
+        """
+        Unsubscribe the client from one topic on the MQTT broker.
+
+        :param str topic: a single string which is the subscription topic to unsubscribe from.
+        :param callback: A callback to be triggered upon completion (Optional). If the operation
+            times out, it is triggered with an OperationTimeoutError as the error keyword argument.
+
+        :raises: ValueError if topic is None or has zero string length.
+        :raises: ConnectionDroppedError if the transport is not connected.
+        """
+        logger.info("unsubscribing from %s", topic)
+        _validate_topic(topic, allow_wildcards=True)
+        mid = self._get_mid()
+        body = struct.pack("!H", mid) + encode_string(topic)
+        self._send_operation(mid, encode_packet(UNSUBSCRIBE | 0x02, body), callback)
+
+    def publish(self, topic, payload, qos=1, callback=None):
+        """
+        Send a message via the MQTT broker.
+
+        :param str topic: topic: The topic that the message should be published on.
+        :param payload: The actual message to send.
+        :type payload: str, bytes, int, float or None
+        :param int qos: the desired quality of service level for the subscription. Defaults to 1.
+        :param callback: A callback to be triggered upon completion (Optional). For QoS 0, this is when
+            the message has been written to the socket rather than when it has been acknowledged. If the
+            operation times out, it is triggered with an OperationTimeoutError as the error keyword argument.
+
+        :raises: ValueError if qos is not 0 or 1
+        :raises: ValueError if topic is None or has zero string length
+        :raises: ValueError if topic contains a wildcard ("+" or "#")
+        :raises: ValueError if the length of the payload is greater than 268435455 bytes
+        :raises: TypeError if payload is not a valid type
+        :raises: ConnectionDroppedError if the transport is not connected.
+        """
+        logger.log(self._message_log_level, "publishing on %s", topic)
+        if qos not in (0, 1):
+            raise ValueError("AsyncMQTTTransport only supports publishing with QoS 0 or 1.")
+        _validate_topic(topic, allow_wildcards=False)
+        payload = encode_payload(payload)
+        if len(payload) > MAX_PAYLOAD_SIZE:
+            raise ValueError("Payload too large.")
+
+        mid = self._get_mid()
+        body = encode_string(topic)
+        if qos:
+            body += struct.pack("!H", mid)
+        packet = encode_packet(PUBLISH | (qos << 1), body + payload)
+        if qos:
+            callback = self._forget_publish_on_failure(mid, packet, callback)
+        self._send_operation(mid, packet, callback)
+
+    def _get_mid(self):
+        """
+        Allocate the next message identifier.  MIDs are between 1 and 65535, as in Paho.
+        """
+        with self._mid_lock:
+            self._last_mid = self._last_mid % 65535 + 1
+            return self._last_mid
+
+    def _forget_publish_on_failure(self, mid, packet, callback):
+        """
+        Return a completion callback for a QoS 1 publish which, if the publish times out, stops it
+        from being sent again on reconnect before calling the given callback.
+        """
+
+        def on_complete(error=None):
+            if error:
+                try:
+                    self._run_on_loop(self._forget_publish, mid, packet)
+                finally:
+                    if callback:
+                        callback(error=error)
+            elif callback:
+                callback()
+
+        return on_complete
+
+    def _forget_publish(self, mid, packet):
+        # The mid may have been reused by a later publish, which must still be sent again
+        if self._unacknowledged_publishes.get(mid) is packet:
+            del self._unacknowledged_publishes[mid]
+
+    def _run_on_loop(self, func, *args):
+        self._loop.call_soon_threadsafe(func, *args)
+
+    def _send_operation(self, mid, packet, callback):
+        if not self._connected:
+            raise exceptions.ConnectionDroppedError("Transport is not connected")
+        # Establish the operation before the packet is sent, so that the response can never be
+        # received first
+        self._op_manager.establish_operation(mid, callback)
+        self._run_on_loop(self._send_operation_packet, mid, packet)
+
+    def _send_operation_packet(self, mid, packet):
+        command = packet[0] & 0xF0
+        qos = (packet[0] >> 1) & 0x03
+        if command == PUBLISH and qos:
+            self._unacknowledged_publishes[mid] = packet
+        if not self._write(packet):
+            # The connection was lost after the operation was established.  QoS 1 publishes are
+            # sent again upon reconnection, QoS 0 publishes are failed, and other operations will
+            # time out.
+            logger.warning("Connection lost before MID: %s could be sent", mid)
+            if command == PUBLISH and not qos:
+                self._op_manager.complete_operation(
+                    mid,
+                    error=exceptions.ConnectionDroppedError(
+                        "Connection lost before the message could be sent"
+                    ),
+                )
+        elif command == PUBLISH and not qos:
+            # QoS 0 publishes are complete as soon as they have been handed to the socket
+            self._op_manager.complete_operation(mid)
+
+    def _write(self, data):
+        if not self._writer or self._writer.transport.is_closing():
+            return False
+        self._writer.write(data)
+        self._last_sent = self._loop.time()
+        return True
+
+    async def _open_connection(self):
+        return await asyncio.open_connection(
+            host=self._hostname,
+            port=mqtt_transport.DEFAULT_PORT,
+            ssl=self._ssl_context,
+            server_hostname=self._hostname,
+        )
+
+    def _connect(self, password):
+        self._password = password
+        if self._connection_task:
+            # Close the existing connection without reporting a disconnection, as Paho does
+            self._connection_task.cancel()
+            self._close_connection()
+        self._disconnecting = False
+        self._connection_task = asyncio.ensure_future(self._run_connection(), loop=self._loop)
+
+    def _disconnect(self):
+        if not self._connection_task:
+            logger.info("not connected - nothing to disconnect")
+            return
+        if not self._writer:
+            # Still opening the connection, so there is nothing to close
+            self._connection_task.cancel()
+            self._connection_task = None
+            self._call_handler("on_mqtt_disconnected_handler", None)
+            return
+        self._disconnecting = True
+        self._write(encode_packet(DISCONNECT))
+        self._close_connection()
+
+    def _close_connection(self):
+        self._connected = False
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    async def _run_connection(self):
+        """
+        Establish a connection, then read and handle packets until it is closed
+        """
+        task = self._connection_task
+        connack_received = False
+        cause = None
+        try:
+            reader, self._writer = await self._open_connection()
+            self._write(self._encode_connect())
+            self._last_received = self._loop.time()
+            while True:
+                first_byte, body = await self._read_packet(reader)
+                self._last_received = self._loop.time()
+                if not connack_received:
+                    if first_byte & 0xF0 != CONNACK:
+                        raise exceptions.ProtocolClientError("Expected CONNACK")
+                    connack_received = True
+                    self._handle_connack(body)
+                else:
+                    self._handle_packet(first_byte, body)
+        except asyncio.CancelledError:
+            # The connection was replaced by reconnect()
+            return
+        except (
+            OSError,
+            EOFError,
+            ssl.SSLError,
+            exceptions.ProtocolClientError,
+            _ConnectionRefused,
+        ) as e:
+            cause = e
+        except Exception as e:
+            logger.error("Unexpected error in MQTT connection")
+            logger.error(traceback.format_exc())
+            cause = e
+        finally:
+            if self._connection_task is task:
+                self._connection_task = None
+                self._close_connection()
+
+        if self._disconnecting:
+            logger.info("disconnected")
+            self._call_handler("on_mqtt_disconnected_handler", None)
+        elif isinstance(cause, _ConnectionRefused):
+            logger.info("connection refused: %s", cause.error)
+            self._call_handler("on_mqtt_connection_failure_handler", cause.error)
+        elif not connack_received:
+            logger.info("connection failed: %s", cause)
+            self._call_handler(
+                "on_mqtt_connection_failure_handler",
+                exceptions.ConnectionFailedError(cause=cause),
+            )
+        else:
+            logger.info("connection dropped: %s", cause)
+            self._call_handler(
+                "on_mqtt_disconnected_handler", exceptions.ConnectionDroppedError(cause=cause)
+            )
+
+    async def _read_packet(self, reader):
+        """
+        Read one packet, and return its first byte and its body
+        """
+        header = await reader.readexactly(1)
+        length = 0
+        multiplier = 1
+        while True:
+            (byte,) = await reader.readexactly(1)
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+            if multiplier > 128**3:
+                raise exceptions.ProtocolClientError("Malformed remaining length")
+        body = await reader.readexactly(length)
+        return header[0], body
+
+    def _encode_connect(self):
+        # Clean session is never set, so that the broker keeps subscriptions and QoS 1 messages
+        # across reconnections, as with MQTTTransport
+        flags = 0
+        payload = encode_string(self._client_id)
+        if self._username is not None:
+            flags |= 0x80
+            payload += encode_string(self._username)
+            if self._password is not None:
+                flags |= 0x40
+                payload += encode_string(self._password)
+        body = encode_string("MQTT") + bytes([4, flags]) + struct.pack("!H", self._keepalive)
+        return encode_packet(CONNECT, body + payload)
+
+    def _handle_connack(self, body):
+        rc = body[1]
+        logger.info("connected with result code: %s", rc)
+        if rc:
+            error_class = conack_rc_to_error.get(rc, exceptions.ProtocolClientError)
+            raise _ConnectionRefused(error_class(message="CONNACK rc: {}".format(rc)))
+
+        self._connected = True
+        self._keepalive_task = asyncio.ensure_future(self._keep_alive(), loop=self._loop)
+        # Send again any QoS 1 messages that were not acknowledged on the previous connection
+        for mid in sorted(self._unacknowledged_publishes):
+            packet = self._unacknowledged_publishes[mid]
+            logger.debug("resending unacknowledged publish for MID: %s", mid)
+            self._write(bytes([packet[0] | PUBLISH_DUP]) + packet[1:])
+        self._call_handler("on_mqtt_connected_handler")
+
+    def _handle_packet(self, first_byte, body):
+        command = first_byte & 0xF0
+        if command == PUBLISH:
+            self._handle_publish(first_byte, body)
+        elif command == PUBACK:
+            (mid,) = struct.unpack("!H", body[:2])
+            logger.log(self._message_log_level, "payload published for %s", mid)
+            self._unacknowledged_publishes.pop(mid, None)
+            self._op_manager.complete_operation(mid)
+        elif command == SUBACK:
+            (mid,) = struct.unpack("!H", body[:2])
+            logger.info("suback received for %s", mid)
+            self._op_manager.complete_operation(mid)
+        elif command == UNSUBACK:
+            (mid,) = struct.unpack("!H", body[:2])
+            logger.info("UNSUBACK received for %s", mid)
+            self._op_manager.complete_operation(mid)
+        elif command == PUBREL:
+            # Final step of receiving a QoS 2 message
+            self._write(encode_packet(PUBCOMP, body[:2]))
+        elif command == PINGRESP:
+            pass
+        else:
+            raise exceptions.ProtocolClientError("Unexpected packet type: {}".format(first_byte))
+
+    def _handle_publish(self, first_byte, body):
+        qos = (first_byte >> 1) & 0x03
+        (topic_len,) = struct.unpack("!H", body[:2])
+        topic = body[2 : 2 + topic_len].decode("utf-8")
+        pos = 2 + topic_len
+        if qos:
+            (mid,) = struct.unpack("!H", body[pos : pos + 2])
+            pos += 2
+        logger.log(self._message_log_level, "message received on %s", topic)
+
+        if self.on_mqtt_message_received_handler:
+            try:
+                self.on_mqtt_message_received_handler(topic, body[pos:])
+            except Exception:
+                logger.error("Unexpected error calling on_mqtt_message_received_handler")
+                logger.error(traceback.format_exc())
+        else:
+            logger.warning(
+                "No event handler callback set for on_mqtt_message_received_handler - DROPPING MESSAGE"
+            )
+
+        if qos == 1:
+            self._write(encode_packet(PUBACK, struct.pack("!H", mid)))
+        elif qos == 2:
+            self._write(encode_packet(PUBREC, struct.pack("!H", mid)))
+
+    async def _keep_alive(self):
+        """
+        Send a PINGREQ whenever nothing has been sent for a keepalive interval, and drop the
+        connection if nothing has been received for one and a half intervals
+        """
+        while True:
+            await asyncio.sleep(self._keepalive / 2.0)
+            now = self._loop.time()
+            if now - self._last_received >= self._keepalive * 1.5:
+                logger.warning("keepalive timeout - dropping connection")
+                if self._writer:
+                    self._writer.transport.abort()
+                return
+            if now - self._last_sent >= self._keepalive:
+                self._write(encode_packet(PINGREQ))
+
+    def _call_handler(self, name, *args):
+        handler = getattr(self, name)
+        if handler:
+            try:
+                handler(*args)
+            except Exception:
+                logger.error("Unexpected error calling {}".format(name))
+                logger.error(traceback.format_exc())
+        else:
+            logger.warning("No event handler callback set for {}".format(name))
+
+
+class _ConnectionRefused(Exception):
+    """
+    The broker refused the connection.  Wraps the error to report to the connection failure handler.
+    """
+
+    def __init__(self, error):
+        super(_ConnectionRefused, self).__init__(error)
+        self.error = error
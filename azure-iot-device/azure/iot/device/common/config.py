@@ -15,9 +15,183 @@ class BasePipelineConfig(object):
     config files.
     """
 
-    def __init__(self, websockets=False):
+    def __init__(
+        self,
+        websockets=False,
+        network_loop=None,
+        max_in_flight_messages=None,
+        in_flight_policy="wait",
+        telemetry_qos=1,
+        operation_timeout=None,
+        max_pending_requests=None,
+        asyncio_loop=None,
+        message_store_path=None,
+        message_store_durability="full",
+        message_store_batch_size=100,
+        message_store_max_attempts=10,
+        executor_shards=None,
+        tracer=None,
+        handler_executor=None,
+        quiet_logging=False,
+        auto_reconnect=False,
+        reconnect_initial_delay=1,
+        reconnect_max_delay=60,
+        reconnect_max_attempts=None,
+        connection_state_handler=None,
+        telemetry_batch_max_messages=None,
+        telemetry_batch_max_bytes=255 * 1024,
+        telemetry_batch_linger=0.1,
+        compression_threshold=None,
+        compression_method="gzip",
+    ):
         """Initializer for BasePipelineConfig
 
         :param bool websockets: Enabling/disabling websockets in MQTT. This feature is relevant if a firewall blocks port 8883 from use.
+        :param network_loop: A shared network loop which services the MQTT connection, instead of a dedicated
+            network thread per client. This feature is relevant when hosting many clients in a single process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
+        :param int max_in_flight_messages: The maximum number of messages that can be sent but not yet acknowledged.
+            Default is None (no limit).
+        :param str in_flight_policy: What to do with a new message when max_in_flight_messages has been reached (or
+            a new request, such as a twin request, when max_pending_requests has been reached). "wait" (default) waits
+            for an in-flight message to be acknowledged (or a response to arrive), and "fail" fails it immediately.
+        :param int telemetry_qos: The MQTT quality of service level used to send messages. With 0, a send completes as
+            soon as the message has been written to the network, without waiting for an acknowledgement, and the
+            message may be lost. Default is 1.
+        :param float operation_timeout: Number of seconds to wait for the service to acknowledge a message, subscribe
+            or unsubscribe, or to respond to a request, before failing it with a timeout error. Default is None (waits
+            indefinitely). A message which times out may still be resent when the connection is re-established, so
+            the service may receive a message whose send failed.
+        :param int max_pending_requests: The maximum number of requests (such as twin requests) that can be waiting
+            for a response from the service. Default is None (no limit).
+        :param asyncio_loop: An asyncio event loop on which to run the MQTT connection, using a native asyncio
+            transport instead of Paho. This feature is relevant when hosting many clients in an asyncio application.
+            Cannot be combined with websockets or network_loop. Python 3.5+ only.
+        :type asyncio_loop: :class:`asyncio.AbstractEventLoop`
+        :param str message_store_path: Path of a database file in which to store outgoing messages until the service
+            has acknowledged them. Messages are accepted while the client is offline, and are kept across restarts.
+            Default is None (messages are not stored).
+        :param str message_store_durability: How the message store is synced to disk. "full" (default) syncs each
+            message before accepting it, "normal" syncs periodically (messages survive the process crashing, but not
+            necessarily the machine losing power), and "off" leaves writing to the operating system.
+        :param int message_store_batch_size: The maximum number of stored messages sent at once. Default is 100.
+        :param int message_store_max_attempts: The number of times a stored message is sent and fails before it is
+            dropped from the store, and the error reported as a background exception, so that it doesn't hold up
+            the messages behind it. A message which can never be sent (such as one which is too large) is dropped
+            after the first attempt. Default is 10.
+        :param executor_shards: How the pipeline and callback threads are shared between clients. Default is None
+            (all clients in the process share one pipeline thread and one callback thread). "per_client" gives each
+            client its own pipeline and callback threads, so a busy client or a slow handler doesn't hold up other
+            clients. An int shares this many pipeline threads (and as many callback threads) between all clients,
+            with each client always assigned to the same one by a hash of its ID.
+        :type executor_shards: int or str
+        :param tracer: A tracer to which the pipeline reports how long each operation and event spends in each
+            stage, and how long work waits for the pipeline and callback threads. Default is None (not traced).
+        :type tracer: :class:`azure.iot.device.common.pipeline.pipeline_tracing.PipelineTracer`
+        :param handler_executor: A pool of threads on which to deliver received messages, method requests and twin
+            patches, instead of the single callback thread of the client. Events of the same type (and messages on
+            the same input) are still delivered in order. This feature is relevant when handlers are slow, and can be
+            shared between clients.
+        :type handler_executor: :class:`azure.iot.device.HandlerExecutor`
+        :param bool quiet_logging: If True, the messages logged for every message sent or received (such as
+            "payload published for <mid>") are logged at DEBUG rather than INFO level. This feature is relevant for
+            clients which send or receive many messages with INFO logging enabled. Default is False.
+        :param bool auto_reconnect: If True, the client reconnects as soon as its connection drops, rather than when
+            it next needs the connection, for as long as it is meant to be connected (i.e. from a successful connect
+            until disconnect is called). Default is False.
+        :param float reconnect_initial_delay: The maximum number of seconds to wait before the first reconnect
+            attempt. The wait before each attempt is random, up to a maximum which doubles after each failed attempt.
+            Default is 1.
+        :param float reconnect_max_delay: The largest maximum number of seconds to wait before a reconnect attempt.
+            Default is 60.
+        :param int reconnect_max_attempts: The number of reconnect attempts in a row which can fail before the client
+            stops reconnecting and reports the error. Default is None (no limit).
+        :param connection_state_handler: A function which is called with the state of the connection ("connected",
+            "disconnected", "reconnecting" or "failed") every time it changes. Default is None.
+        :param int telemetry_batch_max_messages: If set, messages with JSON payloads are combined into batches of up to
+            this many messages, each sent as a single message whose payload is a JSON array of their payloads. This
+            feature is relevant for clients which send many small messages, as the service counts (and throttles) each
+            batch as one message. Default is None (messages are not batched).
+        :param int telemetry_batch_max_bytes: The maximum size of the payload of a batch of messages, in bytes. Cannot be
+            more than 262144 (256 KB, the largest message the service accepts, including its properties). Default is
+            261120 (255 KB).
+        :param float telemetry_batch_linger: The number of seconds a batch of messages waits for more messages before it
+            is sent. Default is 0.1.
+        :param int compression_threshold: If set, the payloads of messages (with a content_encoding of "utf-8") of at
+            least this many bytes are compressed, and the content_encoding of the message is set to the compression
+            method. Received messages with a content_encoding of "gzip" or "deflate" are decompressed. This feature
+            is relevant for clients which send large, compressible payloads over metered links. Default is None
+            (messages are not compressed).
+        :param str compression_method: How payloads are compressed, "gzip" (default) or "deflate".
+
+        :raises: ValueError if max_in_flight_messages, in_flight_policy, telemetry_qos, operation_timeout,
+            max_pending_requests, message_store_durability, message_store_batch_size, message_store_max_attempts,
+            executor_shards, reconnect_initial_delay, reconnect_max_delay, reconnect_max_attempts,
+            telemetry_batch_max_messages, telemetry_batch_max_bytes, telemetry_batch_linger, compression_threshold or
+            compression_method is invalid, or if asyncio_loop is combined with websockets or network_loop.
         """
+        if max_in_flight_messages is not None and max_in_flight_messages < 1:
+            raise ValueError("max_in_flight_messages must be at least 1")
+        if in_flight_policy not in ("wait", "fail"):
+            raise ValueError("in_flight_policy must be 'wait' or 'fail'")
+        if telemetry_qos not in (0, 1):
+            raise ValueError("telemetry_qos must be 0 or 1")
+        if operation_timeout is not None and operation_timeout <= 0:
+            raise ValueError("operation_timeout must be greater than 0")
+        if max_pending_requests is not None and max_pending_requests < 1:
+            raise ValueError("max_pending_requests must be at least 1")
+        if asyncio_loop is not None and (websockets or network_loop is not None):
+            raise ValueError("asyncio_loop cannot be combined with websockets or network_loop")
+        if message_store_durability not in ("full", "normal", "off"):
+            raise ValueError("message_store_durability must be 'full', 'normal' or 'off'")
+        if message_store_batch_size < 1:
+            raise ValueError("message_store_batch_size must be at least 1")
+        if message_store_max_attempts < 1:
+            raise ValueError("message_store_max_attempts must be at least 1")
+        if executor_shards not in (None, "per_client") and (
+            not isinstance(executor_shards, int) or executor_shards < 1
+        ):
+            raise ValueError("executor_shards must be None, 'per_client' or at least 1")
+        if reconnect_initial_delay <= 0:
+            raise ValueError("reconnect_initial_delay must be greater than 0")
+        if reconnect_max_delay < reconnect_initial_delay:
+            raise ValueError("reconnect_max_delay must be at least reconnect_initial_delay")
+        if reconnect_max_attempts is not None and reconnect_max_attempts < 1:
+            raise ValueError("reconnect_max_attempts must be at least 1")
+        if telemetry_batch_max_messages is not None and telemetry_batch_max_messages < 1:
+            raise ValueError("telemetry_batch_max_messages must be at least 1")
+        if not 0 < telemetry_batch_max_bytes <= 256 * 1024:
+            raise ValueError("telemetry_batch_max_bytes must be between 1 and 262144")
+        if telemetry_batch_linger < 0:
+            raise ValueError("telemetry_batch_linger cannot be negative")
+        if compression_threshold is not None and compression_threshold < 0:
+            raise ValueError("compression_threshold cannot be negative")
+        if compression_method not in ("gzip", "deflate"):
+            raise ValueError("compression_method must be 'gzip' or 'deflate'")
+
         self.websockets = websockets
+        self.network_loop = network_loop
+        self.max_in_flight_messages = max_in_flight_messages
+        self.in_flight_policy = in_flight_policy
+        self.telemetry_qos = telemetry_qos
+        self.operation_timeout = operation_timeout
+        self.max_pending_requests = max_pending_requests
+        self.asyncio_loop = asyncio_loop
+        self.message_store_path = message_store_path
+        self.message_store_durability = message_store_durability
+        self.message_store_batch_size = message_store_batch_size
+        self.message_store_max_attempts = message_store_max_attempts
+        self.executor_shards = executor_shards
+        self.tracer = tracer
+        self.handler_executor = handler_executor
+        self.quiet_logging = quiet_logging
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_initial_delay = reconnect_initial_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.reconnect_max_attempts = reconnect_max_attempts
+        self.connection_state_handler = connection_state_handler
+        self.telemetry_batch_max_messages = telemetry_batch_max_messages
+        self.telemetry_batch_max_bytes = telemetry_batch_max_bytes
+        self.telemetry_batch_linger = telemetry_batch_linger
+        self.compression_threshold = compression_threshold
+        self.compression_method = compression_method
@@ -44,11 +44,10 @@ class EventedCallback(object):
 
             if self.exception:
                 logger.error(
-                    "Callback completed with error {}".format(self.exception),
-                    exc_info=self.exception,
+                    "Callback completed with error %s", self.exception, exc_info=self.exception
                 )
             else:
-                logger.debug("Callback completed with result {}".format(self.result))
+                logger.debug("Callback completed with result %s", self.result)
 
             self.completion_event.set()
 
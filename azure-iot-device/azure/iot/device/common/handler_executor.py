@@ -0,0 +1,126 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an executor which runs the handlers of many clients on a pool of
+threads, while keeping the handlers for any one stream of events in order.
+"""
+
+import collections
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from azure.iot.device.common import handle_exceptions
+
+logger = logging.getLogger(__name__)
+
+
+class HandlerExecutor(object):
+    """
+    A pool of threads on which to run the handlers which deliver events (such as received
+    messages and method requests) to the application.
+
+    Each handler is submitted with a key.  Handlers with the same key run one at a time, in the
+    order they were submitted, while handlers with different keys run in parallel.  A client
+    uses a different key for each of its streams of events (such as each input), so a slow
+    handler for one stream doesn't hold up the others, or the streams of other clients sharing
+    the executor.
+
+    Worker threads are named "callback", like the callback thread of a pipeline, since they run
+    the same code.
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        :param int max_workers: The number of worker threads.  At most this many handlers run at
+          the same time.
+
+        :raises: ValueError if max_workers is less than 1.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        # Maps key->deque of (future, func, args, kwargs) for every key with a handler running
+        # or waiting to run.  The handler at the front of each deque is the running one.
+        self._pending = {}
+
+    @property
+    def pending_count(self):
+        """
+        The number of handlers which are running or waiting to run.
+        """
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on a worker thread, after every handler previously submitted
+        with the same key has completed.
+
+        :param key: A hashable value identifying the stream of events that the handler is for.
+        :returns: A concurrent.futures.Future for the result of the handler.
+        """
+        future = Future()
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.append((future, func, args, kwargs))
+                return future
+            self._pending[key] = collections.deque([(future, func, args, kwargs)])
+        self._executor.submit(self._run_next, key)
+        return future
+
+    def _run_next(self, key):
+        """
+        Run the handler at the front of the queue for the given key, then give the worker back
+        to the pool, so that a key with many handlers waiting doesn't hold a worker for long.
+        """
+        threading.current_thread().name = "callback"
+        with self._lock:
+            future, func, args, kwargs = self._pending[key][0]
+        run = future.set_running_or_notify_cancel()
+        result = error = None
+        try:
+            if run:
+                result = func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            handle_exceptions.handle_background_exception(e)
+        finally:
+            with self._lock:
+                pending = self._pending[key]
+                pending.popleft()
+                if not pending:
+                    del self._pending[key]
+                    pending = None
+            if pending is not None:
+                self._executor.submit(self._run_next, key)
+        # The future is only resolved once the handler is off the queue, so that pending_count
+        # is up to date for anyone waiting on it.
+        if run:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads once every submitted handler has run.
+
+        :param bool wait: If True, wait for the handlers to run before returning.
+        """
+        # Handlers for a key are submitted to the pool one after another, so wait for the queues
+        # to drain before shutting the pool down.
+        if wait:
+            while self.pending_count:
+                with self._lock:
+                    futures = [pending[-1][0] for pending in self._pending.values()]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception:
+                        pass
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,276 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a network loop which can drive the sockets of many MQTT clients
+from a small, fixed number of threads.
+"""
+
+import collections
+import logging
+import socket
+import threading
+import time
+import traceback
+
+try:
+    import selectors
+except ImportError:
+    # Python 2.7 does not have the selectors module.  MQTTNetworkLoop is not available there.
+    selectors = None
+
+logger = logging.getLogger(__name__)
+
+# Interval (in seconds) at which loop_misc() is called on every registered client.  Paho uses
+# loop_misc() to send PINGREQ packets and to detect keepalive timeouts, so this only needs to be
+# a fraction of the keepalive interval.
+MISC_INTERVAL = 1.0
+
+# Commands posted to a loop thread from other threads
+_CMD_OPEN = "open"
+_CMD_CLOSE = "close"
+_CMD_REGISTER_WRITE = "register_write"
+_CMD_UNREGISTER_WRITE = "unregister_write"
+_CMD_STOP = "stop"
+
+
+class MQTTNetworkLoop(object):
+    """
+    A shared network loop for Paho MQTT clients.
+
+    By default, every MQTTTransport calls Paho's loop_start(), which spawns a dedicated network
+    thread for each client.  An MQTTNetworkLoop instead runs a fixed number of threads, each of
+    which waits on the sockets of many clients at once using the selectors module, and calls
+    loop_read(), loop_write() and loop_misc() on each client as its socket becomes ready.
+
+    Each socket is assigned to the least loaded thread when it is opened, and stays on that
+    thread until it is closed.
+
+    Unlike loop_start(), this loop does not automatically reconnect a client whose connection
+    has dropped.  Reconnection is left to the pipeline.
+
+    Requires Python 3.4+.
+    """
+
+    def __init__(self, num_threads=1):
+        """
+        Initializer for MQTTNetworkLoop.
+
+        :param int num_threads: The number of threads used to service client sockets.
+        """
+        if selectors is None:
+            raise NotImplementedError("MQTTNetworkLoop requires Python 3.4+")
+        if num_threads < 1:
+            raise ValueError("num_threads must be at least 1")
+        self._lock = threading.Lock()
+        self._loop_threads = [
+            _NetworkLoopThread(name="mqtt-network-loop-{}".format(i)) for i in range(num_threads)
+        ]
+        # Maps socket->loop thread, so that socket events are posted to the thread that owns it
+        self._socket_owners = {}
+
+    @property
+    def num_threads(self):
+        return len(self._loop_threads)
+
+    @property
+    def socket_count(self):
+        """
+        The number of client sockets currently being serviced by this loop.
+        """
+        with self._lock:
+            return len(self._socket_owners)
+
+    def attach(self, mqtt_client):
+        """
+        Configure a Paho client to be driven by this loop instead of loop_start().
+
+        The client will be serviced by the loop whenever it has an open socket, i.e. from the
+        time connect() or reconnect() is called until the connection is closed.
+
+        :param mqtt_client: The Paho client object.
+        """
+        mqtt_client.on_socket_open = self._on_socket_open
+        mqtt_client.on_socket_close = self._on_socket_close
+        mqtt_client.on_socket_register_write = self._on_socket_register_write
+        mqtt_client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def stop(self):
+        """
+        Stop all loop threads.  Any sockets still registered with the loop will no longer be
+        serviced.
+        """
+        for loop_thread in self._loop_threads:
+            loop_thread.stop()
+        with self._lock:
+            self._socket_owners = {}
+
+    def _on_socket_open(self, client, userdata, sock):
+        with self._lock:
+            loop_thread = min(self._loop_threads, key=lambda t: t.socket_count)
+            self._socket_owners[sock] = loop_thread
+            loop_thread.socket_count += 1
+        logger.debug("Registering socket for %s with %s", client, loop_thread.name)
+        loop_thread.post(_CMD_OPEN, sock, client)
+
+    def _on_socket_close(self, client, userdata, sock):
+        with self._lock:
+            loop_thread = self._socket_owners.pop(sock, None)
+            if loop_thread:
+                loop_thread.socket_count -= 1
+        if loop_thread:
+            logger.debug("Unregistering socket for %s from %s", client, loop_thread.name)
+            loop_thread.post(_CMD_CLOSE, sock, client)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        with self._lock:
+            loop_thread = self._socket_owners.get(sock)
+        if loop_thread:
+            loop_thread.post(_CMD_REGISTER_WRITE, sock, client)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        with self._lock:
+            loop_thread = self._socket_owners.get(sock)
+        if loop_thread:
+            loop_thread.post(_CMD_UNREGISTER_WRITE, sock, client)
+
+
+class _NetworkLoopThread(object):
+    """
+    A single thread servicing a set of client sockets with a selector.
+
+    Selectors are not thread-safe, so all changes to the set of registered sockets are posted
+    to the loop thread as commands and applied by the loop thread itself.  A socketpair is
+    used to wake the thread up when a command is posted.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # Number of sockets assigned to this thread.  Maintained by MQTTNetworkLoop under its lock.
+        self.socket_count = 0
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, None)
+        # deque.append() and deque.popleft() are thread-safe
+        self._commands = collections.deque()
+        # Maps socket->client for every socket registered with the selector
+        self._clients = {}
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def post(self, command, sock=None, client=None):
+        """
+        Post a command to the loop thread, starting the thread if necessary.
+        """
+        self._ensure_started()
+        self._commands.append((command, sock, client))
+        try:
+            self._wakeup_send.send(b"\x00")
+        except (socket.error, OSError):
+            # The wakeup socket buffer is full, which means the thread is already
+            # guaranteed to wake up.
+            pass
+
+    def stop(self):
+        if self._thread:
+            self.post(_CMD_STOP)
+            if threading.current_thread() is not self._thread:
+                self._thread.join()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name=self.name)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        logger.debug("%s: starting", self.name)
+        next_misc = time.time() + MISC_INTERVAL
+        while True:
+            if not self._process_commands():
+                break
+
+            timeout = max(0.0, next_misc - time.time())
+            for key, mask in self._selector.select(timeout):
+                if key.data is None:
+                    self._drain_wakeup()
+                else:
+                    self._service(key.fileobj, key.data, mask)
+
+            now = time.time()
+            if now >= next_misc:
+                next_misc = now + MISC_INTERVAL
+                for client in list(self._clients.values()):
+                    self._call(client, "loop_misc")
+
+        for sock in list(self._clients):
+            self._unregister(sock)
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        logger.debug("%s: stopped", self.name)
+
+    def _process_commands(self):
+        """
+        Apply all pending commands.  Returns False if the thread has been asked to stop.
+        """
+        while self._commands:
+            command, sock, client = self._commands.popleft()
+            if command == _CMD_OPEN:
+                self._unregister(sock)
+                self._clients[sock] = client
+                events = selectors.EVENT_READ
+                if client.want_write():
+                    events |= selectors.EVENT_WRITE
+                self._selector.register(sock, events, client)
+            elif command == _CMD_CLOSE:
+                self._unregister(sock)
+            elif command in (_CMD_REGISTER_WRITE, _CMD_UNREGISTER_WRITE):
+                if sock in self._clients:
+                    events = selectors.EVENT_READ
+                    if command == _CMD_REGISTER_WRITE:
+                        events |= selectors.EVENT_WRITE
+                    try:
+                        self._selector.modify(sock, events, client)
+                    except (KeyError, ValueError, OSError):
+                        # The socket was closed by another thread before we got here.  The
+                        # close command is right behind this one.
+                        pass
+            elif command == _CMD_STOP:
+                return False
+        return True
+
+    def _unregister(self, sock):
+        if self._clients.pop(sock, None) is not None:
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError, OSError):
+                pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (socket.error, OSError):
+            pass
+
+    def _service(self, sock, client, mask):
+        if mask & selectors.EVENT_READ:
+            self._call(client, "loop_read")
+            # TLS sockets can hold decrypted data which select() does not know about.
+            pending = getattr(sock, "pending", None)
+            while pending and client.socket() is sock and pending():
+                self._call(client, "loop_read")
+        if mask & selectors.EVENT_WRITE and sock in self._clients:
+            self._call(client, "loop_write")
+
+    def _call(self, client, method_name):
+        try:
+            getattr(client, method_name)()
+        except Exception:
+            logger.error("Unexpected error calling %s on %s", method_name, client)
+            logger.error(traceback.format_exc())
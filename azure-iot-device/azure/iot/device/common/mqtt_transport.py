@@ -5,9 +5,13 @@
 # --------------------------------------------------------------------------
 
 import paho.mqtt.client as mqtt
+import collections
+import hashlib
 import logging
+import os
 import ssl
 import threading
+import time
 import traceback
 import weakref
 from . import transport_exceptions as exceptions
@@ -48,6 +52,18 @@ paho_rc_to_error = {
 # to make sure the connection is still open.
 DEFAULT_KEEPALIVE = 60
 
+# Ports used for MQTT over TLS, and for MQTT over websockets
+DEFAULT_PORT = 8883
+WEBSOCKETS_PORT = 443
+
+# Responses for unknown MIDs are kept until the operation is established, but no longer than
+# this many seconds, and no more than this many at a time
+UNKNOWN_COMPLETION_TTL = 60
+MAX_UNKNOWN_COMPLETIONS = 1000
+
+# Monotonic clock used for operation deadlines, where available
+_now = getattr(time, "monotonic", time.time)
+
 
 def _create_error_from_conack_rc_code(rc):
     """
@@ -71,6 +87,149 @@ def _create_error_from_rc_code(rc):
         return exceptions.ProtocolClientError("Unknown CONACK rc={}".format(rc))
 
 
+def _digest(value):
+    """
+    Return a digest of a (possibly secret) string, suitable for use in a cache key
+    """
+    if value is None:
+        return None
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+
+def _get_file_stamp(path):
+    """
+    Return a value which changes whenever the file at the given path is modified
+    """
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except (OSError, IOError):
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+class SSLContextCache(object):
+    """
+    A cache of SSLContext objects, so that transports with identical TLS settings can share one.
+
+    Contexts are held with weak references, so a context is freed once no transport uses it.
+    A cached context is rebuilt if the certificate or key file it was loaded from has changed.
+
+    :ivar hits: Number of times a cached context was returned.
+    :ivar misses: Number of times a new context had to be created.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Maps key->(file stamps, weak reference to SSLContext)
+        self._contexts = {}
+        # Keys of entries whose context has been freed.  deque.append() is thread-safe.
+        self._dead_keys = collections.deque()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key, create_context):
+        """
+        Return the cached SSLContext for the given key, or create and cache a new one.
+
+        :param tuple key: Hashable TLS settings.  The second and third items are the certificate
+          and key file paths (or None), which are checked for changes.
+        :param create_context: Function which creates a new SSLContext for these settings.
+        """
+        stamps = (_get_file_stamp(key[1]), _get_file_stamp(key[2]))
+        with self._lock:
+            self._remove_dead_entries()
+            entry = self._contexts.get(key)
+            if entry and entry[0] == stamps:
+                ssl_context = entry[1]()
+                if ssl_context is not None:
+                    self.hits += 1
+                    return ssl_context
+
+            # Create the context while holding the lock, so that many transports created at
+            # the same time do not all load the same certificates.
+            ssl_context = create_context()
+            self.misses += 1
+            self._contexts[key] = (stamps, weakref.ref(ssl_context, self._make_remover(key)))
+            return ssl_context
+
+    def clear(self):
+        """
+        Remove all contexts from the cache.
+        """
+        with self._lock:
+            self._contexts = {}
+
+    def _make_remover(self, key):
+        # Returns a weakref callback which marks the entry for removal once its context is freed.
+        # The callback can run during garbage collection on any thread (including one holding
+        # the lock), so it only records the key, and the entry is removed on the next lookup.
+        dead_keys = self._dead_keys
+
+        def remove(context_weakref):
+            dead_keys.append(key)
+
+        return remove
+
+    def _remove_dead_entries(self):
+        while self._dead_keys:
+            key = self._dead_keys.popleft()
+            entry = self._contexts.get(key)
+            if entry and entry[1]() is None:
+                del self._contexts[key]
+
+
+# Process-wide cache used by all MQTTTransport objects
+ssl_context_cache = SSLContextCache()
+
+
+class _ResumableSSLContext(object):
+    """
+    Wrapper around an SSLContext which offers the TLS session from the last successful
+    connection when Paho wraps a new socket, so that a reconnect can resume the session instead
+    of performing a full handshake.
+
+    All other attributes are read from the wrapped SSLContext, which may be shared with other
+    transports.
+    """
+
+    def __init__(self, ssl_context):
+        self._ssl_context = ssl_context
+        self._session = None
+        self._session_offered = False
+        self._ssl_socket = None
+
+    def __getattr__(self, name):
+        return getattr(self._ssl_context, name)
+
+    def wrap_socket(self, sock, **kwargs):
+        # SSLSession is not available before Python 3.6, in which case no session is ever saved
+        if self._session is not None:
+            kwargs["session"] = self._session
+        self._session_offered = self._session is not None
+        self._ssl_socket = self._ssl_context.wrap_socket(sock, **kwargs)
+        return self._ssl_socket
+
+    def on_connection_established(self):
+        """
+        Save the TLS session of the current connection for use by the next one.
+
+        :returns: True if a saved session was offered and resumed, False if a saved session was
+          offered but a full handshake was performed, or None if no session was offered.
+        """
+        if self._ssl_socket is None:
+            return None
+        resumed = None
+        if self._session_offered:
+            resumed = bool(getattr(self._ssl_socket, "session_reused", False))
+        self._session = getattr(self._ssl_socket, "session", None)
+        self._session_offered = False
+        return resumed
+
+
 class MQTTTransport(object):
     """
     A wrapper class that provides an implementation-agnostic MQTT message broker interface.
@@ -83,10 +242,24 @@ class MQTTTransport(object):
     :type on_mqtt_message_received_handler: Function
     :ivar on_mqtt_connection_failure_handler: Event handler callback, called upon a connection failure.
     :type on_mqtt_connection_failure_handler: Function
+    :ivar tls_resumption_hits: Number of connections which resumed the previous TLS session.
+    :type tls_resumption_hits: int
+    :ivar tls_resumption_misses: Number of connections which offered the previous TLS session,
+      but required a full TLS handshake.
+    :type tls_resumption_misses: int
     """
 
     def __init__(
-        self, client_id, hostname, username, ca_cert=None, x509_cert=None, websockets=False
+        self,
+        client_id,
+        hostname,
+        username,
+        ca_cert=None,
+        x509_cert=None,
+        websockets=False,
+        network_loop=None,
+        operation_timeout=None,
+        quiet_logging=False,
     ):
         """
         Constructor to instantiate an MQTT protocol wrapper.
@@ -96,6 +269,13 @@ class MQTTTransport(object):
         :param str ca_cert: Certificate which can be used to validate a server-side TLS connection (optional).
         :param x509_cert: Certificate which can be used to authenticate connection to a server in lieu of a password (optional).
         :param bool websockets: Indicates whether or not to enable a websockets connection in the Transport.
+        :param network_loop: A shared network loop used to service the connection instead of a
+          dedicated Paho network thread (optional).
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
+        :param float operation_timeout: Number of seconds to wait for a PUBACK, SUBACK or UNSUBACK
+          before failing the operation with an OperationTimeoutError (optional).
+        :param bool quiet_logging: If True, log each message published or received at DEBUG
+          rather than INFO level (optional).
         """
         self._client_id = client_id
         self._hostname = hostname
@@ -104,13 +284,18 @@ class MQTTTransport(object):
         self._ca_cert = ca_cert
         self._x509_cert = x509_cert
         self._websockets = websockets
+        self._network_loop = network_loop
+        self._message_log_level = logging.DEBUG if quiet_logging else logging.INFO
 
         self.on_mqtt_connected_handler = None
         self.on_mqtt_disconnected_handler = None
         self.on_mqtt_message_received_handler = None
         self.on_mqtt_connection_failure_handler = None
 
-        self._op_manager = OperationManager()
+        self.tls_resumption_hits = 0
+        self.tls_resumption_misses = 0
+
+        self._op_manager = OperationManager(operation_timeout=operation_timeout)
 
         self._mqtt_client = self._create_mqtt_client()
 
@@ -138,9 +323,9 @@ class MQTTTransport(object):
 
         mqtt_client.enable_logger(logging.getLogger("paho"))
 
-        # Configure TLS/SSL
-        ssl_context = self._create_ssl_context()
-        mqtt_client.tls_set_context(context=ssl_context)
+        # Configure TLS/SSL.  The wrapper allows TLS sessions to be resumed on reconnect.
+        self._ssl_context = _ResumableSSLContext(self._create_ssl_context())
+        mqtt_client.tls_set_context(context=self._ssl_context)
 
         # Set event handlers.  Use weak references back into this object to prevent
         # leaks on Python 2.7.  See callable_weak_method.py and PEP 442 for explanation.
@@ -151,7 +336,7 @@ class MQTTTransport(object):
 
         def on_connect(client, userdata, flags, rc):
             this = self_weakref()
-            logger.info("connected with result code: {}".format(rc))
+            logger.info("connected with result code: %s", rc)
 
             if rc:  # i.e. if there is an error
                 if this.on_mqtt_connection_failure_handler:
@@ -166,18 +351,21 @@ class MQTTTransport(object):
                     logger.warning(
                         "connection failed, but no on_mqtt_connection_failure_handler handler callback provided"
                     )
-            elif this.on_mqtt_connected_handler:
-                try:
-                    this.on_mqtt_connected_handler()
-                except Exception:
-                    logger.error("Unexpected error calling on_mqtt_connected_handler")
-                    logger.error(traceback.format_exc())
             else:
-                logger.warning("No event handler callback set for on_mqtt_connected_handler")
+                this._record_tls_session()
+
+                if this.on_mqtt_connected_handler:
+                    try:
+                        this.on_mqtt_connected_handler()
+                    except Exception:
+                        logger.error("Unexpected error calling on_mqtt_connected_handler")
+                        logger.error(traceback.format_exc())
+                else:
+                    logger.warning("No event handler callback set for on_mqtt_connected_handler")
 
         def on_disconnect(client, userdata, rc):
             this = self_weakref()
-            logger.info("disconnected with result code: {}".format(rc))
+            logger.info("disconnected with result code: %s", rc)
 
             cause = None
             if rc:  # i.e. if there is an error
@@ -194,28 +382,28 @@ class MQTTTransport(object):
 
         def on_subscribe(client, userdata, mid, granted_qos):
             this = self_weakref()
-            logger.info("suback received for {}".format(mid))
+            logger.info("suback received for %s", mid)
             # subscribe failures are returned from the subscribe() call.  This is just
             # a notification that a SUBACK was received, so there is no failure case here
             this._op_manager.complete_operation(mid)
 
         def on_unsubscribe(client, userdata, mid):
             this = self_weakref()
-            logger.info("UNSUBACK received for {}".format(mid))
+            logger.info("UNSUBACK received for %s", mid)
             # unsubscribe failures are returned from the unsubscribe() call.  This is just
             # a notification that a SUBACK was received, so there is no failure case here
             this._op_manager.complete_operation(mid)
 
         def on_publish(client, userdata, mid):
             this = self_weakref()
-            logger.info("payload published for {}".format(mid))
+            logger.log(this._message_log_level, "payload published for %s", mid)
             # publish failures are returned from the publish() call.  This is just
             # a notification that a PUBACK was received, so there is no failure case here
             this._op_manager.complete_operation(mid)
 
         def on_message(client, userdata, mqtt_message):
             this = self_weakref()
-            logger.info("message received on {}".format(mqtt_message.topic))
+            logger.log(this._message_log_level, "message received on %s", mqtt_message.topic)
 
             if this.on_mqtt_message_received_handler:
                 try:
@@ -235,12 +423,45 @@ class MQTTTransport(object):
         mqtt_client.on_publish = on_publish
         mqtt_client.on_message = on_message
 
+        # If a shared network loop is being used, let it drive the socket instead of a Paho thread
+        if self._network_loop:
+            self._network_loop.attach(mqtt_client)
+
         logger.debug("Created MQTT protocol client, assigned callbacks")
         return mqtt_client
 
+    def _record_tls_session(self):
+        """
+        Save the TLS session of a newly established connection, and count whether it resumed
+        the session of the previous connection.
+        """
+        resumed = self._ssl_context.on_connection_established()
+        if resumed is True:
+            self.tls_resumption_hits += 1
+            logger.debug("TLS session resumed")
+        elif resumed is False:
+            self.tls_resumption_misses += 1
+            logger.debug("TLS session could not be resumed - full handshake performed")
+
     def _create_ssl_context(self):
         """
-        This method creates the SSLContext object used by Paho to authenticate the connection.
+        This method gets the SSLContext object used by Paho to authenticate the connection.
+
+        Transports with identical TLS settings share a single SSLContext from the process-wide
+        SSLContextCache, since loading trusted certificates is expensive.
+        """
+        key = (
+            _digest(self._ca_cert),
+            self._x509_cert.certificate_file if self._x509_cert else None,
+            self._x509_cert.key_file if self._x509_cert else None,
+            _digest(self._x509_cert.pass_phrase) if self._x509_cert else None,
+            self._websockets,
+        )
+        return ssl_context_cache.get_or_create(key, self._build_ssl_context)
+
+    def _build_ssl_context(self):
+        """
+        This method creates a new SSLContext object.
         """
         logger.debug("creating a SSL context")
         ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLSv1_2)
@@ -284,20 +505,21 @@ class MQTTTransport(object):
         try:
             if self._websockets:
                 rc = self._mqtt_client.connect(
-                    host=self._hostname, port=443, keepalive=DEFAULT_KEEPALIVE
+                    host=self._hostname, port=WEBSOCKETS_PORT, keepalive=DEFAULT_KEEPALIVE
                 )
             else:
                 rc = self._mqtt_client.connect(
-                    host=self._hostname, port=8883, keepalive=DEFAULT_KEEPALIVE
+                    host=self._hostname, port=DEFAULT_PORT, keepalive=DEFAULT_KEEPALIVE
                 )
         except Exception as e:
             raise exceptions.ProtocolClientError(
                 message="Unexpected Paho failure during connect", cause=e
             )
-        logger.debug("_mqtt_client.connect returned rc={}".format(rc))
+        logger.debug("_mqtt_client.connect returned rc=%s", rc)
         if rc:
             raise _create_error_from_rc_code(rc)
-        self._mqtt_client.loop_start()
+        if not self._network_loop:
+            self._mqtt_client.loop_start()
 
     def reconnect(self, password=None):
         """
@@ -322,7 +544,7 @@ class MQTTTransport(object):
             raise exceptions.ProtocolClientError(
                 message="Unexpected Paho failure during reconnect", cause=e
             )
-        logger.debug("_mqtt_client.reconnect returned rc={}".format(rc))
+        logger.debug("_mqtt_client.reconnect returned rc=%s", rc)
         if rc:
             # This could result in ConnectionFailedError, ConnectionDroppedError, UnauthorizedError
             # or ProtocolClientError
@@ -341,8 +563,9 @@ class MQTTTransport(object):
             raise exceptions.ProtocolClientError(
                 message="Unexpected Paho failure during disconnect", cause=e
             )
-        logger.debug("_mqtt_client.disconnect returned rc={}".format(rc))
-        self._mqtt_client.loop_stop()
+        logger.debug("_mqtt_client.disconnect returned rc=%s", rc)
+        if not self._network_loop:
+            self._mqtt_client.loop_stop()
         if rc:
             # This could result in ConnectionDroppedError or ProtocolClientError
             err = _create_error_from_rc_code(rc)
@@ -355,29 +578,37 @@ class MQTTTransport(object):
 
     def subscribe(self, topic, qos=1, callback=None):
         """
-        This method subscribes the client to one topic from the MQTT broker.
+        This method subscribes the client to one or more topics from the MQTT broker.
 
-        :param str topic: a single string specifying the subscription topic to subscribe to
+        :param topic: a single string specifying the subscription topic to subscribe to, or a
+            list of topic strings to subscribe to with a single SUBSCRIBE packet.
+        :type topic: str or list(str)
         :param int qos: the desired quality of service level for the subscription. Defaults to 1.
-        :param callback: A callback to be triggered upon completion (Optional).
+        :param callback: A callback to be triggered upon completion (Optional). If the operation
+            times out, it is triggered with an OperationTimeoutError as the error keyword argument.
 
         :return: message ID for the subscribe request.
 
         :raises: ValueError if qos is not 0, 1 or 2.
-        :raises: ValueError if topic is None or has zero string length.
+        :raises: ValueError if topic is None, has zero string length, or is an empty list.
         :raises: ConnectionDroppedError if connection is dropped during execution.
         :raises: ProtocolClientError if there is some other client error.
         """
-        logger.info("subscribing to {} with qos {}".format(topic, qos))
+        logger.info("subscribing to %s with qos %s", topic, qos)
+        if isinstance(topic, list) and not topic:
+            raise ValueError("Invalid topic.")
         try:
-            (rc, mid) = self._mqtt_client.subscribe(topic, qos=qos)
+            if isinstance(topic, list):
+                (rc, mid) = self._mqtt_client.subscribe([(t, qos) for t in topic])
+            else:
+                (rc, mid) = self._mqtt_client.subscribe(topic, qos=qos)
         except ValueError:
             raise
         except Exception as e:
             raise exceptions.ProtocolClientError(
                 message="Unexpected Paho failure during subscribe", cause=e
             )
-        logger.debug("_mqtt_client.subscribe returned rc={}".format(rc))
+        logger.debug("_mqtt_client.subscribe returned rc=%s", rc)
         if rc:
             # This could result in ConnectionDroppedError or ProtocolClientError
             raise _create_error_from_rc_code(rc)
@@ -388,13 +619,14 @@ class MQTTTransport(object):
         Unsubscribe the client from one topic on the MQTT broker.
 
         :param str topic: a single string which is the subscription topic to unsubscribe from.
-        :param callback: A callback to be triggered upon completion (Optional).
+        :param callback: A callback to be triggered upon completion (Optional). If the operation
+            times out, it is triggered with an OperationTimeoutError as the error keyword argument.
 
         :raises: ValueError if topic is None or has zero string length.
         :raises: ConnectionDroppedError if connection is dropped during execution.
         :raises: ProtocolClientError if there is some other client error.
         """
-        logger.info("unsubscribing from {}".format(topic))
+        logger.info("unsubscribing from %s", topic)
         try:
             (rc, mid) = self._mqtt_client.unsubscribe(topic)
         except ValueError:
@@ -403,7 +635,7 @@ class MQTTTransport(object):
             raise exceptions.ProtocolClientError(
                 message="Unexpected Paho failure during unsubscribe", cause=e
             )
-        logger.debug("_mqtt_client.unsubscribe returned rc={}".format(rc))
+        logger.debug("_mqtt_client.unsubscribe returned rc=%s", rc)
         if rc:
             # This could result in ConnectionDroppedError or ProtocolClientError
             raise _create_error_from_rc_code(rc)
@@ -417,7 +649,9 @@ class MQTTTransport(object):
         :param payload: The actual message to send.
         :type payload: str, bytes, int, float or None
         :param int qos: the desired quality of service level for the subscription. Defaults to 1.
-        :param callback: A callback to be triggered upon completion (Optional).
+        :param callback: A callback to be triggered upon completion (Optional). For QoS 0, this is when
+            the message has been written to the socket rather than when it has been acknowledged. If the
+            operation times out, it is triggered with an OperationTimeoutError as the error keyword argument.
 
         :raises: ValueError if qos is not 0, 1 or 2
         :raises: ValueError if topic is None or has zero string length
@@ -427,7 +661,7 @@ class MQTTTransport(object):
         :raises: ConnectionDroppedError if connection is dropped during execution.
         :raises: ProtocolClientError if there is some other client error.
         """
-        logger.info("publishing on {}".format(topic))
+        logger.log(self._message_log_level, "publishing on %s", topic)
         try:
             (rc, mid) = self._mqtt_client.publish(topic=topic, payload=payload, qos=qos)
         except ValueError:
@@ -438,7 +672,7 @@ class MQTTTransport(object):
             raise exceptions.ProtocolClientError(
                 message="Unexpected Paho failure during publish", cause=e
             )
-        logger.debug("_mqtt_client.publish returned rc={}".format(rc))
+        logger.debug("_mqtt_client.publish returned rc=%s", rc)
         if rc:
             # This could result in ConnectionDroppedError or ProtocolClientError
             raise _create_error_from_rc_code(rc)
@@ -447,21 +681,37 @@ class MQTTTransport(object):
 
 class OperationManager(object):
     """Tracks pending operations and thier associated callbacks until completion.
+
+    If an operation timeout is given, pending operations which are not completed within it are
+    failed with an OperationTimeoutError by the shared operation_timeout_sweeper.
     """
 
-    def __init__(self):
+    def __init__(self, operation_timeout=None):
+        """
+        :param float operation_timeout: Number of seconds to wait for an operation to complete
+          before failing it (optional).  If not provided, operations wait indefinitely.
+        """
+        self.operation_timeout = operation_timeout
+
         # Maps mid->callback for operations where a request has been sent
         # but the reponse has not yet been received
         self._pending_operation_callbacks = {}
 
-        # Maps mid->mid for responses received that are NOT established in the _pending_operation_callbacks dict.
-        # Necessary because sometimes an operation will complete with a response before the
-        # Paho call returns.
-        # TODO: make this map mid to something more useful (result code?)
-        self._unknown_operation_completions = {}
+        # Maps mid->deadline for pending operations.  Every operation has the same timeout, so
+        # insertion order is also deadline order, and expired operations are always at the front.
+        self._pending_operation_deadlines = collections.OrderedDict()
+
+        # Maps mid->time of arrival for responses received that are NOT established in the
+        # _pending_operation_callbacks dict. Necessary because sometimes an operation will complete
+        # with a response before the Paho call returns.  Paho reuses MIDs, so these are bounded,
+        # and aged out, rather than being kept until the MID is established.
+        self._unknown_operation_completions = collections.OrderedDict()
 
         self._lock = threading.Lock()
 
+        if operation_timeout is not None:
+            operation_timeout_sweeper.register(self)
+
     def establish_operation(self, mid, callback=None):
         """Establish a pending operation identified by MID, and store its completion callback.
 
@@ -483,14 +733,14 @@ class OperationManager(object):
             else:
                 # Store the operation as pending, along with callback
                 self._pending_operation_callbacks[mid] = callback
-                logger.debug("Waiting for response on MID: {}".format(mid))
+                if self.operation_timeout is not None:
+                    self._pending_operation_deadlines[mid] = _now() + self.operation_timeout
+                logger.debug("Waiting for response on MID: %s", mid)
 
         # Now that the lock has been released, if the callback should be triggered,
         # go ahead and trigger it now.
         if trigger_callback:
-            logger.debug(
-                "Response for MID: {} was received early - triggering callback".format(mid)
-            )
+            logger.debug("Response for MID: %s was received early - triggering callback", mid)
             if callback:
                 try:
                     callback()
@@ -500,11 +750,14 @@ class OperationManager(object):
             else:
                 logger.exception("No callback for MID: {}".format(mid))
 
-    def complete_operation(self, mid):
+    def complete_operation(self, mid, error=None):
         """Complete an operation identified by MID and trigger the associated completion callback.
 
         If the operation MID is unknown, the completion status will be stored until
         the operation is established.
+
+        :param error: An exception with which to fail the operation, passed to the callback as the
+          error keyword argument (optional).  Failures of unknown operations are not stored.
         """
         callback = None
         trigger_callback = False
@@ -516,28 +769,135 @@ class OperationManager(object):
                 # Retrieve the callback, and clear the pending operation now that it has been completed
                 callback = self._pending_operation_callbacks[mid]
                 del self._pending_operation_callbacks[mid]
+                self._pending_operation_deadlines.pop(mid, None)
 
                 # Since the operation is complete, indicate the callback should be triggered
                 trigger_callback = True
 
-            else:
-                # Otherwise, store the mid as an unknown response
-                logger.warning("Response received for unknown MID: {}".format(mid))
-                self._unknown_operation_completions[
-                    mid
-                ] = mid  # TODO: set something more useful here
+            elif error is None:
+                # Otherwise, store the mid as an unknown response.  This is expected for QoS 0
+                # publishes, which usually complete before the Paho call returns.
+                logger.debug("Response received for unknown MID: %s", mid)
+                now = _now()
+                self._unknown_operation_completions.pop(mid, None)
+                self._unknown_operation_completions[mid] = now
+                self._age_unknown_completions(now)
 
         # Now that the lock has been released, if the callback should be triggered,
         # go ahead and trigger it now.
         if trigger_callback:
-            logger.debug(
-                "Response received for recognized MID: {} - triggering callback".format(mid)
-            )
+            logger.debug("Response received for recognized MID: %s - triggering callback", mid)
             if callback:
                 try:
-                    callback()
+                    if error:
+                        callback(error=error)
+                    else:
+                        callback()
                 except Exception:
                     logger.error("Unexpected error calling callback for MID: {}".format(mid))
                     logger.error(traceback.format_exc())
             else:
                 logger.warning("No callback set for MID: {}".format(mid))
+
+    def expire_operations(self, now=None):
+        """Fail all pending operations whose deadline has passed with an OperationTimeoutError.
+
+        :param float now: The current time, as returned by the clock used for deadlines (optional).
+        """
+        if now is None:
+            now = _now()
+        expired = []
+
+        with self._lock:
+            deadlines = self._pending_operation_deadlines
+            while deadlines:
+                mid, deadline = next(iter(deadlines.items()))
+                if deadline > now:
+                    break
+                del deadlines[mid]
+                expired.append((mid, self._pending_operation_callbacks.pop(mid)))
+            self._age_unknown_completions(now)
+
+        # Trigger the callbacks after the lock has been released, as for completions
+        for mid, callback in expired:
+            logger.warning("Operation for MID: {} timed out".format(mid))
+            if callback:
+                error = exceptions.OperationTimeoutError(
+                    message="No response received for MID: {} within {} seconds".format(
+                        mid, self.operation_timeout
+                    )
+                )
+                try:
+                    callback(error=error)
+                except Exception:
+                    logger.error("Unexpected error calling callback for MID: {}".format(mid))
+                    logger.error(traceback.format_exc())
+
+    def _age_unknown_completions(self, now):
+        """Discard unknown completions that are too old, or too many, to still be established.
+        Must be called with the lock held.
+        """
+        completions = self._unknown_operation_completions
+        while completions:
+            mid, received = next(iter(completions.items()))
+            if (
+                len(completions) <= MAX_UNKNOWN_COMPLETIONS
+                and now - received < UNKNOWN_COMPLETION_TTL
+            ):
+                break
+            logger.debug("Discarding unknown completion for MID: %s", mid)
+            del completions[mid]
+
+
+class OperationTimeoutSweeper(object):
+    """Expires the timed out operations of every OperationManager from a single thread.
+
+    The thread is started when the first OperationManager is registered, and exits once none
+    remain, so a process only pays for the sweeper while it has transports.
+    """
+
+    def __init__(self, interval=1.0):
+        """
+        :param float interval: Number of seconds between sweeps.  Operations may run this much
+          past their timeout before they are failed.
+        """
+        self.interval = interval
+        self._managers = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, manager):
+        """Sweep the given OperationManager until it is garbage collected."""
+        with self._lock:
+            self._managers.add(manager)
+            if not self._thread:
+                self._thread = threading.Thread(
+                    target=self._run, name="mqtt-operation-timeout-sweeper"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._sweep():
+                return
+
+    def _sweep(self):
+        """Sweep every registered OperationManager once.  Returns False if none remain."""
+        with self._lock:
+            managers = list(self._managers)
+            if not managers:
+                self._thread = None
+                return False
+        now = _now()
+        for manager in managers:
+            try:
+                manager.expire_operations(now)
+            except Exception:
+                logger.error("Unexpected error expiring operations")
+                logger.error(traceback.format_exc())
+        return True
+
+
+operation_timeout_sweeper = OperationTimeoutSweeper()
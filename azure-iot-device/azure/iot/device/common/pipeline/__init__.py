@@ -6,5 +6,5 @@ INTERNAL USAGE ONLY
 """
 from .pipeline_events_base import PipelineEvent
 from .pipeline_ops_base import PipelineOperation
-from .pipeline_stages_base import PipelineStage
+from .pipeline_stages_base import PipelineStage, handles_ops, handles_events
 from .pipeline_exceptions import OperationCancelled
@@ -20,8 +20,13 @@ class PipelineEvent(object):
 
     :ivar name: The name of the event.  This is used primarily for logging
     :type name: str
+
+    Events are created for every message that is received, so this class and all of its derived
+    classes use __slots__.  Derived classes must declare __slots__ for any attributes they add.
     """
 
+    __slots__ = ("name",)
+
     def __init__(self):
         """
         Initializer for PipelineEvent objects.
@@ -59,6 +64,8 @@ class IotResponseEvent(PipelineEvent):
     :ivar respons_body:
     """
 
+    __slots__ = ("request_id", "status_code", "response_body")
+
     def __init__(self, request_id, status_code, response_body):
         super(IotResponseEvent, self).__init__()
         self.request_id = request_id
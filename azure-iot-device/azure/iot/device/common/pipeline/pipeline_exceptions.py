@@ -30,3 +30,9 @@ class PipelineError(PipelineException):
     """Error in Pipeline"""
 
     pass
+
+
+class PipelineBusyError(PipelineException):
+    """Pipeline has too many operations in flight to accept another"""
+
+    pass
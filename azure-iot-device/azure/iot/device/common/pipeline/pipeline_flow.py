@@ -17,7 +17,7 @@ logger = logging.getLogger(__name__)
 
 class PipelineFlow(object):
     @pipeline_thread.runs_on_pipeline_thread
-    def _send_worker_op_down(self, worker_op, op):
+    def _send_worker_op_down(self, worker_op, op, release_worker_op=None):
         """
         Continue an operation using a new worker operation.  This means that the new operation
         will be passed down the pipeline (starting at the next stage). When that new
@@ -48,16 +48,21 @@ class PipelineFlow(object):
           to effectively continue the work represented by the original op.  This is most likely
           a different type of operation that is able to accomplish the intention of the
           original op in a way that is more specific than the original op.
+        :param Function release_worker_op: (Optional) Function that is called with the worker_op
+          after the original op has been completed, when nothing in the pipeline refers to the
+          worker_op any more.  This can be used to keep the worker_op for reuse.
         """
 
-        logger.debug("{}({}): continuing with {} op".format(self.name, op.name, worker_op.name))
+        logger.debug("%s(%s): continuing with %s op", self.name, op.name, worker_op.name)
 
         @pipeline_thread.runs_on_pipeline_thread
         def worker_op_complete(worker_op, error):
             logger.debug(
-                "{}({}): completing with result from {}".format(self.name, op.name, worker_op.name)
+                "%s(%s): completing with result from %s", self.name, op.name, worker_op.name
             )
             self._complete_op(op, error=error)
+            if release_worker_op:
+                release_worker_op(worker_op)
 
         worker_op.callback = worker_op_complete
         self._send_op_down(worker_op)
@@ -66,21 +71,22 @@ class PipelineFlow(object):
     def _send_op_down(self, op):
         """
         Helper function to continue a given operation by passing it to the next stage
-        in the pipeline.  If there is no next stage in the pipeline, this function
-        will fail the operation and call _complete_op to return the failure back up the
-        pipeline.
+        in the pipeline which acts on operations of its type.  If there is no such stage
+        in the pipeline, this function will fail the operation and call _complete_op to
+        return the failure back up the pipeline.
 
         :param PipelineOperation op: Operation which is being passed on
         """
-        if not self.next:
+        next_stage = self._get_op_destination(op)
+        if not next_stage:
             logger.error("{}({}): no next stage.  completing with error".format(self.name, op.name))
             error = PipelineError(
                 "{} not handled after {} stage with no next stage".format(op.name, self.name)
             )
             self._complete_op(op, error=error)
         else:
-            logger.debug("{}({}): passing to next stage.".format(self.name, op.name))
-            self.next.run_op(op)
+            logger.debug("%s(%s): passing to %s stage.", self.name, op.name, next_stage.name)
+            next_stage.run_op(op)
 
     @pipeline_thread.runs_on_pipeline_thread
     def _complete_op(self, op, error=None):
@@ -90,10 +96,13 @@ class PipelineFlow(object):
         calling the operation's callback directly as it provides several layers of protection
         (such as a try/except wrapper) which are strongly advised.
         """
+        tracer = self.tracer
+        if tracer is not None:
+            start = tracer.start()
         if error:
             logger.error("{}({}): completing with error {}".format(self.name, op.name, error))
         else:
-            logger.debug("{}({}): completing without error".format(self.name, op.name))
+            logger.debug("%s(%s): completing without error", self.name, op.name)
 
         if op.completed:
             logger.error(
@@ -108,6 +117,8 @@ class PipelineFlow(object):
         else:
             op.completed = True
             self._send_completed_op_up(op, error)
+        if tracer is not None:
+            tracer.end(start, "complete_op", self.name, op.name)
 
     @pipeline_thread.runs_on_pipeline_thread
     def _send_completed_op_up(self, op, error=None):
@@ -136,21 +147,28 @@ class PipelineFlow(object):
     @pipeline_thread.runs_on_pipeline_thread
     def _send_event_up(self, event):
         """
-        Helper function to pass an event to the previous stage of the pipeline.  This is the default
-        behavior of events while traveling through the pipeline. They start somewhere (maybe the
-        bottom) and move up the pipeline until they're handled or until they error out.
+        Helper function to pass an event to the previous stage of the pipeline which acts on events
+        of its type.  This is the default behavior of events while traveling through the pipeline.
+        They start somewhere (maybe the bottom) and move up the pipeline until they're handled or
+        until they error out.
         """
-        if self.previous:
+        tracer = self.tracer
+        if tracer is not None:
+            start = tracer.start()
+        previous_stage = self._get_event_destination(event)
+        if previous_stage:
             logger.debug(
-                "{}({}): pushing event up to {}".format(self.name, event.name, self.previous.name)
+                "%s(%s): pushing event up to %s", self.name, event.name, previous_stage.name
             )
-            self.previous.handle_pipeline_event(event)
+            previous_stage.handle_pipeline_event(event)
         else:
             logger.error("{}({}): Error: unhandled event".format(self.name, event.name))
             error = PipelineError(
                 "{} unhandled at {} stage with no previous stage".format(event.name, self.name)
             )
             handle_exceptions.handle_background_exception(error)
+        if tracer is not None:
+            tracer.end(start, "send_event_up", self.name, event.name)
 
     @pipeline_thread.runs_on_pipeline_thread
     def _send_op_down_and_intercept_return(self, op, intercepted_return):
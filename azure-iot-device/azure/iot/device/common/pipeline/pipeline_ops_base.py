@@ -29,8 +29,14 @@ class PipelineOperation(object):
     :ivar error: The presence of a value in the error attribute indicates that the operation failed,
       absence of this value indicates that the operation either succeeded or hasn't been handled yet.
     :type error: Error
+
+    Operations are created for every message that is sent, so this class and all of its derived
+    classes use __slots__ to keep them small and cheap to create.  Derived classes must declare
+    __slots__ for any attributes they add.
     """
 
+    __slots__ = ("name", "callback", "needs_connection", "completed")
+
     def __init__(self, callback):
         """
         Initializer for PipelineOperation objects.
@@ -58,7 +64,7 @@ class ConnectOperation(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
     """
 
-    pass
+    __slots__ = ()
 
 
 class ReconnectOperation(PipelineOperation):
@@ -73,7 +79,7 @@ class ReconnectOperation(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
     """
 
-    pass
+    __slots__ = ()
 
 
 class DisconnectOperation(PipelineOperation):
@@ -85,7 +91,7 @@ class DisconnectOperation(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
     """
 
-    pass
+    __slots__ = ()
 
 
 class EnableFeatureOperation(PipelineOperation):
@@ -102,6 +108,8 @@ class EnableFeatureOperation(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
     """
 
+    __slots__ = ("feature_name",)
+
     def __init__(self, feature_name, callback):
         """
         Initializer for EnableFeatureOperation objects.
@@ -116,6 +124,33 @@ class EnableFeatureOperation(PipelineOperation):
         self.feature_name = feature_name
 
 
+class EnableFeaturesOperation(PipelineOperation):
+    """
+    A PipelineOperation object which tells the pipeline to "enable" several features at once.
+
+    This is the same as sending an EnableFeatureOperation for each of the features, except that stages
+    which handle this operation may combine the work of enabling the features, (such as subscribing to all
+    of the topics for the features with a single MQTT subscribe operation).
+
+    Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
+    """
+
+    __slots__ = ("feature_names",)
+
+    def __init__(self, feature_names, callback):
+        """
+        Initializer for EnableFeaturesOperation objects.
+
+        :param list feature_names: Names of the features that are being enabled.  The meaning of these
+          strings is defined in the stage which handles this operation.
+        :param Function callback: The function that gets called when this operation is complete or has
+          failed.  The callback function must accept A PipelineOperation object which indicates
+          the specific operation which has completed or failed.
+        """
+        super(EnableFeaturesOperation, self).__init__(callback=callback)
+        self.feature_names = feature_names
+
+
 class DisableFeatureOperation(PipelineOperation):
     """
     A PipelineOperation object which tells the pipeline to "disable" a particular feature.
@@ -130,6 +165,8 @@ class DisableFeatureOperation(PipelineOperation):
     Even though this is an base operation, it will most likely be handled by a more specific stage (such as an IoTHub or MQTT stage).
     """
 
+    __slots__ = ("feature_name",)
+
     def __init__(self, feature_name, callback):
         """
         Initializer for DisableFeatureOperation objects.
@@ -155,6 +192,8 @@ class UpdateSasTokenOperation(PipelineOperation):
     (such as IoTHub or MQTT stages).
     """
 
+    __slots__ = ("sas_token",)
+
     def __init__(self, sas_token, callback):
         """
         Initializer for UpdateSasTokenOperation objects.
@@ -188,6 +227,15 @@ class SendIotRequestAndWaitForResponseOperation(PipelineOperation):
     :type response_body: Undefined
     """
 
+    __slots__ = (
+        "request_type",
+        "method",
+        "resource_location",
+        "request_body",
+        "status_code",
+        "response_body",
+    )
+
     def __init__(self, request_type, method, resource_location, request_body, callback):
         """
         Initializer for SendIotRequestAndWaitForResponseOperation objects
@@ -223,6 +271,8 @@ class SendIotRequestOperation(PipelineOperation):
     (such as IoTHub or MQTT stages).
     """
 
+    __slots__ = ("method", "resource_location", "request_type", "request_body", "request_id")
+
     def __init__(self, request_type, method, resource_location, request_body, request_id, callback):
         """
         Initializer for SendIotRequestOperation objects
@@ -13,6 +13,8 @@ class SetMQTTConnectionArgsOperation(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
+    __slots__ = ("client_id", "hostname", "username", "ca_cert", "client_cert", "sas_token")
+
     def __init__(
         self,
         client_id,
@@ -54,7 +56,9 @@ class MQTTPublishOperation(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
-    def __init__(self, topic, payload, callback):
+    __slots__ = ("topic", "payload", "qos")
+
+    def __init__(self, topic, payload, callback, qos=1):
         """
         Initializer for MQTTPublishOperation objects.
 
@@ -63,12 +67,31 @@ class MQTTPublishOperation(PipelineOperation):
         :param Function callback: The function that gets called when this operation is complete or has failed.
           The callback function must accept A PipelineOperation object which indicates the specific operation which
           has completed or failed.
+        :param int qos: (Optional) The quality of service level to publish with. With QoS 0, the operation is
+          complete as soon as the payload has been written to the socket. Defaults to 1.
         """
         super(MQTTPublishOperation, self).__init__(callback=callback)
         self.topic = topic
         self.payload = payload
+        self.qos = qos
         self.needs_connection = True
 
+    def reset(self, topic, payload, qos=1):
+        """
+        Reset a completed MQTTPublishOperation so that it can be reused to publish another payload.
+        None of the state of its previous use is kept, and it has no callback until one is set.
+
+        :param str topic: The name of the topic to publish to
+        :param str payload: The payload to publish
+        :param int qos: (Optional) The quality of service level to publish with. Defaults to 1.
+        """
+        self.callback = None
+        self.completed = False
+        self.needs_connection = True
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+
 
 class MQTTSubscribeOperation(PipelineOperation):
     """
@@ -77,11 +100,15 @@ class MQTTSubscribeOperation(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
+    __slots__ = ("topic",)
+
     def __init__(self, topic, callback):
         """
         Initializer for MQTTSubscribeOperation objects.
 
-        :param str topic: The name of the topic to subscribe to
+        :param topic: The name of the topic to subscribe to, or a list of topic names to subscribe to
+          with a single SUBSCRIBE packet
+        :type topic: str or list(str)
         :param Function callback: The function that gets called when this operation is complete or has failed.
           The callback function must accept A PipelineOperation object which indicates the specific operation which
           has completed or failed.
@@ -98,6 +125,8 @@ class MQTTUnsubscribeOperation(PipelineOperation):
     This operation is in the group of MQTT operations because its attributes are very specific to the MQTT protocol.
     """
 
+    __slots__ = ("topic",)
+
     def __init__(self, topic, callback):
         """
         Initializer for MQTTUnsubscribeOperation objects.
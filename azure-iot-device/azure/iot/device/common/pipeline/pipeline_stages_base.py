@@ -6,24 +6,115 @@
 
 import logging
 import abc
+import collections
+import itertools
+import random
 import six
 import sys
 import time
 import uuid
 import weakref
-from six.moves import queue
-from threading import Timer
+from threading import Lock, Timer
 from . import pipeline_events_base
 from . import pipeline_ops_base, pipeline_ops_mqtt
+from . import pipeline_exceptions
 from .pipeline_flow import PipelineFlow
 from . import pipeline_thread
-from azure.iot.device.common import handle_exceptions
+from . import pipeline_tracing
+from azure.iot.device.common import handle_exceptions, transport_exceptions
 from azure.iot.device.common.callable_weak_method import CallableWeakMethod
 
 logger = logging.getLogger(__name__)
 
+# Monotonic clock used for request deadlines, where available
+_now = getattr(time, "monotonic", time.time)
 
-@six.add_metaclass(abc.ABCMeta)
+
+def handles_ops(*op_types):
+    """
+    Decorator which marks a method of a PipelineStage as the method which runs operations of the
+    given types (and of types derived from them).  The method is called with the operation as its
+    only argument.
+    """
+
+    def decorator(func):
+        func.handled_op_types = op_types
+        return func
+
+    return decorator
+
+
+def handles_events(*event_types):
+    """
+    Decorator which marks a method of a PipelineStage as the method which handles events of the
+    given types (and of types derived from them).  The method is called with the event as its
+    only argument.
+    """
+
+    def decorator(func):
+        func.handled_event_types = event_types
+        return func
+
+    return decorator
+
+
+def _find_handler(handlers, cache, item_type):
+    """
+    Return the name of the method in handlers which handles item_type (or the nearest of its base
+    classes), or None if there isn't one.  Results are saved in cache.
+    """
+    try:
+        return cache[item_type]
+    except KeyError:
+        handler = None
+        for base in item_type.__mro__:
+            if base in handlers:
+                handler = handlers[base]
+                break
+        cache[item_type] = handler
+        return handler
+
+
+def _find_attribute(cls, name):
+    """
+    Return the attribute with the given name as it is defined in cls or its nearest base class
+    """
+    for klass in cls.__mro__:
+        if name in vars(klass):
+            return vars(klass)[name]
+    return None
+
+
+class PipelineStageMeta(abc.ABCMeta):
+    """
+    Metaclass for PipelineStage.  When each stage class is created, this builds the tables which map
+    operation and event types to the methods marked with handles_ops and handles_events.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super(PipelineStageMeta, cls).__init__(name, bases, namespace)
+        cls._op_handlers = {}
+        cls._event_handlers = {}
+        for klass in reversed(cls.__mro__):
+            for attr_name, attr in vars(klass).items():
+                for op_type in getattr(attr, "handled_op_types", ()):
+                    cls._op_handlers[op_type] = attr_name
+                for event_type in getattr(attr, "handled_event_types", ()):
+                    cls._event_handlers[event_type] = attr_name
+        # Filled in with the concrete op and event types this stage sees
+        cls._op_handler_cache = {}
+        cls._event_handler_cache = {}
+
+        # A stage which overrides _execute_op or _handle_pipeline_event instead of using the tables
+        # above might act on any op or event, so it can never be skipped.
+        base_stage = vars([k for k in cls.__mro__ if isinstance(k, PipelineStageMeta)][-1])
+        execute_op = _find_attribute(cls, "_execute_op")
+        handle_event = _find_attribute(cls, "_handle_pipeline_event")
+        cls._sees_all_ops = execute_op is not base_stage.get("_execute_op")
+        cls._sees_all_events = handle_event is not base_stage.get("_handle_pipeline_event")
+
+
+@six.add_metaclass(PipelineStageMeta)
 class PipelineStage(PipelineFlow):
     """
     Base class representing a stage in the processing pipeline.  Each stage is responsible for receiving
@@ -56,6 +147,12 @@ class PipelineStage(PipelineFlow):
     than having some MQTT-specific code that re-connects to the MQTT broker if the user calls Publish and
     there's no connection.
 
+    A stage says which operations and events it acts on by marking its methods with the handles_ops and
+    handles_events decorators.  Operations and events are dispatched to those methods by type, and are
+    passed straight past any stage that doesn't act on them.  A stage which needs to see every operation
+    (or event), such as a stage that queues all operations while it is blocked, can instead override
+    _execute_op (or _handle_pipeline_event).
+
     One way to think about stages is to look at every "block of functionality" in your code and ask yourself
     "is this the one and only time I will need this code"?  If the answer is no, it might be worthwhile to
     implement that code in it's own stage in a very generic way.
@@ -71,6 +168,9 @@ class PipelineStage(PipelineFlow):
       submit an operation to the pipeline starting at the root.  This type of behavior is uncommon but not
       unexpected.
     :type pipeline_root: PipelineStage
+    :ivar tracer: The PipelineTracer that this stage reports timings to, copied from the root of
+      the pipeline when the stage is appended to it.  Set to None if the pipeline isn't traced.
+    :type tracer: PipelineTracer
     """
 
     def __init__(self):
@@ -81,6 +181,11 @@ class PipelineStage(PipelineFlow):
         self.next = None
         self.previous = None
         self.pipeline_root = None
+        # The stages that ops and events of each type are passed to from this stage, skipping over
+        # stages that don't act on them.  Reset whenever a stage is appended to the pipeline.
+        self._op_destinations = {}
+        self._event_destinations = {}
+        self.tracer = None
 
     @pipeline_thread.runs_on_pipeline_thread
     def run_op(self, op):
@@ -97,7 +202,10 @@ class PipelineStage(PipelineFlow):
 
         :param PipelineOperation op: The operation to run.
         """
-        logger.debug("{}({}): running".format(self.name, op.name))
+        tracer = self.tracer
+        if tracer is not None:
+            start = tracer.start()
+        logger.debug("%s(%s): running", self.name, op.name)
         try:
             self._execute_op(op)
         except Exception as e:
@@ -105,20 +213,26 @@ class PipelineStage(PipelineFlow):
             # within ._execute_op()
             logger.error(msg="Unexpected error in {}._execute_op() call".format(self), exc_info=e)
             self._complete_op(op, error=e)
+        if tracer is not None:
+            tracer.end(start, "run_op", self.name, op.name)
 
-    @abc.abstractmethod
+    @pipeline_thread.runs_on_pipeline_thread
     def _execute_op(self, op):
         """
-        Abstract method to run the actual operation.  This function is implemented in derived classes
-        and performs the actual work that any operation expects.  The default behavior for this function
-        should be to forward the event to the next stage using _send_op_down for any
-        operations that a particular stage might not operate on.
+        Run the actual operation.  This calls the method marked with handles_ops for the type of the
+        operation, or forwards the operation to the next stage using _send_op_down if this stage
+        doesn't act on operations of that type.  Derived classes which need to see every operation
+        can override this function instead.
 
         See the description of the run_op method for more discussion on what it means to "run" an operation.
 
         :param PipelineOperation op: The operation to run.
         """
-        pass
+        handler = _find_handler(self._op_handlers, self._op_handler_cache, type(op))
+        if handler:
+            getattr(self, handler)(op)
+        else:
+            self._send_op_down(op)
 
     @pipeline_thread.runs_on_pipeline_thread
     def handle_pipeline_event(self, event):
@@ -141,13 +255,78 @@ class PipelineStage(PipelineFlow):
     @pipeline_thread.runs_on_pipeline_thread
     def _handle_pipeline_event(self, event):
         """
-        Handle a pipeline event that arrives from the stage below this stage.  This
-        is a function that is intended to be overridden in any stages that want to implement
-        stage-specific handling of any events
+        Handle a pipeline event that arrives from the stage below this stage.  This calls the
+        method marked with handles_events for the type of the event, or passes the event up to the
+        previous stage if this stage doesn't act on events of that type.  Derived classes which need
+        to see every event can override this function instead.
 
         :param PipelineEvent event: The event that is being passed back up the pipeline
         """
-        self._send_event_up(event)
+        handler = _find_handler(self._event_handlers, self._event_handler_cache, type(event))
+        if handler:
+            getattr(self, handler)(event)
+        else:
+            self._send_event_up(event)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _acts_on_op_type(self, op_type):
+        """
+        Return True if this stage might do anything with an operation of the given type other than
+        passing it to the next stage.
+        """
+        return (
+            self._sees_all_ops
+            # run_op or _execute_op may have been replaced on this instance (e.g. by tests)
+            or "run_op" in vars(self)
+            or "_execute_op" in vars(self)
+            or _find_handler(self._op_handlers, self._op_handler_cache, op_type) is not None
+        )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _acts_on_event_type(self, event_type):
+        """
+        Return True if this stage might do anything with an event of the given type other than
+        passing it to the previous stage.
+        """
+        return (
+            self._sees_all_events
+            or "handle_pipeline_event" in vars(self)
+            or "_handle_pipeline_event" in vars(self)
+            or _find_handler(self._event_handlers, self._event_handler_cache, event_type)
+            is not None
+        )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _get_op_destination(self, op):
+        """
+        Return the first stage after this one which acts on operations of the same type as op, or
+        None if there is no such stage.
+        """
+        op_type = type(op)
+        try:
+            return self._op_destinations[op_type]
+        except KeyError:
+            stage = self.next
+            while stage and not stage._acts_on_op_type(op_type):
+                stage = stage.next
+            self._op_destinations[op_type] = stage
+            return stage
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _get_event_destination(self, event):
+        """
+        Return the first stage before this one which acts on events of the same type as event, or
+        None if there is no such stage.
+        """
+        event_type = type(event)
+        try:
+            return self._event_destinations[event_type]
+        except KeyError:
+            stage = self.previous
+            while stage and not stage._acts_on_event_type(event_type):
+                stage = stage.previous
+            self._event_destinations[event_type] = stage
+            return stage
 
     @pipeline_thread.runs_on_pipeline_thread
     def on_connected(self):
@@ -183,6 +362,26 @@ class PipelineRootStage(PipelineStage):
     :ivar on_disconnected_handler: Handler which can be set by users of the pipeline to
       receive events every time the underlying transport disconnects
     :type on_disconnected_handler: Function
+    :ivar on_connection_state_changed_handler: Handler which can be set by users of the pipeline
+      to receive the state of the connection every time it changes.  This function is called with
+      "connected", "disconnected", "reconnecting" (when a reconnect attempt is scheduled) or
+      "failed" (when the pipeline gives up reconnecting).
+    :type on_connection_state_changed_handler: Function
+    :ivar executors: The set of executors which run the pipeline and callback threads of this
+      pipeline, as returned by pipeline_thread.get_pipeline_executors.  If None, the pipeline
+      uses the executors shared by the whole process.
+    :type executors: dict
+    :ivar tracer: The PipelineTracer that every stage of this pipeline reports timings to, as set by
+      set_tracer.  Set to None if the pipeline isn't traced.
+    :type tracer: PipelineTracer
+    :ivar handler_executor: The HandlerExecutor which runs on_pipeline_event_handler, keyed by this
+      pipeline and the type of event (and input name, for input messages), so that events of one
+      type are delivered in order, but aren't held up by slow handlers for events of other types.
+      If None, the handlers run on the callback thread of the pipeline.
+    :type handler_executor: HandlerExecutor
+
+    Handlers which run on the callback thread are handed to it in batches, so that a burst of
+    events costs one switch to the callback thread rather than one per event.
     """
 
     def __init__(self, pipeline_configuration):
@@ -190,22 +389,50 @@ class PipelineRootStage(PipelineStage):
         self.on_pipeline_event_handler = None
         self.on_connected_handler = None
         self.on_disconnected_handler = None
+        self.on_connection_state_changed_handler = None
         self.connected = False
         self.pipeline_configuration = pipeline_configuration
+        self.executors = None
+        self.handler_executor = None
+        self._callbacks = []
+        self._callbacks_lock = Lock()
 
     def run_op(self, op):
-        op.callback = pipeline_thread.invoke_on_callback_thread_nowait(op.callback)
-        pipeline_thread.invoke_on_pipeline_thread(super(PipelineRootStage, self).run_op)(op)
+        self._wrap_op_callback(op)
+        pipeline_thread.invoke_on_pipeline_thread(
+            super(PipelineRootStage, self).run_op, executors=self.executors, tracer=self.tracer
+        )(op)
 
-    @pipeline_thread.runs_on_pipeline_thread
-    def _execute_op(self, op):
+    def run_ops(self, ops):
         """
-        run the operation.  At the root, the only thing to do is to pass the operation
-        to the next stage.
+        Run several operations, in order.  This is the same as calling run_op with each of them,
+        except that the pipeline thread is only entered once for all of them, and none of them
+        is run until all of them have been handed to the pipeline thread.
 
-        :param PipelineOperation op: Operation to run.
+        :param list ops: The operations to run.
         """
-        self._send_op_down(op)
+        ops = list(ops)
+        for op in ops:
+            self._wrap_op_callback(op)
+
+        def run_all():
+            for op in ops:
+                super(PipelineRootStage, self).run_op(op)
+
+        pipeline_thread.invoke_on_pipeline_thread(
+            run_all, executors=self.executors, tracer=self.tracer
+        )()
+
+    def _wrap_op_callback(self, op):
+        """
+        Make the callback of an operation run on the callback thread
+        """
+        op.callback = pipeline_thread.invoke_on_callback_thread_nowait(
+            op.callback, executors=self.executors, tracer=self.tracer
+        )
+        if self.tracer is not None:
+            # Measure the whole life of the op, from here to the callback being scheduled
+            op.callback = self.tracer.trace_callback(op.callback, "op", op.name)
 
     def append_stage(self, new_next_stage):
         """
@@ -222,8 +449,28 @@ class PipelineRootStage(PipelineStage):
         old_tail.next = new_next_stage
         new_next_stage.previous = old_tail
         new_next_stage.pipeline_root = self
+        new_next_stage.tracer = self.tracer
+
+        # The stages that ops and events are passed to have changed
+        stage = self
+        while stage:
+            stage._op_destinations = {}
+            stage._event_destinations = {}
+            stage = stage.next
         return self
 
+    def set_tracer(self, tracer):
+        """
+        Set the PipelineTracer that every stage of the pipeline reports timings to, including
+        stages appended to the pipeline later.
+
+        :param PipelineTracer tracer: The tracer, or None to stop tracing the pipeline.
+        """
+        stage = self
+        while stage:
+            stage.tracer = tracer
+            stage = stage.next
+
     @pipeline_thread.runs_on_pipeline_thread
     def _handle_pipeline_event(self, event):
         """
@@ -235,31 +482,244 @@ class PipelineRootStage(PipelineStage):
           through the handle_pipeline_event (if provided).
         """
         if self.on_pipeline_event_handler:
-            pipeline_thread.invoke_on_callback_thread_nowait(self.on_pipeline_event_handler)(event)
+            if self.handler_executor is not None:
+                # Input messages are kept in order per input, and everything else per event type
+                key = (self, event.name, getattr(event, "input_name", None))
+                self.handler_executor.submit(key, self.on_pipeline_event_handler, event)
+            else:
+                self._call_on_callback_thread(self.on_pipeline_event_handler, event)
         else:
             logger.warning("incoming pipeline event with no handler.  dropping.")
 
     @pipeline_thread.runs_on_pipeline_thread
     def on_connected(self):
         logger.debug(
-            "{}: on_connected.  on_connected_handler={}".format(
-                self.name, self.on_connected_handler
-            )
+            "%s: on_connected.  on_connected_handler=%s", self.name, self.on_connected_handler
         )
         self.connected = True
         if self.on_connected_handler:
-            pipeline_thread.invoke_on_callback_thread_nowait(self.on_connected_handler)()
+            if self.handler_executor is not None:
+                # Same key for connects and disconnects, so they're delivered in order
+                self.handler_executor.submit((self, "connection_state"), self.on_connected_handler)
+            else:
+                self._call_on_callback_thread(self.on_connected_handler)
+        self.on_connection_state_changed("connected")
 
     @pipeline_thread.runs_on_pipeline_thread
     def on_disconnected(self):
         logger.debug(
-            "{}: on_disconnected.  on_disconnected_handler={}".format(
-                self.name, self.on_disconnected_handler
-            )
+            "%s: on_disconnected.  on_disconnected_handler=%s",
+            self.name,
+            self.on_disconnected_handler,
         )
         self.connected = False
         if self.on_disconnected_handler:
-            pipeline_thread.invoke_on_callback_thread_nowait(self.on_disconnected_handler)()
+            if self.handler_executor is not None:
+                # Same key for connects and disconnects, so they're delivered in order
+                self.handler_executor.submit(
+                    (self, "connection_state"), self.on_disconnected_handler
+                )
+            else:
+                self._call_on_callback_thread(self.on_disconnected_handler)
+        self.on_connection_state_changed("disconnected")
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_connection_state_changed(self, state):
+        """
+        Called by stages of the pipeline when the state of the connection changes, and by the root
+        itself when the transport connects or disconnects.
+
+        :param str state: The new state of the connection.
+        """
+        if self.on_connection_state_changed_handler:
+            if self.handler_executor is not None:
+                # Same key as connects and disconnects, so they're delivered in order
+                self.handler_executor.submit(
+                    (self, "connection_state"), self.on_connection_state_changed_handler, state
+                )
+            else:
+                self._call_on_callback_thread(self.on_connection_state_changed_handler, state)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _call_on_callback_thread(self, func, *args):
+        """
+        Call func(*args) on the callback thread, after any calls already waiting for it.  Only the
+        first call in a batch enters the callback thread.  Calls made before that batch runs are
+        added to it.
+        """
+        with self._callbacks_lock:
+            self._callbacks.append((func, args))
+            first_in_batch = len(self._callbacks) == 1
+        if first_in_batch:
+            pipeline_thread.invoke_on_callback_thread_nowait(
+                self._run_callbacks, executors=self.executors, tracer=self.tracer
+            )()
+
+    def _run_callbacks(self):
+        """
+        Run every call waiting for the callback thread, in order.
+        """
+        with self._callbacks_lock:
+            callbacks = self._callbacks
+            self._callbacks = []
+        for func, args in callbacks:
+            try:
+                func(*args)
+            except Exception as e:
+                # Don't let one failing handler stop the rest of the batch from running
+                handle_exceptions.handle_background_exception(e)
+
+
+class ReconnectStage(PipelineStage):
+    """
+    This stage is responsible for reconnecting the protocol when the connection drops
+    unexpectedly, instead of waiting for the next operation that needs a connection.
+
+    It only reconnects if the last connect or reconnect op to pass through it succeeded and no
+    disconnect op has passed through it since, i.e. if the client is meant to be connected.  The
+    delay before each attempt is chosen at random between 0 and an exponentially growing
+    maximum ("full jitter"), so that many clients dropped at the same time don't all reconnect at
+    the same time.  If the pipeline configuration has a maximum number of attempts, the stage gives
+    up once that many attempts in a row have failed, and reports the last error as a background
+    exception.
+
+    Every attempt, and giving up, is reported to the connection state handler of the pipeline root
+    as the "reconnecting" and "failed" states.
+    """
+
+    def __init__(self):
+        super(ReconnectStage, self).__init__()
+        # True while the client is meant to be connected
+        self.wants_connection = False
+        # The number of reconnect attempts in a row which have failed
+        self.failed_attempts = 0
+        self._reconnect_timer = None
+        # The number of connect and reconnect ops passed down by this stage which haven't completed.
+        # A disconnect while one is pending is part of a failed or deliberate reconnect.
+        self._pending_connect_ops = 0
+
+    @handles_ops(pipeline_ops_base.ConnectOperation, pipeline_ops_base.ReconnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _run_connect_op(self, op):
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_connect_op_complete(op, error):
+            self._pending_connect_ops -= 1
+            if not error:
+                self.wants_connection = True
+            elif not self.pipeline_root.connected:
+                # e.g. a reconnect to renew credentials, which has left the transport disconnected
+                self._reconnect_if_wanted()
+            self._send_completed_op_up(op, error=error)
+
+        self._pending_connect_ops += 1
+        self._send_op_down_and_intercept_return(op, intercepted_return=on_connect_op_complete)
+
+    @handles_ops(pipeline_ops_base.DisconnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _run_disconnect_op(self, op):
+        self.wants_connection = False
+        self._cancel_reconnect_timer()
+        self._send_op_down(op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_connected(self):
+        self.failed_attempts = 0
+        self._cancel_reconnect_timer()
+        super(ReconnectStage, self).on_connected()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_disconnected(self):
+        super(ReconnectStage, self).on_disconnected()
+        if not self._pending_connect_ops:
+            self._reconnect_if_wanted()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _reconnect_if_wanted(self):
+        """
+        Schedule a reconnect attempt if the client is meant to be connected and auto_reconnect is
+        enabled
+        """
+        if self.wants_connection and self.pipeline_root.pipeline_configuration.auto_reconnect:
+            logger.info("%s: connection lost.  Scheduling reconnect", self.name)
+            self._schedule_reconnect()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _get_reconnect_delay(self):
+        """
+        Return the number of seconds to wait before the next reconnect attempt
+        """
+        pipeline_configuration = self.pipeline_root.pipeline_configuration
+        max_delay = min(
+            pipeline_configuration.reconnect_max_delay,
+            pipeline_configuration.reconnect_initial_delay * 2 ** self.failed_attempts,
+        )
+        return random.uniform(0, max_delay)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _schedule_reconnect(self):
+        """
+        Start a timer to make the next reconnect attempt, unless one is already running
+        """
+        if self._reconnect_timer is not None:
+            return
+        delay = self._get_reconnect_delay()
+        logger.info(
+            "%s: reconnect attempt %s in %.3f seconds", self.name, self.failed_attempts + 1, delay
+        )
+        self.pipeline_root.on_connection_state_changed("reconnecting")
+
+        # The timer holds a weak reference so that it doesn't keep the pipeline alive
+        self_weakref = weakref.ref(self)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_reconnect_timer():
+            this = self_weakref()
+            if this:
+                this._reconnect()
+
+        self._reconnect_timer = Timer(delay, on_reconnect_timer)
+        self._reconnect_timer.daemon = True
+        self._reconnect_timer.start()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _cancel_reconnect_timer(self):
+        if self._reconnect_timer is not None:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _reconnect(self):
+        """
+        Make a reconnect attempt, and schedule the next one if it fails
+        """
+        self._reconnect_timer = None
+        if not self.wants_connection or self.pipeline_root.connected:
+            return
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_reconnect_complete(op, error):
+            self._pending_connect_ops -= 1
+            if not error:
+                logger.info("%s: reconnect succeeded", self.name)
+                self.failed_attempts = 0
+            elif self.wants_connection:
+                self.failed_attempts += 1
+                max_attempts = self.pipeline_root.pipeline_configuration.reconnect_max_attempts
+                if max_attempts is not None and self.failed_attempts >= max_attempts:
+                    logger.error(
+                        "%s: reconnect failed %s times.  Giving up", self.name, self.failed_attempts
+                    )
+                    self.wants_connection = False
+                    self.failed_attempts = 0
+                    self.pipeline_root.on_connection_state_changed("failed")
+                    handle_exceptions.handle_background_exception(error)
+                else:
+                    logger.info("%s: reconnect failed: %s", self.name, error)
+                    self._schedule_reconnect()
+
+        logger.info("%s: reconnecting", self.name)
+        self._pending_connect_ops += 1
+        self._send_op_down(pipeline_ops_base.ConnectOperation(callback=on_reconnect_complete))
 
 
 class EnsureConnectionStage(PipelineStage):
@@ -274,9 +734,9 @@ class EnsureConnectionStage(PipelineStage):
         # we're not connected.
         if op.needs_connection and not self.pipeline_root.connected:
             logger.debug(
-                "{}({}): Op needs connection.  Queueing this op and starting a ConnectionOperation".format(
-                    self.name, op.name
-                )
+                "%s(%s): Op needs connection.  Queueing this op and starting a ConnectionOperation",
+                self.name,
+                op.name,
             )
             self._do_connect(op)
 
@@ -302,15 +762,22 @@ class EnsureConnectionStage(PipelineStage):
                 self._complete_op(op, error=error)
             else:
                 logger.debug(
-                    "{}({}): connection is complete.  Continuing with op".format(self.name, op.name)
+                    "%s(%s): connection is complete.  Continuing with op", self.name, op.name
                 )
                 self._send_op_down(op)
 
         # call down to the next stage to connect.
-        logger.debug("{}({}): calling down with Connect operation".format(self.name, op.name))
+        logger.debug("%s(%s): calling down with Connect operation", self.name, op.name)
         self._send_op_down(pipeline_ops_base.ConnectOperation(callback=on_connect_op_complete))
 
 
+_CONNECTION_OP_TYPES = (
+    pipeline_ops_base.ConnectOperation,
+    pipeline_ops_base.DisconnectOperation,
+    pipeline_ops_base.ReconnectOperation,
+)
+
+
 class SerializeConnectOpsStage(PipelineStage):
     """
     This stage is responsible for serializing connect, disconnect, and reconnect ops on
@@ -318,43 +785,60 @@ class SerializeConnectOpsStage(PipelineStage):
     time.  This way, we don't have to worry about cases like "what happens if we try to
     disconnect if we're in the middle of reconnecting."  This stage will wait for the
     reconnect to complete before letting the disconnect past.
+
+    While the stage is blocked, a connect, disconnect or reconnect op of the same type as the
+    last one to block the stage or be queued is merged into that op instead of being queued, and
+    is completed with the same result.  This way, a flapping connection with many pending sends
+    (each of which may ask for a connection) only causes one connection attempt at a time.  A
+    reconnect op is never merged into the reconnect op blocking the stage, as that one has
+    already been sent down (with the credentials of the time), and the new one may be for
+    renewed credentials.
     """
 
     def __init__(self):
         super(SerializeConnectOpsStage, self).__init__()
-        self.queue = queue.Queue()
+        self.queue = collections.deque()
         self.blocked = False
+        # The last connect/disconnect/reconnect op to block the stage or be queued, and the ops
+        # that have been merged into it (None until the first op is merged)
+        self._coalescing_op = None
+        self._coalesced_ops = None
 
     @pipeline_thread.runs_on_pipeline_thread
     def _execute_op(self, op):
         # If this stage is currently blocked (because we're waiting for a connection, etc,
         # to complete), we queue up all operations until after the connect completes.
         if self.blocked:
+            if isinstance(op, _CONNECTION_OP_TYPES):
+                if type(op) is type(self._coalescing_op):
+                    logger.info(
+                        "%s(%s): pipeline is blocked and the same op is already pending.  merging.",
+                        self.name,
+                        op.name,
+                    )
+                    self._coalesce(op)
+                    return
+                self._coalescing_op = op
+                self._coalesced_ops = None
             logger.info(
-                "{}({}): pipeline is blocked waiting for a prior connect/disconnect/reconnect to complete.  queueing.".format(
-                    self.name, op.name
-                )
+                "%s(%s): pipeline is blocked waiting for a prior connect/disconnect/reconnect to complete.  queueing.",
+                self.name,
+                op.name,
             )
-            self.queue.put_nowait(op)
+            self.queue.append(op)
 
         elif isinstance(op, pipeline_ops_base.ConnectOperation) and self.pipeline_root.connected:
-            logger.info("{}({}): Transport is connected.  Completing.".format(self.name, op.name))
+            logger.info("%s(%s): Transport is connected.  Completing.", self.name, op.name)
             self._complete_op(op)
 
         elif (
             isinstance(op, pipeline_ops_base.DisconnectOperation)
             and not self.pipeline_root.connected
         ):
-            logger.info(
-                "{}({}): Transport is disconnected.  Completing.".format(self.name, op.name)
-            )
+            logger.info("%s(%s): Transport is disconnected.  Completing.", self.name, op.name)
             self._complete_op(op=op)
 
-        elif (
-            isinstance(op, pipeline_ops_base.DisconnectOperation)
-            or isinstance(op, pipeline_ops_base.ConnectOperation)
-            or isinstance(op, pipeline_ops_base.ReconnectOperation)
-        ):
+        elif isinstance(op, _CONNECTION_OP_TYPES):
             self._block(op)
 
             @pipeline_thread.runs_on_pipeline_thread
@@ -366,15 +850,13 @@ class SerializeConnectOpsStage(PipelineStage):
                         )
                     )
                 else:
-                    logger.debug(
-                        "{}({}): op succeeded.  Unblocking queue".format(self.name, op.name)
-                    )
+                    logger.debug("%s(%s): op succeeded.  Unblocking queue", self.name, op.name)
 
                 self._unblock(op, error)
                 logger.debug(
-                    "{}({}): unblock is complete.  completing op that caused unblock".format(
-                        self.name, op.name
-                    )
+                    "%s(%s): unblock is complete.  completing op that caused unblock",
+                    self.name,
+                    op.name,
                 )
                 self._send_completed_op_up(op, error)
 
@@ -388,8 +870,35 @@ class SerializeConnectOpsStage(PipelineStage):
         """
         block this stage while we're waiting for the connect/disconnect/reconnect operation to complete.
         """
-        logger.debug("{}({}): blocking".format(self.name, op.name))
+        logger.debug("%s(%s): blocking", self.name, op.name)
         self.blocked = True
+        if isinstance(op, pipeline_ops_base.ReconnectOperation):
+            # A later reconnect (e.g. for a renewed SAS token) must still be sent down
+            self._coalescing_op = None
+        else:
+            self._coalescing_op = op
+        self._coalesced_ops = None
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _coalesce(self, op):
+        """
+        Merge op into the pending connect/disconnect/reconnect op of the same type, so that it is
+        completed with the same result as that op.
+        """
+        if self._coalesced_ops is None:
+            coalesced_ops = self._coalesced_ops = []
+            pending_op = self._coalescing_op
+            pending_op_callback = pending_op.callback
+
+            @pipeline_thread.runs_on_pipeline_thread
+            def on_pending_op_complete(pending_op, error):
+                pending_op.callback = pending_op_callback
+                pending_op_callback(pending_op, error=error)
+                for coalesced_op in coalesced_ops:
+                    self._complete_op(coalesced_op, error=error)
+
+            pending_op.callback = on_pending_op_complete
+        self._coalesced_ops.append(op)
 
     @pipeline_thread.runs_on_pipeline_thread
     def _unblock(self, op, error):
@@ -397,18 +906,18 @@ class SerializeConnectOpsStage(PipelineStage):
         Unblock this stage after the connect/disconnect/reconnect operation is complete.  This also means
         releasing all the operations that were queued up.
         """
-        logger.debug("{}({}): unblocking and releasing queued ops.".format(self.name, op.name))
+        logger.debug("%s(%s): unblocking and releasing queued ops.", self.name, op.name)
         self.blocked = False
-        logger.info(
-            "{}({}): processing {} items in queue".format(self.name, op.name, self.queue.qsize())
-        )
+        self._coalescing_op = None
+        self._coalesced_ops = None
+        logger.info("%s(%s): processing %s items in queue", self.name, op.name, len(self.queue))
         # Loop through our queue and release all the blocked operations
-        # Put a new Queue in self.queue because releasing ops might put them back in the
+        # Put a new deque in self.queue because releasing ops might put them back in the
         # queue, especially if there's a ConnectOperation in the list of ops to release
         old_queue = self.queue
-        self.queue = queue.Queue()
-        while not old_queue.empty():
-            op_to_release = old_queue.get_nowait()
+        self.queue = collections.deque()
+        while old_queue:
+            op_to_release = old_queue.popleft()
             if error:
                 # if we're unblocking the queue because something (like a connect operation) failed,
                 # then we fail all of the blocked operations with the same error.
@@ -419,9 +928,7 @@ class SerializeConnectOpsStage(PipelineStage):
                 )
                 self._complete_op(op_to_release, error=error)
             else:
-                logger.debug(
-                    "{}({}): releasing {} op.".format(self.name, op.name, op_to_release.name)
-                )
+                logger.debug("%s(%s): releasing %s op.", self.name, op.name, op_to_release.name)
                 # call run_op directly here so operations go through this stage again (especiall connect/disconnect ops)
                 self.run_op(op_to_release)
 
@@ -431,98 +938,245 @@ class CoordinateRequestAndResponseStage(PipelineStage):
     Pipeline stage which is responsible for coordinating SendIotRequestAndWaitForResponseOperation operations.  For each
     SendIotRequestAndWaitForResponseOperation operation, this stage passes down a SendIotRequestOperation operation and waits for
     an IotResponseEvent event.  All other events are passed down unmodified.
+
+    Requests which don't get a response within the operation_timeout pipeline configuration option
+    are failed with an OperationTimeoutError.  The max_pending_requests option limits the number of
+    requests waiting for a response.  When it has been reached, the in_flight_policy option decides
+    whether new requests wait for a response to arrive ("wait") or are failed immediately with a
+    PipelineBusyError ("fail").
+
+    :ivar pending_responses: Requests waiting for a response, keyed by request ID.
+    :type pending_responses: dict
+    :ivar queue: Requests waiting for room because max_pending_requests has been reached.
+    :type queue: collections.deque
+    :ivar response_latency: Histogram of the time from sending each request to its response arriving.
+    :type response_latency: LatencyHistogram
     """
 
     def __init__(self):
         super(CoordinateRequestAndResponseStage, self).__init__()
         self.pending_responses = {}
-
+        self.queue = collections.deque()
+        self.response_latency = pipeline_tracing.LatencyHistogram()
+        # Request IDs are a counter (much cheaper than a uuid per request), prefixed with a random
+        # value for this stage so that a late response to a request sent by an earlier pipeline
+        # (or process) on the same MQTT session cannot match a new request
+        self._request_id_prefix = uuid.uuid4().hex[:8]
+        self._request_ids = itertools.count(1)
+        # Maps request_id->time sent for pending requests.  Every request has the same timeout, so
+        # insertion order is also deadline order, and expired requests are always at the front.
+        self._request_send_times = collections.OrderedDict()
+        self._sweep_timer = None
+        self._releasing = False
+
+    @handles_ops(pipeline_ops_base.SendIotRequestAndWaitForResponseOperation)
     @pipeline_thread.runs_on_pipeline_thread
-    def _execute_op(self, op):
-        if isinstance(op, pipeline_ops_base.SendIotRequestAndWaitForResponseOperation):
-            # Convert SendIotRequestAndWaitForResponseOperation operation into a SendIotRequestOperation operation
-            # and send it down.  A lower level will convert the SendIotRequestOperation into an
-            # actual protocol client operation.  The SendIotRequestAndWaitForResponseOperation operation will be
-            # completed when the corresponding IotResponse event is received in this stage.
-
-            request_id = str(uuid.uuid4())
-
-            @pipeline_thread.runs_on_pipeline_thread
-            def on_send_request_done(send_request_op, error):
-                logger.debug(
-                    "{}({}): Finished sending {} request to {} resource {}".format(
-                        self.name, op.name, op.request_type, op.method, op.resource_location
-                    )
+    def _execute_send_iot_request_op(self, op):
+        config = self.pipeline_root.pipeline_configuration
+        if (
+            config.max_pending_requests is None
+            or len(self.pending_responses) < config.max_pending_requests
+        ):
+            self._send_request_down(op)
+        elif config.in_flight_policy == "fail":
+            logger.warning(
+                "{}({}): {} requests already pending.  Failing.".format(
+                    self.name, op.name, len(self.pending_responses)
                 )
-                if error:
-                    logger.debug(
-                        "{}({}): removing request {} from pending list".format(
-                            self.name, op.name, request_id
-                        )
+            )
+            self._complete_op(
+                op,
+                error=pipeline_exceptions.PipelineBusyError(
+                    "Maximum of {} requests waiting for a response has been reached".format(
+                        config.max_pending_requests
                     )
-                    del (self.pending_responses[request_id])
-                    self._complete_op(op, error=error)
-                else:
-                    # request sent.  Nothing to do except wait for the response
-                    pass
-
-            logger.debug(
-                "{}({}): Sending {} request to {} resource {}".format(
-                    self.name, op.name, op.request_type, op.method, op.resource_location
-                )
+                ),
             )
-
+        else:
             logger.debug(
-                "{}({}): adding request {} to pending list".format(self.name, op.name, request_id)
+                "%s(%s): %s requests already pending.  Queueing.",
+                self.name,
+                op.name,
+                len(self.pending_responses),
             )
-            self.pending_responses[request_id] = op
-
-            new_op = pipeline_ops_base.SendIotRequestOperation(
-                method=op.method,
-                resource_location=op.resource_location,
-                request_body=op.request_body,
-                request_id=request_id,
-                request_type=op.request_type,
-                callback=on_send_request_done,
-            )
-            self._send_op_down(new_op)
-
-        else:
-            self._send_op_down(op)
+            self.queue.append(op)
 
     @pipeline_thread.runs_on_pipeline_thread
-    def _handle_pipeline_event(self, event):
-        if isinstance(event, pipeline_events_base.IotResponseEvent):
-            # match IotResponseEvent events to the saved dictionary of SendIotRequestAndWaitForResponseOperation
-            # operations which have not received responses yet.  If the operation is found,
-            # complete it.
+    def _send_request_down(self, op):
+        """
+        Convert a SendIotRequestAndWaitForResponseOperation operation into a SendIotRequestOperation operation
+        and send it down.  A lower level will convert the SendIotRequestOperation into an
+        actual protocol client operation.  The SendIotRequestAndWaitForResponseOperation operation will be
+        completed when the corresponding IotResponse event is received in this stage.
+        """
+        request_id = "{}-{}".format(self._request_id_prefix, next(self._request_ids))
 
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_send_request_done(send_request_op, error):
             logger.debug(
-                "{}({}): Handling event with request_id {}".format(
-                    self.name, event.name, event.request_id
-                )
+                "%s(%s): Finished sending %s request to %s resource %s",
+                self.name,
+                op.name,
+                op.request_type,
+                op.method,
+                op.resource_location,
             )
-            if event.request_id in self.pending_responses:
-                op = self.pending_responses[event.request_id]
-                del (self.pending_responses[event.request_id])
-                op.status_code = event.status_code
-                op.response_body = event.response_body
+            if error and request_id in self.pending_responses:
                 logger.debug(
-                    "{}({}): Completing {} request to {} resource {} with status {}".format(
-                        self.name,
-                        op.name,
-                        op.request_type,
-                        op.method,
-                        op.resource_location,
-                        op.status_code,
-                    )
+                    "%s(%s): removing request %s from pending list", self.name, op.name, request_id
                 )
-                self._complete_op(op)
+                self._remove_pending_request(request_id)
+                self._complete_op(op, error=error)
+                self._release_queued_requests()
             else:
-                logger.warning(
-                    "{}({}): request_id {} not found in pending list.  Nothing to do.  Dropping".format(
-                        self.name, event.name, event.request_id
-                    )
+                # request sent (or already timed out).  Nothing to do except wait for the response
+                pass
+
+        logger.debug(
+            "%s(%s): Sending %s request to %s resource %s",
+            self.name,
+            op.name,
+            op.request_type,
+            op.method,
+            op.resource_location,
+        )
+
+        logger.debug("%s(%s): adding request %s to pending list", self.name, op.name, request_id)
+        self.pending_responses[request_id] = op
+        self._request_send_times[request_id] = _now()
+        self._schedule_sweep()
+
+        new_op = pipeline_ops_base.SendIotRequestOperation(
+            method=op.method,
+            resource_location=op.resource_location,
+            request_body=op.request_body,
+            request_id=request_id,
+            request_type=op.request_type,
+            callback=on_send_request_done,
+        )
+        self._send_op_down(new_op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _remove_pending_request(self, request_id):
+        """
+        Remove a request from the pending list, and return the time it was sent.
+        """
+        del self.pending_responses[request_id]
+        return self._request_send_times.pop(request_id)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _release_queued_requests(self):
+        """
+        Send queued requests down for as long as there is room for them.
+        """
+        # Requests can fail synchronously (e.g. if there is no next stage), which calls back into
+        # this method.  The outermost call does all the releasing, to avoid deep recursion.
+        if self._releasing:
+            return
+        self._releasing = True
+        try:
+            max_pending_requests = self.pipeline_root.pipeline_configuration.max_pending_requests
+            while self.queue and (
+                max_pending_requests is None or len(self.pending_responses) < max_pending_requests
+            ):
+                self._send_request_down(self.queue.popleft())
+        finally:
+            self._releasing = False
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _schedule_sweep(self):
+        """
+        Start a timer to fail the oldest pending request when its deadline passes, unless there
+        is no timeout or a timer is already running.
+        """
+        timeout = self.pipeline_root.pipeline_configuration.operation_timeout
+        if timeout is None or self._sweep_timer is not None or not self._request_send_times:
+            return
+        oldest_send_time = next(iter(self._request_send_times.values()))
+        interval = max(0, oldest_send_time + timeout - _now())
+
+        # The timer holds a weak reference so that it doesn't keep the pipeline alive
+        self_weakref = weakref.ref(self)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_sweep_timer():
+            this = self_weakref()
+            if this:
+                this._sweep()
+
+        self._sweep_timer = Timer(interval, on_sweep_timer)
+        self._sweep_timer.daemon = True
+        self._sweep_timer.start()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _sweep(self, now=None):
+        """
+        Fail every pending request whose deadline has passed with an OperationTimeoutError, and
+        start a timer for the next deadline.
+
+        :param float now: The current time, as returned by the clock used for deadlines (optional).
+        """
+        self._sweep_timer = None
+        if now is None:
+            now = _now()
+        timeout = self.pipeline_root.pipeline_configuration.operation_timeout
+        expired = []
+        if timeout is not None:
+            while self._request_send_times:
+                request_id, send_time = next(iter(self._request_send_times.items()))
+                if send_time + timeout > now:
+                    break
+                expired.append((request_id, self.pending_responses[request_id]))
+                self._remove_pending_request(request_id)
+
+        for request_id, op in expired:
+            logger.warning(
+                "{}({}): no response to request {} within {} seconds.  Failing.".format(
+                    self.name, op.name, request_id, timeout
                 )
+            )
+            self._complete_op(
+                op,
+                error=transport_exceptions.OperationTimeoutError(
+                    message="No response received for request {} within {} seconds".format(
+                        request_id, timeout
+                    )
+                ),
+            )
+        if expired:
+            self._release_queued_requests()
+        self._schedule_sweep()
+
+    @handles_events(pipeline_events_base.IotResponseEvent)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _handle_iot_response_event(self, event):
+        # match IotResponseEvent events to the saved dictionary of SendIotRequestAndWaitForResponseOperation
+        # operations which have not received responses yet.  If the operation is found,
+        # complete it.
+
+        logger.debug(
+            "%s(%s): Handling event with request_id %s", self.name, event.name, event.request_id
+        )
+        if event.request_id in self.pending_responses:
+            op = self.pending_responses[event.request_id]
+            send_time = self._remove_pending_request(event.request_id)
+            self.response_latency.record(_now() - send_time)
+            op.status_code = event.status_code
+            op.response_body = event.response_body
+            logger.debug(
+                "%s(%s): Completing %s request to %s resource %s with status %s",
+                self.name,
+                op.name,
+                op.request_type,
+                op.method,
+                op.resource_location,
+                op.status_code,
+            )
+            self._complete_op(op)
+            self._release_queued_requests()
         else:
-            self._send_event_up(event)
+            logger.warning(
+                "{}({}): request_id {} not found in pending list.  Nothing to do.  Dropping".format(
+                    self.name, event.name, event.request_id
+                )
+            )
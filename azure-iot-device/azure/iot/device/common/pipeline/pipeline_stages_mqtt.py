@@ -4,11 +4,14 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import collections
 import logging
 import six
+import threading
 from . import (
     pipeline_ops_base,
     PipelineStage,
+    handles_ops,
     pipeline_ops_mqtt,
     pipeline_events_mqtt,
     pipeline_thread,
@@ -26,8 +29,18 @@ class MQTTTransportStage(PipelineStage):
     PipelineStage object which is responsible for interfacing with the MQTT protocol wrapper object.
     This stage handles all MQTT operations and any other operations (such as ConnectOperation) which
     is not in the MQTT group of operations, but can only be run at the protocol level.
+
+    Incoming messages are handed to the pipeline thread in batches.  Each message received by the
+    transport is added to a list, and the pipeline thread is only entered for a message which
+    arrives when the list is empty.  By the time the pipeline thread runs, every message which
+    arrived in the meantime is in the list, so they are all passed up together.
     """
 
+    def __init__(self):
+        super(MQTTTransportStage, self).__init__()
+        self._incoming_messages = []
+        self._incoming_messages_lock = threading.Lock()
+
     @pipeline_thread.runs_on_pipeline_thread
     def _cancel_pending_connection_op(self):
         """
@@ -46,140 +59,198 @@ class MQTTTransportStage(PipelineStage):
             self._complete_op(op, error=error)
             self._pending_connection_op = None
 
+    @handles_ops(pipeline_ops_mqtt.SetMQTTConnectionArgsOperation)
     @pipeline_thread.runs_on_pipeline_thread
-    def _execute_op(self, op):
-        if isinstance(op, pipeline_ops_mqtt.SetMQTTConnectionArgsOperation):
-            # pipeline_ops_mqtt.SetMQTTConnectionArgsOperation is where we create our MQTTTransport object and set
-            # all of its properties.
-            logger.debug("{}({}): got connection args".format(self.name, op.name))
-            self.hostname = op.hostname
-            self.username = op.username
-            self.client_id = op.client_id
-            self.ca_cert = op.ca_cert
-            self.sas_token = op.sas_token
-            self.client_cert = op.client_cert
-            self.transport = MQTTTransport(
+    def _execute_set_connection_args_op(self, op):
+        # pipeline_ops_mqtt.SetMQTTConnectionArgsOperation is where we create our MQTTTransport object and set
+        # all of its properties.
+        logger.debug("%s(%s): got connection args", self.name, op.name)
+        self.hostname = op.hostname
+        self.username = op.username
+        self.client_id = op.client_id
+        self.ca_cert = op.ca_cert
+        self.sas_token = op.sas_token
+        self.client_cert = op.client_cert
+        config = self.pipeline_root.pipeline_configuration
+        if config.asyncio_loop:
+            # Imported here because the asyncio transport is only available on Python 3.5+
+            from azure.iot.device.common.async_mqtt_transport import AsyncMQTTTransport
+
+            self.transport = AsyncMQTTTransport(
                 client_id=self.client_id,
                 hostname=self.hostname,
                 username=self.username,
                 ca_cert=self.ca_cert,
                 x509_cert=self.client_cert,
-                websockets=self.pipeline_root.pipeline_configuration.websockets,
-            )
-            self.transport.on_mqtt_connected_handler = CallableWeakMethod(
-                self, "_on_mqtt_connected"
-            )
-            self.transport.on_mqtt_connection_failure_handler = CallableWeakMethod(
-                self, "_on_mqtt_connection_failure"
+                loop=config.asyncio_loop,
+                operation_timeout=config.operation_timeout,
+                quiet_logging=config.quiet_logging,
             )
-            self.transport.on_mqtt_disconnected_handler = CallableWeakMethod(
-                self, "_on_mqtt_disconnected"
-            )
-            self.transport.on_mqtt_message_received_handler = CallableWeakMethod(
-                self, "_on_mqtt_message_received"
+        else:
+            self.transport = MQTTTransport(
+                client_id=self.client_id,
+                hostname=self.hostname,
+                username=self.username,
+                ca_cert=self.ca_cert,
+                x509_cert=self.client_cert,
+                websockets=config.websockets,
+                network_loop=config.network_loop,
+                operation_timeout=config.operation_timeout,
+                quiet_logging=config.quiet_logging,
             )
+        self.transport.on_mqtt_connected_handler = CallableWeakMethod(self, "_on_mqtt_connected")
+        self.transport.on_mqtt_connection_failure_handler = CallableWeakMethod(
+            self, "_on_mqtt_connection_failure"
+        )
+        self.transport.on_mqtt_disconnected_handler = CallableWeakMethod(
+            self, "_on_mqtt_disconnected"
+        )
+        self.transport.on_mqtt_message_received_handler = CallableWeakMethod(
+            self, "_on_mqtt_message_received"
+        )
 
-            # There can only be one pending connection operation (Connect, Reconnect, Disconnect)
-            # at a time. The existing one must be completed or canceled before a new one is set.
+        # There can only be one pending connection operation (Connect, Reconnect, Disconnect)
+        # at a time. The existing one must be completed or canceled before a new one is set.
 
-            # Currently, this means that if, say, a connect operation is the pending op and is executed
-            # but another connection op is begins by the time the CONACK is received, the original
-            # operation will be cancelled, but the CONACK for it will still be received, and complete the
-            # NEW operation. This is not desirable, but it is how things currently work.
+        # Currently, this means that if, say, a connect operation is the pending op and is executed
+        # but another connection op is begins by the time the CONACK is received, the original
+        # operation will be cancelled, but the CONACK for it will still be received, and complete the
+        # NEW operation. This is not desirable, but it is how things currently work.
 
-            # We are however, checking the type, so the CONACK from a cancelled Connect, cannot successfully
-            # complete a Disconnect operation.
-            self._pending_connection_op = None
+        # We are however, checking the type, so the CONACK from a cancelled Connect, cannot successfully
+        # complete a Disconnect operation.
+        self._pending_connection_op = None
 
-            self.pipeline_root.transport = self.transport
-            self._complete_op(op)
+        self.pipeline_root.transport = self.transport
+        self._complete_op(op)
 
-        elif isinstance(op, pipeline_ops_base.UpdateSasTokenOperation):
-            logger.debug("{}({}): saving sas token and completing".format(self.name, op.name))
-            self.sas_token = op.sas_token
-            self._complete_op(op)
+    @handles_ops(pipeline_ops_base.UpdateSasTokenOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_update_sas_token_op(self, op):
+        logger.debug("%s(%s): saving sas token and completing", self.name, op.name)
+        self.sas_token = op.sas_token
+        self._complete_op(op)
 
-        elif isinstance(op, pipeline_ops_base.ConnectOperation):
-            logger.info("{}({}): connecting".format(self.name, op.name))
-
-            self._cancel_pending_connection_op()
-            self._pending_connection_op = op
-            try:
-                self.transport.connect(password=self.sas_token)
-            except Exception as e:
-                logger.error("transport.connect raised error", exc_info=True)
-                self._pending_connection_op = None
-                self._complete_op(op, error=e)
-
-        elif isinstance(op, pipeline_ops_base.ReconnectOperation):
-            logger.info("{}({}): reconnecting".format(self.name, op.name))
-
-            # We set _active_connect_op here because a reconnect is the same as a connect for "active operation" tracking purposes.
-            self._cancel_pending_connection_op()
-            self._pending_connection_op = op
-            try:
-                self.transport.reconnect(password=self.sas_token)
-            except Exception as e:
-                logger.error("transport.reconnect raised error", exc_info=True)
-                self._pending_connection_op = None
-                self._complete_op(op, error=e)
-
-        elif isinstance(op, pipeline_ops_base.DisconnectOperation):
-            logger.info("{}({}): disconnecting".format(self.name, op.name))
-
-            self._cancel_pending_connection_op()
-            self._pending_connection_op = op
-            try:
-                self.transport.disconnect()
-            except Exception as e:
-                logger.error("transport.disconnect raised error", exc_info=True)
-                self._pending_connection_op = None
-                self._complete_op(op, error=e)
-
-        elif isinstance(op, pipeline_ops_mqtt.MQTTPublishOperation):
-            logger.info("{}({}): publishing on {}".format(self.name, op.name, op.topic))
-
-            @pipeline_thread.invoke_on_pipeline_thread_nowait
-            def on_published():
-                logger.debug("{}({}): PUBACK received. completing op.".format(self.name, op.name))
-                self._complete_op(op)
-
-            self.transport.publish(topic=op.topic, payload=op.payload, callback=on_published)
-
-        elif isinstance(op, pipeline_ops_mqtt.MQTTSubscribeOperation):
-            logger.info("{}({}): subscribing to {}".format(self.name, op.name, op.topic))
-
-            @pipeline_thread.invoke_on_pipeline_thread_nowait
-            def on_subscribed():
-                logger.debug("{}({}): SUBACK received. completing op.".format(self.name, op.name))
-                self._complete_op(op)
-
-            self.transport.subscribe(topic=op.topic, callback=on_subscribed)
-
-        elif isinstance(op, pipeline_ops_mqtt.MQTTUnsubscribeOperation):
-            logger.info("{}({}): unsubscribing from {}".format(self.name, op.name, op.topic))
-
-            @pipeline_thread.invoke_on_pipeline_thread_nowait
-            def on_unsubscribed():
-                logger.debug(
-                    "{}({}): UNSUBACK received.  completing op.".format(self.name, op.name)
-                )
-                self._complete_op(op)
+    @handles_ops(pipeline_ops_base.ConnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_connect_op(self, op):
+        logger.info("%s(%s): connecting", self.name, op.name)
+
+        self._cancel_pending_connection_op()
+        self._pending_connection_op = op
+        try:
+            self.transport.connect(password=self.sas_token)
+        except Exception as e:
+            logger.error("transport.connect raised error", exc_info=True)
+            self._pending_connection_op = None
+            self._complete_op(op, error=e)
 
-            self.transport.unsubscribe(topic=op.topic, callback=on_unsubscribed)
+    @handles_ops(pipeline_ops_base.ReconnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_reconnect_op(self, op):
+        logger.info("%s(%s): reconnecting", self.name, op.name)
+
+        # We set _active_connect_op here because a reconnect is the same as a connect for "active operation" tracking purposes.
+        self._cancel_pending_connection_op()
+        self._pending_connection_op = op
+        try:
+            self.transport.reconnect(password=self.sas_token)
+        except Exception as e:
+            logger.error("transport.reconnect raised error", exc_info=True)
+            self._pending_connection_op = None
+            self._complete_op(op, error=e)
+
+    @handles_ops(pipeline_ops_base.DisconnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_disconnect_op(self, op):
+        logger.info("%s(%s): disconnecting", self.name, op.name)
+
+        self._cancel_pending_connection_op()
+        self._pending_connection_op = op
+        try:
+            self.transport.disconnect()
+        except Exception as e:
+            logger.error("transport.disconnect raised error", exc_info=True)
+            self._pending_connection_op = None
+            self._complete_op(op, error=e)
 
+    @handles_ops(pipeline_ops_mqtt.MQTTPublishOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_publish_op(self, op):
+        if self.pipeline_root.pipeline_configuration.quiet_logging:
+            logger.debug("%s(%s): publishing on %s", self.name, op.name, op.topic)
         else:
-            self._send_op_down(op)
+            logger.info("%s(%s): publishing on %s", self.name, op.name, op.topic)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_published(error=None):
+            if error:
+                logger.error("{}({}): publish failed: {}".format(self.name, op.name, error))
+            elif op.qos:
+                logger.debug("%s(%s): PUBACK received. completing op.", self.name, op.name)
+            else:
+                logger.debug("%s(%s): QoS 0 publish sent. completing op.", self.name, op.name)
+            self._complete_op(op, error=error)
+
+        self.transport.publish(
+            topic=op.topic, payload=op.payload, qos=op.qos, callback=on_published
+        )
+
+    @handles_ops(pipeline_ops_mqtt.MQTTSubscribeOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_subscribe_op(self, op):
+        logger.info("%s(%s): subscribing to %s", self.name, op.name, op.topic)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_subscribed(error=None):
+            if error:
+                logger.error("{}({}): subscribe failed: {}".format(self.name, op.name, error))
+            else:
+                logger.debug("%s(%s): SUBACK received. completing op.", self.name, op.name)
+            self._complete_op(op, error=error)
+
+        self.transport.subscribe(topic=op.topic, callback=on_subscribed)
+
+    @handles_ops(pipeline_ops_mqtt.MQTTUnsubscribeOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_unsubscribe_op(self, op):
+        logger.info("%s(%s): unsubscribing from %s", self.name, op.name, op.topic)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_unsubscribed(error=None):
+            if error:
+                logger.error("{}({}): unsubscribe failed: {}".format(self.name, op.name, error))
+            else:
+                logger.debug("%s(%s): UNSUBACK received.  completing op.", self.name, op.name)
+            self._complete_op(op, error=error)
+
+        self.transport.unsubscribe(topic=op.topic, callback=on_unsubscribed)
 
-    @pipeline_thread.invoke_on_pipeline_thread_nowait
     def _on_mqtt_message_received(self, topic, payload):
         """
         Handler that gets called by the protocol library when an incoming message arrives.
-        Convert that message into a pipeline event and pass it up for someone to handle.
+        Add that message to the batch waiting for the pipeline thread, entering the pipeline
+        thread to deliver the batch if this is the first message in it.
         """
-        self._send_event_up(
-            pipeline_events_mqtt.IncomingMQTTMessageEvent(topic=topic, payload=payload)
-        )
+        with self._incoming_messages_lock:
+            self._incoming_messages.append((topic, payload))
+            first_in_batch = len(self._incoming_messages) == 1
+        if first_in_batch:
+            self._deliver_incoming_messages()
+
+    @pipeline_thread.invoke_on_pipeline_thread_nowait
+    def _deliver_incoming_messages(self):
+        """
+        Convert every message waiting for the pipeline thread into a pipeline event and pass it
+        up for someone to handle.
+        """
+        with self._incoming_messages_lock:
+            messages = self._incoming_messages
+            self._incoming_messages = []
+        for topic, payload in messages:
+            self._send_event_up(
+                pipeline_events_mqtt.IncomingMQTTMessageEvent(topic=topic, payload=payload)
+            )
 
     @pipeline_thread.invoke_on_pipeline_thread_nowait
     def _on_mqtt_connected(self):
@@ -217,7 +288,7 @@ class MQTTTransportStage(PipelineStage):
         if isinstance(
             self._pending_connection_op, pipeline_ops_base.ConnectOperation
         ) or isinstance(self._pending_connection_op, pipeline_ops_base.ReconnectOperation):
-            logger.debug("{}: failing connect op".format(self.name))
+            logger.debug("%s: failing connect op", self.name)
             op = self._pending_connection_op
             self._pending_connection_op = None
             self._complete_op(op, error=cause)
@@ -235,14 +306,14 @@ class MQTTTransportStage(PipelineStage):
         if cause:
             logger.error("{}: _on_mqtt_disconnect called: {}".format(self.name, cause))
         else:
-            logger.info("{}: _on_mqtt_disconnect called".format(self.name))
+            logger.info("%s: _on_mqtt_disconnect called", self.name)
 
         # self.on_disconnected() tells other pipeilne stages that we're disconnected.  Do this before
         # we do anything else (in case upper stages have any "are we connected" logic.
         self.on_disconnected()
 
         if isinstance(self._pending_connection_op, pipeline_ops_base.DisconnectOperation):
-            logger.debug("{}: completing disconnect op".format(self.name))
+            logger.debug("%s: completing disconnect op", self.name)
             op = self._pending_connection_op
             self._pending_connection_op = None
 
@@ -259,3 +330,102 @@ class MQTTTransportStage(PipelineStage):
             # Regardless of cause, it is now a ConnectionDroppedError
             e = transport_exceptions.ConnectionDroppedError(cause=cause)
             handle_exceptions.handle_background_exception(e)
+
+
+class MQTTFlowControlStage(PipelineStage):
+    """
+    PipelineStage which limits the number of MQTTPublishOperation operations that are in flight
+    (i.e. passed down to the transport, but not yet acknowledged) at any one time.
+
+    The limit is set by the max_in_flight_messages pipeline configuration option (if it is None,
+    there is no limit).  When the limit has been reached, the in_flight_policy option decides what
+    happens to new publish operations:
+
+    - "wait": the operation is queued in this stage until an in-flight publish completes.  Since
+      clients wait for the publish to complete anyway, sync clients block and async clients
+      await, and memory use is bounded by the number of callers instead of by the transport.
+    - "fail": the operation is failed immediately with a PipelineBusyError.
+
+    All other operations are passed down.
+
+    :ivar in_flight_count: The number of publish operations currently in flight.
+    :type in_flight_count: int
+    :ivar queue: Publish operations waiting for room in the window.
+    :type queue: collections.deque
+    """
+
+    def __init__(self):
+        super(MQTTFlowControlStage, self).__init__()
+        self.in_flight_count = 0
+        self.queue = collections.deque()
+        self._releasing = False
+
+    @handles_ops(pipeline_ops_mqtt.MQTTPublishOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_publish_op(self, op):
+        config = self.pipeline_root.pipeline_configuration
+        if (
+            config.max_in_flight_messages is None
+            or self.in_flight_count < config.max_in_flight_messages
+        ):
+            self._send_publish_down(op)
+        elif config.in_flight_policy == "fail":
+            logger.warning(
+                "{}({}): {} publishes already in flight.  Failing.".format(
+                    self.name, op.name, self.in_flight_count
+                )
+            )
+            self._complete_op(
+                op,
+                error=pipeline_exceptions.PipelineBusyError(
+                    "Maximum of {} messages in flight has been reached".format(
+                        config.max_in_flight_messages
+                    )
+                ),
+            )
+        else:
+            logger.debug(
+                "%s(%s): %s publishes already in flight.  Queueing.",
+                self.name,
+                op.name,
+                self.in_flight_count,
+            )
+            self.queue.append(op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_publish_down(self, op):
+        """
+        Send a publish operation down, and release its place in the window when it completes.
+        """
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_publish_complete(op, error):
+            self.in_flight_count -= 1
+            self._send_completed_op_up(op, error)
+            self._release_queued_publishes()
+
+        self.in_flight_count += 1
+        self._send_op_down_and_intercept_return(op, intercepted_return=on_publish_complete)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _release_queued_publishes(self):
+        """
+        Send queued publish operations down for as long as there is room in the window.
+        """
+        # Publishes can complete synchronously (e.g. if the transport raises), which calls back
+        # into this method.  The outermost call does all the releasing, to avoid deep recursion.
+        if self._releasing:
+            return
+        self._releasing = True
+        try:
+            max_in_flight_messages = (
+                self.pipeline_root.pipeline_configuration.max_in_flight_messages
+            )
+            while self.queue and (
+                max_in_flight_messages is None or self.in_flight_count < max_in_flight_messages
+            ):
+                op = self.queue.popleft()
+                logger.debug("%s(%s): releasing queued publish", self.name, op.name)
+                self._send_publish_down(op)
+        finally:
+            self._releasing = False
@@ -7,9 +7,11 @@ import functools
 import logging
 import threading
 import traceback
+import zlib
 from multiprocessing.pool import ThreadPool
 from concurrent.futures import ThreadPoolExecutor
 from azure.iot.device.common import handle_exceptions
+from . import pipeline_tracing
 
 logger = logging.getLogger(__name__)
 
@@ -70,29 +72,137 @@ These decorators use concurrent.futures.Future and the ThreadPoolExecutor becaus
 
 3. concurrent.futures is available as a backport to 2.7.
 
+Each pipeline can have its own set of executors (a dict of ThreadPoolExecutor objects
+keyed by thread name), stored in the `executors` attribute of its PipelineRootStage, so
+that one busy pipeline doesn't hold up every other pipeline in the process.  Every
+thread in every set is still named "pipeline" or "callback", so the assertions above
+don't need to know which pipeline they are running for.  The decorators find the set to
+use from:
+
+1. The thread the function was decorated on.  A function decorated on a pipeline thread
+  (such as a completion callback created inside a stage) belongs to that pipeline.
+
+2. The pipeline stage the function is a method of.
+
+3. The thread the function is called on.
+
+Pipelines which don't have their own set share a single process-wide set.  This is the
+default, so that a process hosting many clients doesn't need two threads for each of them.
+
+If a pipeline has a tracer (the `tracer` attribute of its PipelineRootStage), the time that
+each function waits for the thread to be free is reported to it.  The tracer is found in the
+same way as the set of executors.
+
 """
 
 _executors = {}
+_executors_lock = threading.Lock()
+_sharded_executors = {}
+_thread_context = threading.local()
+
+# Value of the executor_shards configuration option which gives each pipeline its own executors
+PER_CLIENT = "per_client"
+
 
+def _get_named_executor(thread_name, executors=None):
+    """
+    Get a ThreadPoolExecutor object with the given name from the given set of executors
+    (or the process-wide set, if none is given).  If no such executor exists, this
+    function will create on with a single worker and assign it to the provided name.
+    """
+    if executors is None:
+        executors = _executors
+    with _executors_lock:
+        if thread_name not in executors:
+            logger.debug("Creating %s executor", thread_name)
+            executors[thread_name] = ThreadPoolExecutor(max_workers=1)
+        return executors[thread_name]
 
-def _get_named_executor(thread_name):
+
+def get_pipeline_executors(client_id, shards=None):
     """
-    Get a ThreadPoolExecutor object with the given name.  If no such executor exists,
-    this function will create on with a single worker and assign it to the provided
-    name.
+    Get the set of executors to be used by the pipeline of the client with the given ID.
+
+    :param str client_id: The ID of the client which owns the pipeline.
+    :param shards: If None, the pipeline shares the process-wide pipeline and callback threads.
+      If PER_CLIENT, the pipeline gets its own pipeline and callback threads.  If an int, the
+      pipeline shares one of that many sets of threads with the pipelines of other clients.  The
+      set is chosen by a hash of client_id, so a given client always uses the same set.
+    :type shards: int or str
+
+    :returns: A set of executors to assign to the executors attribute of a PipelineRootStage, or
+      None to use the process-wide set.
     """
-    global _executors
-    if thread_name not in _executors:
-        logger.debug("Creating {} executor".format(thread_name))
-        _executors[thread_name] = ThreadPoolExecutor(max_workers=1)
-    return _executors[thread_name]
+    if shards is None:
+        return None
+    if shards == PER_CLIENT:
+        return {}
+    # crc32 is stable across processes (unlike hash()), and masked because it is signed on 2.7
+    shard = (zlib.crc32(client_id.encode("utf-8")) & 0xFFFFFFFF) % shards
+    with _executors_lock:
+        return _sharded_executors.setdefault((shards, shard), {})
 
 
-def _invoke_on_executor_thread(func, thread_name, block=True):
+def _get_stage_executors(obj):
+    """
+    Get the set of executors belonging to the pipeline of obj, if obj is a pipeline stage
+    """
+    root = getattr(obj, "pipeline_root", None) or obj
+    executors = getattr(root, "executors", None)
+    if isinstance(executors, dict):
+        return executors
+    else:
+        return None
+
+
+def _find_executors(decorated_on_executors, func, args):
+    """
+    Find the set of executors to run func on, in the order described at the top of this module
+    """
+    if decorated_on_executors is not None:
+        return decorated_on_executors
+    for obj in (getattr(func, "__self__", None), args[0] if args else None):
+        executors = _get_stage_executors(obj)
+        if executors is not None:
+            return executors
+    current_executors = getattr(_thread_context, "executors", None)
+    if current_executors is not None:
+        return current_executors
+    return _executors
+
+
+def _find_tracer(decorated_on_tracer, func, args):
+    """
+    Find the tracer to report the time spent waiting for the thread to, if any
+    """
+    if decorated_on_tracer is not None:
+        return decorated_on_tracer
+    for obj in (getattr(func, "__self__", None), args[0] if args else None):
+        root = getattr(obj, "pipeline_root", None) or obj
+        tracer = getattr(root, "tracer", None)
+        if isinstance(tracer, pipeline_tracing.PipelineTracer):
+            return tracer
+    return getattr(_thread_context, "tracer", None)
+
+
+def _is_executor_thread(thread_name, executors):
+    """
+    Return True if the current thread is the given thread of the given set of executors
+    """
+    if threading.current_thread().name != thread_name:
+        return False
+    current_executors = getattr(_thread_context, "executors", None)
+    # A thread which wasn't started by an executor (such as a test faking the pipeline
+    # thread) is trusted by its name alone
+    return current_executors is None or current_executors is executors
+
+
+def _invoke_on_executor_thread(func, thread_name, block=True, executors=None, tracer=None):
     """
     Return wrapper to run the function on a given thread.  If block==False,
     the call returns immediately without waiting for the decorated function to complete.
     If block==True, the call waits for the decorated function to complete before returning.
+    If executors (or tracer) is None, it is found as described at the top of this module.
     """
 
     # Mocks on py27 don't have a __name__ attribute.  Use str() if you can't use __name__
@@ -103,12 +213,29 @@ def _invoke_on_executor_thread(func, thread_name, block=True):
         function_name = str(func)
         function_has_name = False
 
+    if executors is None:
+        decorated_on_executors = getattr(_thread_context, "executors", None)
+    else:
+        decorated_on_executors = executors
+    if tracer is None:
+        decorated_on_tracer = getattr(_thread_context, "tracer", None)
+    else:
+        decorated_on_tracer = tracer
+
     def wrapper(*args, **kwargs):
-        if threading.current_thread().name is not thread_name:
-            logger.debug("Starting {} in {} thread".format(function_name, thread_name))
+        executors = _find_executors(decorated_on_executors, func, args)
+        if not _is_executor_thread(thread_name, executors):
+            logger.debug("Starting %s in %s thread", function_name, thread_name)
+            tracer = _find_tracer(decorated_on_tracer, func, args)
+            if tracer is not None:
+                submitted = tracer.start()
 
             def thread_proc():
                 threading.current_thread().name = thread_name
+                _thread_context.executors = executors
+                _thread_context.tracer = tracer
+                if tracer is not None:
+                    tracer.end(submitted, "queue", None, thread_name)
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
@@ -124,15 +251,19 @@ def _invoke_on_executor_thread(func, thread_name, block=True):
                         )
                         traceback.print_exc()
                     raise
+                finally:
+                    # Don't keep the executors alive after their pipeline has gone away
+                    _thread_context.executors = None
+                    _thread_context.tracer = None
 
             # TODO: add a timeout here and throw exception on failure
-            future = _get_named_executor(thread_name).submit(thread_proc)
+            future = _get_named_executor(thread_name, executors).submit(thread_proc)
             if block:
                 return future.result()
             else:
                 return future
         else:
-            logger.debug("Already in {} thread for {}".format(thread_name, function_name))
+            logger.debug("Already in %s thread for %s", thread_name, function_name)
             return func(*args, **kwargs)
 
     # Silly hack:  On 2.7, we can't use @functools.wraps on callables don't have a __name__ attribute
@@ -145,25 +276,31 @@ def _invoke_on_executor_thread(func, thread_name, block=True):
         return wrapper
 
 
-def invoke_on_pipeline_thread(func):
+def invoke_on_pipeline_thread(func, executors=None, tracer=None):
     """
     Run the decorated function on the pipeline thread.
     """
-    return _invoke_on_executor_thread(func=func, thread_name="pipeline")
+    return _invoke_on_executor_thread(
+        func=func, thread_name="pipeline", executors=executors, tracer=tracer
+    )
 
 
-def invoke_on_pipeline_thread_nowait(func):
+def invoke_on_pipeline_thread_nowait(func, executors=None, tracer=None):
     """
     Run the decorated function on the pipeline thread, but don't wait for it to complete
     """
-    return _invoke_on_executor_thread(func=func, thread_name="pipeline", block=False)
+    return _invoke_on_executor_thread(
+        func=func, thread_name="pipeline", block=False, executors=executors, tracer=tracer
+    )
 
 
-def invoke_on_callback_thread_nowait(func):
+def invoke_on_callback_thread_nowait(func, executors=None, tracer=None):
     """
     Run the decorated function on the callback thread, but don't wait for it to complete
     """
-    return _invoke_on_executor_thread(func=func, thread_name="callback", block=False)
+    return _invoke_on_executor_thread(
+        func=func, thread_name="callback", block=False, executors=executors, tracer=tracer
+    )
 
 
 def _assert_executor_thread(func, thread_name):
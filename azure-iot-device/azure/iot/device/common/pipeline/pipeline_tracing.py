@@ -0,0 +1,200 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains objects used to measure where time goes inside a pipeline.
+
+A PipelineTracer is given to a pipeline with the tracer pipeline configuration option.  The
+pipeline then reports the following measurements to it:
+
+- "run_op": the time each stage spends in run_op for each operation, including the time spent
+  by the stages below it until run_op returns.
+- "complete_op": the time each stage spends in _complete_op for each operation, which is the
+  time spent calling back up the pipeline.
+- "send_event_up": the time each stage spends passing each event up the pipeline.
+- "queue": the time work waits for the pipeline or callback thread to be free.
+- "op": the time from the root of the pipeline running each operation to the operation being
+  completed (for a message, from send_message() to the service acknowledging it).
+
+Each measurement is added to a LatencyHistogram, and can also be reported as a span to an
+OpenTelemetry-compatible tracer.  When a pipeline has no tracer, the only cost of this is a
+check of the tracer attribute of the stage.
+"""
+
+import threading
+import time
+
+# Measurements are taken with a monotonic clock where there is one (Python 3), so that they are
+# not thrown off by changes to the system clock
+_now = getattr(time, "monotonic", time.time)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies with HDR-style buckets.  Values are recorded in microseconds, and
+    every power of two is split into the same number of linear sub-buckets, so any value from
+    one microsecond to many hours is recorded with a relative error of less than 1%, in a small
+    amount of memory.
+
+    :ivar count: The number of values recorded.
+    :type count: int
+    :ivar total: The sum of the values recorded, in seconds.
+    :type total: float
+    :ivar min: The smallest value recorded, in seconds, or None if no values have been recorded.
+    :type min: float
+    :ivar max: The largest value recorded, in seconds, or None if no values have been recorded.
+    :type max: float
+    """
+
+    # Each power of two is split into 2 ** _sub_bucket_bits sub-buckets
+    _sub_bucket_bits = 7
+
+    def __init__(self):
+        self._counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        """
+        Add a value, in seconds, to the histogram.
+        """
+        value = max(0, int(seconds * 1000000))
+        shift = max(0, value.bit_length() - self._sub_bucket_bits - 1)
+        index = (shift << self._sub_bucket_bits) + (value >> shift)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        """
+        The mean of the values recorded, in seconds, or None if no values have been recorded.
+        """
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percentile):
+        """
+        Return the value, in seconds, below which the given percentage of the recorded values
+        fall, or None if no values have been recorded.
+
+        :param float percentile: The percentile, from 0 to 100.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                shift = max(0, (index >> self._sub_bucket_bits) - 1)
+                low = (index - (shift << self._sub_bucket_bits)) << shift
+                middle = (low + ((1 << shift) - 1) / 2.0) / 1000000.0
+                return min(max(middle, self.min), self.max)
+        return self.max
+
+
+class PipelineTracer(object):
+    """
+    Object which collects timing measurements from a pipeline.  See the top of this module for
+    the measurements which are collected.
+
+    :ivar histograms: The LatencyHistogram of each measurement, keyed by the name of the
+      measurement, the name of the stage, and the name of the operation or event, separated by
+      slashes (such as "run_op/MQTTTransportStage/MQTTPublishOperation").  Queue histograms are
+      keyed by the name of the thread ("queue/pipeline" and "queue/callback"), and operation
+      histograms by the name of the operation (such as "op/SendD2CMessageOperation").
+    :type histograms: dict
+    :ivar span_tracer: The OpenTelemetry-compatible tracer that measurements are reported to.
+    """
+
+    def __init__(self, span_tracer=None):
+        """
+        Initializer for PipelineTracer objects.
+
+        :param span_tracer: (Optional) A tracer to report each measurement to as a span, such as
+          one returned by opentelemetry.trace.get_tracer().  Only its start_span(name,
+          attributes=None, start_time=None) method and the end(end_time=None) method of the spans
+          it returns are used, with times in nanoseconds since the epoch, so any object with these
+          methods can be used.
+        """
+        self.span_tracer = span_tracer
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Return the start time of a measurement, to pass to end().  This is only meaningful as an
+        argument to end(), and is not a time since the epoch.
+        """
+        return _now()
+
+    def end(self, start, name, stage_name, item_name):
+        """
+        Record a measurement which started at start (as returned by start()) and ends now.
+
+        :param str name: The name of the measurement, such as "run_op".
+        :param str stage_name: The name of the stage that the measurement is for, or None.
+        :param str item_name: The name of the operation or event (or thread, for queue
+          measurements) that the measurement is for.
+        """
+        end = _now()
+        key = "/".join(part for part in (name, stage_name, item_name) if part is not None)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.record(end - start)
+
+        if self.span_tracer is not None:
+            attributes = {"pipeline.item": item_name}
+            if stage_name is not None:
+                attributes["pipeline.stage"] = stage_name
+            # Spans are timed in nanoseconds since the epoch, so place the measurement so that it
+            # ends at the current time
+            end_time = time.time()
+            span = self.span_tracer.start_span(
+                "pipeline." + name,
+                attributes=attributes,
+                start_time=int((end_time - (end - start)) * 1e9),
+            )
+            span.end(end_time=int(end_time * 1e9))
+
+    def trace_callback(self, callback, name, item_name):
+        """
+        Return a wrapper around callback which records a measurement from now until the
+        wrapper is called.
+        """
+        start = self.start()
+
+        def traced_callback(*args, **kwargs):
+            self.end(start, name, None, item_name)
+            return callback(*args, **kwargs)
+
+        return traced_callback
+
+    def get_summary(self):
+        """
+        Return a summary of every histogram, as a dict keyed by histogram name.  Each value is a
+        dict with the count, and the mean, p50, p99 and max latencies in milliseconds.
+        """
+        with self._lock:
+            histograms = list(self.histograms.items())
+        summary = {}
+        for key, histogram in histograms:
+            summary[key] = {
+                "count": histogram.count,
+                "mean_ms": histogram.mean * 1000,
+                "p50_ms": histogram.percentile(50) * 1000,
+                "p99_ms": histogram.percentile(99) * 1000,
+                "max_ms": histogram.max * 1000,
+            }
+        return summary
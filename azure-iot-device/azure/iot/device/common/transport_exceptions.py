@@ -38,3 +38,11 @@ class ProtocolClientError(ChainableException):
     """
 
     pass
+
+
+class OperationTimeoutError(ChainableException):
+    """
+    No response was received for an operation in time
+    """
+
+    pass
@@ -47,6 +47,18 @@ class CredentialError(ClientError):
     pass
 
 
+class ClientBusyError(ClientError):
+    """Too many messages in flight to accept another"""
+
+    pass
+
+
+class OperationTimeoutError(ClientError):
+    """The service did not respond to an operation in time"""
+
+    pass
+
+
 # ~~~ SERVICE ERRORS ~~~
 
 
@@ -45,6 +45,21 @@ class AbstractIoTHubClient(object):
         self._iothub_pipeline = iothub_pipeline
         self._edge_pipeline = None
 
+    @property
+    def in_flight_message_count(self):
+        """The number of sent messages which have not yet been acknowledged by the service."""
+        return self._iothub_pipeline.in_flight_message_count
+
+    @property
+    def queued_message_count(self):
+        """The number of messages waiting for room in the in-flight window."""
+        return self._iothub_pipeline.queued_message_count
+
+    @property
+    def stored_message_count(self):
+        """The number of messages in the message store which have not yet been sent."""
+        return self._iothub_pipeline.stored_message_count
+
     @classmethod
     def create_from_connection_string(cls, connection_string, ca_cert=None, **kwargs):
         """
@@ -54,6 +69,64 @@ class AbstractIoTHubClient(object):
         :param str ca_cert: The trusted certificate chain. Only necessary when using a
             connection string with a GatewayHostName parameter.
         :param bool websockets: Default is False. Set to true if using MQTT over websockets.
+        :param network_loop: Optional shared network loop used to service the connection instead
+            of a dedicated network thread. Useful when hosting many clients in one process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
+        :param int max_in_flight_messages: Maximum number of sent messages awaiting acknowledgement
+            from the service. Default is None (no limit).
+        :param str in_flight_policy: "wait" (default) to wait for room when max_in_flight_messages
+            is reached, or "fail" to fail the send immediately.
+        :param int telemetry_qos: The MQTT QoS used to send messages (default 1). With 0, a send
+            completes once the message is written to the network, and the message may be lost.
+        :param float operation_timeout: Seconds to wait for the service to acknowledge an operation
+            before failing it with an OperationTimeoutError (default None, waits indefinitely). A
+            message which times out may still be resent on reconnect, and reach the service.
+        :param int max_pending_requests: Maximum number of twin requests awaiting a response from
+            the service (default None, no limit). in_flight_policy decides what happens to a new
+            request when it is reached.
+        :param asyncio_loop: An asyncio event loop on which to run the MQTT connection, instead
+            of a Paho network thread (Python 3.5+ only). Cannot be combined with websockets.
+        :param str message_store_path: Path of a database file in which outgoing messages are kept
+            until acknowledged. Messages are then accepted while offline, and survive restarts.
+        :param str message_store_durability: "full" (default) syncs each stored message to disk,
+            "normal" syncs periodically, and "off" leaves writing to the operating system.
+        :param int message_store_batch_size: Maximum number of stored messages sent at once
+            (default 100).
+        :param int message_store_max_attempts: Number of failed sends after which a stored message
+            is dropped and the error reported as a background exception (default 10).
+        :param executor_shards: How pipeline and callback threads are shared between clients in
+            this process. Default is None (one of each, shared by all clients). "per_client" gives
+            each client its own, and an int shares that many between all clients, with each device
+            always assigned to the same one.
+        :param tracer: A :class:`azure.iot.device.common.pipeline.pipeline_tracing.PipelineTracer`
+            which collects latency histograms (and optionally spans) for the client's pipeline.
+            Default is None (not traced).
+        :param handler_executor: Optional shared pool of threads on which to deliver received
+            messages, method requests and twin patches, in order per type of event (and per input).
+        :type handler_executor: :class:`azure.iot.device.HandlerExecutor`
+        :param bool quiet_logging: If True, log each message sent or received at DEBUG rather
+            than INFO level. Default is False.
+        :param bool auto_reconnect: If True, reconnect as soon as the connection drops, with a
+            random, exponentially growing delay between attempts. Default is False.
+        :param float reconnect_initial_delay: Maximum delay in seconds before the first reconnect
+            attempt. Default is 1.
+        :param float reconnect_max_delay: Largest maximum delay in seconds before a reconnect
+            attempt. Default is 60.
+        :param int reconnect_max_attempts: Number of failed reconnect attempts in a row after which
+            to stop reconnecting. Default is None (no limit).
+        :param connection_state_handler: Optional function called with "connected",
+            "disconnected", "reconnecting" or "failed" every time the connection state changes.
+        :param int telemetry_batch_max_messages: If set, combine messages with JSON payloads into
+            batches of up to this many, each sent as one message with a JSON array payload.
+            Default is None (not batched).
+        :param int telemetry_batch_max_bytes: Maximum payload size of a batch, in bytes, up to
+            262144. Default is 261120.
+        :param float telemetry_batch_linger: Seconds a batch waits for more messages before it is
+            sent. Default is 0.1.
+        :param int compression_threshold: If set, message payloads of at least this many bytes are
+            compressed, and received compressed messages are decompressed. Default is None (not
+            compressed).
+        :param str compression_method: "gzip" (default) or "deflate".
 
         :raises: ValueError if given an invalid connection_string.
 
@@ -76,6 +149,64 @@ class AbstractIoTHubClient(object):
 
         :param str sas_token: The string representation of a SAS token.
         :param bool websockets: Default is False. Set to true if using MQTT over websockets.
+        :param network_loop: Optional shared network loop used to service the connection instead
+            of a dedicated network thread. Useful when hosting many clients in one process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
+        :param int max_in_flight_messages: Maximum number of sent messages awaiting acknowledgement
+            from the service. Default is None (no limit).
+        :param str in_flight_policy: "wait" (default) to wait for room when max_in_flight_messages
+            is reached, or "fail" to fail the send immediately.
+        :param int telemetry_qos: The MQTT QoS used to send messages (default 1). With 0, a send
+            completes once the message is written to the network, and the message may be lost.
+        :param float operation_timeout: Seconds to wait for the service to acknowledge an operation
+            before failing it with an OperationTimeoutError (default None, waits indefinitely). A
+            message which times out may still be resent on reconnect, and reach the service.
+        :param int max_pending_requests: Maximum number of twin requests awaiting a response from
+            the service (default None, no limit). in_flight_policy decides what happens to a new
+            request when it is reached.
+        :param asyncio_loop: An asyncio event loop on which to run the MQTT connection, instead
+            of a Paho network thread (Python 3.5+ only). Cannot be combined with websockets.
+        :param str message_store_path: Path of a database file in which outgoing messages are kept
+            until acknowledged. Messages are then accepted while offline, and survive restarts.
+        :param str message_store_durability: "full" (default) syncs each stored message to disk,
+            "normal" syncs periodically, and "off" leaves writing to the operating system.
+        :param int message_store_batch_size: Maximum number of stored messages sent at once
+            (default 100).
+        :param int message_store_max_attempts: Number of failed sends after which a stored message
+            is dropped and the error reported as a background exception (default 10).
+        :param executor_shards: How pipeline and callback threads are shared between clients in
+            this process. Default is None (one of each, shared by all clients). "per_client" gives
+            each client its own, and an int shares that many between all clients, with each device
+            always assigned to the same one.
+        :param tracer: A :class:`azure.iot.device.common.pipeline.pipeline_tracing.PipelineTracer`
+            which collects latency histograms (and optionally spans) for the client's pipeline.
+            Default is None (not traced).
+        :param handler_executor: Optional shared pool of threads on which to deliver received
+            messages, method requests and twin patches, in order per type of event (and per input).
+        :type handler_executor: :class:`azure.iot.device.HandlerExecutor`
+        :param bool quiet_logging: If True, log each message sent or received at DEBUG rather
+            than INFO level. Default is False.
+        :param bool auto_reconnect: If True, reconnect as soon as the connection drops, with a
+            random, exponentially growing delay between attempts. Default is False.
+        :param float reconnect_initial_delay: Maximum delay in seconds before the first reconnect
+            attempt. Default is 1.
+        :param float reconnect_max_delay: Largest maximum delay in seconds before a reconnect
+            attempt. Default is 60.
+        :param int reconnect_max_attempts: Number of failed reconnect attempts in a row after which
+            to stop reconnecting. Default is None (no limit).
+        :param connection_state_handler: Optional function called with "connected",
+            "disconnected", "reconnecting" or "failed" every time the connection state changes.
+        :param int telemetry_batch_max_messages: If set, combine messages with JSON payloads into
+            batches of up to this many, each sent as one message with a JSON array payload.
+            Default is None (not batched).
+        :param int telemetry_batch_max_bytes: Maximum payload size of a batch, in bytes, up to
+            262144. Default is 261120.
+        :param float telemetry_batch_linger: Seconds a batch waits for more messages before it is
+            sent. Default is 0.1.
+        :param int compression_threshold: If set, message payloads of at least this many bytes are
+            compressed, and received compressed messages are decompressed. Default is None (not
+            compressed).
+        :param str compression_method: "gzip" (default) or "deflate".
 
         :raises: ValueError if given an invalid sas_token
 
@@ -98,6 +229,10 @@ class AbstractIoTHubClient(object):
     def send_message(self, message):
         pass
 
+    @abc.abstractmethod
+    def send_messages(self, messages):
+        pass
+
     @abc.abstractmethod
     def receive_method_request(self, method_name=None):
         pass
@@ -106,6 +241,10 @@ class AbstractIoTHubClient(object):
     def send_method_response(self, method_request, payload, status):
         pass
 
+    @abc.abstractmethod
+    def enable_features(self, feature_names):
+        pass
+
     @abc.abstractmethod
     def get_twin(self):
         pass
@@ -135,6 +274,64 @@ class AbstractIoTHubDeviceClient(AbstractIoTHubClient):
         :type x509: :class:`azure.iot.device.X509`
         :param str device_id: The ID used to uniquely identify a device in the IoTHub
         :param bool websockets: Default is False. Set to true if using MQTT over websockets.
+        :param network_loop: Optional shared network loop used to service the connection instead
+            of a dedicated network thread. Useful when hosting many clients in one process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
+        :param int max_in_flight_messages: Maximum number of sent messages awaiting acknowledgement
+            from the service. Default is None (no limit).
+        :param str in_flight_policy: "wait" (default) to wait for room when max_in_flight_messages
+            is reached, or "fail" to fail the send immediately.
+        :param int telemetry_qos: The MQTT QoS used to send messages (default 1). With 0, a send
+            completes once the message is written to the network, and the message may be lost.
+        :param float operation_timeout: Seconds to wait for the service to acknowledge an operation
+            before failing it with an OperationTimeoutError (default None, waits indefinitely). A
+            message which times out may still be resent on reconnect, and reach the service.
+        :param int max_pending_requests: Maximum number of twin requests awaiting a response from
+            the service (default None, no limit). in_flight_policy decides what happens to a new
+            request when it is reached.
+        :param asyncio_loop: An asyncio event loop on which to run the MQTT connection, instead
+            of a Paho network thread (Python 3.5+ only). Cannot be combined with websockets.
+        :param str message_store_path: Path of a database file in which outgoing messages are kept
+            until acknowledged. Messages are then accepted while offline, and survive restarts.
+        :param str message_store_durability: "full" (default) syncs each stored message to disk,
+            "normal" syncs periodically, and "off" leaves writing to the operating system.
+        :param int message_store_batch_size: Maximum number of stored messages sent at once
+            (default 100).
+        :param int message_store_max_attempts: Number of failed sends after which a stored message
+            is dropped and the error reported as a background exception (default 10).
+        :param executor_shards: How pipeline and callback threads are shared between clients in
+            this process. Default is None (one of each, shared by all clients). "per_client" gives
+            each client its own, and an int shares that many between all clients, with each device
+            always assigned to the same one.
+        :param tracer: A :class:`azure.iot.device.common.pipeline.pipeline_tracing.PipelineTracer`
+            which collects latency histograms (and optionally spans) for the client's pipeline.
+            Default is None (not traced).
+        :param handler_executor: Optional shared pool of threads on which to deliver received
+            messages, method requests and twin patches, in order per type of event (and per input).
+        :type handler_executor: :class:`azure.iot.device.HandlerExecutor`
+        :param bool quiet_logging: If True, log each message sent or received at DEBUG rather
+            than INFO level. Default is False.
+        :param bool auto_reconnect: If True, reconnect as soon as the connection drops, with a
+            random, exponentially growing delay between attempts. Default is False.
+        :param float reconnect_initial_delay: Maximum delay in seconds before the first reconnect
+            attempt. Default is 1.
+        :param float reconnect_max_delay: Largest maximum delay in seconds before a reconnect
+            attempt. Default is 60.
+        :param int reconnect_max_attempts: Number of failed reconnect attempts in a row after which
+            to stop reconnecting. Default is None (no limit).
+        :param connection_state_handler: Optional function called with "connected",
+            "disconnected", "reconnecting" or "failed" every time the connection state changes.
+        :param int telemetry_batch_max_messages: If set, combine messages with JSON payloads into
+            batches of up to this many, each sent as one message with a JSON array payload.
+            Default is None (not batched).
+        :param int telemetry_batch_max_bytes: Maximum payload size of a batch, in bytes, up to
+            262144. Default is 261120.
+        :param float telemetry_batch_linger: Seconds a batch waits for more messages before it is
+            sent. Default is 0.1.
+        :param int compression_threshold: If set, message payloads of at least this many bytes are
+            compressed, and received compressed messages are decompressed. Default is None (not
+            compressed).
+        :param str compression_method: "gzip" (default) or "deflate".
 
         :returns: An instance of an IoTHub client that uses an X509 certificate for authentication.
         """
@@ -172,6 +369,64 @@ class AbstractIoTHubModuleClient(AbstractIoTHubClient):
         environment configured for Edge development (e.g. Visual Studio, Visual Studio Code)
 
         :param bool websockets: Default is False. Set to true if using MQTT over websockets.
+        :param network_loop: Optional shared network loop used to service the connection instead
+            of a dedicated network thread. Useful when hosting many clients in one process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
+        :param int max_in_flight_messages: Maximum number of sent messages awaiting acknowledgement
+            from the service. Default is None (no limit).
+        :param str in_flight_policy: "wait" (default) to wait for room when max_in_flight_messages
+            is reached, or "fail" to fail the send immediately.
+        :param int telemetry_qos: The MQTT QoS used to send messages (default 1). With 0, a send
+            completes once the message is written to the network, and the message may be lost.
+        :param float operation_timeout: Seconds to wait for the service to acknowledge an operation
+            before failing it with an OperationTimeoutError (default None, waits indefinitely). A
+            message which times out may still be resent on reconnect, and reach the service.
+        :param int max_pending_requests: Maximum number of twin requests awaiting a response from
+            the service (default None, no limit). in_flight_policy decides what happens to a new
+            request when it is reached.
+        :param asyncio_loop: An asyncio event loop on which to run the MQTT connection, instead
+            of a Paho network thread (Python 3.5+ only). Cannot be combined with websockets.
+        :param str message_store_path: Path of a database file in which outgoing messages are kept
+            until acknowledged. Messages are then accepted while offline, and survive restarts.
+        :param str message_store_durability: "full" (default) syncs each stored message to disk,
+            "normal" syncs periodically, and "off" leaves writing to the operating system.
+        :param int message_store_batch_size: Maximum number of stored messages sent at once
+            (default 100).
+        :param int message_store_max_attempts: Number of failed sends after which a stored message
+            is dropped and the error reported as a background exception (default 10).
+        :param executor_shards: How pipeline and callback threads are shared between clients in
+            this process. Default is None (one of each, shared by all clients). "per_client" gives
+            each client its own, and an int shares that many between all clients, with each device
+            always assigned to the same one.
+        :param tracer: A :class:`azure.iot.device.common.pipeline.pipeline_tracing.PipelineTracer`
+            which collects latency histograms (and optionally spans) for the client's pipeline.
+            Default is None (not traced).
+        :param handler_executor: Optional shared pool of threads on which to deliver received
+            messages, method requests and twin patches, in order per type of event (and per input).
+        :type handler_executor: :class:`azure.iot.device.HandlerExecutor`
+        :param bool quiet_logging: If True, log each message sent or received at DEBUG rather
+            than INFO level. Default is False.
+        :param bool auto_reconnect: If True, reconnect as soon as the connection drops, with a
+            random, exponentially growing delay between attempts. Default is False.
+        :param float reconnect_initial_delay: Maximum delay in seconds before the first reconnect
+            attempt. Default is 1.
+        :param float reconnect_max_delay: Largest maximum delay in seconds before a reconnect
+            attempt. Default is 60.
+        :param int reconnect_max_attempts: Number of failed reconnect attempts in a row after which
+            to stop reconnecting. Default is None (no limit).
+        :param connection_state_handler: Optional function called with "connected",
+            "disconnected", "reconnecting" or "failed" every time the connection state changes.
+        :param int telemetry_batch_max_messages: If set, combine messages with JSON payloads into
+            batches of up to this many, each sent as one message with a JSON array payload.
+            Default is None (not batched).
+        :param int telemetry_batch_max_bytes: Maximum payload size of a batch, in bytes, up to
+            262144. Default is 261120.
+        :param float telemetry_batch_linger: Seconds a batch waits for more messages before it is
+            sent. Default is 0.1.
+        :param int compression_threshold: If set, message payloads of at least this many bytes are
+            compressed, and received compressed messages are decompressed. Default is None (not
+            compressed).
+        :param str compression_method: "gzip" (default) or "deflate".
 
         :raises: OSError if the IoT Edge container is not configured correctly.
         :raises: ValueError if debug variables are invalid
@@ -260,6 +515,64 @@ class AbstractIoTHubModuleClient(AbstractIoTHubClient):
         :param str device_id: The ID used to uniquely identify a device in the IoTHub
         :param str module_id: The ID used to uniquely identify a module on a device on the IoTHub.
         :param bool websockets: Default is False. Set to true if using MQTT over websockets.
+        :param network_loop: Optional shared network loop used to service the connection instead
+            of a dedicated network thread. Useful when hosting many clients in one process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
+        :param int max_in_flight_messages: Maximum number of sent messages awaiting acknowledgement
+            from the service. Default is None (no limit).
+        :param str in_flight_policy: "wait" (default) to wait for room when max_in_flight_messages
+            is reached, or "fail" to fail the send immediately.
+        :param int telemetry_qos: The MQTT QoS used to send messages (default 1). With 0, a send
+            completes once the message is written to the network, and the message may be lost.
+        :param float operation_timeout: Seconds to wait for the service to acknowledge an operation
+            before failing it with an OperationTimeoutError (default None, waits indefinitely). A
+            message which times out may still be resent on reconnect, and reach the service.
+        :param int max_pending_requests: Maximum number of twin requests awaiting a response from
+            the service (default None, no limit). in_flight_policy decides what happens to a new
+            request when it is reached.
+        :param asyncio_loop: An asyncio event loop on which to run the MQTT connection, instead
+            of a Paho network thread (Python 3.5+ only). Cannot be combined with websockets.
+        :param str message_store_path: Path of a database file in which outgoing messages are kept
+            until acknowledged. Messages are then accepted while offline, and survive restarts.
+        :param str message_store_durability: "full" (default) syncs each stored message to disk,
+            "normal" syncs periodically, and "off" leaves writing to the operating system.
+        :param int message_store_batch_size: Maximum number of stored messages sent at once
+            (default 100).
+        :param int message_store_max_attempts: Number of failed sends after which a stored message
+            is dropped and the error reported as a background exception (default 10).
+        :param executor_shards: How pipeline and callback threads are shared between clients in
+            this process. Default is None (one of each, shared by all clients). "per_client" gives
+            each client its own, and an int shares that many between all clients, with each device
+            always assigned to the same one.
+        :param tracer: A :class:`azure.iot.device.common.pipeline.pipeline_tracing.PipelineTracer`
+            which collects latency histograms (and optionally spans) for the client's pipeline.
+            Default is None (not traced).
+        :param handler_executor: Optional shared pool of threads on which to deliver received
+            messages, method requests and twin patches, in order per type of event (and per input).
+        :type handler_executor: :class:`azure.iot.device.HandlerExecutor`
+        :param bool quiet_logging: If True, log each message sent or received at DEBUG rather
+            than INFO level. Default is False.
+        :param bool auto_reconnect: If True, reconnect as soon as the connection drops, with a
+            random, exponentially growing delay between attempts. Default is False.
+        :param float reconnect_initial_delay: Maximum delay in seconds before the first reconnect
+            attempt. Default is 1.
+        :param float reconnect_max_delay: Largest maximum delay in seconds before a reconnect
+            attempt. Default is 60.
+        :param int reconnect_max_attempts: Number of failed reconnect attempts in a row after which
+            to stop reconnecting. Default is None (no limit).
+        :param connection_state_handler: Optional function called with "connected",
+            "disconnected", "reconnecting" or "failed" every time the connection state changes.
+        :param int telemetry_batch_max_messages: If set, combine messages with JSON payloads into
+            batches of up to this many, each sent as one message with a JSON array payload.
+            Default is None (not batched).
+        :param int telemetry_batch_max_bytes: Maximum payload size of a batch, in bytes, up to
+            262144. Default is 261120.
+        :param float telemetry_batch_linger: Seconds a batch waits for more messages before it is
+            sent. Default is 0.1.
+        :param int compression_threshold: If set, message payloads of at least this many bytes are
+            compressed, and received compressed messages are decompressed. Default is None (not
+            compressed).
+        :param str compression_method: "gzip" (default) or "deflate".
 
         :returns: An instance of an IoTHub client that uses an X509 certificate for authentication.
         """
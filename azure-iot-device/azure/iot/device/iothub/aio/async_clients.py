@@ -24,19 +24,31 @@ from .async_inbox import AsyncClientInbox
 logger = logging.getLogger(__name__)
 
 
+def convert_exception(e):
+    """
+    Return the client exception to raise (or report) for an error from the pipeline
+    """
+    if isinstance(e, pipeline_exceptions.ConnectionDroppedError):
+        return exceptions.ConnectionDroppedError(message="Lost connection to IoTHub", cause=e)
+    elif isinstance(e, pipeline_exceptions.ConnectionFailedError):
+        return exceptions.ConnectionFailedError(message="Could not connect to IoTHub", cause=e)
+    elif isinstance(e, pipeline_exceptions.UnauthorizedError):
+        return exceptions.CredentialError(message="Credentials invalid, could not connect", cause=e)
+    elif isinstance(e, pipeline_exceptions.ProtocolClientError):
+        return exceptions.ClientError(message="Error in the IoTHub client", cause=e)
+    elif isinstance(e, pipeline_exceptions.PipelineBusyError):
+        return exceptions.ClientBusyError(message="Too many messages in flight", cause=e)
+    elif isinstance(e, pipeline_exceptions.OperationTimeoutError):
+        return exceptions.OperationTimeoutError(message="Operation timed out", cause=e)
+    else:
+        return exceptions.ClientError(message="Unexpected failure", cause=e)
+
+
 async def handle_result(callback):
     try:
         return await callback.completion()
-    except pipeline_exceptions.ConnectionDroppedError as e:
-        raise exceptions.ConnectionDroppedError(message="Lost connection to IoTHub", cause=e)
-    except pipeline_exceptions.ConnectionFailedError as e:
-        raise exceptions.ConnectionFailedError(message="Could not connect to IoTHub", cause=e)
-    except pipeline_exceptions.UnauthorizedError as e:
-        raise exceptions.CredentialError(message="Credentials invalid, could not connect", cause=e)
-    except pipeline_exceptions.ProtocolClientError as e:
-        raise exceptions.ClientError(message="Error in the IoTHub client", cause=e)
     except Exception as e:
-        raise exceptions.ClientError(message="Unexpected failure", cause=e)
+        raise convert_exception(e)
 
 
 class GenericIoTHubClient(AbstractIoTHubClient):
@@ -131,6 +143,10 @@ class GenericIoTHubClient(AbstractIoTHubClient):
             connection results in failure.
         :raises: :class:`azure.iot.device.exceptions.ConnectionDroppedError` if connection is lost
             during execution.
+        :raises: :class:`azure.iot.device.exceptions.OperationTimeoutError` if the service
+            does not acknowledge the operation within operation_timeout.
+        :raises: :class:`azure.iot.device.exceptions.ClientBusyError` if in_flight_policy is
+            "fail" and max_in_flight_messages has been reached.
         :raises: :class:`azure.iot.device.exceptions.ClientError` if there is an unexpected failure
             during execution.
         """
@@ -146,6 +162,47 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         logger.info("Successfully sent message to Hub")
 
+    async def send_messages(self, messages):
+        """Sends several messages to the default events endpoint on the Azure IoT Hub or Azure IoT
+        Edge Hub instance at once.
+
+        Unlike calling send_message for each message, this does not wait for each message to be
+        acknowledged before sending the next one, so sending many messages costs about one round
+        trip to the service rather than one per message.  The messages are sent in order.
+
+        If the connection to the service has not previously been opened by a call to connect, this
+        function will open the connection before sending the messages.
+
+        :param messages: The messages to send. Anything passed that is not an instance of the
+            Message class will be converted to Message object.
+        :type messages: list of :class:`azure.iot.device.Message` or str
+
+        :returns: A list with the result of sending each message, in the same order as messages:
+            None if the message was sent, or the exception that send_message would have raised
+            if it failed (such as :class:`azure.iot.device.exceptions.ConnectionFailedError` or
+            :class:`azure.iot.device.exceptions.OperationTimeoutError`).
+        :rtype: list
+        """
+        messages = [
+            message if isinstance(message, Message) else Message(message) for message in messages
+        ]
+
+        logger.info("Sending %s messages to Hub...", len(messages))
+        send_messages_async = async_adapter.emulate_async(self._iothub_pipeline.send_messages)
+
+        callback = async_adapter.AwaitableCallback(return_arg_name="results")
+        await send_messages_async(messages, callback=callback)
+        results = [
+            convert_exception(error) if error else None for error in await handle_result(callback)
+        ]
+
+        logger.info(
+            "Sent %s messages to Hub, %s failed",
+            len(messages),
+            len(results) - results.count(None),
+        )
+        return results
+
     async def receive_method_request(self, method_name=None):
         """Receive a method request via the Azure IoT Hub or Azure IoT Edge Hub.
 
@@ -183,6 +240,8 @@ class GenericIoTHubClient(AbstractIoTHubClient):
             connection results in failure.
         :raises: :class:`azure.iot.device.exceptions.ConnectionDroppedError` if connection is lost
             during execution.
+        :raises: :class:`azure.iot.device.exceptions.OperationTimeoutError` if the service
+            does not acknowledge the operation within operation_timeout.
         :raises: :class:`azure.iot.device.exceptions.ClientError` if there is an unexpected failure
             during execution.
         """
@@ -214,6 +273,46 @@ class GenericIoTHubClient(AbstractIoTHubClient):
 
         logger.info("Successfully enabled feature:" + feature_name)
 
+    async def enable_features(self, feature_names):
+        """Enable several Azure IoT Hub features with a single request to the service.
+
+        Otherwise, each feature is enabled on the first call to a function which needs it (such
+        as receive_method_request), and each costs a round trip to the service. Enabling all of
+        the features an application uses at startup avoids those round trips.
+
+        :param list feature_names: The names of the features to enable: "methods", "twin",
+            "twin_patches", and "c2d" for a device client or "input" for a module client.
+            Features which are already enabled are skipped.
+
+        :raises: ValueError if a feature name is invalid.
+        :raises: :class:`azure.iot.device.exceptions.CredentialError` if credentials are invalid
+            and a connection cannot be established.
+        :raises: :class:`azure.iot.device.exceptions.ConnectionFailedError` if a establishing a
+            connection results in failure.
+        :raises: :class:`azure.iot.device.exceptions.ConnectionDroppedError` if connection is lost
+            during execution.
+        :raises: :class:`azure.iot.device.exceptions.OperationTimeoutError` if the service
+            does not acknowledge the operation within operation_timeout.
+        :raises: :class:`azure.iot.device.exceptions.ClientError` if there is an unexpected failure
+            during execution.
+        """
+        feature_names = [
+            feature_name
+            for feature_name in feature_names
+            if feature_name not in self._iothub_pipeline.feature_enabled
+            or not self._iothub_pipeline.feature_enabled[feature_name]
+        ]
+        if not feature_names:
+            return
+        logger.info("Enabling features: {}...".format(", ".join(feature_names)))
+        enable_features_async = async_adapter.emulate_async(self._iothub_pipeline.enable_features)
+
+        callback = async_adapter.AwaitableCallback()
+        await enable_features_async(feature_names, callback=callback)
+        await handle_result(callback)
+
+        logger.info("Successfully enabled features: {}".format(", ".join(feature_names)))
+
     async def get_twin(self):
         """
         Gets the device or module twin from the Azure IoT Hub or Azure IoT Edge Hub service.
@@ -227,6 +326,10 @@ class GenericIoTHubClient(AbstractIoTHubClient):
             connection results in failure.
         :raises: :class:`azure.iot.device.exceptions.ConnectionDroppedError` if connection is lost
             during execution.
+        :raises: :class:`azure.iot.device.exceptions.OperationTimeoutError` if the service
+            does not acknowledge the operation within operation_timeout.
+        :raises: :class:`azure.iot.device.exceptions.ClientBusyError` if in_flight_policy is
+            "fail" and max_pending_requests has been reached.
         :raises: :class:`azure.iot.device.exceptions.ClientError` if there is an unexpected failure
             during execution.
         """
@@ -259,6 +362,10 @@ class GenericIoTHubClient(AbstractIoTHubClient):
             connection results in failure.
         :raises: :class:`azure.iot.device.exceptions.ConnectionDroppedError` if connection is lost
             during execution.
+        :raises: :class:`azure.iot.device.exceptions.OperationTimeoutError` if the service
+            does not acknowledge the operation within operation_timeout.
+        :raises: :class:`azure.iot.device.exceptions.ClientBusyError` if in_flight_policy is
+            "fail" and max_pending_requests has been reached.
         :raises: :class:`azure.iot.device.exceptions.ClientError` if there is an unexpected failure
             during execution.
         """
@@ -371,6 +478,10 @@ class IoTHubModuleClient(GenericIoTHubClient, AbstractIoTHubModuleClient):
             connection results in failure.
         :raises: :class:`azure.iot.device.exceptions.ConnectionDroppedError` if connection is lost
             during execution.
+        :raises: :class:`azure.iot.device.exceptions.OperationTimeoutError` if the service
+            does not acknowledge the operation within operation_timeout.
+        :raises: :class:`azure.iot.device.exceptions.ClientBusyError` if in_flight_policy is
+            "fail" and max_in_flight_messages has been reached.
         :raises: :class:`azure.iot.device.exceptions.ClientError` if there is an unexpected failure
             during execution.
         """
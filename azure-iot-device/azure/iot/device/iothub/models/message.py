@@ -26,8 +26,28 @@ class Message(object):
     :ivar content_encoding: Content encoding of the message data. Can be 'utf-8', 'utf-16' or 'utf-32'
     :ivar content_type: Content type property used to route messages with the message-body. Can be 'application/json'
     :ivar output_name: Name of the output that the is being sent to.
+    :ivar qos: The MQTT quality of service level to send the message with (0 or 1). If None, the client's telemetry_qos is used.
     """
 
+    __slots__ = (
+        "data",
+        "custom_properties",
+        "lock_token",
+        "message_id",
+        "sequence_number",
+        "to",
+        "expiry_time_utc",
+        "enqueued_time",
+        "correlation_id",
+        "user_id",
+        "ack",
+        "content_encoding",
+        "content_type",
+        "output_name",
+        "qos",
+        "_iothub_interface_id",
+    )
+
     def __init__(
         self,
         data,
@@ -35,6 +55,7 @@ class Message(object):
         content_encoding="utf-8",
         content_type="application/json",
         output_name=None,
+        qos=None,
     ):
         """
         Initializer for Message
@@ -44,7 +65,12 @@ class Message(object):
         :param str content_encoding: Content encoding of the message data. Default is 'utf-8'. Other values can be utf-16' or 'utf-32'
         :param str content_type: Content type property used to routes with the message body. Default value is 'application/json'
         :param str output_name: Name of the output that the is being sent to.
+        :param int qos: The MQTT quality of service level to send the message with. 0 sends the message without waiting
+            for an acknowledgement, so it may be lost. Default is None (use the telemetry_qos of the client).
+        :raises: ValueError if qos is not None, 0 or 1.
         """
+        if qos not in (None, 0, 1):
+            raise ValueError("qos must be 0 or 1")
         self.data = data
         self.custom_properties = {}
         self.lock_token = None
@@ -59,6 +85,7 @@ class Message(object):
         self.content_encoding = content_encoding
         self.content_type = content_type
         self.output_name = output_name
+        self.qos = qos
         self._iothub_interface_id = None
 
     @property
@@ -11,6 +11,7 @@ from azure.iot.device.common.pipeline import (
     pipeline_stages_base,
     pipeline_ops_base,
     pipeline_stages_mqtt,
+    pipeline_thread,
 )
 from . import (
     constant,
@@ -48,14 +49,28 @@ class IoTHubPipeline(object):
         self.on_method_request_received = None
         self.on_twin_patch_received = None
 
+        # Kept so that the occupancy of the in-flight window, message store and pending request
+        # table, the size of telemetry batches, and the effect of compression, can be reported
+        self._flow_control_stage = pipeline_stages_mqtt.MQTTFlowControlStage()
+        self._store_and_forward_stage = pipeline_stages_iothub.StoreAndForwardStage()
+        self._aggregate_telemetry_stage = pipeline_stages_iothub.AggregateTelemetryStage()
+        self._compress_messages_stage = pipeline_stages_iothub.CompressMessagesStage()
+        self._request_stage = pipeline_stages_base.CoordinateRequestAndResponseStage()
+
         self._pipeline = (
             pipeline_stages_base.PipelineRootStage(pipeline_configuration=pipeline_configuration)
             .append_stage(pipeline_stages_iothub.UseAuthProviderStage())
             .append_stage(pipeline_stages_iothub.HandleTwinOperationsStage())
-            .append_stage(pipeline_stages_base.CoordinateRequestAndResponseStage())
+            .append_stage(self._request_stage)
+            .append_stage(self._store_and_forward_stage)
+            .append_stage(self._aggregate_telemetry_stage)
+            .append_stage(self._compress_messages_stage)
             .append_stage(pipeline_stages_iothub_mqtt.IoTHubMQTTConverterStage())
             .append_stage(pipeline_stages_base.EnsureConnectionStage())
+            # Below EnsureConnectionStage, so that it sees the connect ops made for pending ops
+            .append_stage(pipeline_stages_base.ReconnectStage())
             .append_stage(pipeline_stages_base.SerializeConnectOpsStage())
+            .append_stage(self._flow_control_stage)
             .append_stage(pipeline_stages_mqtt.MQTTTransportStage())
         )
 
@@ -99,6 +114,18 @@ class IoTHubPipeline(object):
         self._pipeline.on_connected_handler = _on_connected
         self._pipeline.on_disconnected_handler = _on_disconnected
 
+        client_id = auth_provider.device_id
+        if auth_provider.module_id:
+            client_id += "/" + auth_provider.module_id
+        self._pipeline.executors = pipeline_thread.get_pipeline_executors(
+            client_id, shards=pipeline_configuration.executor_shards
+        )
+        self._pipeline.set_tracer(pipeline_configuration.tracer)
+        self._pipeline.handler_executor = pipeline_configuration.handler_executor
+        self._pipeline.on_connection_state_changed_handler = (
+            pipeline_configuration.connection_state_handler
+        )
+
         callback = EventedCallback()
 
         if isinstance(auth_provider, X509AuthenticationProvider):
@@ -113,6 +140,76 @@ class IoTHubPipeline(object):
         self._pipeline.run_op(op)
         callback.wait_for_completion()
 
+    @property
+    def in_flight_message_count(self):
+        """
+        The number of messages which have been sent, but not yet acknowledged by the service.
+        """
+        return self._flow_control_stage.in_flight_count
+
+    @property
+    def queued_message_count(self):
+        """
+        The number of messages waiting to be sent because max_in_flight_messages has been reached.
+        """
+        return len(self._flow_control_stage.queue)
+
+    @property
+    def stored_message_count(self):
+        """
+        The number of messages in the message store which have not yet been sent.
+        """
+        store = self._store_and_forward_stage.store
+        return len(store) if store is not None else 0
+
+    @property
+    def telemetry_batch_count(self):
+        """
+        The number of batches of messages which have been sent, if telemetry_batch_max_messages is set.
+        """
+        return self._aggregate_telemetry_stage.batch_count
+
+    @property
+    def average_telemetry_batch_size(self):
+        """
+        The average number of messages in each batch of messages which has been sent, or None if no
+        batch has been sent.
+        """
+        stage = self._aggregate_telemetry_stage
+        return float(stage.batched_message_count) / stage.batch_count if stage.batch_count else None
+
+    @property
+    def compression_ratio(self):
+        """
+        The total size of the payloads of the messages which have been compressed, divided by their
+        size before they were compressed, or None if no message has been compressed.
+        """
+        stage = self._compress_messages_stage
+        if not stage.uncompressed_byte_count:
+            return None
+        return float(stage.compressed_byte_count) / stage.uncompressed_byte_count
+
+    @property
+    def pending_request_count(self):
+        """
+        The number of twin requests which have been sent, but not yet responded to by the service.
+        """
+        return len(self._request_stage.pending_responses)
+
+    @property
+    def queued_request_count(self):
+        """
+        The number of twin requests waiting to be sent because max_pending_requests has been reached.
+        """
+        return len(self._request_stage.queue)
+
+    @property
+    def request_latency(self):
+        """
+        A LatencyHistogram of the time from sending each twin request to its response arriving.
+        """
+        return self._request_stage.response_latency
+
     def connect(self, callback):
         """
         Connect to the service.
@@ -175,6 +272,43 @@ class IoTHubPipeline(object):
             pipeline_ops_iothub.SendD2CMessageOperation(message=message, callback=on_complete)
         )
 
+    def send_messages(self, messages, callback):
+        """
+        Send several telemetry messages to the service at once, without waiting for each to be
+        acknowledged before sending the next.
+
+        :param messages: list of messages to send.
+        :param callback: callback which is called when every message publish has been acknowledged
+            by the service (or has failed).  It is called with a "results" argument, which is a list
+            with the error for each message that failed, and None for each message that was sent.
+
+        The errors in results can be any of the errors listed for send_message.
+        """
+        results = [None] * len(messages)
+        if not messages:
+            callback(results=results)
+            return
+        # Op callbacks all run on the callback thread of the pipeline, so no locking is needed
+        remaining = [len(messages)]
+
+        def make_on_complete(index):
+            def on_complete(op, error):
+                results[index] = error
+                remaining[0] -= 1
+                if not remaining[0]:
+                    callback(results=results)
+
+            return on_complete
+
+        self._pipeline.run_ops(
+            [
+                pipeline_ops_iothub.SendD2CMessageOperation(
+                    message=message, callback=make_on_complete(index)
+                )
+                for index, message in enumerate(messages)
+            ]
+        )
+
     def send_output_event(self, message, callback):
         """
         Send an output message to the service.
@@ -284,7 +418,7 @@ class IoTHubPipeline(object):
 
         :raises: ValueError if feature_name is invalid
         """
-        logger.debug("enable_feature {} called".format(feature_name))
+        logger.debug("enable_feature %s called", feature_name)
         if feature_name not in self.feature_enabled:
             raise ValueError("Invalid feature_name")
         self.feature_enabled[feature_name] = True
@@ -298,6 +432,31 @@ class IoTHubPipeline(object):
             )
         )
 
+    def enable_features(self, feature_names, callback):
+        """
+        Enable the given features by subscribing to all of their topics at once.
+
+        :param feature_names: list of feature name constants from constant.py
+        :param callback: callback which is called when all of the features are enabled
+
+        :raises: ValueError if any feature_name is invalid
+        """
+        logger.debug("enable_features %s called", feature_names)
+        for feature_name in feature_names:
+            if feature_name not in self.feature_enabled:
+                raise ValueError("Invalid feature_name")
+        for feature_name in feature_names:
+            self.feature_enabled[feature_name] = True
+
+        def on_complete(op, error):
+            callback(error=error)
+
+        self._pipeline.run_op(
+            pipeline_ops_base.EnableFeaturesOperation(
+                feature_names=list(feature_names), callback=on_complete
+            )
+        )
+
     def disable_feature(self, feature_name, callback):
         """
         Disable the given feature by subscribing to the appropriate topics.
@@ -307,7 +466,7 @@ class IoTHubPipeline(object):
 
         :raises: ValueError if feature_name is invalid
         """
-        logger.debug("disable_feature {} called".format(feature_name))
+        logger.debug("disable_feature %s called", feature_name)
         if feature_name not in self.feature_enabled:
             raise ValueError("Invalid feature_name")
         self.feature_enabled[feature_name] = False
@@ -0,0 +1,59 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains functions to compress the payloads of outgoing messages, and decompress
+the payloads of received messages, based on their content_encoding.
+"""
+
+import zlib
+
+# The content_encoding values of compressed messages.  "deflate" is the zlib format, as it is in
+# HTTP.
+COMPRESSED_ENCODINGS = ("gzip", "deflate")
+
+# The content_encoding of a message once its payload has been decompressed
+DECOMPRESSED_ENCODING = "utf-8"
+
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def compress(data, method):
+    """
+    Compress a payload.
+
+    :param bytes data: The payload to compress.
+    :param str method: The compression format, "gzip" or "deflate".
+    :returns: The compressed payload.
+    :raises: ValueError if method is not "gzip" or "deflate".
+    """
+    if method == "gzip":
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, _GZIP_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    elif method == "deflate":
+        return zlib.compress(data)
+    else:
+        raise ValueError("Unsupported compression method: {}".format(method))
+
+
+def decompress(data, method):
+    """
+    Decompress a payload.
+
+    :param bytes data: The compressed payload.
+    :param str method: The compression format, "gzip" or "deflate".  Raw deflate data (without the
+      zlib header) is also accepted for "deflate".
+    :returns: The decompressed payload.
+    :raises: ValueError if method is not "gzip" or "deflate".
+    :raises: zlib.error if data is not valid compressed data.
+    """
+    if method == "gzip":
+        return zlib.decompress(data, _GZIP_WBITS)
+    elif method == "deflate":
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    else:
+        raise ValueError("Unsupported compression method: {}".format(method))
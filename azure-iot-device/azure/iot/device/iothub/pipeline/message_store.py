@@ -0,0 +1,277 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a persistent store for outgoing messages, used to send telemetry
+which was accepted while the client could not reach the service.
+"""
+
+import base64
+import calendar
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+import time
+import six
+from azure.iot.device.iothub.models import Message
+
+logger = logging.getLogger(__name__)
+
+# Maps the durability option onto SQLite's synchronous setting
+DURABILITY_LEVELS = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}
+
+_EXPIRY_FORMATS = ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+
+
+def _expiry_timestamp(expiry_time_utc):
+    """
+    Return the expiry_time_utc of a message as seconds since the epoch, or None if the message
+    does not expire (or its expiry time cannot be understood).
+    """
+    if expiry_time_utc is None:
+        return None
+    if isinstance(expiry_time_utc, datetime.datetime):
+        if expiry_time_utc.utcoffset() is not None:
+            expiry_time_utc = expiry_time_utc.replace(tzinfo=None) - expiry_time_utc.utcoffset()
+        return calendar.timegm(expiry_time_utc.timetuple()) + expiry_time_utc.microsecond / 1e6
+    if isinstance(expiry_time_utc, datetime.date):
+        return calendar.timegm(expiry_time_utc.timetuple())
+    value = str(expiry_time_utc)
+    if value.endswith("Z"):
+        value = value[:-1]
+    for expiry_format in _EXPIRY_FORMATS:
+        try:
+            return _expiry_timestamp(datetime.datetime.strptime(value, expiry_format))
+        except ValueError:
+            pass
+    logger.warning("Cannot parse expiry_time_utc {}.  Message will not expire.".format(value))
+    return None
+
+
+def _encode_message(message):
+    """
+    Serialize a Message to a JSON string
+    """
+    if isinstance(message.data, six.binary_type):
+        data = {"bytes": base64.b64encode(message.data).decode("ascii")}
+    elif isinstance(message.data, six.text_type):
+        data = {"text": message.data}
+    else:
+        data = {"json": message.data}
+    expiry_time_utc = message.expiry_time_utc
+    if isinstance(expiry_time_utc, datetime.date):
+        expiry_time_utc = expiry_time_utc.isoformat()
+    return json.dumps(
+        {
+            "data": data,
+            "message_id": message.message_id,
+            "content_encoding": message.content_encoding,
+            "content_type": message.content_type,
+            "output_name": message.output_name,
+            "qos": message.qos,
+            "custom_properties": message.custom_properties,
+            "expiry_time_utc": expiry_time_utc,
+            "correlation_id": message.correlation_id,
+            "user_id": message.user_id,
+            "iothub_interface_id": message.iothub_interface_id,
+        }
+    )
+
+
+def _decode_message(encoded):
+    """
+    Deserialize a Message from a JSON string created by _encode_message
+    """
+    fields = json.loads(encoded)
+    data = fields["data"]
+    if "bytes" in data:
+        data = base64.b64decode(data["bytes"])
+    elif "text" in data:
+        data = data["text"]
+    else:
+        data = data["json"]
+    message = Message(
+        data,
+        message_id=fields["message_id"],
+        content_encoding=fields["content_encoding"],
+        content_type=fields["content_type"],
+        output_name=fields["output_name"],
+        qos=fields["qos"],
+    )
+    message.custom_properties = fields["custom_properties"]
+    message.expiry_time_utc = fields["expiry_time_utc"]
+    message.correlation_id = fields["correlation_id"]
+    message.user_id = fields["user_id"]
+    message._iothub_interface_id = fields["iothub_interface_id"]
+    return message
+
+
+class MessageStore(object):
+    """
+    A persistent first-in, first-out store of outgoing messages, kept in a SQLite database.
+
+    Messages stay in the store until they are removed, so messages which were stored but never
+    sent survive a restart of the process.  How much survives a crash of the machine depends on
+    the durability level:
+
+    - "full": each message is synced to disk before put returns.
+    - "normal": each message is committed before put returns, and the database is synced to disk
+      periodically.  Messages survive the process crashing, but recently stored messages may be lost
+      if the machine loses power.
+    - "off": the database is never explicitly synced, and is left to the operating system to write.
+
+    :ivar str path: The path of the database file.
+    """
+
+    def __init__(self, path, durability="full"):
+        """
+        Initializer for MessageStore
+
+        :param str path: The path of the database file.  It is created if it does not exist.
+        :param str durability: "full" (default), "normal" or "off".
+
+        :raises: ValueError if durability is invalid.
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError("durability must be 'full', 'normal' or 'off'")
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous={}".format(DURABILITY_LEVELS[durability]))
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "expiry REAL, message TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(messages)")]
+        if "attempts" not in columns:
+            # A store created before failed attempts were counted
+            self._connection.execute(
+                "ALTER TABLE messages ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+            )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS messages_expiry ON messages(expiry) WHERE expiry IS NOT NULL"
+        )
+        self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM messages").fetchone()
+        return count
+
+    def put(self, message):
+        """
+        Add a message to the end of the store.
+
+        :param message: The message to store.
+        :type message: :class:`azure.iot.device.Message`
+
+        :returns: The ID of the stored message.
+        """
+        row = (_expiry_timestamp(message.expiry_time_utc), _encode_message(message))
+        with self._lock:
+            with self._connection:
+                cursor = self._connection.execute(
+                    "INSERT INTO messages (expiry, message) VALUES (?, ?)", row
+                )
+        return cursor.lastrowid
+
+    def drop_expired(self, now=None):
+        """
+        Remove the messages whose expiry time has passed from the store.
+
+        :param float now: The current time, in seconds since the epoch.  Defaults to time.time().
+
+        :returns: The number of messages removed.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            with self._connection:
+                expired = self._connection.execute(
+                    "DELETE FROM messages WHERE expiry IS NOT NULL AND expiry <= ?", (now,)
+                ).rowcount
+        if expired:
+            logger.warning("Dropped %s expired stored messages", expired)
+        return expired
+
+    def peek(self, limit, now=None):
+        """
+        Return the oldest unexpired messages in the store, without removing them.  Expired messages
+        among the oldest messages are removed from the store; use drop_expired to remove all of them.
+
+        :param int limit: The maximum number of messages to return.
+        :param float now: The current time, in seconds since the epoch.  Defaults to time.time().
+
+        :returns: A list of (ID, message) tuples, oldest first.
+        """
+        if now is None:
+            now = time.time()
+        batch = []
+        expired_ids = []
+        last_id = 0
+        with self._lock:
+            while len(batch) < limit:
+                rows = self._connection.execute(
+                    "SELECT id, expiry, message FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, limit - len(batch)),
+                ).fetchall()
+                if not rows:
+                    break
+                for message_id, expiry, encoded in rows:
+                    if expiry is not None and expiry <= now:
+                        expired_ids.append((message_id,))
+                    else:
+                        batch.append((message_id, encoded))
+                last_id = rows[-1][0]
+            if expired_ids:
+                with self._connection:
+                    self._connection.executemany("DELETE FROM messages WHERE id = ?", expired_ids)
+        if expired_ids:
+            logger.warning("Dropped %s expired stored messages", len(expired_ids))
+        return [(message_id, _decode_message(encoded)) for (message_id, encoded) in batch]
+
+    def remove(self, message_ids):
+        """
+        Remove messages from the store.
+
+        :param list message_ids: The IDs of the messages to remove.
+        """
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    "DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids]
+                )
+
+    def record_failures(self, message_ids):
+        """
+        Count a failed attempt to send each of the given messages.
+
+        :param list message_ids: The IDs of the messages which failed to send.
+
+        :returns: A dict mapping the ID of each message still in the store to the number of failed
+          attempts to send it.
+        """
+        attempts = {}
+        with self._lock:
+            with self._connection:
+                for message_id in message_ids:
+                    self._connection.execute(
+                        "UPDATE messages SET attempts = attempts + 1 WHERE id = ?", (message_id,)
+                    )
+                    row = self._connection.execute(
+                        "SELECT attempts FROM messages WHERE id = ?", (message_id,)
+                    ).fetchone()
+                    if row is not None:
+                        attempts[message_id] = row[0]
+        return attempts
+
+    def close(self):
+        """
+        Close the database.  The store cannot be used after it has been closed.
+        """
+        with self._lock:
+            self._connection.close()
@@ -4,12 +4,24 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import collections
+import functools
 import logging
+import threading
 from datetime import date
+import six
 import six.moves.urllib as urllib
+import zlib
+from . import constant
+from . import message_compression
 
 logger = logging.getLogger(__name__)
 
+# The maximum number of topic templates kept by encode_properties
+TOPIC_TEMPLATE_CACHE_SIZE = 256
+# The maximum number of uri-decoded property keys and values kept by IncomingTopicParser
+UNQUOTED_STRING_CACHE_SIZE = 1024
+
 
 def _get_topic_base(device_id, module_id):
     """
@@ -164,11 +176,13 @@ def get_method_request_id_from_topic(topic):
 
 
 # TODO: this has too generic a name, given that it's only for messages
-def extract_properties_from_topic(topic, message_received):
+def extract_properties_from_topic(topic, message_received, decompress=False):
     """
     Extract key=value pairs from custom properties and set the properties on the received message.
     :param topic: The topic string
     :param message_received: The message received with the payload in bytes
+    :param bool decompress: If True, and the content_encoding of the message is "gzip" or
+    "deflate", decompress the payload of the message and set its content_encoding to "utf-8"
     """
 
     parts = topic.split("/")
@@ -185,28 +199,312 @@ def extract_properties_from_topic(topic, message_received):
     else:
         raise ValueError("topic has incorrect format")
 
-    if properties:
-        key_value_pairs = properties.split("&")
-
-        for entry in key_value_pairs:
-            pair = entry.split("=")
-            key = urllib.parse.unquote_plus(pair[0])
-            value = urllib.parse.unquote_plus(pair[1])
-
-            if key == "$.mid":
-                message_received.message_id = value
-            elif key == "$.cid":
-                message_received.correlation_id = value
-            elif key == "$.uid":
-                message_received.user_id = value
-            elif key == "$.to":
-                message_received.to = value
-            elif key == "$.ct":
-                message_received.content_type = value
-            elif key == "$.ce":
-                message_received.content_encoding = value
+    set_message_properties(
+        message_received, _split_properties(properties) if properties else [], decompress
+    )
+
+
+_unquoted_strings = {}
+
+
+def _split_properties(properties_str):
+    """
+    Return a list of the (key, value) pairs in a string in the format
+    {key1}={value1}&{key2}={value2}&...{keyn}={valuen}, uri-decoded
+    """
+    pairs = []
+    for entry in properties_str.split("&"):
+        key, _, value = entry.partition("=")
+        pairs.append((_unquote(key), _unquote(value)))
+    return pairs
+
+
+def _unquote(value):
+    """
+    uri-decode a property key or value.  Keys, and many values, are the same in every message, so
+    decoded strings are cached.
+    """
+    if "%" not in value and "+" not in value:
+        return value
+    unquoted = _unquoted_strings.get(value)
+    if unquoted is None:
+        if len(_unquoted_strings) >= UNQUOTED_STRING_CACHE_SIZE:
+            _unquoted_strings.clear()
+        unquoted = _unquoted_strings[value] = urllib.parse.unquote_plus(value)
+    return unquoted
+
+
+def set_message_properties(message_received, properties, decompress=False):
+    """
+    Set the properties of a received message.
+    :param message_received: The message received with the payload in bytes
+    :param properties: A list of the (key, value) pairs of the properties of the message, as they
+    are on the topic once uri-decoded.  Keys of system properties start with "$.".
+    :param bool decompress: If True, and the content_encoding of the message is "gzip" or
+    "deflate", decompress the payload of the message and set its content_encoding to "utf-8"
+    """
+    for key, value in properties:
+        if key == "$.mid":
+            message_received.message_id = value
+        elif key == "$.cid":
+            message_received.correlation_id = value
+        elif key == "$.uid":
+            message_received.user_id = value
+        elif key == "$.to":
+            message_received.to = value
+        elif key == "$.ct":
+            message_received.content_type = value
+        elif key == "$.ce":
+            message_received.content_encoding = value
+        else:
+            message_received.custom_properties[key] = value
+
+    if decompress and message_received.content_encoding in message_compression.COMPRESSED_ENCODINGS:
+        try:
+            message_received.data = message_compression.decompress(
+                message_received.data, message_received.content_encoding
+            )
+        except (zlib.error, TypeError):
+            # Leave the payload as it is, so that the handler can decide what to do with it
+            logger.warning(
+                "Payload of message with content_encoding %s could not be decompressed",
+                message_received.content_encoding,
+            )
+        else:
+            message_received.content_encoding = message_compression.DECOMPRESSED_ENCODING
+
+
+class ParsedTopic(object):
+    """
+    The parts of the topic of an incoming message, as parsed by IncomingTopicParser.
+
+    :ivar str kind: The feature the message is for: constant.C2D_MSG, INPUT_MSG, METHODS, TWIN (a
+      twin response) or TWIN_PATCHES.
+    :ivar str name: The input name of an input message, or the method name of a method request.
+    :ivar str request_id: The request id of a method request or twin response.
+    :ivar str status_code: The status code of a twin response.
+    :ivar list properties: The uri-decoded (key, value) pairs of the properties of a C2D or input
+      message, or of the query of a method request or twin response.
+    """
+
+    __slots__ = ("kind", "name", "request_id", "status_code", "properties")
+
+    def __init__(self, kind, name=None, request_id=None, status_code=None, properties=None):
+        self.kind = kind
+        self.name = name
+        self.request_id = request_id
+        self.status_code = status_code
+        self.properties = properties if properties is not None else []
+
+
+class IncomingTopicParser(object):
+    """
+    Parser for the topics of incoming messages for a device or module.  The topic prefix of each
+    kind of message is built once, so that a topic is classified by its prefix, and its parts are
+    extracted in a single pass over the rest of it.
+    """
+
+    def __init__(self, device_id=None, module_id=None):
+        """
+        :param str device_id: The device id. If None, only method and twin topics are recognized.
+        :param str module_id: The module id, if this is a module. Input message topics are only
+          recognized for a module.
+        """
+        self.prefixes = []
+        if device_id:
+            self.prefixes.append(
+                (_get_topic_base(device_id, None) + "/messages/devicebound", constant.C2D_MSG)
+            )
+            if module_id:
+                self.prefixes.append(
+                    (_get_topic_base(device_id, module_id) + "/inputs/", constant.INPUT_MSG)
+                )
+        self.prefixes.extend(
+            [
+                ("$iothub/methods/POST/", constant.METHODS),
+                ("$iothub/twin/res/", constant.TWIN),
+                ("$iothub/twin/PATCH/properties/desired", constant.TWIN_PATCHES),
+            ]
+        )
+
+    def parse(self, topic):
+        """
+        Parse the topic of an incoming message.
+        :param str topic: The topic string
+        :returns: A ParsedTopic, or None if the topic is not for this device or module
+        :raises: ValueError if the topic has an incorrect format
+        """
+        for prefix, kind in self.prefixes:
+            if topic.startswith(prefix):
+                break
+        else:
+            return None
+        rest = topic[len(prefix) :]
+
+        if kind == constant.C2D_MSG:
+            # devices/<deviceId>/messages/devicebound/<properties>
+            if rest and rest[0] != "/":
+                return None
+            properties = rest[1:].partition("/")[0]
+            return ParsedTopic(kind, properties=_split_properties(properties) if properties else [])
+
+        elif kind == constant.INPUT_MSG:
+            # devices/<deviceId>/modules/<moduleId>/inputs/<inputName>/<properties>
+            name, _, rest = rest.partition("/")
+            properties = rest.partition("/")[0]
+            return ParsedTopic(
+                kind, name=name, properties=_split_properties(properties) if properties else []
+            )
+
+        elif kind == constant.TWIN_PATCHES:
+            return ParsedTopic(kind)
+
+        # $iothub/methods/POST/<methodName>/?$rid=<requestId> or
+        # $iothub/twin/res/<statusCode>/?$rid=<requestId>
+        segment, _, query = rest.partition("?")
+        properties = _split_properties(query) if query else []
+        request_id = None
+        for key, value in properties:
+            if key == "$rid":
+                request_id = value
+        if request_id is None:
+            raise ValueError("topic has incorrect format")
+        segment = segment.partition("/")[0]
+        if kind == constant.METHODS:
+            return ParsedTopic(kind, name=segment, request_id=request_id, properties=properties)
+        else:
+            return ParsedTopic(
+                kind, request_id=request_id, status_code=segment, properties=properties
+            )
+
+
+_topic_templates = collections.OrderedDict()
+_topic_templates_lock = threading.Lock()
+
+
+def _quote(value):
+    """
+    uri-encode a property key or value the way urllib.parse.urlencode does
+    """
+    if not isinstance(value, six.binary_type):
+        value = str(value)
+    return urllib.parse.quote_plus(value)
+
+
+def _get_expiry_time_utc(message):
+    if isinstance(message.expiry_time_utc, date):
+        return message.expiry_time_utc.isoformat()
+    return message.expiry_time_utc
+
+
+def _get_custom_property(key, message):
+    return message.custom_properties[key]
+
+
+def _get_signature(message):
+    """
+    Return the signature of a message: which properties it has, and the values of those which are
+    usually the same for every message a client sends
+    """
+    return (
+        message.output_name or None,
+        bool(message.message_id),
+        bool(message.correlation_id),
+        bool(message.user_id),
+        message.to or None,
+        message.content_type or None,
+        message.content_encoding or None,
+        message.iothub_interface_id or None,
+        bool(message.expiry_time_utc),
+        tuple(message.custom_properties) if message.custom_properties else (),
+    )
+
+
+class _TopicTemplate(object):
+    """
+    The encoded properties of messages with the same signature.  The encoded properties of a message
+    are literals[0], then for each function in getters, the encoded value it returns for the message
+    followed by the next literal.
+    """
+
+    __slots__ = ("literals", "getters")
+
+    def __init__(self, signature):
+        (
+            output_name,
+            has_message_id,
+            has_correlation_id,
+            has_user_id,
+            to,
+            content_type,
+            content_encoding,
+            iothub_interface_id,
+            has_expiry_time_utc,
+            custom_property_keys,
+        ) = signature
+
+        # Each property is a key, and either its value or a function returning its value
+        properties = []
+        if output_name:
+            properties.append(("$.on", output_name))
+        if has_message_id:
+            properties.append(("$.mid", lambda message: message.message_id))
+        if has_correlation_id:
+            properties.append(("$.cid", lambda message: message.correlation_id))
+        if has_user_id:
+            properties.append(("$.uid", lambda message: message.user_id))
+        if to:
+            properties.append(("$.to", to))
+        if content_type:
+            properties.append(("$.ct", content_type))
+        if content_encoding:
+            properties.append(("$.ce", content_encoding))
+        if iothub_interface_id:
+            properties.append(("$.ifid", iothub_interface_id))
+        if has_expiry_time_utc:
+            properties.append(("$.exp", _get_expiry_time_utc))
+        for key in custom_property_keys:
+            properties.append((key, functools.partial(_get_custom_property, key)))
+
+        literals = []
+        getters = []
+        current = ""
+        for index, (key, value) in enumerate(properties):
+            if index:
+                current += "&"
+            current += _quote(key) + "="
+            if callable(value):
+                literals.append(current)
+                getters.append(value)
+                current = ""
             else:
-                message_received.custom_properties[key] = value
+                current += _quote(value)
+        literals.append(current)
+        self.literals = tuple(literals)
+        self.getters = tuple(getters)
+
+    def encode(self, message):
+        literals = self.literals
+        parts = [literals[0]]
+        for index, getter in enumerate(self.getters):
+            parts.append(_quote(getter(message)))
+            parts.append(literals[index + 1])
+        return "".join(parts)
+
+
+def _get_topic_template(signature):
+    """
+    Return the template for the given signature, creating it if it is not in the cache, and evicting
+    the least recently used template if the cache is full
+    """
+    with _topic_templates_lock:
+        template = _topic_templates.pop(signature, None)
+        if template is None:
+            template = _TopicTemplate(signature)
+            if len(_topic_templates) >= TOPIC_TEMPLATE_CACHE_SIZE:
+                _topic_templates.popitem(last=False)
+        _topic_templates[signature] = template
+    return template
 
 
 # TODO: this has too generic a name, given that it's only for messages
@@ -216,6 +514,32 @@ def encode_properties(message_to_send, topic):
     Additionally if the message has user defined properties, the property keys and values shall be
     uri-encoded and appended at the end of the above topic with the following convention:
     '<key>=<value>&<key2>=<value2>&<key3>=<value3>(...)'
+
+    The keys, and the values which are usually the same for every message (such as content_type), are
+    encoded once for each combination of them, and kept in a cache of up to
+    TOPIC_TEMPLATE_CACHE_SIZE combinations.
+    :param message_to_send: The message to send
+    :param topic: The topic which has not been encoded yet. For a device it looks like
+    "devices/<deviceId>/messages/events/" and for a module it looks like
+    "devices/<deviceId>/modules/<moduleId>/messages/events/
+    :return: The topic which has been uri-encoded
+    """
+    try:
+        signature = _get_signature(message_to_send)
+        hash(signature)
+    except TypeError:
+        # Properties which can't be part of a signature, such as a list as the content_type
+        return _encode_properties_uncached(message_to_send, topic)
+    return topic + _get_topic_template(signature).encode(message_to_send)
+
+
+# TODO: this has too generic a name, given that it's only for messages
+def _encode_properties_uncached(message_to_send, topic):
+    """
+    uri-encode the system properties of a message as key-value pairs on the topic with defined keys.
+    Additionally if the message has user defined properties, the property keys and values shall be
+    uri-encoded and appended at the end of the above topic with the following convention:
+    '<key>=<value>&<key2>=<value2>&<key3>=<value3>(...)'
     :param message_to_send: The message to send
     :param topic: The topic which has not been encoded yet. For a device it looks like
     "devices/<deviceId>/messages/events/" and for a module it looks like
@@ -18,6 +18,8 @@ class SetX509AuthProviderOperation(PipelineOperation):
     very IoTHub-specific
     """
 
+    __slots__ = ("auth_provider",)
+
     def __init__(self, auth_provider, callback):
         """
         Initializer for SetAuthProviderOperation objects.
@@ -42,6 +44,8 @@ class SetAuthProviderOperation(PipelineOperation):
     very IoTHub-specific
     """
 
+    __slots__ = ("auth_provider",)
+
     def __init__(self, auth_provider, callback):
         """
         Initializer for SetAuthProviderOperation objects.
@@ -65,6 +69,16 @@ class SetIoTHubConnectionArgsOperation(PipelineOperation):
     IoTHub connections and would not apply to other types of client connections (such as a DPS client).
     """
 
+    __slots__ = (
+        "device_id",
+        "module_id",
+        "hostname",
+        "gateway_hostname",
+        "ca_cert",
+        "client_cert",
+        "sas_token",
+    )
+
     def __init__(
         self,
         device_id,
@@ -111,6 +125,8 @@ class SendD2CMessageOperation(PipelineOperation):
     This operation is in the group of IoTHub operations because it is very specific to the IoTHub client
     """
 
+    __slots__ = ("message",)
+
     def __init__(self, message, callback):
         """
         Initializer for SendD2CMessageOperation objects.
@@ -131,6 +147,8 @@ class SendOutputEventOperation(PipelineOperation):
     This operation is in the group of IoTHub operations because it is very specific to the IoTHub client
     """
 
+    __slots__ = ("message",)
+
     def __init__(self, message, callback):
         """
         Initializer for SendOutputEventOperation objects.
@@ -152,6 +170,8 @@ class SendMethodResponseOperation(PipelineOperation):
     This operation is in the group of IoTHub operations because it is very specific to the IoTHub client.
     """
 
+    __slots__ = ("method_response",)
+
     def __init__(self, method_response, callback):
         """
         Initializer for SendMethodResponseOperation objects.
@@ -176,6 +196,8 @@ class GetTwinOperation(PipelineOperation):
     :type twin: Twin
     """
 
+    __slots__ = ("twin",)
+
     def __init__(self, callback):
         """
         Initializer for GetTwinOperation objects.
@@ -190,6 +212,8 @@ class PatchTwinReportedPropertiesOperation(PipelineOperation):
     IoT Hub or Azure IoT Edge Hub service.
     """
 
+    __slots__ = ("patch",)
+
     def __init__(self, patch, callback):
         """
         Initializer for PatchTwinReportedPropertiesOperation object
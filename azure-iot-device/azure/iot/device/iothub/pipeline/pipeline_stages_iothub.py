@@ -4,17 +4,33 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import collections
+import copy
 import json
 import logging
-from azure.iot.device.common.pipeline import pipeline_ops_base, PipelineStage, pipeline_thread
+import six
+import time
+import weakref
+from threading import Timer
+from azure.iot.device.common.pipeline import (
+    pipeline_ops_base,
+    PipelineStage,
+    pipeline_thread,
+    handles_ops,
+)
 from azure.iot.device import exceptions
+from azure.iot.device.iothub.models import Message
 from azure.iot.device.common import handle_exceptions
 from azure.iot.device.common.callable_weak_method import CallableWeakMethod
 from . import pipeline_ops_iothub
 from . import constant
+from . import message_compression
 
 logger = logging.getLogger(__name__)
 
+# Monotonic clock used for batch deadlines, where available
+_now = getattr(time, "monotonic", time.time)
+
 
 class UseAuthProviderStage(PipelineStage):
     def __init__(self):
@@ -28,47 +44,46 @@ class UseAuthProviderStage(PipelineStage):
     All other operations are passed down.
     """
 
+    @handles_ops(pipeline_ops_iothub.SetAuthProviderOperation)
     @pipeline_thread.runs_on_pipeline_thread
-    def _execute_op(self, op):
-        if isinstance(op, pipeline_ops_iothub.SetAuthProviderOperation):
-            self.auth_provider = op.auth_provider
-            self.auth_provider.on_sas_token_updated_handler = CallableWeakMethod(
-                self, "on_sas_token_updated"
-            )
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_iothub.SetIoTHubConnectionArgsOperation(
-                    device_id=self.auth_provider.device_id,
-                    module_id=getattr(self.auth_provider, "module_id", None),
-                    hostname=self.auth_provider.hostname,
-                    gateway_hostname=getattr(self.auth_provider, "gateway_hostname", None),
-                    ca_cert=getattr(self.auth_provider, "ca_cert", None),
-                    sas_token=self.auth_provider.get_current_sas_token(),
-                    callback=op.callback,
-                ),
-                op=op,
-            )
-        elif isinstance(op, pipeline_ops_iothub.SetX509AuthProviderOperation):
-            self.auth_provider = op.auth_provider
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_iothub.SetIoTHubConnectionArgsOperation(
-                    device_id=self.auth_provider.device_id,
-                    module_id=getattr(self.auth_provider, "module_id", None),
-                    hostname=self.auth_provider.hostname,
-                    gateway_hostname=getattr(self.auth_provider, "gateway_hostname", None),
-                    ca_cert=getattr(self.auth_provider, "ca_cert", None),
-                    client_cert=self.auth_provider.get_x509_certificate(),
-                    callback=op.callback,
-                ),
-                op=op,
-            )
-        else:
-            self._send_op_down(op)
+    def _execute_set_auth_provider_op(self, op):
+        self.auth_provider = op.auth_provider
+        self.auth_provider.on_sas_token_updated_handler = CallableWeakMethod(
+            self, "on_sas_token_updated"
+        )
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_iothub.SetIoTHubConnectionArgsOperation(
+                device_id=self.auth_provider.device_id,
+                module_id=getattr(self.auth_provider, "module_id", None),
+                hostname=self.auth_provider.hostname,
+                gateway_hostname=getattr(self.auth_provider, "gateway_hostname", None),
+                ca_cert=getattr(self.auth_provider, "ca_cert", None),
+                sas_token=self.auth_provider.get_current_sas_token(),
+                callback=op.callback,
+            ),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_iothub.SetX509AuthProviderOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_set_x509_auth_provider_op(self, op):
+        self.auth_provider = op.auth_provider
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_iothub.SetIoTHubConnectionArgsOperation(
+                device_id=self.auth_provider.device_id,
+                module_id=getattr(self.auth_provider, "module_id", None),
+                hostname=self.auth_provider.hostname,
+                gateway_hostname=getattr(self.auth_provider, "gateway_hostname", None),
+                ca_cert=getattr(self.auth_provider, "ca_cert", None),
+                client_cert=self.auth_provider.get_x509_certificate(),
+                callback=op.callback,
+            ),
+            op=op,
+        )
 
     @pipeline_thread.invoke_on_pipeline_thread_nowait
     def on_sas_token_updated(self):
-        logger.info(
-            "{}: New sas token received.  Passing down UpdateSasTokenOperation.".format(self.name)
-        )
+        logger.info("%s: New sas token received.  Passing down UpdateSasTokenOperation.", self.name)
 
         @pipeline_thread.runs_on_pipeline_thread
         def on_token_update_complete(op, error):
@@ -80,9 +95,7 @@ class UseAuthProviderStage(PipelineStage):
                 )
                 handle_exceptions.handle_background_exception(error)
             else:
-                logger.debug(
-                    "{}({}): token update operation is complete".format(self.name, op.name)
-                )
+                logger.debug("%s(%s): token update operation is complete", self.name, op.name)
 
         self._send_op_down(
             op=pipeline_ops_base.UpdateSasTokenOperation(
@@ -92,6 +105,18 @@ class UseAuthProviderStage(PipelineStage):
         )
 
 
+def _map_twin_error(error, twin_op):
+    if error:
+        return error
+    elif twin_op.status_code >= 300:
+        # TODO map error codes to correct exceptions
+        logger.error("Error {} received from twin operation".format(twin_op.status_code))
+        logger.error("response body: {}".format(twin_op.response_body))
+        return exceptions.ServiceError(
+            "twin operation returned status {}".format(twin_op.status_code)
+        )
+
+
 class HandleTwinOperationsStage(PipelineStage):
     """
     PipelineStage which handles twin operations. In particular, it converts twin GET and PATCH
@@ -102,62 +127,557 @@ class HandleTwinOperationsStage(PipelineStage):
     protocol-specific receive event into an IotResponseEvent event.
     """
 
+    @handles_ops(pipeline_ops_iothub.GetTwinOperation)
     @pipeline_thread.runs_on_pipeline_thread
-    def _execute_op(self, op):
-        def map_twin_error(error, twin_op):
-            if error:
-                return error
-            elif twin_op.status_code >= 300:
-                # TODO map error codes to correct exceptions
-                logger.error("Error {} received from twin operation".format(twin_op.status_code))
-                logger.error("response body: {}".format(twin_op.response_body))
-                return exceptions.ServiceError(
-                    "twin operation returned status {}".format(twin_op.status_code)
-                )
+    def _execute_get_twin_op(self, op):
+        def on_twin_response(twin_op, error):
+            logger.debug("%s(%s): Got response for GetTwinOperation", self.name, op.name)
+            error = _map_twin_error(error=error, twin_op=twin_op)
+            if not error:
+                op.twin = json.loads(twin_op.response_body.decode("utf-8"))
+            self._complete_op(op, error=error)
 
-        if isinstance(op, pipeline_ops_iothub.GetTwinOperation):
+        self._send_op_down(
+            pipeline_ops_base.SendIotRequestAndWaitForResponseOperation(
+                request_type=constant.TWIN,
+                method="GET",
+                resource_location="/",
+                request_body=" ",
+                callback=on_twin_response,
+            )
+        )
 
-            def on_twin_response(twin_op, error):
-                logger.debug("{}({}): Got response for GetTwinOperation".format(self.name, op.name))
-                error = map_twin_error(error=error, twin_op=twin_op)
-                if not error:
-                    op.twin = json.loads(twin_op.response_body.decode("utf-8"))
-                self._complete_op(op, error=error)
+    @handles_ops(pipeline_ops_iothub.PatchTwinReportedPropertiesOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_patch_twin_reported_properties_op(self, op):
+        def on_twin_response(twin_op, error):
+            logger.debug(
+                "%s(%s): Got response for PatchTwinReportedPropertiesOperation operation",
+                self.name,
+                op.name,
+            )
+            error = _map_twin_error(error=error, twin_op=twin_op)
+            self._complete_op(op, error=error)
 
-            self._send_op_down(
-                pipeline_ops_base.SendIotRequestAndWaitForResponseOperation(
-                    request_type=constant.TWIN,
-                    method="GET",
-                    resource_location="/",
-                    request_body=" ",
-                    callback=on_twin_response,
-                )
+        logger.debug("%s(%s): Sending reported properties patch: %s", self.name, op.name, op.patch)
+
+        self._send_op_down(
+            pipeline_ops_base.SendIotRequestAndWaitForResponseOperation(
+                request_type=constant.TWIN,
+                method="PATCH",
+                resource_location="/properties/reported/",
+                request_body=json.dumps(op.patch),
+                callback=on_twin_response,
             )
+        )
 
-        elif isinstance(op, pipeline_ops_iothub.PatchTwinReportedPropertiesOperation):
 
-            def on_twin_response(twin_op, error):
-                logger.debug(
-                    "{}({}): Got response for PatchTwinReportedPropertiesOperation operation".format(
-                        self.name, op.name
-                    )
+class StoreAndForwardStage(PipelineStage):
+    """
+    PipelineStage which keeps outgoing messages in a persistent MessageStore until the service has
+    acknowledged them, so that messages can be accepted while the client is offline, and are not lost
+    if the process restarts before they are sent.
+
+    This stage only acts if the message_store_path pipeline configuration option is set.  Then, a
+    SendD2CMessageOperation or SendOutputEventOperation completes as soon as its message has been
+    written to the store.  Stored messages are sent oldest first, in batches of up to
+    message_store_batch_size messages, and each batch is removed from the store once it has been
+    sent.  Messages whose expiry_time_utc has passed are dropped instead of being sent.
+
+    Storing a message, the pipeline connecting, and a batch completing all cause the next batch to be
+    sent.  If any message in a batch fails to send, it stays in the store, and sending stops until the
+    pipeline connects again (or, if the pipeline is still connected, until another message is stored).
+    A message which has failed to send message_store_max_attempts times, or which can never be sent
+    (the send failed with a ValueError or TypeError, e.g. because the message is too large), is
+    instead dropped from the store and the error reported as a background exception, so that it
+    doesn't hold up the messages behind it.
+    Expired messages are removed from the whole store when sending starts, rather than with every
+    batch.
+
+    The store is closed once a DisconnectOperation has completed and no batch is being sent, so that
+    a disconnected client doesn't hold the database open.  It is opened again when it is next needed.
+
+    All other operations are passed down.
+
+    :ivar store: The store of messages which have not yet been sent, or None if the message_store_path
+      configuration option is not set.
+    :type store: :class:`azure.iot.device.iothub.pipeline.message_store.MessageStore`
+    :ivar sending_count: The number of stored messages which have been sent, but not yet completed.
+    :type sending_count: int
+    """
+
+    def __init__(self):
+        super(StoreAndForwardStage, self).__init__()
+        self.store = None
+        self.sending_count = 0
+        self._store_opened = False
+        self._sent_message_ids = []
+        # (ID, error) for each message in the batch being sent which failed to send
+        self._failed_messages = []
+        self._waiting_for_connection = False
+        self._close_requested = False
+        # Incremented on every connection, so a failed batch knows whether a reconnect happened
+        # while it was being sent
+        self._connection_number = 0
+        self._batch_connection_number = 0
+
+    @handles_ops(
+        pipeline_ops_iothub.SendD2CMessageOperation, pipeline_ops_iothub.SendOutputEventOperation
+    )
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_message_op(self, op):
+        if self._get_store() is None:
+            self._send_op_down(op)
+            return
+
+        try:
+            self.store.put(op.message)
+        except Exception as e:
+            logger.error("{}({}): failed to store message".format(self.name, op.name))
+            self._complete_op(op, error=e)
+        else:
+            logger.debug("%s(%s): message stored.  completing op.", self.name, op.name)
+            self._complete_op(op)
+            self._send_stored_messages()
+
+    @handles_ops(pipeline_ops_base.DisconnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_disconnect_op(self, op):
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_disconnected(op, error):
+            if self.store is not None:
+                self._close_requested = True
+                if not self.sending_count:
+                    self._close_store()
+            self._send_completed_op_up(op, error=error)
+
+        self._send_op_down_and_intercept_return(op, intercepted_return=on_disconnected)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def on_connected(self):
+        super(StoreAndForwardStage, self).on_connected()
+        self._connection_number += 1
+        self._waiting_for_connection = False
+        if self._get_store() is not None:
+            self._send_stored_messages()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _get_store(self):
+        """
+        Return the message store, opening it the first time this is called
+        """
+        self._close_requested = False
+        if not self._store_opened:
+            self._store_opened = True
+            config = self.pipeline_root.pipeline_configuration
+            if config.message_store_path is not None:
+                # Imported here so that sqlite3 is only required when the store is used
+                from .message_store import MessageStore
+
+                self.store = MessageStore(
+                    config.message_store_path, durability=config.message_store_durability
                 )
-                error = map_twin_error(error=error, twin_op=twin_op)
-                self._complete_op(op, error=error)
+                logger.info(
+                    "%s: opened message store %s with %s messages",
+                    self.name,
+                    config.message_store_path,
+                    len(self.store),
+                )
+        return self.store
 
-            logger.debug(
-                "{}({}): Sending reported properties patch: {}".format(self.name, op.name, op.patch)
-            )
+    @pipeline_thread.runs_on_pipeline_thread
+    def _close_store(self):
+        """
+        Close the message store.  It is opened again the next time it is needed.
+        """
+        logger.debug("%s: closing message store", self.name)
+        self._close_requested = False
+        self._store_opened = False
+        store, self.store = self.store, None
+        try:
+            store.close()
+        except Exception as e:
+            logger.error("%s: failed to close the message store", self.name)
+            handle_exceptions.handle_background_exception(e)
 
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_stored_messages(self, continuing=False):
+        """
+        Send the next batch of stored messages, unless a batch is already being sent or sending is
+        waiting for the pipeline to connect.  continuing is True if a batch has just been sent.
+        """
+        if self.sending_count or (
+            self._waiting_for_connection and not self.pipeline_root.connected
+        ):
+            return
+        self._waiting_for_connection = False
+        if not continuing:
+            self.store.drop_expired()
+        batch = self.store.peek(self.pipeline_root.pipeline_configuration.message_store_batch_size)
+        if not batch:
+            return
+        logger.debug("%s: sending %s stored messages", self.name, len(batch))
+        self.sending_count = len(batch)
+        self._sent_message_ids = []
+        self._failed_messages = []
+        self._batch_connection_number = self._connection_number
+        for message_id, message in batch:
+            if message.output_name:
+                op_class = pipeline_ops_iothub.SendOutputEventOperation
+            else:
+                op_class = pipeline_ops_iothub.SendD2CMessageOperation
             self._send_op_down(
-                pipeline_ops_base.SendIotRequestAndWaitForResponseOperation(
-                    request_type=constant.TWIN,
-                    method="PATCH",
-                    resource_location="/properties/reported/",
-                    request_body=json.dumps(op.patch),
-                    callback=on_twin_response,
-                )
+                op_class(message=message, callback=self._create_sent_callback(message_id))
             )
 
+    @pipeline_thread.runs_on_pipeline_thread
+    def _create_sent_callback(self, message_id):
+        """
+        Create the callback for the operation sending the stored message with the given ID
+        """
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_sent(op, error):
+            if error:
+                logger.warning(
+                    "{}({}): failed to send stored message: {}".format(self.name, op.name, error)
+                )
+                self._failed_messages.append((message_id, error))
+            else:
+                self._sent_message_ids.append(message_id)
+            self.sending_count -= 1
+            if not self.sending_count:
+                self._on_batch_complete()
+
+        return on_sent
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _on_batch_complete(self):
+        try:
+            self.store.remove(self._sent_message_ids)
+        except Exception as e:
+            # The messages will be sent again, which is better than losing them
+            logger.error("{}: failed to remove sent messages from the store".format(self.name))
+            handle_exceptions.handle_background_exception(e)
+        retrying = self._failed_messages and self._drop_failed_messages()
+        if self._close_requested:
+            self._close_store()
+        elif retrying and self._batch_connection_number == self._connection_number:
+            logger.info("%s: waiting for a connection to send stored messages", self.name)
+            self._waiting_for_connection = True
         else:
+            self._send_stored_messages(continuing=True)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _drop_failed_messages(self):
+        """
+        Count a failed attempt for each message in the batch which failed to send, and drop the
+        messages which can't be sent or have run out of attempts.  Returns True if any failed
+        message is left in the store to be sent again.
+        """
+        max_attempts = self.pipeline_root.pipeline_configuration.message_store_max_attempts
+        failed_messages, self._failed_messages = self._failed_messages, []
+        try:
+            attempts = self.store.record_failures(
+                [message_id for (message_id, _) in failed_messages]
+            )
+        except Exception as e:
+            logger.error("%s: failed to count failed attempts in the store", self.name)
+            handle_exceptions.handle_background_exception(e)
+            return True
+
+        dropped = [
+            (message_id, error)
+            for (message_id, error) in failed_messages
+            if isinstance(error, (ValueError, TypeError))
+            or attempts.get(message_id, 0) >= max_attempts
+        ]
+        if dropped:
+            try:
+                self.store.remove([message_id for (message_id, _) in dropped])
+            except Exception as e:
+                logger.error("%s: failed to drop messages from the store", self.name)
+                handle_exceptions.handle_background_exception(e)
+                return True
+            for message_id, error in dropped:
+                logger.error(
+                    "%s: dropping stored message %s after %s failed attempts: %s",
+                    self.name,
+                    message_id,
+                    attempts.get(message_id, 0),
+                    error,
+                )
+                handle_exceptions.handle_background_exception(error)
+        return len(dropped) < len(failed_messages)
+
+
+class _TelemetryBatch(object):
+    """
+    The operations waiting to be sent together by AggregateTelemetryStage, and the JSON text of
+    their messages
+    """
+
+    __slots__ = ("ops", "payloads", "size", "deadline")
+
+    def __init__(self, deadline):
+        self.ops = []
+        self.payloads = []
+        # The size of the combined payload, in bytes, including the brackets and commas
+        self.size = 1
+        # The time at which the batch is sent, if it hasn't been filled by then
+        self.deadline = deadline
+
+
+class AggregateTelemetryStage(PipelineStage):
+    """
+    PipelineStage which combines outgoing messages into batches, each sent as one message whose
+    payload is a JSON array of the payloads of the messages in it.  The service counts (and
+    throttles) each batch as one message.
+
+    This stage only acts if the telemetry_batch_max_messages pipeline configuration option is set.
+    Then, a SendD2CMessageOperation or SendOutputEventOperation whose message can be combined with
+    others waits in a batch with other messages of the same kind, until the batch holds
+    telemetry_batch_max_messages messages, adding the message would make the payload larger than
+    telemetry_batch_max_bytes, or telemetry_batch_linger seconds have passed since the first
+    message was added.  Every operation in a batch completes when the batch has been sent.
+
+    A message can be combined with others if its payload is UTF-8 JSON text, and it has no
+    message_id, correlation_id, user_id or expiry_time_utc (which apply to a single message).
+    Messages are only combined with others which go to the same output, and have the same QoS and
+    custom properties.  Any other message is sent on its own, after any waiting batches, as are
+    waiting batches when a DisconnectOperation is run.
+
+    :ivar batch_count: The number of batches which have been sent.
+    :type batch_count: int
+    :ivar batched_message_count: The number of messages in the batches which have been sent.
+    :type batched_message_count: int
+    :ivar batched_byte_count: The number of bytes in the payloads of the batches which have been
+      sent.
+    :type batched_byte_count: int
+    """
+
+    def __init__(self):
+        super(AggregateTelemetryStage, self).__init__()
+        self.batch_count = 0
+        self.batched_message_count = 0
+        self.batched_byte_count = 0
+        # Batches waiting to be sent, keyed by what their messages have in common.  Batches are
+        # sent in the order they were started, so the first has the earliest deadline.
+        self._batches = collections.OrderedDict()
+        # A single timer, for the deadline of the first batch
+        self._linger_timer = None
+
+    @handles_ops(
+        pipeline_ops_iothub.SendD2CMessageOperation, pipeline_ops_iothub.SendOutputEventOperation
+    )
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_message_op(self, op):
+        config = self.pipeline_root.pipeline_configuration
+        if config.telemetry_batch_max_messages is None:
+            self._send_op_down(op)
+            return
+
+        key, payload = self._get_batch_key_and_payload(op)
+        if key is None or len(payload) + 2 > config.telemetry_batch_max_bytes:
+            logger.debug("%s(%s): message cannot be batched.  sending.", self.name, op.name)
+            self._send_all_batches()
             self._send_op_down(op)
+            return
+
+        batch = self._batches.get(key)
+        if batch is not None and batch.size + len(payload) + 1 > config.telemetry_batch_max_bytes:
+            self._send_batch(key)
+            batch = None
+        if batch is None:
+            batch = self._batches[key] = _TelemetryBatch(_now() + config.telemetry_batch_linger)
+            self._schedule_linger_timer()
+        batch.ops.append(op)
+        batch.payloads.append(payload)
+        # One byte for the comma or bracket before the payload
+        batch.size += len(payload) + 1
+        if len(batch.ops) >= config.telemetry_batch_max_messages:
+            self._send_batch(key)
+
+    @handles_ops(pipeline_ops_base.DisconnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_disconnect_op(self, op):
+        self._send_all_batches()
+        self._send_op_down(op)
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _get_batch_key_and_payload(self, op):
+        """
+        Return the key of the batches which the message of op can be added to, and its payload
+        as UTF-8 JSON text, or (None, None) if the message can't be combined with others.
+        """
+        message = op.message
+        if (
+            message.content_type != "application/json"
+            or message.content_encoding != "utf-8"
+            or message.message_id is not None
+            or message.correlation_id is not None
+            or message.user_id is not None
+            or message.expiry_time_utc is not None
+        ):
+            return None, None
+        data = message.data
+        try:
+            if isinstance(data, six.binary_type):
+                json.loads(data.decode("utf-8"))
+                payload = data
+            elif isinstance(data, six.text_type):
+                json.loads(data)
+                payload = data.encode("utf-8")
+            else:
+                return None, None
+            key = (
+                type(op),
+                message.output_name,
+                message.qos,
+                message.iothub_interface_id,
+                tuple(sorted(message.custom_properties.items())),
+            )
+            hash(key)
+        except (ValueError, TypeError):
+            # Not JSON text, or custom properties which can't be compared
+            return None, None
+        return key, payload
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _schedule_linger_timer(self):
+        """
+        Start a timer to send the first batch when its deadline passes, unless there are no
+        batches or a timer is already running.
+        """
+        if self._linger_timer is not None or not self._batches:
+            return
+        first_batch = next(iter(self._batches.values()))
+        interval = max(0, first_batch.deadline - _now())
+
+        # The timer holds a weak reference so that it doesn't keep the pipeline alive
+        self_weakref = weakref.ref(self)
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def on_linger_timer():
+            this = self_weakref()
+            if this:
+                this._send_lingering_batches()
+
+        self._linger_timer = Timer(interval, on_linger_timer)
+        self._linger_timer.daemon = True
+        self._linger_timer.start()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_lingering_batches(self, now=None):
+        """
+        Send every batch whose deadline has passed, and start a timer for the next deadline.
+
+        :param float now: The current time, as returned by the clock used for deadlines (optional).
+        """
+        self._linger_timer = None
+        if now is None:
+            now = _now()
+        while self._batches:
+            key, batch = next(iter(self._batches.items()))
+            if batch.deadline > now:
+                break
+            self._send_batch(key)
+        self._schedule_linger_timer()
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_all_batches(self):
+        for key in list(self._batches):
+            self._send_batch(key)
+        if self._linger_timer is not None:
+            self._linger_timer.cancel()
+            self._linger_timer = None
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _send_batch(self, key):
+        """
+        Send the batch with the given key as a single message, and complete its operations when it
+        has been sent
+        """
+        batch = self._batches.pop(key)
+        self.batch_count += 1
+        self.batched_message_count += len(batch.ops)
+        self.batched_byte_count += batch.size
+        if len(batch.ops) == 1:
+            self._send_op_down(batch.ops[0])
+            return
+
+        ops = batch.ops
+        first_message = ops[0].message
+        message = Message(
+            b"[" + b",".join(batch.payloads) + b"]",
+            output_name=first_message.output_name,
+            qos=first_message.qos,
+        )
+        message.custom_properties = dict(first_message.custom_properties)
+        message._iothub_interface_id = first_message.iothub_interface_id
+        logger.debug("%s: sending %s messages in %s bytes", self.name, len(ops), batch.size)
+
+        @pipeline_thread.runs_on_pipeline_thread
+        def on_batch_sent(batch_op, error):
+            for op in ops:
+                self._complete_op(op, error=error)
+
+        self._send_op_down(type(ops[0])(message=message, callback=on_batch_sent))
+
+
+class CompressMessagesStage(PipelineStage):
+    """
+    PipelineStage which compresses the payloads of outgoing messages.
+
+    This stage only acts if the compression_threshold pipeline configuration option is set.  Then,
+    the payload of a SendD2CMessageOperation or SendOutputEventOperation whose message has a
+    content_encoding of "utf-8" and a payload of at least compression_threshold bytes is
+    compressed with the compression_method pipeline configuration option, and the
+    content_encoding of the message sent is set to the compression method.  The message of the
+    operation is replaced with a compressed copy, so the message passed in is not changed.  A
+    payload which doesn't get smaller is sent as it is.
+
+    :ivar compressed_message_count: The number of messages which have been compressed.
+    :type compressed_message_count: int
+    :ivar uncompressed_byte_count: The number of bytes in the payloads of those messages, before
+      they were compressed.
+    :type uncompressed_byte_count: int
+    :ivar compressed_byte_count: The number of bytes in the payloads of those messages, after they
+      were compressed.
+    :type compressed_byte_count: int
+    """
+
+    def __init__(self):
+        super(CompressMessagesStage, self).__init__()
+        self.compressed_message_count = 0
+        self.uncompressed_byte_count = 0
+        self.compressed_byte_count = 0
+
+    @handles_ops(
+        pipeline_ops_iothub.SendD2CMessageOperation, pipeline_ops_iothub.SendOutputEventOperation
+    )
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_message_op(self, op):
+        config = self.pipeline_root.pipeline_configuration
+        message = op.message
+        if config.compression_threshold is not None and message.content_encoding == "utf-8":
+            data = message.data
+            if isinstance(data, six.text_type):
+                data = data.encode("utf-8")
+            if isinstance(data, six.binary_type) and len(data) >= config.compression_threshold:
+                compressed_data = message_compression.compress(data, config.compression_method)
+                if len(compressed_data) < len(data):
+                    logger.debug(
+                        "%s(%s): compressed payload from %s to %s bytes",
+                        self.name,
+                        op.name,
+                        len(data),
+                        len(compressed_data),
+                    )
+                    self.compressed_message_count += 1
+                    self.uncompressed_byte_count += len(data)
+                    self.compressed_byte_count += len(compressed_data)
+                    op.message = copy.copy(message)
+                    op.message.data = compressed_data
+                    op.message.content_encoding = config.compression_method
+        self._send_op_down(op)
@@ -14,6 +14,8 @@ from azure.iot.device.common.pipeline import (
     pipeline_events_mqtt,
     PipelineStage,
     pipeline_thread,
+    handles_ops,
+    handles_events,
 )
 from azure.iot.device.iothub.models import Message, MethodRequest
 from . import pipeline_ops_iothub, pipeline_events_iothub, mqtt_topic_iothub
@@ -23,6 +25,9 @@ from azure.iot.device import constant as pkg_constant
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of completed telemetry publish operations kept for reuse
+MAX_FREE_PUBLISH_OPS = 32
+
 
 class IoTHubMQTTConverterStage(PipelineStage):
     """
@@ -33,179 +38,218 @@ class IoTHubMQTTConverterStage(PipelineStage):
     def __init__(self):
         super(IoTHubMQTTConverterStage, self).__init__()
         self.feature_to_topic = {}
+        # Replaced by a parser which also recognizes message topics once the device and module ids
+        # are known
+        self.topic_parser = mqtt_topic_iothub.IncomingTopicParser()
+        # Completed MQTTPublishOperation objects which can be reused for telemetry
+        self._free_publish_ops = []
 
+    @handles_ops(pipeline_ops_iothub.SetIoTHubConnectionArgsOperation)
     @pipeline_thread.runs_on_pipeline_thread
-    def _execute_op(self, op):
-
-        if isinstance(op, pipeline_ops_iothub.SetIoTHubConnectionArgsOperation):
-            self.device_id = op.device_id
-            self.module_id = op.module_id
+    def _execute_set_connection_args_op(self, op):
+        self.device_id = op.device_id
+        self.module_id = op.module_id
 
-            # if we get auth provider args from above, we save some, use some to build topic names,
-            # and always pass it down because we know that the MQTT protocol stage will also want
-            # to receive these args.
-            self._set_topic_names(device_id=op.device_id, module_id=op.module_id)
+        # if we get auth provider args from above, we save some, use some to build topic names,
+        # and always pass it down because we know that the MQTT protocol stage will also want
+        # to receive these args.
+        self._set_topic_names(device_id=op.device_id, module_id=op.module_id)
 
-            if op.module_id:
-                client_id = "{}/{}".format(op.device_id, op.module_id)
-            else:
-                client_id = op.device_id
-
-            query_param_seq = [
-                ("api-version", pkg_constant.IOTHUB_API_VERSION),
-                ("DeviceClientType", pkg_constant.USER_AGENT),
-            ]
-            username = "{hostname}/{client_id}/?{query_params}".format(
-                hostname=op.hostname,
-                client_id=client_id,
-                query_params=urllib.parse.urlencode(query_param_seq),
-            )
+        if op.module_id:
+            client_id = "{}/{}".format(op.device_id, op.module_id)
+        else:
+            client_id = op.device_id
+
+        query_param_seq = [
+            ("api-version", pkg_constant.IOTHUB_API_VERSION),
+            ("DeviceClientType", pkg_constant.USER_AGENT),
+        ]
+        username = "{hostname}/{client_id}/?{query_params}".format(
+            hostname=op.hostname,
+            client_id=client_id,
+            query_params=urllib.parse.urlencode(query_param_seq),
+        )
 
-            if op.gateway_hostname:
-                hostname = op.gateway_hostname
-            else:
-                hostname = op.hostname
+        if op.gateway_hostname:
+            hostname = op.gateway_hostname
+        else:
+            hostname = op.hostname
 
-            # TODO: test to make sure client_cert and sas_token travel down correctly
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.SetMQTTConnectionArgsOperation(
-                    client_id=client_id,
-                    hostname=hostname,
-                    username=username,
-                    ca_cert=op.ca_cert,
-                    client_cert=op.client_cert,
-                    sas_token=op.sas_token,
-                    callback=op.callback,
-                ),
-                op=op,
-            )
+        # TODO: test to make sure client_cert and sas_token travel down correctly
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.SetMQTTConnectionArgsOperation(
+                client_id=client_id,
+                hostname=hostname,
+                username=username,
+                ca_cert=op.ca_cert,
+                client_cert=op.client_cert,
+                sas_token=op.sas_token,
+                callback=op.callback,
+            ),
+            op=op,
+        )
 
-        elif (
-            isinstance(op, pipeline_ops_base.UpdateSasTokenOperation)
-            and self.pipeline_root.connected
-        ):
-            logger.debug(
-                "{}({}): Connected.  Passing op down and reconnecting after token is updated.".format(
-                    self.name, op.name
-                )
-            )
+    @handles_ops(pipeline_ops_base.UpdateSasTokenOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_update_sas_token_op(self, op):
+        if not self.pipeline_root.connected:
+            self._send_op_down(op)
+            return
 
-            # make a callback that can call the user's callback after the reconnect is complete
-            def on_reconnect_complete(reconnect_op, error):
-                if error:
-                    logger.error(
-                        "{}({}) reconnection failed.  returning error {}".format(
-                            self.name, op.name, error
-                        )
-                    )
-                    self._send_completed_op_up(op, error=error)
-                else:
-                    logger.debug(
-                        "{}({}) reconnection succeeded.  returning success.".format(
-                            self.name, op.name
-                        )
-                    )
-                    self._send_completed_op_up(op)
-
-            # save the old user callback so we can call it later.
-            old_callback = op.callback
-
-            # make a callback that either fails the UpdateSasTokenOperation (if the lower level failed it),
-            # or issues a ReconnectOperation (if the lower level returned success for the UpdateSasTokenOperation)
-            def on_token_update_complete(op, error):
-                op.callback = old_callback
-                if error:
-                    logger.error(
-                        "{}({}) token update failed.  returning failure {}".format(
-                            self.name, op.name, error
-                        )
-                    )
-                    self._send_completed_op_up(op, error=error)
-                else:
-                    logger.debug(
-                        "{}({}) token update succeeded.  reconnecting".format(self.name, op.name)
-                    )
+        logger.debug(
+            "%s(%s): Connected.  Passing op down and reconnecting after token is updated.",
+            self.name,
+            op.name,
+        )
 
-                    self._send_op_down(
-                        pipeline_ops_base.ReconnectOperation(callback=on_reconnect_complete)
+        # make a callback that can call the user's callback after the reconnect is complete
+        def on_reconnect_complete(reconnect_op, error):
+            if error:
+                logger.error(
+                    "{}({}) reconnection failed.  returning error {}".format(
+                        self.name, op.name, error
                     )
-
+                )
+                self._send_completed_op_up(op, error=error)
+            else:
                 logger.debug(
-                    "{}({}): passing to next stage with updated callback.".format(
-                        self.name, op.name
+                    "%s(%s) reconnection succeeded.  returning success.", self.name, op.name
+                )
+                self._send_completed_op_up(op)
+
+        # save the old user callback so we can call it later.
+        old_callback = op.callback
+
+        # make a callback that either fails the UpdateSasTokenOperation (if the lower level failed it),
+        # or issues a ReconnectOperation (if the lower level returned success for the UpdateSasTokenOperation)
+        def on_token_update_complete(op, error):
+            op.callback = old_callback
+            if error:
+                logger.error(
+                    "{}({}) token update failed.  returning failure {}".format(
+                        self.name, op.name, error
                     )
                 )
+                self._send_completed_op_up(op, error=error)
+            else:
+                logger.debug("%s(%s) token update succeeded.  reconnecting", self.name, op.name)
 
-            # now, pass the UpdateSasTokenOperation down with our new callback.
-            op.callback = on_token_update_complete
-            self._send_op_down(op)
+                self._send_op_down(
+                    pipeline_ops_base.ReconnectOperation(callback=on_reconnect_complete)
+                )
 
-        elif isinstance(op, pipeline_ops_iothub.SendD2CMessageOperation) or isinstance(
-            op, pipeline_ops_iothub.SendOutputEventOperation
-        ):
-            # Convert SendTelementry and SendOutputEventOperation operations into MQTT Publish operations
-            topic = mqtt_topic_iothub.encode_properties(op.message, self.telemetry_topic)
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
-                    topic=topic, payload=op.message.data, callback=op.callback
-                ),
-                op=op,
-            )
+            logger.debug("%s(%s): passing to next stage with updated callback.", self.name, op.name)
 
-        elif isinstance(op, pipeline_ops_iothub.SendMethodResponseOperation):
-            # Sending a Method Response gets translated into an MQTT Publish operation
-            topic = mqtt_topic_iothub.get_method_topic_for_publish(
-                op.method_response.request_id, str(op.method_response.status)
-            )
-            payload = json.dumps(op.method_response.payload)
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
-                    topic=topic, payload=payload, callback=op.callback
-                ),
-                op=op,
-            )
+        # now, pass the UpdateSasTokenOperation down with our new callback.
+        op.callback = on_token_update_complete
+        self._send_op_down(op)
 
-        elif isinstance(op, pipeline_ops_base.EnableFeatureOperation):
-            # Enabling a feature gets translated into an MQTT subscribe operation
-            topic = self.feature_to_topic[op.feature_name]
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTSubscribeOperation(
-                    topic=topic, callback=op.callback
-                ),
-                op=op,
-            )
+    @handles_ops(
+        pipeline_ops_iothub.SendD2CMessageOperation,
+        pipeline_ops_iothub.SendOutputEventOperation,
+    )
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_message_op(self, op):
+        # Convert SendTelementry and SendOutputEventOperation operations into MQTT Publish operations
+        topic = mqtt_topic_iothub.encode_properties(op.message, self.telemetry_topic)
+        # A QoS set on the message overrides the QoS configured for the client
+        qos = op.message.qos
+        if qos is None:
+            qos = self.pipeline_root.pipeline_configuration.telemetry_qos
+        self._send_worker_op_down(
+            worker_op=self._get_publish_op(topic=topic, payload=op.message.data, qos=qos),
+            op=op,
+            release_worker_op=self._release_publish_op,
+        )
 
-        elif isinstance(op, pipeline_ops_base.DisableFeatureOperation):
-            # Disabling a feature gets turned into an MQTT unsubscribe operation
-            topic = self.feature_to_topic[op.feature_name]
+    @pipeline_thread.runs_on_pipeline_thread
+    def _get_publish_op(self, topic, payload, qos):
+        """
+        Return an MQTTPublishOperation for telemetry, reusing a completed one if there is one.
+        """
+        if self._free_publish_ops:
+            worker_op = self._free_publish_ops.pop()
+            worker_op.reset(topic=topic, payload=payload, qos=qos)
+            return worker_op
+        return pipeline_ops_mqtt.MQTTPublishOperation(
+            topic=topic, payload=payload, callback=None, qos=qos
+        )
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _release_publish_op(self, worker_op):
+        """
+        Keep a completed telemetry MQTTPublishOperation for reuse by _get_publish_op.
+        """
+        if len(self._free_publish_ops) < MAX_FREE_PUBLISH_OPS:
+            worker_op.payload = None
+            worker_op.callback = None
+            self._free_publish_ops.append(worker_op)
+
+    @handles_ops(pipeline_ops_iothub.SendMethodResponseOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_method_response_op(self, op):
+        # Sending a Method Response gets translated into an MQTT Publish operation
+        topic = mqtt_topic_iothub.get_method_topic_for_publish(
+            op.method_response.request_id, str(op.method_response.status)
+        )
+        payload = json.dumps(op.method_response.payload)
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
+                topic=topic, payload=payload, callback=op.callback
+            ),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_base.EnableFeatureOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_enable_feature_op(self, op):
+        # Enabling a feature gets translated into an MQTT subscribe operation
+        topic = self.feature_to_topic[op.feature_name]
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTSubscribeOperation(topic=topic, callback=op.callback),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_base.EnableFeaturesOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_enable_features_op(self, op):
+        # Enabling several features gets translated into a single MQTT subscribe operation
+        # for all of their topics
+        topics = [self.feature_to_topic[feature_name] for feature_name in op.feature_names]
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTSubscribeOperation(topic=topics, callback=op.callback),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_base.DisableFeatureOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_disable_feature_op(self, op):
+        # Disabling a feature gets turned into an MQTT unsubscribe operation
+        topic = self.feature_to_topic[op.feature_name]
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTUnsubscribeOperation(topic=topic, callback=op.callback),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_base.SendIotRequestOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_iot_request_op(self, op):
+        if op.request_type == pipeline_constant.TWIN:
+            topic = mqtt_topic_iothub.get_twin_topic_for_publish(
+                method=op.method,
+                resource_location=op.resource_location,
+                request_id=op.request_id,
+            )
             self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTUnsubscribeOperation(
-                    topic=topic, callback=op.callback
+                worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
+                    topic=topic, payload=op.request_body, callback=op.callback
                 ),
                 op=op,
             )
-
-        elif isinstance(op, pipeline_ops_base.SendIotRequestOperation):
-            if op.request_type == pipeline_constant.TWIN:
-                topic = mqtt_topic_iothub.get_twin_topic_for_publish(
-                    method=op.method,
-                    resource_location=op.resource_location,
-                    request_id=op.request_id,
-                )
-                self._send_worker_op_down(
-                    worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
-                        topic=topic, payload=op.request_body, callback=op.callback
-                    ),
-                    op=op,
-                )
-            else:
-                raise pipeline_exceptions.OperationError(
-                    "SendIotRequestOperation request_type {} not supported".format(op.request_type)
-                )
-
         else:
-            # All other operations get passed down
-            self._send_op_down(op)
+            raise pipeline_exceptions.OperationError(
+                "SendIotRequestOperation request_type {} not supported".format(op.request_type)
+            )
 
     @pipeline_thread.runs_on_pipeline_thread
     def _set_topic_names(self, device_id, module_id):
@@ -215,6 +259,7 @@ class IoTHubMQTTConverterStage(PipelineStage):
         self.telemetry_topic = mqtt_topic_iothub.get_telemetry_topic_for_publish(
             device_id, module_id
         )
+        self.topic_parser = mqtt_topic_iothub.IncomingTopicParser(device_id, module_id)
         self.feature_to_topic = {
             pipeline_constant.C2D_MSG: (
                 mqtt_topic_iothub.get_c2d_topic_for_subscribe(device_id, module_id)
@@ -229,56 +274,56 @@ class IoTHubMQTTConverterStage(PipelineStage):
             ),
         }
 
+    @handles_events(pipeline_events_mqtt.IncomingMQTTMessageEvent)
     @pipeline_thread.runs_on_pipeline_thread
-    def _handle_pipeline_event(self, event):
+    def _handle_incoming_mqtt_message_event(self, event):
         """
-        Pipeline Event handler function to convert incoming MQTT messages into the appropriate IoTHub
-        events, based on the topic of the message
+        Convert incoming MQTT messages into the appropriate IoTHub events, based on the topic of
+        the message
         """
-        if isinstance(event, pipeline_events_mqtt.IncomingMQTTMessageEvent):
-            topic = event.topic
-
-            if mqtt_topic_iothub.is_c2d_topic(topic, self.device_id):
-                message = Message(event.payload)
-                mqtt_topic_iothub.extract_properties_from_topic(topic, message)
+        topic = event.topic
+        parsed_topic = self.topic_parser.parse(topic)
+        kind = parsed_topic.kind if parsed_topic else None
+
+        if kind == pipeline_constant.C2D_MSG or kind == pipeline_constant.INPUT_MSG:
+            message = Message(event.payload)
+            mqtt_topic_iothub.set_message_properties(
+                message,
+                parsed_topic.properties,
+                decompress=self.pipeline_root.pipeline_configuration.compression_threshold
+                is not None,
+            )
+            if kind == pipeline_constant.C2D_MSG:
                 self._send_event_up(pipeline_events_iothub.C2DMessageEvent(message))
-
-            elif mqtt_topic_iothub.is_input_topic(topic, self.device_id, self.module_id):
-                message = Message(event.payload)
-                mqtt_topic_iothub.extract_properties_from_topic(topic, message)
-                input_name = mqtt_topic_iothub.get_input_name_from_topic(topic)
-                self._send_event_up(pipeline_events_iothub.InputMessageEvent(input_name, message))
-
-            elif mqtt_topic_iothub.is_method_topic(topic):
-                request_id = mqtt_topic_iothub.get_method_request_id_from_topic(topic)
-                method_name = mqtt_topic_iothub.get_method_name_from_topic(topic)
-                method_received = MethodRequest(
-                    request_id=request_id,
-                    name=method_name,
-                    payload=json.loads(event.payload.decode("utf-8")),
-                )
-                self._send_event_up(pipeline_events_iothub.MethodRequestEvent(method_received))
-
-            elif mqtt_topic_iothub.is_twin_response_topic(topic):
-                request_id = mqtt_topic_iothub.get_twin_request_id_from_topic(topic)
-                status_code = int(mqtt_topic_iothub.get_twin_status_code_from_topic(topic))
+            else:
                 self._send_event_up(
-                    pipeline_events_base.IotResponseEvent(
-                        request_id=request_id, status_code=status_code, response_body=event.payload
-                    )
+                    pipeline_events_iothub.InputMessageEvent(parsed_topic.name, message)
                 )
 
-            elif mqtt_topic_iothub.is_twin_desired_property_patch_topic(topic):
-                self._send_event_up(
-                    pipeline_events_iothub.TwinDesiredPropertiesPatchEvent(
-                        patch=json.loads(event.payload.decode("utf-8"))
-                    )
+        elif kind == pipeline_constant.METHODS:
+            method_received = MethodRequest(
+                request_id=parsed_topic.request_id,
+                name=parsed_topic.name,
+                payload=json.loads(event.payload.decode("utf-8")),
+            )
+            self._send_event_up(pipeline_events_iothub.MethodRequestEvent(method_received))
+
+        elif kind == pipeline_constant.TWIN:
+            self._send_event_up(
+                pipeline_events_base.IotResponseEvent(
+                    request_id=parsed_topic.request_id,
+                    status_code=int(parsed_topic.status_code),
+                    response_body=event.payload,
                 )
+            )
 
-            else:
-                logger.debug("Uunknown topic: {} passing up to next handler".format(topic))
-                self._send_event_up(event)
+        elif kind == pipeline_constant.TWIN_PATCHES:
+            self._send_event_up(
+                pipeline_events_iothub.TwinDesiredPropertiesPatchEvent(
+                    patch=json.loads(event.payload.decode("utf-8"))
+                )
+            )
 
         else:
-            # all other messages get passed up
+            logger.debug("Uunknown topic: %s passing up to next handler", topic)
             self._send_event_up(event)
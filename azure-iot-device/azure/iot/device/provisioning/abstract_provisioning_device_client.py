@@ -59,6 +59,9 @@ class AbstractProvisioningDeviceClient(object):
             Users can provide their own symmetric keys for enrollments by disabling this option
             within 16 bytes and 64 bytes and in valid Base64 format.
         :param bool websockets: The switch for enabling MQTT over websockets. Defaults to false (no websockets).
+        :param network_loop: Optional shared network loop used to service the connection instead
+            of a dedicated network thread. Useful when hosting many clients in one process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
         :returns: A ProvisioningDeviceClient instance which can register via Symmetric Key.
         """
         security_client = SymmetricKeySecurityClient(
@@ -90,6 +93,9 @@ class AbstractProvisioningDeviceClient(object):
             If the cert comes from a CER file, it needs to be base64 encoded.
         :type x509: :class:`azure.iot.device.X509`
         :param bool websockets: The switch for enabling MQTT over websockets. Defaults to false (no websockets).
+        :param network_loop: Optional shared network loop used to service the connection instead
+            of a dedicated network thread. Useful when hosting many clients in one process.
+        :type network_loop: :class:`azure.iot.device.MQTTNetworkLoop`
         :returns: A ProvisioningDeviceClient which can register via Symmetric Key.
         """
         security_client = X509SecurityClient(provisioning_host, registration_id, id_scope, x509)
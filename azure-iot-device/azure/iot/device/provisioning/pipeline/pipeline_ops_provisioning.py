@@ -16,6 +16,8 @@ class SetSymmetricKeySecurityClientOperation(PipelineOperation):
     very provisioning-specific
     """
 
+    __slots__ = ("security_client",)
+
     def __init__(self, security_client, callback):
         """
         Initializer for SetSecurityClient.
@@ -41,6 +43,8 @@ class SetX509SecurityClientOperation(PipelineOperation):
     (such as a Provisioning client).
     """
 
+    __slots__ = ("security_client",)
+
     def __init__(self, security_client, callback):
         """
         Initializer for SetSecurityClient.
@@ -66,6 +70,8 @@ class SetProvisioningClientConnectionArgsOperation(PipelineOperation):
     (such as a Provisioning client).
     """
 
+    __slots__ = ("provisioning_host", "registration_id", "id_scope", "client_cert", "sas_token")
+
     def __init__(
         self,
         provisioning_host,
@@ -99,6 +105,8 @@ class SendRegistrationRequestOperation(PipelineOperation):
     This operation is in the group of DPS operations because it is very specific to the DPS client.
     """
 
+    __slots__ = ("request_id", "request_payload", "registration_id")
+
     def __init__(self, request_id, request_payload, registration_id, callback=None):
         """
         Initializer for SendRegistrationRequestOperation objects.
@@ -124,6 +132,8 @@ class SendQueryRequestOperation(PipelineOperation):
     This operation is in the group of DPS operations because it is very specific to the DPS client.
     """
 
+    __slots__ = ("request_id", "operation_id", "request_payload")
+
     def __init__(self, request_id, operation_id, request_payload, callback):
         """
         Initializer for SendRegistrationRequestOperation objects.
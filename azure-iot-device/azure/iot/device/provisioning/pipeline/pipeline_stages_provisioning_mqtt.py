@@ -11,6 +11,8 @@ from azure.iot.device.common.pipeline import (
     pipeline_ops_mqtt,
     pipeline_events_mqtt,
     pipeline_thread,
+    handles_ops,
+    handles_events,
 )
 from azure.iot.device.common.pipeline.pipeline_stages_base import PipelineStage
 from azure.iot.device.provisioning.pipeline import mqtt_topic
@@ -34,124 +36,119 @@ class ProvisioningMQTTConverterStage(PipelineStage):
         super(ProvisioningMQTTConverterStage, self).__init__()
         self.action_to_topic = {}
 
+    @handles_ops(pipeline_ops_provisioning.SetProvisioningClientConnectionArgsOperation)
     @pipeline_thread.runs_on_pipeline_thread
-    def _execute_op(self, op):
-
-        if isinstance(op, pipeline_ops_provisioning.SetProvisioningClientConnectionArgsOperation):
-            # get security client args from above, save some, use some to build topic names,
-            # always pass it down because MQTT protocol stage will also want to receive these args.
-
-            client_id = op.registration_id
-            query_param_seq = [
-                ("api-version", pkg_constant.PROVISIONING_API_VERSION),
-                ("ClientVersion", pkg_constant.USER_AGENT),
-            ]
-            username = "{id_scope}/registrations/{registration_id}/{query_params}".format(
-                id_scope=op.id_scope,
-                registration_id=op.registration_id,
-                query_params=urllib.parse.urlencode(query_param_seq),
-            )
-
-            hostname = op.provisioning_host
-
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.SetMQTTConnectionArgsOperation(
-                    client_id=client_id,
-                    hostname=hostname,
-                    username=username,
-                    client_cert=op.client_cert,
-                    sas_token=op.sas_token,
-                    callback=op.callback,
-                ),
-                op=op,
-            )
-
-        elif isinstance(op, pipeline_ops_provisioning.SendRegistrationRequestOperation):
-            # Convert Sending the request into MQTT Publish operations
-            topic = mqtt_topic.get_topic_for_register(op.request_id)
-
-            # This is an easier way to get the json eventually
-            # rather than formatting strings without if else conditions
-            registration_payload = DeviceRegistrationPayload(
-                registration_id=op.registration_id, custom_payload=op.request_payload
-            )
-
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
-                    topic=topic,
-                    payload=registration_payload.get_json_string(),
-                    callback=op.callback,
-                ),
-                op=op,
-            )
-
-        elif isinstance(op, pipeline_ops_provisioning.SendQueryRequestOperation):
-            # Convert Sending the request into MQTT Publish operations
-            topic = mqtt_topic.get_topic_for_query(op.request_id, op.operation_id)
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
-                    topic=topic, payload=op.request_payload, callback=op.callback
-                ),
-                op=op,
-            )
-
-        elif isinstance(op, pipeline_ops_base.EnableFeatureOperation):
-            # Enabling for register gets translated into an MQTT subscribe operation
-            topic = mqtt_topic.get_topic_for_subscribe()
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTSubscribeOperation(
-                    topic=topic, callback=op.callback
-                ),
-                op=op,
-            )
-
-        elif isinstance(op, pipeline_ops_base.DisableFeatureOperation):
-            # Disabling a register response gets turned into an MQTT unsubscribe operation
-            topic = mqtt_topic.get_topic_for_subscribe()
-            self._send_worker_op_down(
-                worker_op=pipeline_ops_mqtt.MQTTUnsubscribeOperation(
-                    topic=topic, callback=op.callback
-                ),
-                op=op,
-            )
-
-        else:
-            # All other operations get passed down
-            self._send_op_down(op)
-
+    def _execute_set_connection_args_op(self, op):
+        # get security client args from above, save some, use some to build topic names,
+        # always pass it down because MQTT protocol stage will also want to receive these args.
+
+        client_id = op.registration_id
+        query_param_seq = [
+            ("api-version", pkg_constant.PROVISIONING_API_VERSION),
+            ("ClientVersion", pkg_constant.USER_AGENT),
+        ]
+        username = "{id_scope}/registrations/{registration_id}/{query_params}".format(
+            id_scope=op.id_scope,
+            registration_id=op.registration_id,
+            query_params=urllib.parse.urlencode(query_param_seq),
+        )
+
+        hostname = op.provisioning_host
+
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.SetMQTTConnectionArgsOperation(
+                client_id=client_id,
+                hostname=hostname,
+                username=username,
+                client_cert=op.client_cert,
+                sas_token=op.sas_token,
+                callback=op.callback,
+            ),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_provisioning.SendRegistrationRequestOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_registration_request_op(self, op):
+        # Convert Sending the request into MQTT Publish operations
+        topic = mqtt_topic.get_topic_for_register(op.request_id)
+
+        # This is an easier way to get the json eventually
+        # rather than formatting strings without if else conditions
+        registration_payload = DeviceRegistrationPayload(
+            registration_id=op.registration_id, custom_payload=op.request_payload
+        )
+
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
+                topic=topic,
+                payload=registration_payload.get_json_string(),
+                callback=op.callback,
+            ),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_provisioning.SendQueryRequestOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_send_query_request_op(self, op):
+        # Convert Sending the request into MQTT Publish operations
+        topic = mqtt_topic.get_topic_for_query(op.request_id, op.operation_id)
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTPublishOperation(
+                topic=topic, payload=op.request_payload, callback=op.callback
+            ),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_base.EnableFeatureOperation)
     @pipeline_thread.runs_on_pipeline_thread
-    def _handle_pipeline_event(self, event):
+    def _execute_enable_feature_op(self, op):
+        # Enabling for register gets translated into an MQTT subscribe operation
+        topic = mqtt_topic.get_topic_for_subscribe()
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTSubscribeOperation(topic=topic, callback=op.callback),
+            op=op,
+        )
+
+    @handles_ops(pipeline_ops_base.DisableFeatureOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_disable_feature_op(self, op):
+        # Disabling a register response gets turned into an MQTT unsubscribe operation
+        topic = mqtt_topic.get_topic_for_subscribe()
+        self._send_worker_op_down(
+            worker_op=pipeline_ops_mqtt.MQTTUnsubscribeOperation(topic=topic, callback=op.callback),
+            op=op,
+        )
+
+    @handles_events(pipeline_events_mqtt.IncomingMQTTMessageEvent)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _handle_incoming_mqtt_message_event(self, event):
         """
-        Pipeline Event handler function to convert incoming MQTT messages into the appropriate DPS
-        events, based on the topic of the message
+        Convert incoming MQTT messages into the appropriate DPS events, based on the topic of the
+        message
         """
-        if isinstance(event, pipeline_events_mqtt.IncomingMQTTMessageEvent):
-            topic = event.topic
-
-            if mqtt_topic.is_dps_response_topic(topic):
-                logger.info(
-                    "Received payload:{payload} on topic:{topic}".format(
-                        payload=event.payload, topic=topic
-                    )
+        topic = event.topic
+
+        if mqtt_topic.is_dps_response_topic(topic):
+            logger.info(
+                "Received payload:{payload} on topic:{topic}".format(
+                    payload=event.payload, topic=topic
                 )
-                key_values = mqtt_topic.extract_properties_from_topic(topic)
-                status_code = mqtt_topic.extract_status_code_from_topic(topic)
-                request_id = key_values["rid"][0]
-                if event.payload is not None:
-                    response = event.payload.decode("utf-8")
-                # Extract pertinent information from mqtt topic
-                # like status code request_id and send it upwards.
-                self._send_event_up(
-                    pipeline_events_provisioning.RegistrationResponseEvent(
-                        request_id, status_code, key_values, response
-                    )
+            )
+            key_values = mqtt_topic.extract_properties_from_topic(topic)
+            status_code = mqtt_topic.extract_status_code_from_topic(topic)
+            request_id = key_values["rid"][0]
+            if event.payload is not None:
+                response = event.payload.decode("utf-8")
+            # Extract pertinent information from mqtt topic
+            # like status code request_id and send it upwards.
+            self._send_event_up(
+                pipeline_events_provisioning.RegistrationResponseEvent(
+                    request_id, status_code, key_values, response
                 )
-            else:
-                logger.warning("Unknown topic: {} passing up to next handler".format(topic))
-                self._send_event_up(event)
-
+            )
         else:
-            # all other messages get passed up
+            logger.warning("Unknown topic: {} passing up to next handler".format(topic))
             self._send_event_up(event)
 
 
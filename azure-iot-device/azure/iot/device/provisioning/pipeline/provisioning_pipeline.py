@@ -9,6 +9,7 @@ from azure.iot.device.common.evented_callback import EventedCallback
 from azure.iot.device.common.pipeline import pipeline_stages_base
 from azure.iot.device.common.pipeline import pipeline_ops_base
 from azure.iot.device.common.pipeline import pipeline_stages_mqtt
+from azure.iot.device.common.pipeline import pipeline_thread
 from azure.iot.device.provisioning.pipeline import (
     pipeline_stages_provisioning,
     pipeline_stages_provisioning_mqtt,
@@ -37,6 +38,8 @@ class ProvisioningPipeline(object):
             .append_stage(pipeline_stages_provisioning.UseSecurityClientStage())
             .append_stage(pipeline_stages_provisioning_mqtt.ProvisioningMQTTConverterStage())
             .append_stage(pipeline_stages_base.EnsureConnectionStage())
+            # Below EnsureConnectionStage, so that it sees the connect ops made for pending ops
+            .append_stage(pipeline_stages_base.ReconnectStage())
             .append_stage(pipeline_stages_base.SerializeConnectOpsStage())
             .append_stage(pipeline_stages_mqtt.MQTTTransportStage())
         )
@@ -68,6 +71,15 @@ class ProvisioningPipeline(object):
         self._pipeline.on_connected_handler = _on_connected
         self._pipeline.on_disconnected_handler = _on_disconnected
 
+        self._pipeline.executors = pipeline_thread.get_pipeline_executors(
+            self._registration_id, shards=pipeline_configuration.executor_shards
+        )
+        self._pipeline.set_tracer(pipeline_configuration.tracer)
+        self._pipeline.handler_executor = pipeline_configuration.handler_executor
+        self._pipeline.on_connection_state_changed_handler = (
+            pipeline_configuration.connection_state_handler
+        )
+
         callback = EventedCallback()
 
         if isinstance(security_client, X509SecurityClient):
@@ -6,6 +6,7 @@
 
 import pytest
 import sys
+import azure.iot.device.common.mqtt_transport as mqtt_transport
 
 collect_ignore = []
 
@@ -13,8 +14,23 @@ collect_ignore = []
 if sys.version_info < (3, 5):
     collect_ignore.append("test_async_adapter.py")
     collect_ignore.append("test_asyncio_compat.py")
+    collect_ignore.append("test_async_mqtt_transport.py")
 
 
 @pytest.fixture
 def fake_return_arg_value():
     return "__fake_return_arg_value__"
+
+
+@pytest.fixture
+def mqtt_broker(monkeypatch):
+    """
+    A local TLS MQTT broker stand-in, which MQTTTransport objects will connect to
+    (given a hostname of "localhost")
+    """
+    from tests.common.fake_mqtt_broker import FakeMQTTBroker
+
+    broker = FakeMQTTBroker().start()
+    monkeypatch.setattr(mqtt_transport, "DEFAULT_PORT", broker.port)
+    yield broker
+    broker.stop()
@@ -0,0 +1,463 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""A minimal MQTT 3.1.1 broker stand-in, used by tests and benchmarks.
+
+The broker runs on a single thread using the selectors module, so it can hold thousands of
+connections without adding threads to the process under test.  It can also be run as a
+separate process:
+
+    python -m tests.common.fake_mqtt_broker --port 8883
+
+It implements just enough of the protocol for the SDK: CONNECT, PUBLISH (QoS 0 and 1),
+SUBSCRIBE, UNSUBSCRIBE, PINGREQ and DISCONNECT.  Messages published by a client are routed to
+every connection with a matching subscription, and messages can be injected with publish().
+"""
+
+import argparse
+import collections
+import heapq
+import logging
+import os
+import selectors
+import socket
+import ssl
+import struct
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CERT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "certs")
+CERT_FILE = os.path.join(CERT_DIR, "localhost.crt")
+KEY_FILE = os.path.join(CERT_DIR, "localhost.key")
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA0
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+def get_ca_cert():
+    """
+    Return the PEM certificate the broker uses for TLS, suitable for use as a client ca_cert.
+    """
+    with open(CERT_FILE) as f:
+        return f.read()
+
+
+def topic_matches(topic_filter, topic):
+    """
+    Return True if the topic matches the MQTT topic filter (including + and # wildcards)
+    """
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+def encode_packet(packet_type, body):
+    """
+    Encode an MQTT packet from the first header byte and the variable header + payload.
+    """
+    header = bytearray([packet_type])
+    length = len(body)
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        header.append(byte)
+        if not length:
+            break
+    return bytes(header) + bytes(body)
+
+
+def _encode_string(s):
+    data = s.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def encode_publish(topic, payload, qos=0, mid=0):
+    if not isinstance(payload, bytes):
+        payload = payload.encode("utf-8")
+    body = _encode_string(topic)
+    if qos:
+        body += struct.pack("!H", mid)
+    return encode_packet(PUBLISH | (qos << 1), body + payload)
+
+
+class _Connection(object):
+    def __init__(self, sock, tls):
+        self.sock = sock
+        self.handshaking = tls
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.client_id = None
+        self.subscriptions = []
+        self.next_mid = 1
+        self.writing = False
+        self.closed = False
+
+
+class FakeMQTTBroker(object):
+    """
+    MQTT broker stand-in.
+
+    :ivar connect_count: Number of CONNECT packets received.
+    :ivar tls_sessions_reused: Number of TLS handshakes that resumed a previous session.
+    :ivar publish_count: Number of PUBLISH packets received from clients.
+    :ivar received: The most recent (topic, payload, qos) tuples received from clients.
+    :ivar ack_publishes: If False, PUBLISH packets from clients are not acknowledged.
+    :ivar ack_subscribes: If False, SUBSCRIBE packets from clients are not acknowledged.
+    :ivar ack_delay: Number of seconds to wait before sending any acknowledgement, to simulate
+      network latency.
+    :ivar connack_rc: Return code to send in CONNACK packets.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, tls=True, ack_delay=0.0, max_received=1000):
+        self.host = host
+        self.tls = tls
+        self.ack_delay = ack_delay
+        self.ack_publishes = True
+        self.ack_subscribes = True
+        self.connack_rc = 0
+
+        self.connect_count = 0
+        self.tls_sessions_reused = 0
+        self.publish_count = 0
+        self.subscribe_packet_count = 0
+        self.received = collections.deque(maxlen=max_received)
+
+        self._ssl_context = None
+        if tls:
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self._ssl_context.load_cert_chain(CERT_FILE, KEY_FILE)
+
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(1024)
+        self._listener.setblocking(False)
+        self.port = self._listener.getsockname()[1]
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ, "listener")
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ, "wakeup")
+
+        self._connections = set()
+        self._commands = collections.deque()
+        self._delayed = []
+        self._delayed_seq = 0
+        self._running = False
+        self._thread = None
+
+    @property
+    def connection_count(self):
+        return len(self._connections)
+
+    def start(self):
+        """
+        Start serving on a background thread.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name="fake-mqtt-broker")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._running = True
+        self._serve()
+
+    def stop(self):
+        self._post(("stop",))
+        if self._thread:
+            self._thread.join()
+
+    def publish(self, topic, payload, qos=0):
+        """
+        Send a message to every connection subscribed to a matching topic.  Thread-safe.
+        """
+        self._post(("publish", topic, payload, qos))
+
+    def disconnect_all(self):
+        """
+        Drop every client connection without sending anything.  Thread-safe.
+        """
+        self._post(("disconnect_all",))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _post(self, command):
+        self._commands.append(command)
+        try:
+            self._wakeup_send.send(b"\x00")
+        except OSError:
+            pass
+
+    def _serve(self):
+        while self._running:
+            timeout = None
+            if self._delayed:
+                timeout = max(0.0, self._delayed[0][0] - time.time())
+            for key, mask in self._selector.select(timeout):
+                if key.data == "listener":
+                    self._accept()
+                elif key.data == "wakeup":
+                    try:
+                        self._wakeup_recv.recv(4096)
+                    except OSError:
+                        pass
+                    self._process_commands()
+                else:
+                    conn = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._on_readable(conn)
+                    if mask & selectors.EVENT_WRITE and not conn.closed:
+                        self._flush(conn)
+            now = time.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, conn, data = heapq.heappop(self._delayed)
+                self._send(conn, data)
+        for conn in list(self._connections):
+            self._close(conn)
+        self._selector.close()
+        self._listener.close()
+
+    def _process_commands(self):
+        while self._commands:
+            command = self._commands.popleft()
+            if command[0] == "stop":
+                self._running = False
+            elif command[0] == "publish":
+                _, topic, payload, qos = command
+                for conn in list(self._connections):
+                    if any(topic_matches(f, topic) for f in conn.subscriptions):
+                        mid = conn.next_mid
+                        conn.next_mid = conn.next_mid % 65535 + 1
+                        self._send(conn, encode_publish(topic, payload, qos, mid))
+            elif command[0] == "disconnect_all":
+                for conn in list(self._connections):
+                    self._close(conn)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self._ssl_context:
+                sock = self._ssl_context.wrap_socket(
+                    sock, server_side=True, do_handshake_on_connect=False
+                )
+            sock.setblocking(False)
+            conn = _Connection(sock, tls=bool(self._ssl_context))
+            self._connections.add(conn)
+            self._selector.register(sock, selectors.EVENT_READ, conn)
+
+    def _on_readable(self, conn):
+        if conn.handshaking:
+            try:
+                conn.sock.do_handshake()
+            except ssl.SSLWantReadError:
+                return
+            except ssl.SSLWantWriteError:
+                self._set_writing(conn, True)
+                return
+            except (ssl.SSLError, OSError):
+                self._close(conn)
+                return
+            conn.handshaking = False
+            if conn.sock.session_reused:
+                self.tls_sessions_reused += 1
+        while True:
+            try:
+                data = conn.sock.recv(65536)
+            except (ssl.SSLWantReadError, BlockingIOError):
+                break
+            except ssl.SSLWantWriteError:
+                self._set_writing(conn, True)
+                break
+            except OSError:
+                self._close(conn)
+                return
+            if not data:
+                self._close(conn)
+                return
+            conn.inbuf += data
+            if not (self._ssl_context and conn.sock.pending()):
+                break
+        self._process_packets(conn)
+
+    def _process_packets(self, conn):
+        buf = conn.inbuf
+        while not conn.closed:
+            # Decode the fixed header
+            if len(buf) < 2:
+                return
+            length = 0
+            multiplier = 1
+            pos = 1
+            while True:
+                if pos >= len(buf):
+                    return
+                byte = buf[pos]
+                length += (byte & 0x7F) * multiplier
+                multiplier *= 128
+                pos += 1
+                if not byte & 0x80:
+                    break
+            if len(buf) < pos + length:
+                return
+            packet_type = buf[0]
+            body = bytes(buf[pos : pos + length])
+            del buf[: pos + length]
+            self._handle_packet(conn, packet_type, body)
+
+    def _handle_packet(self, conn, packet_type, body):
+        command = packet_type & 0xF0
+        if command == CONNECT:
+            self.connect_count += 1
+            (proto_len,) = struct.unpack("!H", body[:2])
+            pos = 2 + proto_len + 4
+            (id_len,) = struct.unpack("!H", body[pos : pos + 2])
+            conn.client_id = body[pos + 2 : pos + 2 + id_len].decode("utf-8")
+            self._send(conn, encode_packet(CONNACK, bytes([0, self.connack_rc])), delay=True)
+        elif command == PUBLISH:
+            qos = (packet_type >> 1) & 0x03
+            (topic_len,) = struct.unpack("!H", body[:2])
+            topic = body[2 : 2 + topic_len].decode("utf-8")
+            pos = 2 + topic_len
+            mid = None
+            if qos:
+                (mid,) = struct.unpack("!H", body[pos : pos + 2])
+                pos += 2
+            payload = body[pos:]
+            self.publish_count += 1
+            self.received.append((topic, payload, qos))
+            if qos and self.ack_publishes:
+                self._send(conn, encode_packet(PUBACK, struct.pack("!H", mid)), delay=True)
+            for other in list(self._connections):
+                if other is not conn and any(topic_matches(f, topic) for f in other.subscriptions):
+                    self._send(other, encode_publish(topic, payload, 0))
+        elif command == SUBSCRIBE:
+            self.subscribe_packet_count += 1
+            (mid,) = struct.unpack("!H", body[:2])
+            pos = 2
+            granted = bytearray()
+            while pos < len(body):
+                (topic_len,) = struct.unpack("!H", body[pos : pos + 2])
+                topic = body[pos + 2 : pos + 2 + topic_len].decode("utf-8")
+                qos = body[pos + 2 + topic_len]
+                pos += 3 + topic_len
+                conn.subscriptions.append(topic)
+                granted.append(min(qos, 1))
+            if self.ack_subscribes:
+                self._send(
+                    conn, encode_packet(SUBACK, struct.pack("!H", mid) + bytes(granted)), delay=True
+                )
+        elif command == UNSUBSCRIBE:
+            (mid,) = struct.unpack("!H", body[:2])
+            pos = 2
+            while pos < len(body):
+                (topic_len,) = struct.unpack("!H", body[pos : pos + 2])
+                topic = body[pos + 2 : pos + 2 + topic_len].decode("utf-8")
+                pos += 2 + topic_len
+                if topic in conn.subscriptions:
+                    conn.subscriptions.remove(topic)
+            self._send(conn, encode_packet(UNSUBACK, struct.pack("!H", mid)), delay=True)
+        elif command == PINGREQ:
+            self._send(conn, encode_packet(PINGRESP, b""))
+        elif command == DISCONNECT:
+            self._close(conn)
+
+    def _send(self, conn, data, delay=False):
+        if conn.closed:
+            return
+        if delay and self.ack_delay:
+            self._delayed_seq += 1
+            heapq.heappush(
+                self._delayed, (time.time() + self.ack_delay, self._delayed_seq, conn, data)
+            )
+            return
+        conn.outbuf += data
+        self._flush(conn)
+
+    def _flush(self, conn):
+        if conn.handshaking:
+            self._on_readable(conn)
+            return
+        while conn.outbuf:
+            try:
+                sent = conn.sock.send(conn.outbuf)
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError, BlockingIOError):
+                break
+            except OSError:
+                self._close(conn)
+                return
+            del conn.outbuf[:sent]
+        self._set_writing(conn, bool(conn.outbuf))
+
+    def _set_writing(self, conn, writing):
+        if conn.writing != writing and not conn.closed:
+            conn.writing = writing
+            events = selectors.EVENT_READ
+            if writing:
+                events |= selectors.EVENT_WRITE
+            self._selector.modify(conn.sock, events, conn)
+
+    def _close(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        self._connections.discard(conn)
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a minimal MQTT broker stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--no-tls", action="store_true", help="serve plain TCP instead of TLS")
+    parser.add_argument("--ack-delay", type=float, default=0.0, help="seconds to delay acks")
+    args = parser.parse_args(argv)
+
+    broker = FakeMQTTBroker(
+        host=args.host, port=args.port, tls=not args.no_tls, ack_delay=args.ack_delay
+    )
+    # The parent process reads the port from the first line of output
+    print("PORT {}".format(broker.port))
+    sys.stdout.flush()
+    broker.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,7 @@ all_common_ops = [
     pipeline_ops_base.ReconnectOperation,
     pipeline_ops_base.DisconnectOperation,
     pipeline_ops_base.EnableFeatureOperation,
+    pipeline_ops_base.EnableFeaturesOperation,
     pipeline_ops_base.DisableFeatureOperation,
     pipeline_ops_base.UpdateSasTokenOperation,
     pipeline_ops_base.SendIotRequestAndWaitForResponseOperation,
@@ -156,7 +157,8 @@ def get_arg_count(fn):
 
 def make_mock_op_or_event(cls):
     args = [None for i in (range(get_arg_count(cls.__init__) - 1))]
-    return cls(*args)
+    # Ops and events use __slots__.  Use a derived class so tests can add attributes to them.
+    return type(cls.__name__, (cls,), {})(*args)
 
 
 def add_mock_method_waiter(obj, method_name):
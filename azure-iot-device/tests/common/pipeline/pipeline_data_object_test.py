@@ -43,6 +43,7 @@ def add_operation_test(
         extra_defaults=all_extra_defaults,
         positional_arguments=positional_arguments,
         keyword_arguments=keyword_arguments,
+        slots=True,
     )
 
 
@@ -62,11 +63,18 @@ def add_event_test(cls, module, extra_defaults={}, positional_arguments=[], keyw
         extra_defaults=all_extra_defaults,
         positional_arguments=positional_arguments,
         keyword_arguments=keyword_arguments,
+        slots=True,
     )
 
 
 def add_instantiation_test(
-    cls, module, defaults, extra_defaults={}, positional_arguments=[], keyword_arguments={}
+    cls,
+    module,
+    defaults,
+    extra_defaults={},
+    positional_arguments=[],
+    keyword_arguments={},
+    slots=False,
 ):
     """
     internal function that takes the class and attribute details and adds a test class which
@@ -135,6 +143,13 @@ def add_instantiation_test(
                 else:
                     assert getattr(instance, key) == all_defaults[key]
 
+        if slots:
+
+            @pytest.mark.it("Uses __slots__ instead of a per-instance __dict__")
+            def test_slots(self):
+                instance = cls(*args)
+                assert not hasattr(instance, "__dict__")
+
     # Adding this object to the namespace of the module that was passed in (using a name that starts with "Test")
     # will cause pytest to pick it up.
     setattr(module, "Test{}Instantiation".format(cls.__name__), LocalTestObject)
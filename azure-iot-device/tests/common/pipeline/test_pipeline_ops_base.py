@@ -35,6 +35,11 @@ pipeline_data_object_test.add_operation_test(
     module=this_module,
     positional_arguments=["feature_name", "callback"],
 )
+pipeline_data_object_test.add_operation_test(
+    cls=pipeline_ops_base.EnableFeaturesOperation,
+    module=this_module,
+    positional_arguments=["feature_names", "callback"],
+)
 pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_base.DisableFeatureOperation,
     module=this_module,
@@ -5,6 +5,7 @@
 # --------------------------------------------------------------------------
 import sys
 import logging
+import pytest
 from azure.iot.device.common.pipeline import pipeline_ops_mqtt
 from tests.common.pipeline import pipeline_data_object_test
 
@@ -21,6 +22,7 @@ pipeline_data_object_test.add_operation_test(
     cls=pipeline_ops_mqtt.MQTTPublishOperation,
     module=this_module,
     positional_arguments=["topic", "payload", "callback"],
+    keyword_arguments={"qos": 1},
     extra_defaults={"needs_connection": True},
 )
 pipeline_data_object_test.add_operation_test(
@@ -35,3 +37,26 @@ pipeline_data_object_test.add_operation_test(
     positional_arguments=["topic", "callback"],
     extra_defaults={"needs_connection": True},
 )
+
+
+@pytest.mark.describe("MQTTPublishOperation - .reset()")
+class TestMQTTPublishOperationReset(object):
+    @pytest.mark.it(
+        "Resets a completed operation to publish the new payload, keeping none of its old state"
+    )
+    def test_reset(self, mocker):
+        op = pipeline_ops_mqtt.MQTTPublishOperation(
+            topic="old_topic", payload="old_payload", callback=mocker.MagicMock(), qos=0
+        )
+        op.completed = True
+        op.needs_connection = False
+
+        op.reset(topic="new_topic", payload="new_payload", qos=1)
+
+        assert op.topic == "new_topic"
+        assert op.payload == "new_payload"
+        assert op.qos == 1
+        assert op.callback is None
+        assert op.completed is False
+        assert op.needs_connection is True
+        assert op.name == "MQTTPublishOperation"
@@ -3,18 +3,21 @@
 # Licensed under the MIT License. See License.txt in the project root for
 # license information.
 # --------------------------------------------------------------------------
+import collections
 import logging
 import pytest
 import sys
 import six
 import threading
-from six.moves import queue
 from azure.iot.device.common.pipeline import (
     pipeline_stages_base,
     pipeline_ops_base,
     pipeline_ops_mqtt,
     pipeline_events_base,
+    pipeline_exceptions,
+    pipeline_thread,
 )
+from azure.iot.device.common import config, handle_exceptions, transport_exceptions
 from tests.common.pipeline.helpers import (
     assert_callback_failed,
     assert_callback_succeeded,
@@ -51,12 +54,21 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
     handled_ops=[],
     all_events=all_common_events,
     handled_events=all_common_events,
-    methods_that_can_run_in_any_thread=["append_stage", "run_op"],
+    methods_that_can_run_in_any_thread=[
+        "append_stage",
+        "set_tracer",
+        "run_op",
+        "run_ops",
+        "_wrap_op_callback",
+        "_run_callbacks",
+    ],
     extra_initializer_defaults={
         "on_pipeline_event_handler": None,
         "on_connected_handler": None,
         "on_disconnected_handler": None,
+        "on_connection_state_changed_handler": None,
         "connected": False,
+        "handler_executor": None,
     },
     positional_arguments=["pipeline_configuration"],
 )
@@ -161,6 +173,365 @@ TestPipelineRootStagePipelineThreading.test_pipeline_root_runs_on_event_received
     _test_pipeline_root_runs_on_event_received_in_callback_thread
 )
 
+
+@pytest.mark.describe("PipelineRootStage - with a handler_executor")
+class TestPipelineRootStageHandlerExecutor(object):
+    @pytest.fixture
+    def stage(self, mocker):
+        stage = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+        stage.handler_executor = mocker.MagicMock()
+        stage.on_pipeline_event_handler = mocker.MagicMock()
+        stage.on_connected_handler = mocker.MagicMock()
+        stage.on_disconnected_handler = mocker.MagicMock()
+        return stage
+
+    @pytest.mark.it(
+        "Submits on_pipeline_event_handler to the handler_executor, keyed by the pipeline and event type"
+    )
+    def test_event_submitted(self, stage, arbitrary_event):
+        stage.handle_pipeline_event(arbitrary_event)
+
+        assert stage.handler_executor.submit.call_count == 1
+        assert stage.handler_executor.submit.call_args == (
+            ((stage, arbitrary_event.name, None), stage.on_pipeline_event_handler, arbitrary_event),
+        )
+        assert stage.on_pipeline_event_handler.call_count == 0
+
+    @pytest.mark.it("Keys input messages by input name as well")
+    def test_input_message_key(self, stage, arbitrary_event):
+        arbitrary_event.input_name = "fake_input"
+
+        stage.handle_pipeline_event(arbitrary_event)
+
+        key = stage.handler_executor.submit.call_args[0][0]
+        assert key == (stage, arbitrary_event.name, "fake_input")
+
+    @pytest.mark.it(
+        "Submits on_connected_handler and on_disconnected_handler to the handler_executor with the same key"
+    )
+    def test_connection_state_submitted(self, stage):
+        stage.on_connected()
+        stage.on_disconnected()
+
+        assert stage.handler_executor.submit.call_args_list == [
+            (((stage, "connection_state"), stage.on_connected_handler),),
+            (((stage, "connection_state"), stage.on_disconnected_handler),),
+        ]
+
+
+@pytest.mark.describe("PipelineRootStage - handlers on the callback thread")
+class TestPipelineRootStageCallbackBatches(object):
+    @pytest.fixture
+    def stage(self, mocker):
+        stage = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+        stage.on_pipeline_event_handler = mocker.MagicMock()
+        stage.on_disconnected_handler = mocker.MagicMock()
+        return stage
+
+    @pytest.fixture
+    def invoke_on_callback_thread_nowait(self, mocker):
+        return mocker.patch.object(pipeline_thread, "invoke_on_callback_thread_nowait")
+
+    @pytest.mark.it("Only enters the callback thread for the first handler waiting for it")
+    def test_enters_callback_thread_once(self, stage, invoke_on_callback_thread_nowait, mocker):
+        stage.handle_pipeline_event(mocker.MagicMock())
+        stage.handle_pipeline_event(mocker.MagicMock())
+        stage.on_disconnected()
+
+        assert invoke_on_callback_thread_nowait.call_count == 1
+        assert invoke_on_callback_thread_nowait.call_args[0][0] == stage._run_callbacks
+        assert invoke_on_callback_thread_nowait.return_value.call_count == 1
+
+    @pytest.mark.it("Runs every waiting handler in order once on the callback thread")
+    def test_runs_batch_in_order(self, stage, invoke_on_callback_thread_nowait, mocker):
+        calls = []
+        stage.on_pipeline_event_handler = calls.append
+        stage.on_disconnected_handler = lambda: calls.append("disconnected")
+        event1 = mocker.MagicMock()
+        event2 = mocker.MagicMock()
+        stage.handle_pipeline_event(event1)
+        stage.on_disconnected()
+        stage.handle_pipeline_event(event2)
+        assert calls == []
+
+        stage._run_callbacks()
+
+        assert calls == [event1, "disconnected", event2]
+
+    @pytest.mark.it(
+        "Calls on_connection_state_changed_handler with the state of the connection every time it changes"
+    )
+    def test_connection_state_handler(self, stage, invoke_on_callback_thread_nowait):
+        calls = []
+        stage.on_connection_state_changed_handler = calls.append
+        stage.on_connected()
+        stage.on_disconnected()
+        stage.on_connection_state_changed("reconnecting")
+
+        stage._run_callbacks()
+
+        assert calls == ["connected", "disconnected", "reconnecting"]
+
+    @pytest.mark.it("Enters the callback thread again for a handler after the batch has run")
+    def test_new_batch(self, stage, invoke_on_callback_thread_nowait, mocker):
+        stage.handle_pipeline_event(mocker.MagicMock())
+        stage._run_callbacks()
+        stage.handle_pipeline_event(mocker.MagicMock())
+
+        assert invoke_on_callback_thread_nowait.return_value.call_count == 2
+
+    @pytest.mark.it(
+        "Reports an exception raised by a handler as a background exception, and runs the rest of the batch"
+    )
+    def test_handler_exception(
+        self, stage, invoke_on_callback_thread_nowait, mocker, arbitrary_exception
+    ):
+        mocker.spy(handle_exceptions, "handle_background_exception")
+        stage.on_pipeline_event_handler.side_effect = arbitrary_exception
+        stage.handle_pipeline_event(mocker.MagicMock())
+        stage.on_disconnected()
+
+        stage._run_callbacks()
+
+        assert handle_exceptions.handle_background_exception.call_args == mocker.call(
+            arbitrary_exception
+        )
+        assert stage.on_disconnected_handler.call_count == 1
+
+
+@pytest.mark.describe("PipelineRootStage - .run_ops()")
+class TestPipelineRootStageRunOps(object):
+    @pytest.fixture
+    def stage(self, mocker):
+        stage = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+        stage.ops_run = []
+        stage._execute_op = stage.ops_run.append
+        return stage
+
+    @pytest.fixture
+    def invoke_on_pipeline_thread(self, mocker):
+        return mocker.patch.object(
+            pipeline_thread,
+            "invoke_on_pipeline_thread",
+            side_effect=lambda func, executors=None, tracer=None: func,
+        )
+
+    @pytest.fixture
+    def ops(self, mocker):
+        return [pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock()) for _ in range(3)]
+
+    @pytest.mark.it("Runs every operation in order, entering the pipeline thread once")
+    def test_runs_ops(self, stage, ops, invoke_on_pipeline_thread):
+        stage.run_ops(iter(ops))
+        assert invoke_on_pipeline_thread.call_count == 1
+        assert stage.ops_run == ops
+
+    @pytest.mark.it("Calls the callback of each operation in the callback thread")
+    def test_callbacks(self, stage, ops, invoke_on_pipeline_thread, mocker):
+        invoke_on_callback_thread_nowait = mocker.patch.object(
+            pipeline_thread, "invoke_on_callback_thread_nowait"
+        )
+        original_callbacks = [op.callback for op in ops]
+        stage.run_ops(ops)
+        assert [
+            call[0][0] for call in invoke_on_callback_thread_nowait.call_args_list
+        ] == original_callbacks
+        assert all(op.callback is invoke_on_callback_thread_nowait.return_value for op in ops)
+
+
+pipeline_stage_test.add_base_pipeline_stage_tests(
+    cls=pipeline_stages_base.ReconnectStage,
+    module=this_module,
+    all_ops=all_common_ops,
+    handled_ops=[
+        pipeline_ops_base.ConnectOperation,
+        pipeline_ops_base.ReconnectOperation,
+        pipeline_ops_base.DisconnectOperation,
+    ],
+    all_events=all_common_events,
+    handled_events=[],
+    extra_initializer_defaults={"wants_connection": False, "failed_attempts": 0},
+)
+
+
+@pytest.mark.describe("ReconnectStage - reconnecting after the connection drops")
+class TestReconnectStage(StageTestBase):
+    @pytest.fixture
+    def stage(self):
+        return pipeline_stages_base.ReconnectStage()
+
+    @pytest.fixture(autouse=True)
+    def timer(self, mocker):
+        return mocker.patch.object(pipeline_stages_base, "Timer")
+
+    @pytest.fixture(autouse=True)
+    def uniform(self, mocker):
+        # Always wait for the longest delay allowed
+        return mocker.patch.object(
+            pipeline_stages_base.random, "uniform", side_effect=lambda low, high: high
+        )
+
+    @pytest.fixture
+    def pipeline_configuration(self, stage, stage_base_configuration):
+        pipeline_configuration = stage.pipeline_root.pipeline_configuration
+        pipeline_configuration.auto_reconnect = True
+        return pipeline_configuration
+
+    @pytest.fixture
+    def state_changed(self, stage, stage_base_configuration, mocker):
+        return mocker.patch.object(stage.pipeline_root, "on_connection_state_changed")
+
+    @pytest.fixture
+    def connected_stage(self, stage, pipeline_configuration, mocker):
+        stage.run_op(pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock()))
+        stage.next._complete_op(stage.next.run_op.call_args[0][0])
+        stage.next.on_connected()
+        stage.next.run_op.reset_mock()
+        return stage
+
+    def fail_reconnect(self, stage, error):
+        connect_op = stage.next.run_op.call_args[0][0]
+        stage.next._complete_op(connect_op, error=error)
+
+    @pytest.mark.it("Expects the client to be connected after a connect op succeeds")
+    def test_connect_succeeds(self, stage, stage_base_configuration, mocker):
+        op = pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock())
+        stage.run_op(op)
+        assert stage.next.run_op.call_args[0][0] is op
+        stage.next._complete_op(op)
+        assert_callback_succeeded(op=op)
+        assert stage.wants_connection
+
+    @pytest.mark.it("Does not expect the client to be connected after a connect op fails")
+    def test_connect_fails(self, stage, stage_base_configuration, mocker, arbitrary_exception):
+        op = pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock())
+        stage.run_op(op)
+        stage.next._complete_op(op, error=arbitrary_exception)
+        assert_callback_failed(op=op, error=arbitrary_exception)
+        assert not stage.wants_connection
+
+    @pytest.mark.it(
+        "Starts a timer to reconnect after a random delay of up to reconnect_initial_delay when the connection drops"
+    )
+    def test_schedules_reconnect(
+        self, connected_stage, timer, uniform, pipeline_configuration, state_changed
+    ):
+        connected_stage.next.on_disconnected()
+        assert uniform.call_args == ((0, pipeline_configuration.reconnect_initial_delay),)
+        assert timer.call_count == 1
+        assert timer.call_args[0][0] == pipeline_configuration.reconnect_initial_delay
+        assert timer.return_value.start.call_count == 1
+        assert state_changed.call_args_list[-1] == (("reconnecting",),)
+
+    @pytest.mark.it("Passes on_disconnected to the previous stage")
+    def test_passes_on_disconnected(self, connected_stage):
+        connected_stage.next.on_disconnected()
+        assert not connected_stage.pipeline_root.connected
+
+    @pytest.mark.it("Does not reconnect if the auto_reconnect configuration option is False")
+    def test_auto_reconnect_disabled(self, connected_stage, timer, pipeline_configuration):
+        pipeline_configuration.auto_reconnect = False
+        connected_stage.next.on_disconnected()
+        assert timer.call_count == 0
+
+    @pytest.mark.it("Does not reconnect after a disconnect op")
+    def test_no_reconnect_after_disconnect(self, connected_stage, timer, mocker):
+        connected_stage.run_op(pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock()))
+        connected_stage.next.on_disconnected()
+        assert timer.call_count == 0
+        assert not connected_stage.wants_connection
+
+    @pytest.mark.it("Does not reconnect if the client was never connected")
+    def test_no_reconnect_if_never_connected(self, stage, timer, pipeline_configuration):
+        stage.next.on_disconnected()
+        assert timer.call_count == 0
+
+    @pytest.mark.it("Does not reconnect when disconnected while a connect op is pending")
+    def test_no_reconnect_while_connecting(self, connected_stage, timer, mocker):
+        connected_stage.run_op(pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock()))
+        connected_stage.next.on_disconnected()
+        assert timer.call_count == 0
+
+    @pytest.mark.it("Reconnects if a reconnect op fails and leaves the transport disconnected")
+    def test_reconnect_op_fails(self, connected_stage, timer, mocker, arbitrary_exception):
+        op = pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock())
+        connected_stage.run_op(op)
+        connected_stage.next.on_disconnected()
+        connected_stage.next._complete_op(op, error=arbitrary_exception)
+        assert_callback_failed(op=op, error=arbitrary_exception)
+        assert timer.call_count == 1
+
+    @pytest.mark.it("Cancels a pending reconnect when a disconnect op is run")
+    def test_disconnect_cancels_timer(self, connected_stage, timer, mocker):
+        connected_stage.next.on_disconnected()
+        connected_stage.run_op(pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock()))
+        assert timer.return_value.cancel.call_count == 1
+        connected_stage._reconnect()
+        assert connected_stage.next.run_op.call_count == 1
+        assert isinstance(
+            connected_stage.next.run_op.call_args[0][0], pipeline_ops_base.DisconnectOperation
+        )
+
+    @pytest.mark.it("Sends a ConnectOperation to the next stage when the timer fires")
+    def test_reconnects(self, connected_stage):
+        connected_stage.next.on_disconnected()
+        connected_stage._reconnect()
+        assert connected_stage.next.run_op.call_count == 1
+        assert isinstance(
+            connected_stage.next.run_op.call_args[0][0], pipeline_ops_base.ConnectOperation
+        )
+
+    @pytest.mark.it(
+        "Doubles the maximum delay after each failed attempt, up to reconnect_max_delay"
+    )
+    def test_backoff(self, connected_stage, timer, pipeline_configuration, arbitrary_exception):
+        pipeline_configuration.reconnect_initial_delay = 1
+        pipeline_configuration.reconnect_max_delay = 5
+        connected_stage.next.on_disconnected()
+        for _ in range(4):
+            connected_stage._reconnect()
+            self.fail_reconnect(connected_stage, arbitrary_exception)
+        assert [call[0][0] for call in timer.call_args_list] == [1, 2, 4, 5, 5]
+
+    @pytest.mark.it("Resets the delay once the connection is made")
+    def test_resets_backoff(self, connected_stage, timer, arbitrary_exception):
+        connected_stage.next.on_disconnected()
+        connected_stage._reconnect()
+        self.fail_reconnect(connected_stage, arbitrary_exception)
+        connected_stage._reconnect()
+        connected_stage.next._complete_op(connected_stage.next.run_op.call_args[0][0])
+        connected_stage.next.on_connected()
+        assert connected_stage.failed_attempts == 0
+
+        connected_stage.next.on_disconnected()
+        assert timer.call_args_list[-1][0][0] == timer.call_args_list[0][0][0]
+
+    @pytest.mark.it(
+        "Gives up and reports the error after reconnect_max_attempts failed attempts in a row"
+    )
+    def test_max_attempts(
+        self,
+        connected_stage,
+        timer,
+        pipeline_configuration,
+        state_changed,
+        unhandled_error_handler,
+        arbitrary_exception,
+    ):
+        pipeline_configuration.reconnect_max_attempts = 2
+        connected_stage.next.on_disconnected()
+        connected_stage._reconnect()
+        self.fail_reconnect(connected_stage, arbitrary_exception)
+        assert unhandled_error_handler.call_count == 0
+        connected_stage._reconnect()
+        self.fail_reconnect(connected_stage, arbitrary_exception)
+
+        assert timer.call_count == 2
+        assert unhandled_error_handler.call_args == ((arbitrary_exception,),)
+        assert state_changed.call_args_list[-1] == (("failed",),)
+        assert not connected_stage.wants_connection
+
+
 pipeline_stage_test.add_base_pipeline_stage_tests(
     cls=pipeline_stages_base.EnsureConnectionStage,
     module=this_module,
@@ -289,7 +660,7 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
     ],
     all_events=all_common_events,
     handled_events=[],
-    extra_initializer_defaults={"blocked": False, "queue": queue.Queue},
+    extra_initializer_defaults={"blocked": False, "queue": collections.deque},
 )
 
 connection_ops = [
@@ -298,6 +669,9 @@ connection_ops = [
     {"op_class": pipeline_ops_base.ReconnectOperation, "connected_flag_required_to_run": True},
 ]
 
+# Reconnect ops are not merged into the op blocking the stage
+merged_connection_ops = connection_ops[:2]
+
 
 class FakeOperation(pipeline_ops_base.PipelineOperation):
     pass
@@ -537,6 +911,192 @@ class TestSerializeConnectOpStageRunOp(StageTestBase):
         assert stage.next.run_op.call_count == 1
         assert_callback_succeeded(op=second_connection_op)
 
+    @pytest.mark.parametrize(
+        "params",
+        merged_connection_ops,
+        ids=[x["op_class"].__name__ for x in merged_connection_ops],
+    )
+    @pytest.mark.it(
+        "Merges a ConnectOperation or DisconnectOperation into the operation of the same type which is currently blocking the stage"
+    )
+    def test_merges_into_blocking_op(self, params, stage, mocker):
+        first_connection_op = params["op_class"](callback=mocker.MagicMock())
+        second_connection_op = params["op_class"](callback=mocker.MagicMock())
+        stage.pipeline_root.connected = params["connected_flag_required_to_run"]
+
+        stage.run_op(first_connection_op)
+        stage.run_op(second_connection_op)
+        assert len(stage.queue) == 0
+
+        stage.next._complete_op(first_connection_op)
+        assert stage.next.run_op.call_count == 1
+        assert_callback_succeeded(op=first_connection_op)
+        assert_callback_succeeded(op=second_connection_op)
+
+    @pytest.mark.it("Merges an operation into a queued operation of the same type")
+    def test_merges_into_queued_op(self, stage, mocker, fake_op):
+        disconnect_op = pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock())
+        first_connect_op = pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock())
+        second_connect_op = pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock())
+        stage.pipeline_root.connected = True
+
+        stage.run_op(disconnect_op)
+        stage.run_op(first_connect_op)
+        stage.run_op(fake_op)
+        stage.run_op(second_connect_op)
+        assert list(stage.queue) == [first_connect_op, fake_op]
+
+        # the disconnect completes, so the first connect is passed down and the stage re-blocks
+        stage.pipeline_root.connected = False
+        stage.next._complete_op(disconnect_op)
+        assert stage.next.run_op.call_count == 2
+        assert stage.next.run_op.call_args[0][0] == first_connect_op
+
+        stage.pipeline_root.connected = True
+        stage.next._complete_op(first_connect_op)
+        assert_callback_succeeded(op=first_connect_op)
+        assert_callback_succeeded(op=second_connect_op)
+        assert stage.next.run_op.call_count == 3
+        assert stage.next.run_op.call_args[0][0] == fake_op
+
+    @pytest.mark.parametrize(
+        "params",
+        merged_connection_ops,
+        ids=[x["op_class"].__name__ for x in merged_connection_ops],
+    )
+    @pytest.mark.it("Fails merged operations if the operation they were merged into fails")
+    def test_fails_merged_ops(self, params, stage, mocker, arbitrary_exception):
+        first_connection_op = params["op_class"](callback=mocker.MagicMock())
+        merged_ops = [params["op_class"](callback=mocker.MagicMock()) for _ in range(3)]
+        stage.pipeline_root.connected = params["connected_flag_required_to_run"]
+
+        stage.run_op(first_connection_op)
+        for op in merged_ops:
+            stage.run_op(op)
+        stage.next._complete_op(first_connection_op, error=arbitrary_exception)
+
+        assert_callback_failed(op=first_connection_op, error=arbitrary_exception)
+        for op in merged_ops:
+            assert_callback_failed(op=op, error=arbitrary_exception)
+
+    @pytest.mark.it(
+        "Does not merge a ReconnectOperation into the ReconnectOperation which has already been passed down"
+    )
+    def test_does_not_merge_into_blocking_reconnect(self, stage, mocker):
+        first_reconnect_op = pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock())
+        second_reconnect_op = pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock())
+        stage.pipeline_root.connected = True
+
+        stage.run_op(first_reconnect_op)
+        stage.run_op(second_reconnect_op)
+        assert list(stage.queue) == [second_reconnect_op]
+
+        stage.next._complete_op(first_reconnect_op)
+        assert_callback_succeeded(op=first_reconnect_op)
+        assert not second_reconnect_op.completed
+        assert stage.next.run_op.call_count == 2
+        assert stage.next.run_op.call_args[0][0] == second_reconnect_op
+
+    @pytest.mark.it("Merges a ReconnectOperation into a queued ReconnectOperation")
+    def test_merges_into_queued_reconnect(self, stage, mocker):
+        reconnect_ops = [
+            pipeline_ops_base.ReconnectOperation(callback=mocker.MagicMock()) for _ in range(3)
+        ]
+        stage.pipeline_root.connected = True
+
+        for op in reconnect_ops:
+            stage.run_op(op)
+        assert list(stage.queue) == [reconnect_ops[1]]
+
+        stage.next._complete_op(reconnect_ops[0])
+        stage.next._complete_op(reconnect_ops[1])
+        assert stage.next.run_op.call_count == 2
+        for op in reconnect_ops:
+            assert_callback_succeeded(op=op)
+
+    @pytest.mark.it(
+        "Does not merge an operation into an earlier operation of the same type if an operation of a different type is between them"
+    )
+    def test_does_not_merge_across_different_op(self, stage, mocker):
+        first_connect_op = pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock())
+        disconnect_op = pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock())
+        second_connect_op = pipeline_ops_base.ConnectOperation(callback=mocker.MagicMock())
+        stage.pipeline_root.connected = False
+
+        stage.run_op(first_connect_op)
+        stage.run_op(disconnect_op)
+        stage.run_op(second_connect_op)
+        assert list(stage.queue) == [disconnect_op, second_connect_op]
+
+
+class FlappingTransportStage(pipeline_stages_base.PipelineStage):
+    """
+    Bottom stage which holds connect ops until the test completes them, and completes every
+    other op immediately
+    """
+
+    def __init__(self):
+        super(FlappingTransportStage, self).__init__()
+        self.connect_ops = []
+        self.ops_run = 0
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_op(self, op):
+        self.ops_run += 1
+        if isinstance(op, pipeline_ops_base.ConnectOperation):
+            self.connect_ops.append(op)
+        else:
+            self._complete_op(op)
+
+
+@pytest.mark.describe("SerializeConnectOpsStage - flapping connection")
+class TestSerializeConnectOpsStageFlapping(object):
+    @pytest.fixture
+    def transport(self):
+        return FlappingTransportStage()
+
+    @pytest.fixture
+    def ensure_connection_stage(self, transport):
+        root = (
+            pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+            .append_stage(pipeline_stages_base.EnsureConnectionStage())
+            .append_stage(pipeline_stages_base.SerializeConnectOpsStage())
+            .append_stage(transport)
+        )
+        return root.next
+
+    @pytest.mark.it(
+        "Makes one connection attempt for any number of pending ops, and passes each op down once"
+    )
+    def test_flapping(self, ensure_connection_stage, transport, mocker, arbitrary_exception):
+        root = ensure_connection_stage.pipeline_root
+        ops_per_round = 200
+        for round in range(20):
+            root.connected = False
+            ops = [
+                pipeline_ops_mqtt.MQTTPublishOperation(
+                    topic="fake_topic", payload="fake_payload", callback=mocker.MagicMock()
+                )
+                for _ in range(ops_per_round)
+            ]
+            for op in ops:
+                ensure_connection_stage.run_op(op)
+            assert len(transport.connect_ops) == 1
+
+            connect_op = transport.connect_ops.pop()
+            if round % 2:
+                transport._complete_op(connect_op, error=arbitrary_exception)
+                for op in ops:
+                    assert_callback_failed(op=op, error=arbitrary_exception)
+            else:
+                root.connected = True
+                transport._complete_op(connect_op)
+                for op in ops:
+                    assert_callback_succeeded(op=op)
+
+        # one connect per round, and each publish passed down at most once
+        assert transport.ops_run <= 20 * (ops_per_round + 1)
+
 
 pipeline_stage_test.add_base_pipeline_stage_tests(
     cls=pipeline_stages_base.CoordinateRequestAndResponseStage,
@@ -545,7 +1105,7 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
     handled_ops=[pipeline_ops_base.SendIotRequestAndWaitForResponseOperation],
     all_events=all_common_events,
     handled_events=[pipeline_events_base.IotResponseEvent],
-    extra_initializer_defaults={"pending_responses": dict},
+    extra_initializer_defaults={"pending_responses": dict, "queue": collections.deque},
 )
 
 
@@ -715,3 +1275,277 @@ class TestCoordinateRequestAndResponseSendIotRequestHandleEvent(StageTestBase):
         stage.next._send_event_up(iot_response)
         assert op.callback.call_count == 0
         assert unhandled_error_handler.call_count == 0
+
+
+@pytest.mark.describe("CoordinateRequestAndResponseStage - request IDs, deadlines and limits")
+class TestCoordinateRequestAndResponseLimits(StageTestBase):
+    @pytest.fixture
+    def stage(self):
+        return pipeline_stages_base.CoordinateRequestAndResponseStage()
+
+    @pytest.fixture(autouse=True)
+    def timer(self, mocker):
+        return mocker.patch.object(pipeline_stages_base, "Timer")
+
+    @pytest.fixture
+    def pipeline_configuration(self, stage, stage_base_configuration):
+        pipeline_configuration = stage.pipeline_root.pipeline_configuration
+        pipeline_configuration.operation_timeout = 60
+        return pipeline_configuration
+
+    def respond(self, stage, request_index):
+        request = stage.next.run_op.call_args_list[request_index][0][0]
+        stage.next._send_event_up(
+            pipeline_events_base.IotResponseEvent(
+                request_id=request.request_id,
+                status_code=fake_status_code,
+                response_body=fake_response_body,
+            )
+        )
+
+    @pytest.mark.it("Generates request IDs from a counter, with a prefix for the stage")
+    def test_counter_request_ids(self, stage, mocker):
+        stage.run_op(make_fake_request_and_response(mocker))
+        stage.run_op(make_fake_request_and_response(mocker))
+        first_id = stage.next.run_op.call_args_list[0][0][0].request_id
+        second_id = stage.next.run_op.call_args_list[1][0][0].request_id
+        first_prefix, _, first_count = first_id.partition("-")
+        second_prefix, _, second_count = second_id.partition("-")
+        assert first_prefix == second_prefix
+        assert int(second_count) == int(first_count) + 1
+
+    @pytest.mark.it("Never generates the same request ID in two stages")
+    def test_request_ids_differ_between_stages(self, stage, mocker):
+        other_stage = pipeline_stages_base.CoordinateRequestAndResponseStage()
+        assert stage._request_id_prefix != other_stage._request_id_prefix
+        stage.run_op(make_fake_request_and_response(mocker))
+        request_id = stage.next.run_op.call_args[0][0].request_id
+        other_stage.pipeline_root = stage.pipeline_root
+        other_stage.next = mocker.MagicMock()
+        other_stage.run_op(make_fake_request_and_response(mocker))
+        assert other_stage.next.run_op.call_args[0][0].request_id != request_id
+
+    @pytest.mark.it("Starts a single timer for the deadline of the oldest pending request")
+    def test_starts_one_timer(self, stage, timer, pipeline_configuration, mocker):
+        stage.run_op(make_fake_request_and_response(mocker))
+        stage.run_op(make_fake_request_and_response(mocker))
+        assert timer.call_count == 1
+        assert 0 < timer.call_args[0][0] <= pipeline_configuration.operation_timeout
+        assert timer.return_value.start.call_count == 1
+
+    @pytest.mark.it("Does not start a timer if operation_timeout is None")
+    def test_no_timeout(self, stage, timer, pipeline_configuration, mocker):
+        pipeline_configuration.operation_timeout = None
+        stage.run_op(make_fake_request_and_response(mocker))
+        assert timer.call_count == 0
+
+    @pytest.mark.it(
+        "Fails requests which have had no response by their deadline with an OperationTimeoutError"
+    )
+    def test_fails_expired_requests(self, stage, pipeline_configuration, mocker):
+        expired_op = make_fake_request_and_response(mocker)
+        stage.run_op(expired_op)
+        sweep_time = pipeline_stages_base._now() + pipeline_configuration.operation_timeout
+        live_op = make_fake_request_and_response(mocker)
+        stage.run_op(live_op)
+        stage._request_send_times[stage.next.run_op.call_args_list[1][0][0].request_id] = sweep_time
+
+        stage._sweep(now=sweep_time)
+
+        assert_callback_failed(op=expired_op, error=transport_exceptions.OperationTimeoutError)
+        assert live_op.callback.call_count == 0
+        assert len(stage.pending_responses) == 1
+
+    @pytest.mark.it("Starts a timer for the next deadline after failing expired requests")
+    def test_reschedules_after_sweep(self, stage, timer, pipeline_configuration, mocker):
+        stage.run_op(make_fake_request_and_response(mocker))
+        stage.run_op(make_fake_request_and_response(mocker))
+        stage._sweep(now=pipeline_stages_base._now())
+        assert timer.call_count == 2
+
+    @pytest.mark.it("Ignores a response which arrives after its request has timed out")
+    def test_ignores_late_response(
+        self, stage, pipeline_configuration, mocker, unhandled_error_handler
+    ):
+        op = make_fake_request_and_response(mocker)
+        stage.run_op(op)
+        stage._sweep(now=pipeline_stages_base._now() + pipeline_configuration.operation_timeout)
+        op.callback.reset_mock()
+
+        self.respond(stage, 0)
+        assert op.callback.call_count == 0
+        assert unhandled_error_handler.call_count == 0
+
+    @pytest.mark.it("Records the latency of each response")
+    def test_records_latency(self, stage, mocker):
+        stage.run_op(make_fake_request_and_response(mocker))
+        self.respond(stage, 0)
+        assert stage.response_latency.count == 1
+        assert stage.pending_responses == {}
+
+    @pytest.mark.it(
+        "Queues requests while max_pending_requests are pending, and sends them as responses arrive, if in_flight_policy is 'wait'"
+    )
+    def test_wait_policy(self, stage, pipeline_configuration, mocker):
+        pipeline_configuration.max_pending_requests = 2
+        ops = [make_fake_request_and_response(mocker) for _ in range(3)]
+        for op in ops:
+            stage.run_op(op)
+        assert stage.next.run_op.call_count == 2
+        assert list(stage.queue) == [ops[2]]
+
+        self.respond(stage, 0)
+        assert_callback_succeeded(op=ops[0])
+        assert stage.next.run_op.call_count == 3
+        assert len(stage.queue) == 0
+
+    @pytest.mark.it("Sends queued requests when pending requests time out")
+    def test_wait_policy_timeout(self, stage, pipeline_configuration, mocker):
+        pipeline_configuration.max_pending_requests = 1
+        ops = [make_fake_request_and_response(mocker) for _ in range(2)]
+        for op in ops:
+            stage.run_op(op)
+        stage._sweep(now=pipeline_stages_base._now() + pipeline_configuration.operation_timeout)
+        assert stage.next.run_op.call_count == 2
+
+    @pytest.mark.it(
+        "Fails requests with a PipelineBusyError while max_pending_requests are pending, if in_flight_policy is 'fail'"
+    )
+    def test_fail_policy(self, stage, pipeline_configuration, mocker):
+        pipeline_configuration.max_pending_requests = 1
+        pipeline_configuration.in_flight_policy = "fail"
+        ops = [make_fake_request_and_response(mocker) for _ in range(2)]
+        for op in ops:
+            stage.run_op(op)
+        assert stage.next.run_op.call_count == 1
+        assert_callback_failed(op=ops[1], error=pipeline_exceptions.PipelineBusyError)
+
+
+class ConnectHandlerStage(pipeline_stages_base.PipelineStage):
+    def __init__(self):
+        super(ConnectHandlerStage, self).__init__()
+        self.handled = []
+
+    @pipeline_stages_base.handles_ops(pipeline_ops_base.ConnectOperation)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_connect_op(self, op):
+        self.handled.append(op)
+        self._complete_op(op)
+
+    @pipeline_stages_base.handles_events(pipeline_events_base.IotResponseEvent)
+    @pipeline_thread.runs_on_pipeline_thread
+    def _handle_iot_response_event(self, event):
+        self.handled.append(event)
+
+
+class PassThroughStage(pipeline_stages_base.PipelineStage):
+    pass
+
+
+class BottomStage(pipeline_stages_base.PipelineStage):
+    def __init__(self):
+        super(BottomStage, self).__init__()
+        self.handled = []
+
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_op(self, op):
+        self.handled.append(op)
+        self._complete_op(op)
+
+
+class DerivedConnectOperation(pipeline_ops_base.ConnectOperation):
+    pass
+
+
+@pytest.mark.describe("PipelineStage - dispatch by type")
+class TestPipelineStageDispatch(object):
+    @pytest.fixture
+    def pipeline(self):
+        root = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+        root.append_stage(PassThroughStage()).append_stage(ConnectHandlerStage()).append_stage(
+            PassThroughStage()
+        ).append_stage(BottomStage())
+        return root
+
+    @pytest.fixture
+    def callback(self, mocker):
+        return mocker.MagicMock()
+
+    @pytest.fixture
+    def top(self, pipeline):
+        return pipeline.next
+
+    @pytest.fixture
+    def handler(self, pipeline):
+        return pipeline.next.next
+
+    @pytest.fixture
+    def bottom(self, pipeline):
+        return pipeline.next.next.next.next
+
+    @pytest.mark.it("Runs an operation with the method marked with handles_ops for its type")
+    @pytest.mark.parametrize(
+        "op_class",
+        [
+            pytest.param(pipeline_ops_base.ConnectOperation, id="Exact type"),
+            pytest.param(DerivedConnectOperation, id="Derived type"),
+        ],
+    )
+    def test_runs_handler(self, top, handler, bottom, op_class, callback):
+        op = op_class(callback=callback)
+        top.run_op(op)
+        assert handler.handled == [op]
+        assert bottom.handled == []
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Passes an operation down to the next stage if no method handles its type")
+    def test_passes_op_down(self, top, handler, bottom, callback):
+        op = pipeline_ops_base.DisconnectOperation(callback=callback)
+        top.run_op(op)
+        assert handler.handled == []
+        assert bottom.handled == [op]
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Skips over stages which don't act on an operation's type")
+    def test_skips_stages_for_op(self, handler, bottom, mocker, callback):
+        mocker.spy(PassThroughStage, "_execute_op")
+        op = pipeline_ops_base.DisconnectOperation(callback=callback)
+        handler.run_op(op)
+        assert PassThroughStage._execute_op.call_count == 0
+        assert bottom.handled == [op]
+
+    @pytest.mark.it("Handles an event with the method marked with handles_events for its type")
+    def test_handles_event(self, pipeline, handler, bottom):
+        pipeline.on_pipeline_event_handler = None
+        event = pipeline_events_base.IotResponseEvent(
+            request_id="fake_request_id", status_code=200, response_body=b""
+        )
+        bottom._send_event_up(event)
+        assert handler.handled == [event]
+
+    @pytest.mark.it("Skips over stages which don't act on an event's type")
+    def test_skips_stages_for_event(self, pipeline, bottom, mocker):
+        mocker.spy(PassThroughStage, "_handle_pipeline_event")
+        mocker.spy(pipeline, "_handle_pipeline_event")
+        event = pipeline_events_base.IotResponseEvent(
+            request_id="fake_request_id", status_code=200, response_body=b""
+        )
+        bottom._send_event_up(event)
+        assert PassThroughStage._handle_pipeline_event.call_count == 0
+        assert pipeline._handle_pipeline_event.call_count == 0
+
+    @pytest.mark.it("Sends operations to a stage appended after the operation was first run")
+    def test_append_stage_resets_destinations(self, mocker):
+        root = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+        top = PassThroughStage()
+        root.append_stage(top)
+
+        op = pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock())
+        top.run_op(op)
+        assert_callback_failed(op=op)
+
+        bottom = BottomStage()
+        root.append_stage(bottom)
+        op = pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock())
+        top.run_op(op)
+        assert bottom.handled == [op]
@@ -86,6 +86,7 @@ pipeline_stage_test.add_base_pipeline_stage_tests(
     handled_events=events_handled_by_this_stage,
     methods_that_enter_pipeline_thread=[
         "_on_mqtt_message_received",
+        "_deliver_incoming_messages",
         "_on_mqtt_connected",
         "_on_mqtt_connection_failure",
         "_on_mqtt_disconnected",
@@ -223,6 +224,9 @@ class TestMQTTTransportStageRunOpWithSetConnectionArgs(MQTTTransportStageTestBas
             ca_cert=fake_ca_cert,
             x509_cert=fake_certificate,
             websockets=False,
+            network_loop=None,
+            operation_timeout=None,
+            quiet_logging=False,
         )
 
     @pytest.mark.it(
@@ -240,8 +244,82 @@ class TestMQTTTransportStageRunOpWithSetConnectionArgs(MQTTTransportStageTestBas
             ca_cert=fake_ca_cert,
             x509_cert=fake_certificate,
             websockets="__fake_boolean__",
+            network_loop=None,
+            operation_timeout=None,
+            quiet_logging=False,
         )
 
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with the network_loop from the PipelineRootStage config"
+    )
+    def test_receives_network_loop_config(self, stage, transport, mocker, op_set_connection_args):
+        fake_network_loop = mocker.MagicMock()
+        stage.pipeline_root = pipeline_stages_base.PipelineRootStage(
+            config.BasePipelineConfig(network_loop=fake_network_loop)
+        )
+        stage.run_op(op_set_connection_args)
+        assert transport.call_args == mocker.call(
+            client_id=fake_client_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            ca_cert=fake_ca_cert,
+            x509_cert=fake_certificate,
+            websockets=False,
+            network_loop=fake_network_loop,
+            operation_timeout=None,
+            quiet_logging=False,
+        )
+
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with the operation_timeout from the PipelineRootStage config"
+    )
+    def test_receives_operation_timeout_config(
+        self, stage, transport, mocker, op_set_connection_args
+    ):
+        stage.pipeline_root = pipeline_stages_base.PipelineRootStage(
+            config.BasePipelineConfig(operation_timeout=5)
+        )
+        stage.run_op(op_set_connection_args)
+        assert transport.call_args[1]["operation_timeout"] == 5
+
+    @pytest.mark.it(
+        "Initializes the MQTTTransport object with quiet_logging from the PipelineRootStage config"
+    )
+    def test_receives_quiet_logging_config(self, stage, transport, mocker, op_set_connection_args):
+        stage.pipeline_root = pipeline_stages_base.PipelineRootStage(
+            config.BasePipelineConfig(quiet_logging=True)
+        )
+        stage.run_op(op_set_connection_args)
+        assert transport.call_args[1]["quiet_logging"] is True
+
+    @pytest.mark.it(
+        "Creates an AsyncMQTTTransport object on the asyncio_loop from the PipelineRootStage config, if there is one"
+    )
+    @pytest.mark.skipif(sys.version_info < (3, 5), reason="Requires Python 3.5+")
+    def test_asyncio_loop_config(self, stage, transport, mocker, op_set_connection_args):
+        from azure.iot.device.common import async_mqtt_transport
+
+        async_transport = mocker.patch.object(
+            async_mqtt_transport, "AsyncMQTTTransport", autospec=True
+        )
+        fake_asyncio_loop = mocker.MagicMock()
+        stage.pipeline_root = pipeline_stages_base.PipelineRootStage(
+            config.BasePipelineConfig(asyncio_loop=fake_asyncio_loop, operation_timeout=5)
+        )
+        stage.run_op(op_set_connection_args)
+        assert transport.call_count == 0
+        assert async_transport.call_args == mocker.call(
+            client_id=fake_client_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            ca_cert=fake_ca_cert,
+            x509_cert=fake_certificate,
+            loop=fake_asyncio_loop,
+            operation_timeout=5,
+            quiet_logging=False,
+        )
+        assert stage.transport is async_transport.return_value
+
     @pytest.mark.it("Sets handlers on the transport")
     def test_sets_parameters(self, stage, transport, mocker, op_set_connection_args):
         stage.run_op(op_set_connection_args)
@@ -427,9 +505,16 @@ class TestMQTTTransportStageExecuteOpWithMQTTPublishOperation(
         stage.run_op(op_publish)
         assert stage.transport.publish.call_count == 1
         assert stage.transport.publish.call_args == mocker.call(
-            topic=op_publish.topic, payload=op_publish.payload, callback=mocker.ANY
+            topic=op_publish.topic, payload=op_publish.payload, qos=1, callback=mocker.ANY
         )
 
+    @pytest.mark.it("Uses the QoS of the operation for the MQTT publish")
+    @pytest.mark.parametrize("qos", [0, 1])
+    def test_mqtt_publish_qos(self, mocker, stage, create_transport, op_publish, qos):
+        op_publish.qos = qos
+        stage.run_op(op_publish)
+        assert stage.transport.publish.call_args[1]["qos"] == qos
+
     @pytest.mark.it(
         "Completes the operation with success, upon successful completion of the MQTT publish"
     )
@@ -442,6 +527,17 @@ class TestMQTTTransportStageExecuteOpWithMQTTPublishOperation(
 
         assert_callback_succeeded(op=op_publish)
 
+    @pytest.mark.it("Completes the operation with failure, if the MQTT publish fails with an error")
+    def test_complete_with_error(
+        self, mocker, stage, create_transport, op_publish, arbitrary_exception
+    ):
+        stage.run_op(op_publish)
+
+        # Trigger publish failure (e.g. a timeout)
+        stage.transport.publish.call_args[1]["callback"](error=arbitrary_exception)
+
+        assert_callback_failed(op=op_publish, error=arbitrary_exception)
+
 
 @pytest.mark.describe("MQTTTransportStage - .run_op() -- called with MQTTSubscribeOperation")
 class TestMQTTTransportStageExecuteOpWithMQTTSubscribeOperation(
@@ -467,6 +563,19 @@ class TestMQTTTransportStageExecuteOpWithMQTTSubscribeOperation(
 
         assert_callback_succeeded(op=op_subscribe)
 
+    @pytest.mark.it(
+        "Completes the operation with failure, if the MQTT subscribe fails with an error"
+    )
+    def test_complete_with_error(
+        self, mocker, stage, create_transport, op_subscribe, arbitrary_exception
+    ):
+        stage.run_op(op_subscribe)
+
+        # Trigger subscribe failure (e.g. a timeout)
+        stage.transport.subscribe.call_args[1]["callback"](error=arbitrary_exception)
+
+        assert_callback_failed(op=op_subscribe, error=arbitrary_exception)
+
 
 @pytest.mark.describe("MQTTTransportStage - .run_op() -- called with MQTTUnsubscribeOperation")
 class TestMQTTTransportStageExecuteOpWithMQTTUnsubscribeOperation(
@@ -492,6 +601,19 @@ class TestMQTTTransportStageExecuteOpWithMQTTUnsubscribeOperation(
 
         assert_callback_succeeded(op=op_unsubscribe)
 
+    @pytest.mark.it(
+        "Completes the operation with failure, if the MQTT unsubscribe fails with an error"
+    )
+    def test_complete_with_error(
+        self, mocker, stage, create_transport, op_unsubscribe, arbitrary_exception
+    ):
+        stage.run_op(op_unsubscribe)
+
+        # Trigger unsubscribe failure (e.g. a timeout)
+        stage.transport.unsubscribe.call_args[1]["callback"](error=arbitrary_exception)
+
+        assert_callback_failed(op=op_unsubscribe, error=arbitrary_exception)
+
 
 @pytest.mark.describe("MQTTTransportStage - .run_op() -- called with UpdateSasTokenOperation")
 class TestMQTTTransportStageExecuteOpWithUpdateSasTokenoperation(
@@ -524,6 +646,39 @@ class TestMQTTTransportStageProtocolClientEvents(MQTTTransportStageTestBase):
         assert call_arg.payload == fake_payload
         assert call_arg.topic == fake_topic
 
+    @pytest.mark.it(
+        "Only enters the pipeline thread for the first message received while a batch is waiting"
+    )
+    def test_enters_pipeline_thread_once(self, stage, create_transport, mocker):
+        mocker.patch.object(stage, "_deliver_incoming_messages")
+        for i in range(3):
+            stage.transport.on_mqtt_message_received_handler(topic=fake_topic, payload=i)
+
+        assert stage._deliver_incoming_messages.call_count == 1
+        assert stage.previous.handle_pipeline_event.call_count == 0
+
+    @pytest.mark.it("Fires an event for every message in the batch, in order, once it is delivered")
+    def test_delivers_batch(self, stage, create_transport, mocker):
+        deliver = stage._deliver_incoming_messages
+        mocker.patch.object(stage, "_deliver_incoming_messages")
+        for i in range(3):
+            stage.transport.on_mqtt_message_received_handler(topic=fake_topic, payload=i)
+
+        deliver()
+
+        events = [call[0][0] for call in stage.previous.handle_pipeline_event.call_args_list]
+        assert [event.payload for event in events] == [0, 1, 2]
+
+    @pytest.mark.it("Starts a new batch for a message received after the batch is delivered")
+    def test_new_batch(self, stage, create_transport, mocker):
+        deliver = stage._deliver_incoming_messages
+        mocker.patch.object(stage, "_deliver_incoming_messages")
+        stage.transport.on_mqtt_message_received_handler(topic=fake_topic, payload=fake_payload)
+        deliver()
+        stage.transport.on_mqtt_message_received_handler(topic=fake_topic, payload=fake_payload)
+
+        assert stage._deliver_incoming_messages.call_count == 2
+
 
 @pytest.mark.describe("MQTTTransportStage - EVENT: MQTT connected")
 class TestMQTTTransportStageOnConnected(MQTTTransportStageTestBase):
@@ -771,3 +926,150 @@ class TestMQTTTransportStageOnDisconnected(MQTTTransportStageTestBase):
         assert mock_handler.call_count == 1
         assert isinstance(mock_handler.call_args[0][0], transport_exceptions.ConnectionDroppedError)
         assert mock_handler.call_args[0][0].__cause__ is cause
+
+
+pipeline_stage_test.add_base_pipeline_stage_tests(
+    cls=pipeline_stages_mqtt.MQTTFlowControlStage,
+    module=this_module,
+    all_ops=all_common_ops,
+    handled_ops=[pipeline_ops_mqtt.MQTTPublishOperation],
+    all_events=all_common_events,
+    handled_events=[],
+    extra_initializer_defaults={"in_flight_count": 0},
+)
+
+
+class MQTTFlowControlStageTestBase(StageTestBase):
+    @pytest.fixture
+    def stage(self):
+        return pipeline_stages_mqtt.MQTTFlowControlStage()
+
+    @pytest.fixture
+    def make_publish_op(self, mocker):
+        def make_publish_op():
+            return pipeline_ops_mqtt.MQTTPublishOperation(
+                topic=fake_topic, payload=fake_payload, callback=mocker.MagicMock()
+            )
+
+        return make_publish_op
+
+    @pytest.fixture
+    def set_window(self, stage, stage_base_configuration):
+        def set_window(max_in_flight_messages, in_flight_policy="wait"):
+            pipeline_configuration = stage.pipeline_root.pipeline_configuration
+            pipeline_configuration.max_in_flight_messages = max_in_flight_messages
+            pipeline_configuration.in_flight_policy = in_flight_policy
+
+        return set_window
+
+
+@pytest.mark.describe("MQTTFlowControlStage - .run_op() -- called with MQTTPublishOperation")
+class TestMQTTFlowControlStageWithPublish(MQTTFlowControlStageTestBase):
+    @pytest.mark.it("Passes the operation down if max_in_flight_messages is not set")
+    def test_no_limit(self, stage, make_publish_op):
+        ops = [make_publish_op() for _ in range(100)]
+        for op in ops:
+            stage.run_op(op)
+
+        assert stage.next.run_op.call_count == 100
+        assert stage.in_flight_count == 100
+
+    @pytest.mark.it("Passes the operation down if the in-flight window has room")
+    @pytest.mark.parametrize("in_flight_policy", ["wait", "fail"])
+    def test_window_has_room(self, stage, set_window, make_publish_op, in_flight_policy):
+        set_window(2, in_flight_policy)
+        op1 = make_publish_op()
+        op2 = make_publish_op()
+
+        stage.run_op(op1)
+        stage.run_op(op2)
+
+        assert stage.next.run_op.call_count == 2
+        assert stage.next.run_op.call_args_list[0][0][0] is op1
+        assert stage.next.run_op.call_args_list[1][0][0] is op2
+        assert stage.in_flight_count == 2
+
+    @pytest.mark.it(
+        "Queues the operation if the in-flight window is full and in_flight_policy is 'wait'"
+    )
+    def test_queues_when_full(self, stage, set_window, make_publish_op):
+        set_window(1)
+        op1 = make_publish_op()
+        op2 = make_publish_op()
+
+        stage.run_op(op1)
+        stage.run_op(op2)
+
+        assert stage.next.run_op.call_count == 1
+        assert list(stage.queue) == [op2]
+        assert op2.callback.call_count == 0
+
+    @pytest.mark.it(
+        "Fails the operation with a PipelineBusyError if the in-flight window is full and in_flight_policy is 'fail'"
+    )
+    def test_fails_when_full(self, stage, set_window, make_publish_op):
+        set_window(1, "fail")
+        op1 = make_publish_op()
+        op2 = make_publish_op()
+
+        stage.run_op(op1)
+        stage.run_op(op2)
+
+        assert stage.next.run_op.call_count == 1
+        assert len(stage.queue) == 0
+        assert_callback_failed(op=op2, error=pipeline_exceptions.PipelineBusyError)
+
+    @pytest.mark.it("Completes the operation when the lower stage completes it")
+    def test_completes(self, stage, set_window, make_publish_op, arbitrary_exception):
+        set_window(2)
+        op1 = make_publish_op()
+        op2 = make_publish_op()
+        stage.run_op(op1)
+        stage.run_op(op2)
+
+        stage.next._complete_op(op1)
+        stage.next._complete_op(op2, error=arbitrary_exception)
+
+        assert_callback_succeeded(op=op1)
+        assert_callback_failed(op=op2, error=arbitrary_exception)
+        assert stage.in_flight_count == 0
+
+    @pytest.mark.it("Releases queued operations in order as in-flight operations complete")
+    def test_releases_queued(self, stage, set_window, make_publish_op, arbitrary_exception):
+        set_window(2)
+        ops = [make_publish_op() for _ in range(5)]
+        for op in ops:
+            stage.run_op(op)
+        assert stage.next.run_op.call_count == 2
+
+        stage.next._complete_op(ops[0])
+        assert stage.next.run_op.call_count == 3
+        assert stage.next.run_op.call_args[0][0] is ops[2]
+
+        # Failures also release room in the window
+        stage.next._complete_op(ops[1], error=arbitrary_exception)
+        assert stage.next.run_op.call_count == 4
+        assert stage.next.run_op.call_args[0][0] is ops[3]
+
+        assert stage.in_flight_count == 2
+        assert list(stage.queue) == [ops[4]]
+
+    @pytest.mark.it(
+        "Releases all queued operations if the lower stage completes them without waiting"
+    )
+    def test_releases_queued_sync_completion(
+        self, mocker, stage, set_window, make_publish_op, arbitrary_exception
+    ):
+        set_window(1)
+        ops = [make_publish_op() for _ in range(50)]
+        for op in ops:
+            stage.run_op(op)
+
+        stage.next._execute_op = mocker.MagicMock(side_effect=arbitrary_exception)
+        stage.next._complete_op(ops[0])
+
+        assert_callback_succeeded(op=ops[0])
+        for op in ops[1:]:
+            assert_callback_failed(op=op, error=arbitrary_exception)
+        assert stage.in_flight_count == 0
+        assert len(stage.queue) == 0
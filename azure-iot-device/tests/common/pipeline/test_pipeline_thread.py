@@ -0,0 +1,178 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import logging
+import threading
+import pytest
+from azure.iot.device.common import config
+from azure.iot.device.common.pipeline import pipeline_thread, pipeline_stages_base
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def make_root(executors):
+    root = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+    root.executors = executors
+    return root
+
+
+@pipeline_thread.invoke_on_pipeline_thread
+def get_pipeline_thread(stage):
+    """
+    Return the pipeline thread of the pipeline that stage belongs to
+    """
+    return threading.current_thread()
+
+
+@pytest.mark.describe("pipeline_thread - get_pipeline_executors()")
+class TestGetPipelineExecutors(object):
+    @pytest.mark.it("Returns None, for the process-wide set of executors, if shards is None")
+    def test_shared(self):
+        assert pipeline_thread.get_pipeline_executors("fake_device") is None
+
+    @pytest.mark.it("Returns a new set of executors every time if shards is PER_CLIENT")
+    def test_per_client(self):
+        executors = pipeline_thread.get_pipeline_executors(
+            "fake_device", shards=pipeline_thread.PER_CLIENT
+        )
+        assert executors == {}
+        assert (
+            pipeline_thread.get_pipeline_executors("fake_device", shards=pipeline_thread.PER_CLIENT)
+            is not executors
+        )
+
+    @pytest.mark.it("Always returns the same set of executors for the same client ID")
+    def test_sharded_stable(self):
+        executors = pipeline_thread.get_pipeline_executors("fake_device", shards=4)
+        assert pipeline_thread.get_pipeline_executors("fake_device", shards=4) is executors
+
+    @pytest.mark.it("Distributes client IDs across the given number of sets of executors")
+    def test_sharded_distribution(self):
+        shards = set(
+            id(pipeline_thread.get_pipeline_executors("device{}".format(i), shards=4))
+            for i in range(100)
+        )
+        assert len(shards) == 4
+
+
+@pytest.mark.describe("pipeline_thread - invoke_on_pipeline_thread()")
+class TestInvokeOnPipelineThread(object):
+    @pytest.mark.it("Runs methods of a stage on a thread named 'pipeline' owned by its pipeline")
+    def test_runs_on_own_thread(self):
+        root1 = make_root(
+            pipeline_thread.get_pipeline_executors("device1", shards=pipeline_thread.PER_CLIENT)
+        )
+        root2 = make_root(
+            pipeline_thread.get_pipeline_executors("device2", shards=pipeline_thread.PER_CLIENT)
+        )
+
+        thread1 = get_pipeline_thread(root1)
+        thread2 = get_pipeline_thread(root2)
+
+        assert thread1.name == "pipeline"
+        assert thread2.name == "pipeline"
+        assert thread1 is not thread2
+        assert get_pipeline_thread(root1) is thread1
+
+    @pytest.mark.it("Runs pipelines sharing a set of executors on the same thread")
+    def test_shared_thread(self):
+        executors = pipeline_thread.get_pipeline_executors("device1", shards=1)
+        assert get_pipeline_thread(make_root(executors)) is get_pipeline_thread(
+            make_root(executors)
+        )
+
+    @pytest.mark.it("Does not block a pipeline while another pipeline's thread is busy")
+    def test_isolation(self):
+        root1 = make_root(
+            pipeline_thread.get_pipeline_executors("device1", shards=pipeline_thread.PER_CLIENT)
+        )
+        root2 = make_root(
+            pipeline_thread.get_pipeline_executors("device2", shards=pipeline_thread.PER_CLIENT)
+        )
+        release = threading.Event()
+
+        @pipeline_thread.invoke_on_pipeline_thread_nowait
+        def block(stage):
+            release.wait()
+
+        block(root1)
+        try:
+            assert get_pipeline_thread(root2).name == "pipeline"
+        finally:
+            release.set()
+
+    @pytest.mark.it(
+        "Runs a function decorated on a pipeline thread on the same thread, when called from elsewhere"
+    )
+    def test_decorated_on_pipeline_thread(self):
+        root = make_root(
+            pipeline_thread.get_pipeline_executors("device1", shards=pipeline_thread.PER_CLIENT)
+        )
+
+        @pipeline_thread.invoke_on_pipeline_thread
+        def make_callback(stage):
+            @pipeline_thread.invoke_on_pipeline_thread
+            def callback():
+                return threading.current_thread()
+
+            return callback
+
+        callback = make_callback(root)
+        assert callback() is get_pipeline_thread(root)
+
+    @pytest.mark.it(
+        "Runs the function immediately if called on the pipeline thread of the same pipeline"
+    )
+    def test_same_pipeline(self):
+        root = make_root(
+            pipeline_thread.get_pipeline_executors("device1", shards=pipeline_thread.PER_CLIENT)
+        )
+
+        @pipeline_thread.invoke_on_pipeline_thread
+        def outer(stage):
+            return get_pipeline_thread(stage)
+
+        assert outer(root) is get_pipeline_thread(root)
+
+    @pytest.mark.it("Switches threads if called on the pipeline thread of a different pipeline")
+    def test_different_pipeline(self):
+        root1 = make_root(
+            pipeline_thread.get_pipeline_executors("device1", shards=pipeline_thread.PER_CLIENT)
+        )
+        root2 = make_root(
+            pipeline_thread.get_pipeline_executors("device2", shards=pipeline_thread.PER_CLIENT)
+        )
+
+        @pipeline_thread.invoke_on_pipeline_thread
+        def outer(stage, other_stage):
+            return get_pipeline_thread(other_stage)
+
+        assert outer(root1, root2) is get_pipeline_thread(root2)
+
+
+@pytest.mark.describe("pipeline_thread - invoke_on_callback_thread_nowait()")
+class TestInvokeOnCallbackThreadNowait(object):
+    @pytest.mark.it("Runs the function on the callback thread of the given set of executors")
+    def test_callback_thread(self):
+        executors1 = pipeline_thread.get_pipeline_executors(
+            "device1", shards=pipeline_thread.PER_CLIENT
+        )
+        executors2 = pipeline_thread.get_pipeline_executors(
+            "device2", shards=pipeline_thread.PER_CLIENT
+        )
+
+        def get_thread():
+            return threading.current_thread()
+
+        thread1 = pipeline_thread.invoke_on_callback_thread_nowait(
+            get_thread, executors=executors1
+        )().result()
+        thread2 = pipeline_thread.invoke_on_callback_thread_nowait(
+            get_thread, executors=executors2
+        )().result()
+
+        assert thread1.name == "callback"
+        assert thread2.name == "callback"
+        assert thread1 is not thread2
@@ -0,0 +1,212 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import logging
+import threading
+import pytest
+from azure.iot.device.common import config
+from azure.iot.device.common.evented_callback import EventedCallback
+from azure.iot.device.common.pipeline import (
+    pipeline_events_base,
+    pipeline_ops_base,
+    pipeline_stages_base,
+    pipeline_thread,
+    pipeline_tracing,
+)
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+class FakeSpan(object):
+    def __init__(self, name, attributes, start_time):
+        self.name = name
+        self.attributes = attributes
+        self.start_time = start_time
+        self.end_time = None
+
+    def end(self, end_time=None):
+        self.end_time = end_time
+
+
+class FakeSpanTracer(object):
+    """
+    Stand-in for an OpenTelemetry Tracer
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, attributes=None, start_time=None):
+        span = FakeSpan(name, attributes, start_time)
+        self.spans.append(span)
+        return span
+
+
+class CompletingStage(pipeline_stages_base.PipelineStage):
+    @pipeline_thread.runs_on_pipeline_thread
+    def _execute_op(self, op):
+        self._complete_op(op)
+
+
+@pytest.fixture
+def tracer():
+    return pipeline_tracing.PipelineTracer()
+
+
+@pytest.fixture
+def root(tracer):
+    root = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+    root.executors = pipeline_thread.get_pipeline_executors(
+        "fake_device", shards=pipeline_thread.PER_CLIENT
+    )
+    root.append_stage(pipeline_stages_base.EnsureConnectionStage())
+    root.set_tracer(tracer)
+    root.append_stage(CompletingStage())
+    root.connected = True
+    return root
+
+
+@pytest.mark.describe("LatencyHistogram")
+class TestLatencyHistogram(object):
+    @pytest.mark.it("Returns None for every statistic when nothing has been recorded")
+    def test_empty(self):
+        histogram = pipeline_tracing.LatencyHistogram()
+        assert histogram.count == 0
+        assert histogram.mean is None
+        assert histogram.percentile(50) is None
+
+    @pytest.mark.it("Keeps the count, total, min, max and mean of the recorded values")
+    def test_statistics(self):
+        histogram = pipeline_tracing.LatencyHistogram()
+        for seconds in (0.001, 0.002, 0.006):
+            histogram.record(seconds)
+        assert histogram.count == 3
+        assert histogram.total == pytest.approx(0.009)
+        assert histogram.min == 0.001
+        assert histogram.max == 0.006
+        assert histogram.mean == pytest.approx(0.003)
+
+    @pytest.mark.it("Returns percentiles within 1% of the exact value")
+    @pytest.mark.parametrize("percentile", [1, 50, 90, 99, 100])
+    def test_percentile_precision(self, percentile):
+        histogram = pipeline_tracing.LatencyHistogram()
+        # values from 100 microseconds to about 20 seconds
+        values = [1.07 ** i / 10000.0 for i in range(180)]
+        for seconds in values:
+            histogram.record(seconds)
+        exact = values[int(round(len(values) * percentile / 100.0)) - 1]
+        assert histogram.percentile(percentile) == pytest.approx(exact, rel=0.01)
+
+    @pytest.mark.it("Returns the recorded value for every percentile if all values are equal")
+    def test_percentile_single_value(self):
+        histogram = pipeline_tracing.LatencyHistogram()
+        for _ in range(10):
+            histogram.record(0.0123)
+        assert histogram.percentile(0) == 0.0123
+        assert histogram.percentile(100) == 0.0123
+
+
+@pytest.mark.describe("PipelineTracer - .end()")
+class TestPipelineTracerEnd(object):
+    @pytest.mark.it("Records the measurement in a histogram named after the stage and item")
+    def test_histogram(self, tracer):
+        start = tracer.start()
+        tracer.end(start, "run_op", "FakeStage", "FakeOperation")
+        tracer.end(tracer.start(), "queue", None, "pipeline")
+        assert set(tracer.histograms) == set(["run_op/FakeStage/FakeOperation", "queue/pipeline"])
+        assert tracer.histograms["run_op/FakeStage/FakeOperation"].count == 1
+
+    @pytest.mark.it("Measures the time with the monotonic clock, not the system clock")
+    def test_monotonic(self, mocker, tracer):
+        mocker.patch.object(pipeline_tracing, "_now", side_effect=[100.0, 100.25])
+        time_mock = mocker.patch.object(pipeline_tracing.time, "time")
+        start = tracer.start()
+        tracer.end(start, "run_op", "FakeStage", "FakeOperation")
+
+        assert tracer.histograms["run_op/FakeStage/FakeOperation"].total == 0.25
+        assert time_mock.call_count == 0
+
+    @pytest.mark.it(
+        "Reports the measurement as a span to the span tracer, if there is one, ending at the current time since the epoch"
+    )
+    def test_span(self, mocker):
+        mocker.patch.object(pipeline_tracing, "_now", side_effect=[100.0, 100.25])
+        mocker.patch.object(pipeline_tracing.time, "time", return_value=1600000000.0)
+        span_tracer = FakeSpanTracer()
+        tracer = pipeline_tracing.PipelineTracer(span_tracer=span_tracer)
+        start = tracer.start()
+        tracer.end(start, "run_op", "FakeStage", "FakeOperation")
+
+        assert len(span_tracer.spans) == 1
+        span = span_tracer.spans[0]
+        assert span.name == "pipeline.run_op"
+        assert span.attributes == {"pipeline.stage": "FakeStage", "pipeline.item": "FakeOperation"}
+        assert span.start_time == int(1599999999.75 * 1e9)
+        assert span.end_time == int(1600000000.0 * 1e9)
+
+    @pytest.mark.it("Summarizes every histogram in milliseconds")
+    def test_summary(self, tracer):
+        tracer.histograms["op/FakeOperation"] = pipeline_tracing.LatencyHistogram()
+        tracer.histograms["op/FakeOperation"].record(0.002)
+        summary = tracer.get_summary()
+        assert summary["op/FakeOperation"]["count"] == 1
+        assert summary["op/FakeOperation"]["p50_ms"] == pytest.approx(2)
+        assert summary["op/FakeOperation"]["max_ms"] == pytest.approx(2)
+
+
+@pytest.mark.describe("PipelineRootStage - .set_tracer()")
+class TestPipelineRootStageSetTracer(object):
+    @pytest.mark.it("Sets the tracer of every stage, including stages appended afterwards")
+    def test_sets_tracer(self, root, tracer):
+        stage = root
+        while stage:
+            assert stage.tracer is tracer
+            stage = stage.next
+
+    @pytest.mark.it("Records the time ops spend in each stage and in the whole pipeline")
+    def test_traces_op(self, root, tracer):
+        callback = EventedCallback()
+        root.run_op(
+            pipeline_ops_base.EnableFeatureOperation(feature_name="fake", callback=callback)
+        )
+        callback.wait_for_completion()
+
+        histograms = tracer.histograms
+        assert "queue/pipeline" in histograms
+        assert "run_op/PipelineRootStage/EnableFeatureOperation" in histograms
+        assert "run_op/EnsureConnectionStage/EnableFeatureOperation" in histograms
+        assert "run_op/CompletingStage/EnableFeatureOperation" in histograms
+        assert "complete_op/CompletingStage/EnableFeatureOperation" in histograms
+        assert histograms["op/EnableFeatureOperation"].count == 1
+
+    @pytest.mark.it("Records the time events spend passing up each stage")
+    def test_traces_event(self, root, tracer):
+        received = threading.Event()
+        root.on_pipeline_event_handler = lambda event: received.set()
+        bottom = root.next.next
+
+        @pipeline_thread.invoke_on_pipeline_thread
+        def send_event_up(stage, event):
+            stage._send_event_up(event)
+
+        send_event_up(
+            bottom,
+            pipeline_events_base.IotResponseEvent(
+                request_id="fake_id", status_code=200, response_body=b""
+            ),
+        )
+        assert received.wait(10)
+        assert "send_event_up/CompletingStage/IotResponseEvent" in tracer.histograms
+        assert "queue/callback" in tracer.histograms
+
+    @pytest.mark.it("Records nothing when set to None")
+    def test_none(self, root, tracer):
+        root.set_tracer(None)
+        callback = EventedCallback()
+        root.run_op(
+            pipeline_ops_base.EnableFeatureOperation(feature_name="fake", callback=callback)
+        )
+        callback.wait_for_completion()
+        assert tracer.histograms == {}
@@ -0,0 +1,412 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import asyncio
+import pytest
+import socket
+import threading
+import time
+import logging
+import paho.mqtt.client as mqtt
+import azure.iot.device.common.mqtt_transport as mqtt_transport
+from azure.iot.device.common.async_mqtt_transport import (
+    AsyncMQTTTransport,
+    encode_remaining_length,
+)
+from azure.iot.device.common import transport_exceptions as errors
+
+logging.basicConfig(level=logging.DEBUG)
+
+fake_username = "localhost/fake_device"
+fake_password = "fake_password"
+fake_topic = "devices/fake_device/messages/events/"
+wait_timeout = 10
+
+
+async def cancel_all_tasks(loop):
+    all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+    current_task = getattr(asyncio, "current_task", None) or asyncio.Task.current_task
+    tasks = [task for task in all_tasks(loop) if task is not current_task(loop)]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@pytest.fixture
+def event_loop_thread():
+    """
+    An event loop running on a background thread, as it would be in an asyncio application
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    yield loop
+    asyncio.run_coroutine_threadsafe(cancel_all_tasks(loop), loop).result(wait_timeout)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def create_transport(loop, client_id="fake_device", **kwargs):
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    transport = AsyncMQTTTransport(
+        client_id=client_id,
+        hostname="localhost",
+        username=fake_username,
+        ca_cert=get_ca_cert(),
+        loop=loop,
+        **kwargs
+    )
+    transport.connected = threading.Event()
+    transport.disconnected = threading.Event()
+    transport.failed = threading.Event()
+    transport.causes = []
+
+    def on_disconnected(cause):
+        transport.causes.append(cause)
+        transport.disconnected.set()
+
+    def on_connection_failure(cause):
+        transport.causes.append(cause)
+        transport.failed.set()
+
+    transport.on_mqtt_connected_handler = transport.connected.set
+    transport.on_mqtt_disconnected_handler = on_disconnected
+    transport.on_mqtt_connection_failure_handler = on_connection_failure
+    return transport
+
+
+@pytest.fixture
+def transport(event_loop_thread):
+    return create_transport(event_loop_thread)
+
+
+@pytest.fixture
+def connected_transport(mqtt_broker, transport):
+    transport.connect(fake_password)
+    assert transport.connected.wait(wait_timeout)
+    yield transport
+    transport.disconnect()
+
+
+@pytest.mark.describe("AsyncMQTTTransport - Packet encoding")
+class TestPacketEncoding(object):
+    @pytest.mark.it("Encodes the remaining length of a packet")
+    @pytest.mark.parametrize(
+        "length, encoded",
+        [
+            (0, b"\x00"),
+            (127, b"\x7f"),
+            (128, b"\x80\x01"),
+            (16383, b"\xff\x7f"),
+            (16384, b"\x80\x80\x01"),
+            (268435455, b"\xff\xff\xff\x7f"),
+        ],
+    )
+    def test_remaining_length(self, length, encoded):
+        assert encode_remaining_length(length) == encoded
+
+
+@pytest.mark.describe("AsyncMQTTTransport - Instantiation")
+class TestInstantiation(object):
+    @pytest.mark.it("Raises a ValueError if websockets is enabled")
+    def test_websockets(self, event_loop_thread):
+        with pytest.raises(ValueError):
+            AsyncMQTTTransport(
+                client_id="fake_device",
+                hostname="localhost",
+                username=fake_username,
+                websockets=True,
+                loop=event_loop_thread,
+            )
+
+    @pytest.mark.it("Raises a ValueError if no event loop is given")
+    def test_no_loop(self):
+        with pytest.raises(ValueError):
+            AsyncMQTTTransport(
+                client_id="fake_device", hostname="localhost", username=fake_username
+            )
+
+    @pytest.mark.it(
+        "Shares a cached SSLContext with MQTTTransports which have the same TLS settings"
+    )
+    def test_shares_ssl_context(self, mocker, event_loop_thread):
+        mocker.patch.object(mqtt, "Client")
+        mqtt_transport.ssl_context_cache.clear()
+        paho_transport = mqtt_transport.MQTTTransport(
+            client_id="fake_device", hostname="localhost", username=fake_username
+        )
+        transport = AsyncMQTTTransport(
+            client_id="fake_device",
+            hostname="localhost",
+            username=fake_username,
+            loop=event_loop_thread,
+        )
+        assert transport._ssl_context is paho_transport._ssl_context._ssl_context
+
+    @pytest.mark.it("Uses the operation_timeout for operation tracking")
+    def test_operation_timeout(self, event_loop_thread):
+        transport = create_transport(event_loop_thread, operation_timeout=30)
+        assert transport._op_manager.operation_timeout == 30
+
+
+@pytest.mark.describe("AsyncMQTTTransport - Argument validation")
+class TestArgumentValidation(object):
+    @pytest.mark.it("Raises a ValueError if a publish topic is empty or contains a wildcard")
+    @pytest.mark.parametrize("topic", [None, "", "devices/+/messages", "devices/#"])
+    def test_publish_topic(self, connected_transport, topic):
+        with pytest.raises(ValueError):
+            connected_transport.publish(topic=topic, payload="hello")
+
+    @pytest.mark.it("Raises a ValueError if a publish QoS is not 0 or 1")
+    @pytest.mark.parametrize("qos", [-1, 2, 3])
+    def test_publish_qos(self, connected_transport, qos):
+        with pytest.raises(ValueError):
+            connected_transport.publish(topic=fake_topic, payload="hello", qos=qos)
+
+    @pytest.mark.it("Raises a TypeError if a payload is not a valid type")
+    def test_payload_type(self, connected_transport):
+        with pytest.raises(TypeError):
+            connected_transport.publish(topic=fake_topic, payload=object())
+
+    @pytest.mark.it(
+        "Raises a ValueError if a subscribe topic list is empty or contains an empty topic"
+    )
+    @pytest.mark.parametrize("topic", [[], [fake_topic, ""]])
+    def test_subscribe_topic_list(self, connected_transport, topic):
+        with pytest.raises(ValueError):
+            connected_transport.subscribe(topic=topic)
+
+    @pytest.mark.it("Raises a ValueError if a subscribe QoS is not 0, 1 or 2")
+    @pytest.mark.parametrize("qos", [-1, 3])
+    def test_subscribe_qos(self, connected_transport, qos):
+        with pytest.raises(ValueError):
+            connected_transport.subscribe(topic=fake_topic, qos=qos)
+
+    @pytest.mark.it("Raises a ConnectionDroppedError for operations while not connected")
+    @pytest.mark.parametrize(
+        "operation",
+        [
+            pytest.param(lambda t: t.publish(topic=fake_topic, payload="hello"), id="publish"),
+            pytest.param(lambda t: t.subscribe(topic=fake_topic), id="subscribe"),
+            pytest.param(lambda t: t.unsubscribe(topic=fake_topic), id="unsubscribe"),
+        ],
+    )
+    def test_not_connected(self, transport, operation):
+        with pytest.raises(errors.ConnectionDroppedError):
+            operation(transport)
+
+
+@pytest.mark.describe("AsyncMQTTTransport - Connection")
+class TestConnection(object):
+    @pytest.mark.it("Calls on_mqtt_connected_handler once connected to the broker")
+    def test_connect(self, mqtt_broker, transport):
+        transport.connect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+        assert mqtt_broker.connect_count == 1
+        transport.disconnect()
+
+    @pytest.mark.it("Calls on_mqtt_disconnected_handler with no cause once disconnected")
+    def test_disconnect(self, mqtt_broker, connected_transport):
+        connected_transport.disconnect()
+        assert connected_transport.disconnected.wait(wait_timeout)
+        assert connected_transport.causes == [None]
+
+    @pytest.mark.it(
+        "Calls on_mqtt_disconnected_handler with a ConnectionDroppedError if the broker drops the connection"
+    )
+    def test_connection_dropped(self, mqtt_broker, connected_transport):
+        mqtt_broker.disconnect_all()
+        assert connected_transport.disconnected.wait(wait_timeout)
+        assert isinstance(connected_transport.causes[0], errors.ConnectionDroppedError)
+
+    @pytest.mark.it(
+        "Calls on_mqtt_connection_failure_handler with an error for the CONNACK return code if the broker refuses the connection"
+    )
+    def test_connection_refused(self, mqtt_broker, transport):
+        mqtt_broker.connack_rc = mqtt.CONNACK_REFUSED_NOT_AUTHORIZED
+        transport.connect(fake_password)
+        assert transport.failed.wait(wait_timeout)
+        assert isinstance(transport.causes[0], errors.UnauthorizedError)
+
+    @pytest.mark.it(
+        "Calls on_mqtt_connection_failure_handler with a ConnectionFailedError if the broker cannot be reached"
+    )
+    def test_connection_failed(self, monkeypatch, transport):
+        # Find a port with nothing listening on it
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        monkeypatch.setattr(mqtt_transport, "DEFAULT_PORT", sock.getsockname()[1])
+        sock.close()
+
+        transport.connect(fake_password)
+        assert transport.failed.wait(wait_timeout)
+        assert isinstance(transport.causes[0], errors.ConnectionFailedError)
+
+    @pytest.mark.it("Reconnects after the connection has been dropped")
+    def test_reconnect(self, mqtt_broker, connected_transport):
+        mqtt_broker.disconnect_all()
+        assert connected_transport.disconnected.wait(wait_timeout)
+
+        connected_transport.connected.clear()
+        connected_transport.reconnect(fake_password)
+        assert connected_transport.connected.wait(wait_timeout)
+        assert mqtt_broker.connect_count == 2
+
+    @pytest.mark.it("Services many connections on a single event loop without adding threads")
+    def test_many_connections(self, mqtt_broker, event_loop_thread):
+        threads_before = set(threading.enumerate())
+        transports = [
+            create_transport(event_loop_thread, client_id="device{}".format(i)) for i in range(50)
+        ]
+        for transport in transports:
+            transport.connect(fake_password)
+        for transport in transports:
+            assert transport.connected.wait(wait_timeout)
+
+        assert mqtt_broker.connection_count == 50
+        # Only the event loop's default executor (used for hostname resolution) may add threads
+        new_threads = set(threading.enumerate()) - threads_before
+        assert all(thread.name.startswith("asyncio") for thread in new_threads)
+
+        for transport in transports:
+            transport.disconnect()
+        for transport in transports:
+            assert transport.disconnected.wait(wait_timeout)
+
+
+@pytest.mark.describe("AsyncMQTTTransport - Operations")
+class TestOperations(object):
+    @pytest.mark.it("Completes a QoS 1 publish once the broker acknowledges it")
+    def test_publish_qos1(self, mqtt_broker, connected_transport):
+        published = threading.Event()
+        connected_transport.publish(topic=fake_topic, payload="hello", callback=published.set)
+        assert published.wait(wait_timeout)
+        assert list(mqtt_broker.received) == [(fake_topic, b"hello", 1)]
+
+    @pytest.mark.it("Completes a QoS 0 publish once it has been written")
+    def test_publish_qos0(self, mqtt_broker, connected_transport):
+        mqtt_broker.ack_publishes = False
+        published = threading.Event()
+        connected_transport.publish(
+            topic=fake_topic, payload="hello", qos=0, callback=published.set
+        )
+        assert published.wait(wait_timeout)
+
+    @pytest.mark.it("Fails a QoS 0 publish with a ConnectionDroppedError if it cannot be written")
+    def test_publish_qos0_write_failed(self, mocker, mqtt_broker, connected_transport):
+        mocker.patch.object(connected_transport, "_write", return_value=False)
+        failed = threading.Event()
+        errors_received = []
+
+        def callback(error=None):
+            errors_received.append(error)
+            failed.set()
+
+        connected_transport.publish(topic=fake_topic, payload="hello", qos=0, callback=callback)
+
+        assert failed.wait(wait_timeout)
+        assert isinstance(errors_received[0], errors.ConnectionDroppedError)
+
+    @pytest.mark.it("Completes subscribe and unsubscribe operations")
+    def test_subscribe_unsubscribe(self, mqtt_broker, connected_transport):
+        subscribed = threading.Event()
+        unsubscribed = threading.Event()
+        connected_transport.subscribe(topic="devices/fake_device/#", callback=subscribed.set)
+        assert subscribed.wait(wait_timeout)
+        connected_transport.unsubscribe(topic="devices/fake_device/#", callback=unsubscribed.set)
+        assert unsubscribed.wait(wait_timeout)
+
+    @pytest.mark.it("Subscribes to a list of topics with a single SUBSCRIBE packet")
+    def test_subscribe_topic_list(self, mqtt_broker, connected_transport):
+        subscribed = threading.Event()
+        connected_transport.subscribe(
+            topic=["devices/fake_device/#", "$iothub/methods/POST/#"], callback=subscribed.set
+        )
+        assert subscribed.wait(wait_timeout)
+        assert mqtt_broker.subscribe_packet_count == 1
+
+    @pytest.mark.it("Calls on_mqtt_message_received_handler for messages from the broker")
+    def test_receive(self, mqtt_broker, connected_transport):
+        received = threading.Event()
+        messages = []
+
+        def on_message(topic, payload):
+            messages.append((topic, payload))
+            received.set()
+
+        connected_transport.on_mqtt_message_received_handler = on_message
+        subscribed = threading.Event()
+        connected_transport.subscribe(topic="devices/fake_device/#", callback=subscribed.set)
+        assert subscribed.wait(wait_timeout)
+
+        mqtt_broker.publish(fake_topic, b"c2d message")
+
+        assert received.wait(wait_timeout)
+        assert messages == [(fake_topic, b"c2d message")]
+
+    @pytest.mark.it("Sends unacknowledged QoS 1 publishes again after reconnecting")
+    def test_resend_after_reconnect(self, mqtt_broker, connected_transport):
+        mqtt_broker.ack_publishes = False
+        published = threading.Event()
+        connected_transport.publish(topic=fake_topic, payload="hello", callback=published.set)
+        deadline = time.time() + wait_timeout
+        while mqtt_broker.publish_count < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        mqtt_broker.disconnect_all()
+        assert connected_transport.disconnected.wait(wait_timeout)
+        assert not published.is_set()
+
+        mqtt_broker.ack_publishes = True
+        connected_transport.reconnect(fake_password)
+
+        assert published.wait(wait_timeout)
+        assert mqtt_broker.publish_count == 2
+
+    @pytest.mark.it("Fails an operation with an OperationTimeoutError if it is not acknowledged")
+    def test_operation_timeout(self, mqtt_broker, event_loop_thread):
+        transport = create_transport(event_loop_thread, operation_timeout=0.1)
+        transport.connect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+        mqtt_broker.ack_publishes = False
+        timed_out = threading.Event()
+        errors_received = []
+
+        def callback(error=None):
+            errors_received.append(error)
+            timed_out.set()
+
+        transport.publish(topic=fake_topic, payload="hello", callback=callback)
+
+        assert timed_out.wait(wait_timeout)
+        assert isinstance(errors_received[0], errors.OperationTimeoutError)
+        transport.disconnect()
+
+    @pytest.mark.it("Does not send a QoS 1 publish again after reconnecting if it has timed out")
+    def test_no_resend_after_timeout(self, mqtt_broker, event_loop_thread):
+        transport = create_transport(event_loop_thread, operation_timeout=0.1)
+        transport.connect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+        mqtt_broker.ack_publishes = False
+        timed_out = threading.Event()
+        transport.publish(
+            topic=fake_topic, payload="hello", callback=lambda error=None: timed_out.set()
+        )
+        assert timed_out.wait(wait_timeout)
+        # Let the loop forget the publish before the connection is dropped
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), event_loop_thread).result(wait_timeout)
+        assert transport._unacknowledged_publishes == {}
+        mqtt_broker.disconnect_all()
+        assert transport.disconnected.wait(wait_timeout)
+
+        transport.connected.clear()
+        transport.reconnect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+
+        assert mqtt_broker.publish_count == 1
+        transport.disconnect()
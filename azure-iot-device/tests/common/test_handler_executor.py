@@ -0,0 +1,127 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import threading
+import logging
+from azure.iot.device.common import handle_exceptions
+from azure.iot.device.common.handler_executor import HandlerExecutor
+
+logging.basicConfig(level=logging.DEBUG)
+
+wait_timeout = 10
+
+
+@pytest.fixture
+def executor():
+    executor = HandlerExecutor(max_workers=4)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.describe("HandlerExecutor - Instantiation")
+class TestInstantiation(object):
+    @pytest.mark.it("Uses 4 workers by default")
+    def test_default_max_workers(self):
+        executor = HandlerExecutor()
+        assert executor.max_workers == 4
+        executor.shutdown()
+
+    @pytest.mark.it("Raises a ValueError if max_workers is less than 1")
+    def test_invalid_max_workers(self):
+        with pytest.raises(ValueError):
+            HandlerExecutor(max_workers=0)
+
+
+@pytest.mark.describe("HandlerExecutor - .submit()")
+class TestSubmit(object):
+    @pytest.mark.it(
+        "Runs the handler on a 'callback' thread and resolves the future with its result"
+    )
+    def test_runs_handler(self, executor):
+        def handler(a, b=None):
+            return (threading.current_thread().name, a, b)
+
+        future = executor.submit("key", handler, 1, b=2)
+
+        assert future.result(wait_timeout) == ("callback", 1, 2)
+
+    @pytest.mark.it(
+        "Runs handlers with the same key one at a time, in the order they were submitted"
+    )
+    def test_same_key_in_order(self, executor):
+        results = []
+        running = []
+
+        def handler(i):
+            running.append(i)
+            assert len(running) == 1
+            results.append(i)
+            running.remove(i)
+
+        futures = [executor.submit("key", handler, i) for i in range(200)]
+        for future in futures:
+            future.result(wait_timeout)
+
+        assert results == list(range(200))
+
+    @pytest.mark.it("Runs handlers with different keys in parallel")
+    def test_different_keys_in_parallel(self, executor):
+        release = threading.Event()
+        slow_future = executor.submit("slow", release.wait, wait_timeout)
+
+        fast_future = executor.submit("fast", lambda: "done")
+
+        assert fast_future.result(wait_timeout) == "done"
+        assert not slow_future.done()
+        release.set()
+        assert slow_future.result(wait_timeout) is True
+
+    @pytest.mark.it(
+        "Reports exceptions raised by a handler as background exceptions, and runs the next handler"
+    )
+    def test_handler_exception(self, mocker, executor):
+        mocker.spy(handle_exceptions, "handle_background_exception")
+        error = ValueError("fake error")
+
+        def handler():
+            raise error
+
+        failed_future = executor.submit("key", handler)
+        next_future = executor.submit("key", lambda: "done")
+
+        assert next_future.result(wait_timeout) == "done"
+        assert failed_future.exception(wait_timeout) is error
+        assert handle_exceptions.handle_background_exception.call_args == mocker.call(error)
+
+    @pytest.mark.it("Counts running and waiting handlers in pending_count")
+    def test_pending_count(self, executor):
+        release = threading.Event()
+        futures = [executor.submit("key", release.wait, wait_timeout) for _ in range(3)]
+
+        assert executor.pending_count == 3
+        release.set()
+        for future in futures:
+            future.result(wait_timeout)
+        executor.shutdown()
+        assert executor.pending_count == 0
+
+
+@pytest.mark.describe("HandlerExecutor - .shutdown()")
+class TestShutdown(object):
+    @pytest.mark.it("Waits for every submitted handler to run")
+    def test_waits_for_handlers(self):
+        executor = HandlerExecutor(max_workers=2)
+        results = []
+        for key in ("a", "b", "c"):
+            for i in range(20):
+                executor.submit(key, results.append, (key, i))
+
+        executor.shutdown()
+
+        assert len(results) == 60
+        for key in ("a", "b", "c"):
+            assert [i for k, i in results if k == key] == list(range(20))
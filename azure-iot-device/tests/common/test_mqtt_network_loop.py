@@ -0,0 +1,196 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import sys
+import threading
+import logging
+from azure.iot.device.common.mqtt_transport import MQTTTransport
+from azure.iot.device.common.mqtt_network_loop import MQTTNetworkLoop
+
+logging.basicConfig(level=logging.DEBUG)
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 4), reason="MQTTNetworkLoop requires Python 3.4+"
+)
+
+fake_username = "localhost/fake_device"
+fake_password = "fake_password"
+fake_topic = "devices/fake_device/messages/events/"
+wait_timeout = 10
+
+
+@pytest.fixture
+def network_loop():
+    network_loop = MQTTNetworkLoop(num_threads=2)
+    yield network_loop
+    network_loop.stop()
+
+
+def create_transport(client_id, network_loop):
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    transport = MQTTTransport(
+        client_id=client_id,
+        hostname="localhost",
+        username=fake_username,
+        ca_cert=get_ca_cert(),
+        network_loop=network_loop,
+    )
+    connected = threading.Event()
+    disconnected = threading.Event()
+    transport.on_mqtt_connected_handler = connected.set
+    transport.on_mqtt_disconnected_handler = lambda cause: disconnected.set()
+    transport.connected = connected
+    transport.disconnected = disconnected
+    return transport
+
+
+@pytest.mark.describe("MQTTNetworkLoop - Instantiation")
+class TestInstantiation(object):
+    @pytest.mark.it("Uses a single thread by default")
+    def test_default_num_threads(self):
+        assert MQTTNetworkLoop().num_threads == 1
+
+    @pytest.mark.it("Uses the number of threads provided")
+    def test_num_threads(self):
+        assert MQTTNetworkLoop(num_threads=4).num_threads == 4
+
+    @pytest.mark.it("Raises a ValueError if num_threads is less than 1")
+    def test_invalid_num_threads(self):
+        with pytest.raises(ValueError):
+            MQTTNetworkLoop(num_threads=0)
+
+    @pytest.mark.it("Does not start any threads until a socket is opened")
+    def test_lazy_threads(self):
+        thread_count = threading.active_count()
+        MQTTNetworkLoop(num_threads=4)
+        assert threading.active_count() == thread_count
+
+
+@pytest.mark.describe("MQTTNetworkLoop - .attach()")
+class TestAttach(object):
+    @pytest.mark.it("Sets the Paho socket callbacks on the client")
+    def test_sets_socket_callbacks(self, mocker):
+        network_loop = MQTTNetworkLoop()
+        mqtt_client = mocker.MagicMock()
+
+        network_loop.attach(mqtt_client)
+
+        assert mqtt_client.on_socket_open == network_loop._on_socket_open
+        assert mqtt_client.on_socket_close == network_loop._on_socket_close
+        assert mqtt_client.on_socket_register_write == network_loop._on_socket_register_write
+        assert mqtt_client.on_socket_unregister_write == network_loop._on_socket_unregister_write
+
+
+@pytest.mark.describe("MQTTNetworkLoop - Servicing MQTTTransport connections")
+class TestServicing(object):
+    @pytest.mark.it("Completes the MQTT connection for many transports without a thread per client")
+    def test_connect_many(self, mqtt_broker, network_loop):
+        thread_count = threading.active_count()
+        transports = [create_transport("device{}".format(i), network_loop) for i in range(10)]
+
+        for transport in transports:
+            transport.connect(fake_password)
+        for transport in transports:
+            assert transport.connected.wait(wait_timeout)
+
+        assert network_loop.socket_count == 10
+        assert mqtt_broker.connect_count == 10
+        # Only the loop threads have been added to the process
+        assert threading.active_count() <= thread_count + network_loop.num_threads
+
+        for transport in transports:
+            transport.disconnect()
+        for transport in transports:
+            assert transport.disconnected.wait(wait_timeout)
+
+    @pytest.mark.it("Spreads sockets evenly across the loop threads")
+    def test_balances_sockets(self, mqtt_broker, network_loop):
+        transports = [create_transport("device{}".format(i), network_loop) for i in range(4)]
+
+        for transport in transports:
+            transport.connect(fake_password)
+        for transport in transports:
+            assert transport.connected.wait(wait_timeout)
+
+        counts = [t.socket_count for t in network_loop._loop_threads]
+        assert counts == [2, 2]
+
+        for transport in transports:
+            transport.disconnect()
+
+    @pytest.mark.it("Completes publish, subscribe and unsubscribe operations")
+    def test_operations(self, mqtt_broker, network_loop):
+        transport = create_transport("device", network_loop)
+        transport.connect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+
+        subscribed = threading.Event()
+        published = threading.Event()
+        unsubscribed = threading.Event()
+        transport.subscribe(topic=fake_topic, qos=1, callback=subscribed.set)
+        assert subscribed.wait(wait_timeout)
+        transport.publish(topic=fake_topic, payload="hello", qos=1, callback=published.set)
+        assert published.wait(wait_timeout)
+        transport.unsubscribe(topic=fake_topic, callback=unsubscribed.set)
+        assert unsubscribed.wait(wait_timeout)
+
+        assert mqtt_broker.publish_count == 1
+        transport.disconnect()
+
+    @pytest.mark.it("Delivers messages received from the broker")
+    def test_receive(self, mqtt_broker, network_loop):
+        transport = create_transport("device", network_loop)
+        received = threading.Event()
+        messages = []
+
+        def on_message(topic, payload):
+            messages.append((topic, payload))
+            received.set()
+
+        transport.on_mqtt_message_received_handler = on_message
+        transport.connect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+        subscribed = threading.Event()
+        transport.subscribe(topic="devices/fake_device/#", qos=1, callback=subscribed.set)
+        assert subscribed.wait(wait_timeout)
+
+        mqtt_broker.publish(fake_topic, b"c2d message")
+
+        assert received.wait(wait_timeout)
+        assert messages == [(fake_topic, b"c2d message")]
+        transport.disconnect()
+
+    @pytest.mark.it("Stops servicing a socket when the connection is dropped by the broker")
+    def test_connection_dropped(self, mqtt_broker, network_loop):
+        transport = create_transport("device", network_loop)
+        transport.connect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+        assert network_loop.socket_count == 1
+
+        mqtt_broker.disconnect_all()
+
+        assert transport.disconnected.wait(wait_timeout)
+        assert network_loop.socket_count == 0
+
+    @pytest.mark.it("Services a reconnected transport")
+    def test_reconnect(self, mqtt_broker, network_loop):
+        transport = create_transport("device", network_loop)
+        transport.connect(fake_password)
+        assert transport.connected.wait(wait_timeout)
+        mqtt_broker.disconnect_all()
+        assert transport.disconnected.wait(wait_timeout)
+
+        transport.connected.clear()
+        transport.reconnect(fake_password)
+
+        assert transport.connected.wait(wait_timeout)
+        assert network_loop.socket_count == 1
+        # The reconnect resumed the TLS session of the dropped connection
+        assert transport.tls_resumption_hits == 1
+        assert mqtt_broker.tls_sessions_reused == 1
+        transport.disconnect()
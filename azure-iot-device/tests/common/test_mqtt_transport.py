@@ -11,6 +11,7 @@ from azure.iot.device.common import transport_exceptions as errors
 import paho.mqtt.client as mqtt
 import ssl
 import copy
+import threading
 import pytest
 import logging
 
@@ -116,6 +117,14 @@ operation_return_codes = [
 ]
 
 
+@pytest.fixture(autouse=True)
+def clear_ssl_context_cache():
+    # Contexts cached by one test must not be reused by another
+    mqtt_transport.ssl_context_cache.clear()
+    yield
+    mqtt_transport.ssl_context_cache.clear()
+
+
 @pytest.fixture
 def mock_mqtt_client(mocker):
     mock = mocker.patch.object(mqtt, "Client")
@@ -192,7 +201,8 @@ class TestInstantiation(object):
 
         # Verify context has been set
         assert mock_mqtt_client.tls_set_context.call_count == 1
-        assert mock_mqtt_client.tls_set_context.call_args == mocker.call(context=mock_ssl_context)
+        context = mock_mqtt_client.tls_set_context.call_args[1]["context"]
+        assert context._ssl_context is mock_ssl_context
 
     @pytest.mark.it(
         "Configures TLS/SSL context using default certificates if protocol wrapper not instantiated with a CA certificate"
@@ -247,6 +257,94 @@ class TestInstantiation(object):
             fake_client_cert.pass_phrase,
         )
 
+    @pytest.mark.it(
+        "Reuses the TLS/SSL context of an existing protocol wrapper with the same TLS settings"
+    )
+    @pytest.mark.parametrize(
+        "ca_cert, x509_cert",
+        [
+            pytest.param(None, None, id="Default certificates"),
+            pytest.param("dummy_certificate", None, id="CA certificate"),
+            pytest.param(
+                None, X509("fantastic_beasts", "where_to_find_them", "alohomora"), id="x509"
+            ),
+        ],
+    )
+    def test_reuses_tls_context(self, mocker, mock_mqtt_client, ca_cert, x509_cert):
+        mock_ssl_context_constructor = mocker.patch.object(ssl, "SSLContext")
+
+        transports = [
+            MQTTTransport(
+                client_id=fake_device_id + str(i),
+                hostname=fake_hostname,
+                username=fake_username,
+                ca_cert=ca_cert,
+                x509_cert=x509_cert,
+            )
+            for i in range(3)
+        ]
+
+        assert mock_ssl_context_constructor.call_count == 1
+        assert mock_mqtt_client.tls_set_context.call_count == len(transports)
+        for call in mock_mqtt_client.tls_set_context.call_args_list:
+            assert call[1]["context"]._ssl_context is mock_ssl_context_constructor.return_value
+
+    @pytest.mark.it(
+        "Creates a new TLS/SSL context for a protocol wrapper with different TLS settings"
+    )
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"ca_cert": "other_certificate"}, id="Different CA certificate"),
+            pytest.param(
+                {"x509_cert": X509("fantastic_beasts", "where_to_find_them", "alohomora")},
+                id="x509",
+            ),
+            pytest.param({"websockets": True}, id="Websockets"),
+        ],
+    )
+    def test_new_tls_context_for_different_settings(self, mocker, mock_mqtt_client, kwargs):
+        mock_ssl_context_constructor = mocker.patch.object(ssl, "SSLContext")
+        mock_ssl_context_constructor.side_effect = lambda protocol: mocker.MagicMock()
+
+        MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            ca_cert="dummy_certificate",
+        )
+        MQTTTransport(
+            client_id=fake_device_id, hostname=fake_hostname, username=fake_username, **kwargs
+        )
+
+        assert mock_ssl_context_constructor.call_count == 2
+
+    @pytest.mark.it(
+        "Creates a new TLS/SSL context if the client-provided certificate file has changed"
+    )
+    def test_new_tls_context_when_cert_file_changes(self, mocker, mock_mqtt_client, tmpdir):
+        mock_ssl_context_constructor = mocker.patch.object(ssl, "SSLContext")
+        mock_ssl_context_constructor.side_effect = lambda protocol: mocker.MagicMock()
+        cert_file = tmpdir.join("cert.pem")
+        cert_file.write("certificate")
+        x509_cert = X509(str(cert_file), "where_to_find_them", "alohomora")
+
+        MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            x509_cert=x509_cert,
+        )
+        cert_file.write("renewed certificate")
+        MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            x509_cert=x509_cert,
+        )
+
+        assert mock_ssl_context_constructor.call_count == 2
+
     @pytest.mark.it("Sets Paho MQTT Client callbacks")
     def test_sets_paho_callbacks(self, mocker):
         mock_mqtt_client = mocker.patch.object(mqtt, "Client").return_value
@@ -272,6 +370,20 @@ class TestInstantiation(object):
         assert transport.on_mqtt_disconnected_handler is None
         assert transport.on_mqtt_message_received_handler is None
 
+    @pytest.mark.it("Attaches the Paho MQTT Client to the network loop, if one is provided")
+    def test_attaches_to_network_loop(self, mocker, mock_mqtt_client):
+        network_loop = mocker.MagicMock()
+
+        MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            network_loop=network_loop,
+        )
+
+        assert network_loop.attach.call_count == 1
+        assert network_loop.attach.call_args == mocker.call(mock_mqtt_client)
+
     @pytest.mark.it("Initializes internal operation tracking structures")
     def test_operation_infrastructure_set_up(self, mocker):
         transport = MQTTTransport(
@@ -280,6 +392,17 @@ class TestInstantiation(object):
         assert transport._op_manager._pending_operation_callbacks == {}
         assert transport._op_manager._unknown_operation_completions == {}
 
+    @pytest.mark.it("Initializes operation tracking with the operation_timeout, if provided")
+    @pytest.mark.parametrize("operation_timeout", [None, 30])
+    def test_operation_timeout(self, mocker, operation_timeout):
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            operation_timeout=operation_timeout,
+        )
+        assert transport._op_manager.operation_timeout == operation_timeout
+
 
 @pytest.mark.describe("MQTTTransport - .connect()")
 class TestConnect(object):
@@ -369,6 +492,18 @@ class TestConnect(object):
         assert mock_mqtt_client.loop_start.call_count == 1
         assert mock_mqtt_client.loop_start.call_args == mocker.call()
 
+    @pytest.mark.it("Does not start the Paho network loop thread if a network loop is provided")
+    def test_no_loop_start_with_network_loop(self, mocker, mock_mqtt_client):
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            network_loop=mocker.MagicMock(),
+        )
+        transport.connect(fake_password)
+
+        assert mock_mqtt_client.loop_start.call_count == 0
+
     @pytest.mark.it("Raises a ProtocolClientError if Paho connect raises an unexpected Exception")
     def test_client_raises_unexpected_error(
         self, mocker, mock_mqtt_client, transport, arbitrary_exception
@@ -473,6 +608,106 @@ class TestReconnect(object):
             transport.reconnect(fake_password)
 
 
+@pytest.mark.describe("MQTTTransport - TLS session resumption")
+class TestTLSSessionResumption(object):
+    @pytest.fixture
+    def mock_ssl_context(self, mocker):
+        return mocker.patch.object(ssl, "SSLContext").return_value
+
+    @pytest.fixture
+    def paho_connect(self, mocker, mock_mqtt_client, mock_ssl_context):
+        """
+        Simulate Paho wrapping a new socket with the configured context, followed by a CONNACK
+        """
+
+        def paho_connect(session_reused=False, rc=fake_rc):
+            context = mock_mqtt_client.tls_set_context.call_args[1]["context"]
+            ssl_socket = mocker.MagicMock()
+            ssl_socket.session_reused = session_reused
+            mock_ssl_context.wrap_socket.return_value = ssl_socket
+            context.wrap_socket(
+                mocker.MagicMock(), server_hostname=fake_hostname, do_handshake_on_connect=False
+            )
+            mock_mqtt_client.on_connect(client=mock_mqtt_client, userdata=None, flags=None, rc=rc)
+            return ssl_socket
+
+        return paho_connect
+
+    @pytest.mark.it("Does not offer a TLS session on the first connection")
+    def test_first_connection(self, mocker, mock_ssl_context, transport, paho_connect):
+        paho_connect()
+
+        assert mock_ssl_context.wrap_socket.call_count == 1
+        assert "session" not in mock_ssl_context.wrap_socket.call_args[1]
+        assert transport.tls_resumption_hits == 0
+        assert transport.tls_resumption_misses == 0
+
+    @pytest.mark.it("Offers the TLS session of the last successful connection when reconnecting")
+    def test_offers_session(self, mocker, mock_ssl_context, transport, paho_connect):
+        first_socket = paho_connect()
+        paho_connect()
+
+        assert mock_ssl_context.wrap_socket.call_count == 2
+        assert mock_ssl_context.wrap_socket.call_args == mocker.call(
+            mocker.ANY,
+            server_hostname=fake_hostname,
+            do_handshake_on_connect=False,
+            session=first_socket.session,
+        )
+
+    @pytest.mark.it("Does not save the TLS session of a connection that was refused")
+    def test_refused_connection(self, mocker, mock_ssl_context, transport, paho_connect):
+        transport.on_mqtt_connection_failure_handler = mocker.MagicMock()
+        paho_connect(rc=failed_conack_rc)
+        paho_connect()
+
+        assert "session" not in mock_ssl_context.wrap_socket.call_args[1]
+
+    @pytest.mark.it("Counts a TLS resumption hit if the offered session was resumed")
+    def test_hit(self, mock_ssl_context, transport, paho_connect):
+        paho_connect()
+        paho_connect(session_reused=True)
+
+        assert transport.tls_resumption_hits == 1
+        assert transport.tls_resumption_misses == 0
+
+    @pytest.mark.it("Counts a TLS resumption miss if the offered session was not resumed")
+    def test_miss(self, mock_ssl_context, transport, paho_connect):
+        paho_connect()
+        paho_connect(session_reused=False)
+
+        assert transport.tls_resumption_hits == 0
+        assert transport.tls_resumption_misses == 1
+
+    @pytest.mark.it("Resumes the TLS session when connecting to a TLS MQTT broker again")
+    def test_resumes_session_with_broker(self, mqtt_broker):
+        from tests.common.fake_mqtt_broker import get_ca_cert
+
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname="localhost",
+            username=fake_username,
+            ca_cert=get_ca_cert(),
+        )
+        connected = threading.Event()
+        disconnected = threading.Event()
+        transport.on_mqtt_connected_handler = connected.set
+        transport.on_mqtt_disconnected_handler = lambda cause: disconnected.set()
+
+        for _ in range(3):
+            connected.clear()
+            disconnected.clear()
+            transport.connect(fake_password)
+            assert connected.wait(10)
+            transport.disconnect()
+            assert disconnected.wait(10)
+
+        assert mqtt_broker.connect_count == 3
+        assert mqtt_broker.tls_sessions_reused == 2
+        assert transport.tls_resumption_hits == 2
+        assert transport.tls_resumption_misses == 0
+
+
 @pytest.mark.describe("MQTTTransport - EVENT: Connect Completed")
 class TestEventConnectComplete(object):
     @pytest.mark.it(
@@ -623,6 +858,18 @@ class TestDisconnect(object):
         assert mock_mqtt_client.loop_stop.call_count == 1
         assert mock_mqtt_client.loop_stop.call_args == mocker.call()
 
+    @pytest.mark.it("Does not stop the Paho network loop thread if a network loop is provided")
+    def test_no_loop_stop_with_network_loop(self, mocker, mock_mqtt_client):
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            network_loop=mocker.MagicMock(),
+        )
+        transport.disconnect()
+
+        assert mock_mqtt_client.loop_stop.call_count == 0
+
     @pytest.mark.it(
         "Raises a ProtocolClientError if Paho disconnect raises an unexpected Exception"
     )
@@ -781,6 +1028,20 @@ class TestSubscribe(object):
         assert mock_mqtt_client.subscribe.call_count == 1
         assert mock_mqtt_client.subscribe.call_args == mocker.call(fake_topic, qos=qos)
 
+    @pytest.mark.it("Subscribes to a list of topics with a single Paho subscribe")
+    @pytest.mark.parametrize(
+        "qos",
+        [pytest.param(0, id="QoS 0"), pytest.param(1, id="QoS 1"), pytest.param(2, id="QoS 2")],
+    )
+    def test_calls_paho_subscribe_with_topic_list(self, mocker, mock_mqtt_client, transport, qos):
+        topics = [fake_topic, "$iothub/methods/POST/#"]
+        transport.subscribe(topics, qos=qos)
+
+        assert mock_mqtt_client.subscribe.call_count == 1
+        assert mock_mqtt_client.subscribe.call_args == mocker.call(
+            [(fake_topic, qos), ("$iothub/methods/POST/#", qos)]
+        )
+
     @pytest.mark.it("Raises ValueError on invalid QoS")
     @pytest.mark.parametrize("qos", [pytest.param(-1, id="QoS < 0"), pytest.param(3, id="QoS > 2")])
     def test_raises_value_error_invalid_qos(self, qos):
@@ -792,7 +1053,14 @@ class TestSubscribe(object):
             transport.subscribe(fake_topic, qos=qos)
 
     @pytest.mark.it("Raises ValueError on invalid topic string")
-    @pytest.mark.parametrize("topic", [pytest.param(None), pytest.param("", id="Empty string")])
+    @pytest.mark.parametrize(
+        "topic",
+        [
+            pytest.param(None),
+            pytest.param("", id="Empty string"),
+            pytest.param([], id="Empty list"),
+        ],
+    )
     def test_raises_value_error_invalid_topic(self, topic):
         # Manually instantiate protocol wrapper, do NOT mock paho client (paho generates this error)
         transport = MQTTTransport(
@@ -1373,6 +1641,38 @@ class TestPublish(object):
         with pytest.raises(TypeError):
             transport.publish(topic=fake_topic, payload=payload, qos=fake_qos)
 
+    @pytest.mark.it("Logs the publish and its completion at INFO level by default")
+    def test_logs_at_info(self, caplog, mock_mqtt_client, transport, message_info):
+        mock_mqtt_client.publish.return_value = message_info
+        with caplog.at_level(logging.DEBUG, logger="azure.iot.device.common.mqtt_transport"):
+            transport.publish(topic=fake_topic, payload=fake_payload)
+            mock_mqtt_client.on_publish(
+                client=mock_mqtt_client, userdata=None, mid=message_info.mid
+            )
+
+        levels = {r.getMessage(): r.levelno for r in caplog.records}
+        assert levels["publishing on {}".format(fake_topic)] == logging.INFO
+        assert levels["payload published for {}".format(fake_mid)] == logging.INFO
+
+    @pytest.mark.it("Logs the publish and its completion at DEBUG level if quiet_logging is set")
+    def test_quiet_logging(self, caplog, mock_mqtt_client, message_info):
+        transport = MQTTTransport(
+            client_id=fake_device_id,
+            hostname=fake_hostname,
+            username=fake_username,
+            quiet_logging=True,
+        )
+        mock_mqtt_client.publish.return_value = message_info
+        with caplog.at_level(logging.DEBUG, logger="azure.iot.device.common.mqtt_transport"):
+            transport.publish(topic=fake_topic, payload=fake_payload)
+            mock_mqtt_client.on_publish(
+                client=mock_mqtt_client, userdata=None, mid=message_info.mid
+            )
+
+        levels = {r.getMessage(): r.levelno for r in caplog.records}
+        assert levels["publishing on {}".format(fake_topic)] == logging.DEBUG
+        assert levels["payload published for {}".format(fake_mid)] == logging.DEBUG
+
     @pytest.mark.it("Triggers callback upon publish completion")
     def test_triggers_callback_upon_paho_on_publish_event(
         self, mocker, mock_mqtt_client, transport, message_info
@@ -1912,6 +2212,26 @@ class TestOperationManagerCompleteOperation(object):
             manager.complete_operation(mid)
         assert e_info.value is arbitrary_base_exception
 
+    @pytest.mark.it("Triggers callback with the error, if one is given, for a pending operation")
+    def test_complete_pending_operation_error(self, mocker, arbitrary_exception):
+        manager = OperationManager()
+        mid = 1
+        cb_mock = mocker.MagicMock()
+
+        manager.establish_operation(mid, cb_mock)
+        manager.complete_operation(mid, error=arbitrary_exception)
+
+        assert cb_mock.call_args == mocker.call(error=arbitrary_exception)
+        assert len(manager._pending_operation_callbacks) == 0
+
+    @pytest.mark.it("Does not track an unknown completion if an error is given")
+    def test_early_failure(self, arbitrary_exception):
+        manager = OperationManager()
+        mid = 1
+
+        manager.complete_operation(mid, error=arbitrary_exception)
+        assert len(manager._unknown_operation_completions) == 0
+
     @pytest.mark.it(
         "Begins tracking an unknown completion if MID does not correspond to a pending operation"
     )
@@ -1959,3 +2279,280 @@ class TestOperationManagerCompleteOperation(object):
 
         # Callback WAS NOT called while the lock was held
         assert mocker.call.cb() not in calls_during_lock
+
+
+@pytest.mark.describe("OperationManager - .expire_operations()")
+class TestOperationManagerExpireOperations(object):
+    @pytest.fixture
+    def manager(self, mocker):
+        # The sweeper is tested separately; these tests call expire_operations() directly
+        mocker.patch.object(mqtt_transport.operation_timeout_sweeper, "register")
+        return OperationManager(operation_timeout=10)
+
+    @pytest.mark.it("Registers with the operation timeout sweeper if an operation_timeout is set")
+    @pytest.mark.parametrize(
+        "operation_timeout, registered", [(10, True), (None, False)], ids=["Timeout", "No timeout"]
+    )
+    def test_registers(self, mocker, operation_timeout, registered):
+        register = mocker.patch.object(mqtt_transport.operation_timeout_sweeper, "register")
+        manager = OperationManager(operation_timeout=operation_timeout)
+        if registered:
+            assert register.call_args == mocker.call(manager)
+        else:
+            assert register.call_count == 0
+
+    @pytest.mark.it(
+        "Triggers the callback of each operation whose deadline has passed with an OperationTimeoutError"
+    )
+    def test_expires(self, mocker, manager):
+        cb_mock1 = mocker.MagicMock()
+        cb_mock2 = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock1)
+        manager.establish_operation(2, cb_mock2)
+
+        manager.expire_operations(mqtt_transport._now() + 11)
+
+        for cb_mock in [cb_mock1, cb_mock2]:
+            assert cb_mock.call_count == 1
+            assert isinstance(cb_mock.call_args[1]["error"], errors.OperationTimeoutError)
+        assert len(manager._pending_operation_callbacks) == 0
+        assert len(manager._pending_operation_deadlines) == 0
+
+    @pytest.mark.it("Does not expire operations whose deadline has not passed")
+    def test_not_expired(self, mocker, manager):
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+
+        manager.expire_operations(mqtt_transport._now() + 5)
+
+        assert cb_mock.call_count == 0
+        assert len(manager._pending_operation_callbacks) == 1
+
+    @pytest.mark.it("Does not expire operations that have already completed")
+    def test_completed(self, mocker, manager):
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+        manager.complete_operation(1)
+
+        manager.expire_operations(mqtt_transport._now() + 11)
+
+        assert cb_mock.call_count == 1
+        assert cb_mock.call_args == mocker.call()
+
+    @pytest.mark.it("Never expires operations if there is no operation_timeout")
+    def test_no_timeout(self, mocker):
+        manager = OperationManager()
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+
+        manager.expire_operations(mqtt_transport._now() + 3600)
+
+        assert cb_mock.call_count == 0
+
+    @pytest.mark.it("Treats a response for an expired operation as an unknown completion")
+    def test_late_response(self, mocker, manager):
+        cb_mock = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock)
+        manager.expire_operations(mqtt_transport._now() + 11)
+
+        manager.complete_operation(1)
+
+        assert cb_mock.call_count == 1
+        assert 1 in manager._unknown_operation_completions
+
+    @pytest.mark.it("Recovers from Exception thrown in callback")
+    def test_callback_raises_exception(self, mocker, manager, arbitrary_exception):
+        cb_mock1 = mocker.MagicMock(side_effect=arbitrary_exception)
+        cb_mock2 = mocker.MagicMock()
+        manager.establish_operation(1, cb_mock1)
+        manager.establish_operation(2, cb_mock2)
+
+        manager.expire_operations(mqtt_transport._now() + 11)
+
+        assert cb_mock1.call_count == 1
+        assert cb_mock2.call_count == 1
+
+    @pytest.mark.it("Discards unknown completions older than UNKNOWN_COMPLETION_TTL")
+    def test_ages_unknown_completions(self, manager):
+        manager.complete_operation(1)
+
+        manager.expire_operations(mqtt_transport._now() + mqtt_transport.UNKNOWN_COMPLETION_TTL)
+
+        assert len(manager._unknown_operation_completions) == 0
+
+    @pytest.mark.it("Keeps no more than MAX_UNKNOWN_COMPLETIONS unknown completions")
+    def test_bounds_unknown_completions(self, manager):
+        for mid in range(mqtt_transport.MAX_UNKNOWN_COMPLETIONS + 10):
+            manager.complete_operation(mid)
+
+        assert len(manager._unknown_operation_completions) == mqtt_transport.MAX_UNKNOWN_COMPLETIONS
+        # The oldest were discarded
+        assert 0 not in manager._unknown_operation_completions
+        assert mqtt_transport.MAX_UNKNOWN_COMPLETIONS + 9 in manager._unknown_operation_completions
+
+    @pytest.mark.it("Does not grow in memory over 100,000 operations")
+    @pytest.mark.parametrize(
+        "outcome", ["completed", "early completion", "expired", "unknown completion"]
+    )
+    def test_flat_memory(self, mocker, manager, outcome):
+        tracemalloc = pytest.importorskip("tracemalloc")
+        # Neither the callback nor pytest's log capture may retain anything per operation
+        mocker.patch.object(mqtt_transport.logger, "disabled", True)
+
+        def callback(error=None):
+            pass
+
+        def run_ops(mids):
+            for mid in mids:
+                # Paho MIDs wrap at 65535
+                mid = mid % 65535 + 1
+                if outcome == "completed":
+                    manager.establish_operation(mid, callback)
+                    manager.complete_operation(mid)
+                elif outcome == "early completion":
+                    manager.complete_operation(mid)
+                    manager.establish_operation(mid, callback)
+                elif outcome == "expired":
+                    manager.establish_operation(mid, callback)
+                    if mid % 1000 == 0:
+                        manager.expire_operations(mqtt_transport._now() + 11)
+                else:
+                    manager.complete_operation(mid)
+
+        tracemalloc.start()
+        try:
+            # Warm up, so that the tracking structures reach their steady state size
+            run_ops(range(10000))
+            before = tracemalloc.get_traced_memory()[0]
+            run_ops(range(10000, 110000))
+            manager.expire_operations(mqtt_transport._now() + 11)
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        assert len(manager._pending_operation_callbacks) == 0
+        assert len(manager._pending_operation_deadlines) == 0
+        assert len(manager._unknown_operation_completions) <= mqtt_transport.MAX_UNKNOWN_COMPLETIONS
+        assert after - before < 64 * 1024
+
+
+@pytest.mark.describe("OperationTimeoutSweeper")
+class TestOperationTimeoutSweeper(object):
+    @pytest.fixture
+    def sweeper(self):
+        return mqtt_transport.OperationTimeoutSweeper(interval=0.01)
+
+    @pytest.mark.it("Does not start a thread until an OperationManager is registered")
+    def test_lazy_thread(self, sweeper):
+        assert sweeper._thread is None
+
+    @pytest.mark.it("Uses a single thread for all registered OperationManagers")
+    def test_single_thread(self, mocker, sweeper):
+        managers = [mocker.MagicMock() for _ in range(10)]
+        threads = set()
+        for manager in managers:
+            sweeper.register(manager)
+            threads.add(sweeper._thread)
+        assert len(threads) == 1
+
+    @pytest.mark.it("Periodically expires the operations of every registered OperationManager")
+    def test_sweeps(self, mocker, sweeper):
+        swept = [threading.Event(), threading.Event()]
+        managers = [
+            mocker.MagicMock(**{"expire_operations.side_effect": lambda now, e=e: e.set()})
+            for e in swept
+        ]
+        for manager in managers:
+            sweeper.register(manager)
+
+        assert swept[0].wait(5)
+        assert swept[1].wait(5)
+
+    @pytest.mark.it("Fails a pending operation with an OperationTimeoutError once it times out")
+    def test_times_out_operation(self, mocker, sweeper):
+        mocker.patch.object(mqtt_transport, "operation_timeout_sweeper", sweeper)
+        manager = OperationManager(operation_timeout=0.05)
+        timed_out = threading.Event()
+        errors_received = []
+
+        def callback(error=None):
+            errors_received.append(error)
+            timed_out.set()
+
+        manager.establish_operation(1, callback)
+
+        assert timed_out.wait(5)
+        assert isinstance(errors_received[0], errors.OperationTimeoutError)
+
+    @pytest.mark.it("Stops its thread once all registered OperationManagers have been collected")
+    def test_thread_exits(self, mocker, sweeper):
+        sweeper.register(OperationManager())
+        thread = sweeper._thread
+
+        thread.join(5)
+
+        assert not thread.is_alive()
+        assert sweeper._thread is None
+
+
+@pytest.mark.describe("SSLContextCache")
+class TestSSLContextCache(object):
+    @pytest.fixture
+    def cache(self):
+        return mqtt_transport.SSLContextCache()
+
+    @pytest.fixture
+    def key(self):
+        return ("ca_digest", None, None, None, False)
+
+    @pytest.mark.it("Creates and returns a new context on the first request for a key")
+    def test_miss(self, mocker, cache, key):
+        ssl_context = mocker.MagicMock()
+        create_context = mocker.MagicMock(return_value=ssl_context)
+
+        assert cache.get_or_create(key, create_context) is ssl_context
+        assert create_context.call_count == 1
+        assert cache.misses == 1
+        assert cache.hits == 0
+
+    @pytest.mark.it("Returns the cached context on subsequent requests for the same key")
+    def test_hit(self, mocker, cache, key):
+        ssl_context = mocker.MagicMock()
+        create_context = mocker.MagicMock(return_value=ssl_context)
+
+        cache.get_or_create(key, create_context)
+        assert cache.get_or_create(key, create_context) is ssl_context
+        assert create_context.call_count == 1
+        assert cache.misses == 1
+        assert cache.hits == 1
+
+    @pytest.mark.it("Does not keep a context alive once it is no longer used")
+    def test_weak_reference(self, cache, key):
+        class FakeSSLContext(object):
+            pass
+
+        # The returned contexts are not stored anywhere, so each is freed immediately
+        cache.get_or_create(key, FakeSSLContext)
+        cache.get_or_create(key, FakeSSLContext)
+
+        assert cache.misses == 2
+        assert len(cache._contexts) == 1
+
+    @pytest.mark.it("Does not cache a context if creating it raises an exception")
+    def test_create_raises(self, mocker, cache, key, arbitrary_exception):
+        create_context = mocker.MagicMock(side_effect=arbitrary_exception)
+
+        with pytest.raises(type(arbitrary_exception)):
+            cache.get_or_create(key, create_context)
+        assert cache._contexts == {}
+
+    @pytest.mark.it("Creates a new context after being cleared")
+    def test_clear(self, mocker, cache, key):
+        ssl_context = mocker.MagicMock()
+        create_context = mocker.MagicMock(return_value=ssl_context)
+
+        cache.get_or_create(key, create_context)
+        cache.clear()
+        cache.get_or_create(key, create_context)
+
+        assert create_context.call_count == 2
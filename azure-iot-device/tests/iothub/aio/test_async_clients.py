@@ -328,6 +328,11 @@ class SharedClientConnectTests(object):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -377,6 +382,11 @@ class SharedClientDisconnectTests(object):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -452,6 +462,16 @@ class SharedClientSendD2CMessageTests(object):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
+            pytest.param(
+                pipeline_exceptions.PipelineBusyError,
+                client_exceptions.ClientBusyError,
+                id="PipelineBusyError->ClientBusyError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -493,6 +513,53 @@ class SharedClientSendD2CMessageTests(object):
         assert sent_message.data == message_input
 
 
+class SharedClientSendD2CMessagesTests(object):
+    @pytest.mark.it("Begins a single 'send_messages' pipeline operation for all the messages")
+    async def test_calls_pipeline_send_messages(self, client, iothub_pipeline, message):
+        messages = [message, Message("other message")]
+        await client.send_messages(iter(messages))
+        assert iothub_pipeline.send_messages.call_count == 1
+        assert iothub_pipeline.send_messages.call_args[0][0] == messages
+        assert iothub_pipeline.send_message.call_count == 0
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'send_messages' pipeline operation before returning"
+    )
+    async def test_waits_for_pipeline_op_completion(self, mocker, client, iothub_pipeline, message):
+        cb_mock = mocker.patch.object(async_adapter, "AwaitableCallback").return_value
+        cb_mock.completion.return_value = await create_completed_future([None])
+
+        await client.send_messages([message])
+
+        # Assert callback is sent to pipeline
+        assert iothub_pipeline.send_messages.call_args[1]["callback"] is cb_mock
+        # Assert callback completion is waited upon
+        assert cb_mock.completion.call_count == 1
+
+    @pytest.mark.it(
+        "Returns None for each message that was sent, and a client error for each message that failed"
+    )
+    async def test_returns_results(self, mocker, client, iothub_pipeline, message):
+        my_pipeline_error = pipeline_exceptions.ConnectionDroppedError()
+
+        def send_messages(messages, callback):
+            callback(results=[None, my_pipeline_error])
+
+        iothub_pipeline.send_messages = mocker.MagicMock(side_effect=send_messages)
+        results = await client.send_messages([message, message])
+        assert results[0] is None
+        assert isinstance(results[1], client_exceptions.ConnectionDroppedError)
+        assert results[1].__cause__ is my_pipeline_error
+
+    @pytest.mark.it("Wraps inputs which are not Message objects in Message objects")
+    async def test_wraps_data_in_message(self, client, iothub_pipeline, message):
+        await client.send_messages([message, "message", 222])
+        sent_messages = iothub_pipeline.send_messages.call_args[0][0]
+        assert sent_messages[0] is message
+        assert [sent_message.data for sent_message in sent_messages[1:]] == ["message", 222]
+        assert all(isinstance(sent_message, Message) for sent_message in sent_messages)
+
+
 class SharedClientReceiveMethodRequestTests(object):
     @pytest.mark.it("Implicitly enables methods feature if not already enabled")
     @pytest.mark.parametrize(
@@ -619,6 +686,11 @@ class SharedClientSendMethodResponseTests(object):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -639,6 +711,105 @@ class SharedClientSendMethodResponseTests(object):
         assert iothub_pipeline.send_method_response.call_count == 1
 
 
+class SharedClientEnableFeaturesTests(object):
+    @pytest.fixture
+    def feature_names(self):
+        return [constant.METHODS, constant.TWIN, constant.TWIN_PATCHES]
+
+    @pytest.mark.it(
+        "Begins a single 'enable_features' pipeline operation for the features which are not already enabled"
+    )
+    async def test_calls_pipeline_enable_features(self, client, iothub_pipeline, feature_names):
+        iothub_pipeline.feature_enabled.__contains__.return_value = True
+        iothub_pipeline.feature_enabled.__getitem__.side_effect = (
+            lambda feature_name: feature_name == constant.TWIN
+        )  # Only twin will appear enabled
+        await client.enable_features(feature_names)
+        assert iothub_pipeline.enable_features.call_count == 1
+        assert iothub_pipeline.enable_features.call_args[0][0] == [
+            constant.METHODS,
+            constant.TWIN_PATCHES,
+        ]
+        assert iothub_pipeline.enable_feature.call_count == 0
+
+    @pytest.mark.it(
+        "Does not begin a pipeline operation if all of the features are already enabled"
+    )
+    async def test_all_features_already_enabled(self, client, iothub_pipeline, feature_names):
+        iothub_pipeline.feature_enabled.__contains__.return_value = True
+        iothub_pipeline.feature_enabled.__getitem__.return_value = True
+        await client.enable_features(feature_names)
+        assert iothub_pipeline.enable_features.call_count == 0
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'enable_features' pipeline operation before returning"
+    )
+    async def test_waits_for_pipeline_op_completion(
+        self, mocker, client, iothub_pipeline, feature_names
+    ):
+        iothub_pipeline.feature_enabled.__contains__.return_value = True
+        iothub_pipeline.feature_enabled.__getitem__.return_value = False
+        cb_mock = mocker.patch.object(async_adapter, "AwaitableCallback").return_value
+        cb_mock.completion.return_value = await create_completed_future(None)
+
+        await client.enable_features(feature_names)
+
+        # Assert callback is sent to pipeline
+        assert iothub_pipeline.enable_features.call_args[1]["callback"] is cb_mock
+        # Assert callback completion is waited upon
+        assert cb_mock.completion.call_count == 1
+
+    @pytest.mark.it(
+        "Raises a client error if the `enable_features` pipeline operation calls back with a pipeline error"
+    )
+    @pytest.mark.parametrize(
+        "pipeline_error,client_error",
+        [
+            pytest.param(
+                pipeline_exceptions.ConnectionDroppedError,
+                client_exceptions.ConnectionDroppedError,
+                id="ConnectionDroppedError->ConnectionDroppedError",
+            ),
+            pytest.param(
+                pipeline_exceptions.ConnectionFailedError,
+                client_exceptions.ConnectionFailedError,
+                id="ConnectionFailedError->ConnectionFailedError",
+            ),
+            pytest.param(
+                pipeline_exceptions.UnauthorizedError,
+                client_exceptions.CredentialError,
+                id="UnauthorizedError->CredentialError",
+            ),
+            pytest.param(
+                pipeline_exceptions.ProtocolClientError,
+                client_exceptions.ClientError,
+                id="ProtocolClientError->ClientError",
+            ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
+            pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
+        ],
+    )
+    async def test_raises_error_on_pipeline_op_error(
+        self, mocker, client, iothub_pipeline, feature_names, pipeline_error, client_error
+    ):
+        iothub_pipeline.feature_enabled.__contains__.return_value = True
+        iothub_pipeline.feature_enabled.__getitem__.return_value = False
+        my_pipeline_error = pipeline_error()
+
+        def fail_enable_features(feature_names, callback):
+            callback(error=my_pipeline_error)
+
+        iothub_pipeline.enable_features = mocker.MagicMock(side_effect=fail_enable_features)
+        with pytest.raises(client_error) as e_info:
+            await client.enable_features(feature_names)
+        assert e_info.value.__cause__ is my_pipeline_error
+        assert iothub_pipeline.enable_features.call_count == 1
+
+
 class SharedClientGetTwinTests(object):
     @pytest.mark.it("Implicitly enables twin messaging feature if not already enabled")
     async def test_enables_twin_only_if_not_already_enabled(
@@ -715,6 +886,11 @@ class SharedClientGetTwinTests(object):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -827,6 +1003,11 @@ class SharedClientPatchTwinReportedPropertiesTests(object):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -1032,6 +1213,13 @@ class TestIoTHubDeviceClientSendD2CMessage(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .send_messages()")
+class TestIoTHubDeviceClientSendD2CMessages(
+    IoTHubDeviceClientTestsConfig, SharedClientSendD2CMessagesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .receive_message()")
 class TestIoTHubDeviceClientReceiveC2DMessage(IoTHubDeviceClientTestsConfig):
     @pytest.mark.it("Implicitly enables C2D messaging feature if not already enabled")
@@ -1084,6 +1272,13 @@ class TestIoTHubDeviceClientSendMethodResponse(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .enable_features()")
+class TestIoTHubDeviceClientEnableFeatures(
+    IoTHubDeviceClientTestsConfig, SharedClientEnableFeaturesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Asynchronous) - .get_twin()")
 class TestIoTHubDeviceClientGetTwin(IoTHubDeviceClientTestsConfig, SharedClientGetTwinTests):
     pass
@@ -1658,6 +1853,13 @@ class TestIoTHubNModuleClientSendD2CMessage(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .send_messages()")
+class TestIoTHubModuleClientSendD2CMessages(
+    IoTHubModuleClientTestsConfig, SharedClientSendD2CMessagesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .send_message_to_output()")
 class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig):
     @pytest.mark.it("Begins a 'send_output_event' pipeline operation")
@@ -1709,6 +1911,16 @@ class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
+            pytest.param(
+                pipeline_exceptions.PipelineBusyError,
+                client_exceptions.ClientBusyError,
+                id="PipelineBusyError->ClientBusyError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -1811,6 +2023,13 @@ class TestIoTHubModuleClientSendMethodResponse(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .enable_features()")
+class TestIoTHubModuleClientEnableFeatures(
+    IoTHubModuleClientTestsConfig, SharedClientEnableFeaturesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Asynchronous) - .get_twin()")
 class TestIoTHubModuleClientGetTwin(IoTHubModuleClientTestsConfig, SharedClientGetTwinTests):
     pass
@@ -183,12 +183,18 @@ class FakeIoTHubPipeline:
     def enable_feature(self, feature_name, callback):
         callback()
 
+    def enable_features(self, feature_names, callback):
+        callback()
+
     def disable_feature(self, feature_name, callback):
         callback()
 
     def send_message(self, event, callback):
         callback()
 
+    def send_messages(self, events, callback):
+        callback(results=[None] * len(events))
+
     def send_output_event(self, event, callback):
         callback()
 
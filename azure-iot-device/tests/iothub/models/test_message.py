@@ -43,6 +43,23 @@ class TestMessage(object):
         assert msg.content_encoding == encoding
         assert msg.content_type == ctype
 
+    @pytest.mark.it("Instantiates with no qos by default")
+    def test_default_qos(self):
+        msg = Message("After all this time? Always")
+        assert msg.qos is None
+
+    @pytest.mark.it("Instantiates with optional qos")
+    @pytest.mark.parametrize("qos", [0, 1])
+    def test_instantiates_with_optional_qos(self, qos):
+        msg = Message("After all this time? Always", qos=qos)
+        assert msg.qos == qos
+
+    @pytest.mark.it("Raises a ValueError if qos is not 0 or 1")
+    @pytest.mark.parametrize("qos", [2, -1, "1"])
+    def test_invalid_qos(self, qos):
+        with pytest.raises(ValueError):
+            Message("After all this time? Always", qos=qos)
+
     @pytest.mark.it("Setting message as security message")
     def test_setting_message_as_security_message(self):
         s = "After all this time? Always"
@@ -62,3 +79,8 @@ class TestMessage(object):
     def test_str_rep(self, data):
         msg = Message(data)
         assert str(msg) == str(data)
+
+    @pytest.mark.it("Uses __slots__ instead of a per-instance __dict__")
+    def test_slots(self):
+        msg = Message(self.data_str)
+        assert not hasattr(msg, "__dict__")
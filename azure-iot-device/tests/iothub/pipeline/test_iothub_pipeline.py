@@ -11,6 +11,7 @@ from azure.iot.device.common.pipeline import (
     pipeline_stages_base,
     pipeline_stages_mqtt,
     pipeline_ops_base,
+    pipeline_thread,
 )
 from azure.iot.device.iothub.pipeline import (
     pipeline_stages_iothub,
@@ -44,13 +45,25 @@ def auth_provider(mocker):
 
 @pytest.fixture
 def pipeline_configuration(mocker):
-    return mocker.MagicMock()
+    pipeline_configuration = mocker.MagicMock()
+    # Use the default (Paho) transport, which is mocked below
+    pipeline_configuration.asyncio_loop = None
+    pipeline_configuration.message_store_path = None
+    pipeline_configuration.telemetry_batch_max_messages = None
+    pipeline_configuration.compression_threshold = None
+    pipeline_configuration.executor_shards = None
+    pipeline_configuration.tracer = None
+    pipeline_configuration.handler_executor = None
+    pipeline_configuration.auto_reconnect = False
+    pipeline_configuration.connection_state_handler = None
+    return pipeline_configuration
 
 
 @pytest.fixture
 def pipeline(mocker, auth_provider, pipeline_configuration):
     pipeline = IoTHubPipeline(auth_provider, pipeline_configuration)
     mocker.patch.object(pipeline._pipeline, "run_op")
+    mocker.patch.object(pipeline._pipeline, "run_ops")
     return pipeline
 
 
@@ -100,6 +113,17 @@ class TestIoTHubPipelineInstantiation(object):
         assert pipeline._pipeline.on_connected_handler is not None
         assert pipeline._pipeline.on_disconnected_handler is not None
 
+    @pytest.mark.it(
+        "Sets the connection state handler of the pipeline to the connection_state_handler configuration option"
+    )
+    def test_connection_state_handler(self, mocker, auth_provider, pipeline_configuration):
+        pipeline_configuration.connection_state_handler = mocker.MagicMock()
+        pipeline = IoTHubPipeline(auth_provider, pipeline_configuration)
+        assert (
+            pipeline._pipeline.on_connection_state_changed_handler
+            is pipeline_configuration.connection_state_handler
+        )
+
     @pytest.mark.it("Configures the pipeline with a series of PipelineStages")
     def test_pipeline_configuration(self, auth_provider, pipeline_configuration):
         pipeline = IoTHubPipeline(auth_provider, pipeline_configuration)
@@ -110,9 +134,14 @@ class TestIoTHubPipelineInstantiation(object):
             pipeline_stages_iothub.UseAuthProviderStage,
             pipeline_stages_iothub.HandleTwinOperationsStage,
             pipeline_stages_base.CoordinateRequestAndResponseStage,
+            pipeline_stages_iothub.StoreAndForwardStage,
+            pipeline_stages_iothub.AggregateTelemetryStage,
+            pipeline_stages_iothub.CompressMessagesStage,
             pipeline_stages_iothub_mqtt.IoTHubMQTTConverterStage,
             pipeline_stages_base.EnsureConnectionStage,
+            pipeline_stages_base.ReconnectStage,
             pipeline_stages_base.SerializeConnectOpsStage,
+            pipeline_stages_mqtt.MQTTFlowControlStage,
             pipeline_stages_mqtt.MQTTTransportStage,
         ]
 
@@ -125,6 +154,38 @@ class TestIoTHubPipelineInstantiation(object):
         # Assert there are no more additional stages
         assert curr_stage is None
 
+    @pytest.mark.it(
+        "Uses the process-wide pipeline and callback threads if the executor_shards configuration option is None"
+    )
+    def test_shared_executors(self, auth_provider, pipeline_configuration):
+        pipeline = IoTHubPipeline(auth_provider, pipeline_configuration)
+        assert pipeline._pipeline.executors is None
+
+    @pytest.mark.it(
+        "Gives the pipeline its own pipeline and callback threads if the executor_shards configuration option is 'per_client'"
+    )
+    def test_own_executors(self, auth_provider, pipeline_configuration):
+        pipeline_configuration.executor_shards = "per_client"
+        pipeline1 = IoTHubPipeline(auth_provider, pipeline_configuration)
+        pipeline2 = IoTHubPipeline(auth_provider, pipeline_configuration)
+        assert pipeline1._pipeline.executors is not None
+        assert pipeline1._pipeline.executors is not pipeline2._pipeline.executors
+
+    @pytest.mark.it(
+        "Assigns the pipeline to shared pipeline and callback threads by device and module ID if the executor_shards configuration option is an int"
+    )
+    def test_sharded_executors(self, mocker, auth_provider, pipeline_configuration):
+        pipeline_configuration.executor_shards = 4
+        auth_provider.device_id = "fake_device"
+        auth_provider.module_id = "fake_module"
+        spy = mocker.spy(pipeline_thread, "get_pipeline_executors")
+
+        pipeline1 = IoTHubPipeline(auth_provider, pipeline_configuration)
+        pipeline2 = IoTHubPipeline(auth_provider, pipeline_configuration)
+
+        assert spy.call_args == mocker.call("fake_device/fake_module", shards=4)
+        assert pipeline1._pipeline.executors is pipeline2._pipeline.executors
+
     # TODO: revist these tests after auth revision
     # They are too tied to auth types (and there's too much variance in auths to effectively test)
     # Ideally IoTHubPipeline is entirely insulated from any auth differential logic (and module/device distinctions)
@@ -207,6 +268,81 @@ class TestIoTHubPipelineInstantiation(object):
             IoTHubPipeline(auth_provider, pipeline_configuration)
 
 
+@pytest.mark.describe("IoTHubPipeline - In-flight window")
+class TestIoTHubPipelineInFlightWindow(object):
+    @pytest.mark.it("Reports the number of messages in flight")
+    def test_in_flight_message_count(self, pipeline):
+        pipeline._flow_control_stage.in_flight_count = 3
+        assert pipeline.in_flight_message_count == 3
+
+    @pytest.mark.it("Reports the number of messages waiting for room in the in-flight window")
+    def test_queued_message_count(self, mocker, pipeline):
+        pipeline._flow_control_stage.queue.extend([mocker.MagicMock(), mocker.MagicMock()])
+        assert pipeline.queued_message_count == 2
+
+
+@pytest.mark.describe("IoTHubPipeline - Message store")
+class TestIoTHubPipelineMessageStore(object):
+    @pytest.mark.it("Reports no stored messages if there is no message store")
+    def test_no_store(self, pipeline):
+        assert pipeline._store_and_forward_stage.store is None
+        assert pipeline.stored_message_count == 0
+
+    @pytest.mark.it("Reports the number of messages in the message store")
+    def test_stored_message_count(self, mocker, pipeline):
+        pipeline._store_and_forward_stage.store = mocker.MagicMock()
+        pipeline._store_and_forward_stage.store.__len__.return_value = 4
+        assert pipeline.stored_message_count == 4
+
+
+@pytest.mark.describe("IoTHubPipeline - Telemetry batches")
+class TestIoTHubPipelineTelemetryBatches(object):
+    @pytest.mark.it("Reports the number of batches of messages sent")
+    def test_telemetry_batch_count(self, pipeline):
+        pipeline._aggregate_telemetry_stage.batch_count = 3
+        assert pipeline.telemetry_batch_count == 3
+
+    @pytest.mark.it("Reports the average number of messages in each batch sent")
+    def test_average_telemetry_batch_size(self, pipeline):
+        pipeline._aggregate_telemetry_stage.batch_count = 4
+        pipeline._aggregate_telemetry_stage.batched_message_count = 10
+        assert pipeline.average_telemetry_batch_size == 2.5
+
+    @pytest.mark.it("Reports no average batch size if no batch has been sent")
+    def test_no_batches(self, pipeline):
+        assert pipeline.average_telemetry_batch_size is None
+
+
+@pytest.mark.describe("IoTHubPipeline - Compression")
+class TestIoTHubPipelineCompression(object):
+    @pytest.mark.it("Reports the size of compressed payloads relative to their original size")
+    def test_compression_ratio(self, pipeline):
+        pipeline._compress_messages_stage.uncompressed_byte_count = 1000
+        pipeline._compress_messages_stage.compressed_byte_count = 250
+        assert pipeline.compression_ratio == 0.25
+
+    @pytest.mark.it("Reports no compression ratio if no message has been compressed")
+    def test_no_compressed_messages(self, pipeline):
+        assert pipeline.compression_ratio is None
+
+
+@pytest.mark.describe("IoTHubPipeline - Pending requests")
+class TestIoTHubPipelinePendingRequests(object):
+    @pytest.mark.it("Reports the number of requests waiting for a response")
+    def test_pending_request_count(self, mocker, pipeline):
+        pipeline._request_stage.pending_responses["1"] = mocker.MagicMock()
+        assert pipeline.pending_request_count == 1
+
+    @pytest.mark.it("Reports the number of requests waiting for room in the pending request table")
+    def test_queued_request_count(self, mocker, pipeline):
+        pipeline._request_stage.queue.extend([mocker.MagicMock(), mocker.MagicMock()])
+        assert pipeline.queued_request_count == 2
+
+    @pytest.mark.it("Reports the latency of responses to requests")
+    def test_request_latency(self, pipeline):
+        assert pipeline.request_latency is pipeline._request_stage.response_latency
+
+
 @pytest.mark.describe("IoTHubPipeline - .connect()")
 class TestIoTHubPipelineConnect(object):
     @pytest.mark.it("Runs a ConnectOperation on the pipeline")
@@ -328,6 +464,46 @@ class TestIoTHubPipelineSendD2CMessage(object):
         assert cb.call_args == mocker.call(error=arbitrary_exception)
 
 
+@pytest.mark.describe("IoTHubPipeline - .send_messages()")
+class TestIoTHubPipelineSendD2CMessages(object):
+    @pytest.fixture
+    def messages(self, message):
+        return [message, Message("other message")]
+
+    @pytest.mark.it(
+        "Runs a SendD2CMessageOperation for each of the provided messages, in order, on the pipeline at once"
+    )
+    def test_runs_ops(self, pipeline, messages, mocker):
+        pipeline.send_messages(messages, callback=mocker.MagicMock())
+        assert pipeline._pipeline.run_ops.call_count == 1
+        assert pipeline._pipeline.run_op.call_count == 0
+        ops = pipeline._pipeline.run_ops.call_args[0][0]
+        assert all(isinstance(op, pipeline_ops_iothub.SendD2CMessageOperation) for op in ops)
+        assert [op.message for op in ops] == messages
+
+    @pytest.mark.it(
+        "Calls the callback with the result of each SendD2CMessageOperation once all of them have completed"
+    )
+    def test_op_completion(self, mocker, pipeline, messages, arbitrary_exception):
+        cb = mocker.MagicMock()
+        pipeline.send_messages(messages, callback=cb)
+        ops = pipeline._pipeline.run_ops.call_args[0][0]
+
+        ops[1].callback(ops[1], error=arbitrary_exception)
+        assert cb.call_count == 0
+        ops[0].callback(ops[0], error=None)
+
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call(results=[None, arbitrary_exception])
+
+    @pytest.mark.it("Calls the callback straight away if there are no messages")
+    def test_no_messages(self, mocker, pipeline):
+        cb = mocker.MagicMock()
+        pipeline.send_messages([], callback=cb)
+        assert pipeline._pipeline.run_ops.call_count == 0
+        assert cb.call_args == mocker.call(results=[])
+
+
 @pytest.mark.describe("IoTHubPipeline - .send_output_event()")
 class TestIoTHubPipelineSendOutputEvent(object):
     @pytest.fixture
@@ -568,6 +744,64 @@ class TestIoTHubPipelineEnableFeature(object):
         assert cb.call_args == mocker.call(error=arbitrary_exception)
 
 
+@pytest.mark.describe("IoTHubPipeline - .enable_features()")
+class TestIoTHubPipelineEnableFeatures(object):
+    @pytest.mark.it("Marks all of the features as enabled")
+    def test_mark_features_enabled(self, pipeline, mocker):
+        pipeline.enable_features(all_features, callback=mocker.MagicMock())
+        for feature in all_features:
+            assert pipeline.feature_enabled[feature]
+
+    @pytest.mark.it(
+        "Raises ValueError without enabling any of the features if any feature_name is invalid"
+    )
+    def test_invalid_feature_name(self, pipeline, mocker):
+        bad_feature = "not-a-feature-name"
+        with pytest.raises(ValueError):
+            pipeline.enable_features([constant.METHODS, bad_feature], callback=mocker.MagicMock())
+        assert not pipeline.feature_enabled[constant.METHODS]
+        assert bad_feature not in pipeline.feature_enabled
+        assert pipeline._pipeline.run_op.call_count == 0
+
+    @pytest.mark.it(
+        "Runs a single EnableFeaturesOperation with the provided feature_names on the pipeline"
+    )
+    def test_runs_op(self, pipeline, mocker):
+        pipeline.enable_features(all_features, callback=mocker.MagicMock())
+        op = pipeline._pipeline.run_op.call_args[0][0]
+
+        assert pipeline._pipeline.run_op.call_count == 1
+        assert isinstance(op, pipeline_ops_base.EnableFeaturesOperation)
+        assert op.feature_names == list(all_features)
+
+    @pytest.mark.it(
+        "Triggers the callback upon successful completion of the EnableFeaturesOperation"
+    )
+    def test_op_success_with_callback(self, mocker, pipeline):
+        cb = mocker.MagicMock()
+        pipeline.enable_features(all_features, callback=cb)
+        assert cb.call_count == 0
+
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        op.callback(op, error=None)
+
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call(error=None)
+
+    @pytest.mark.it(
+        "Calls the callback with the error upon unsuccessful completion of the EnableFeaturesOperation"
+    )
+    def test_op_fail(self, mocker, pipeline, arbitrary_exception):
+        cb = mocker.MagicMock()
+        pipeline.enable_features(all_features, callback=cb)
+
+        op = pipeline._pipeline.run_op.call_args[0][0]
+        op.callback(op, error=arbitrary_exception)
+
+        assert cb.call_count == 1
+        assert cb.call_args == mocker.call(error=arbitrary_exception)
+
+
 @pytest.mark.describe("IoTHubPipeline - .disable_feature()")
 class TestIoTHubPipelineDisableFeature(object):
     @pytest.mark.it("Marks the feature as disabled")
@@ -676,6 +910,38 @@ class TestIoTHubPipelineEVENTDisconnect(object):
         # No assertions required - not throwing an exception means the test passed
 
 
+@pytest.mark.describe("IoTHubPipeline - Automatic reconnection")
+class TestIoTHubPipelineAutoReconnect(object):
+    @pytest.mark.it(
+        "Reconnects on its own after the connection drops, if it was connected to send a message without .connect()"
+    )
+    def test_reconnects_after_implicit_connect(
+        self, mocker, fake_pipeline_thread, auth_provider, pipeline_configuration
+    ):
+        auth_provider.module_id = None
+        pipeline_configuration.auto_reconnect = True
+        pipeline_configuration.reconnect_initial_delay = 1
+        pipeline_configuration.reconnect_max_delay = 1
+        pipeline_configuration.reconnect_max_attempts = None
+        pipeline_configuration.max_in_flight_messages = None
+        pipeline_configuration.telemetry_qos = 1
+        timer = mocker.patch.object(pipeline_stages_base, "Timer")
+        pipeline = IoTHubPipeline(auth_provider, pipeline_configuration)
+        transport = pipeline_stages_mqtt.MQTTTransport.return_value
+
+        pipeline.send_message(Message("fake_data"), callback=mocker.MagicMock())
+        assert transport.connect.call_count == 1
+        transport.on_mqtt_connected_handler()
+        assert transport.publish.call_count == 1
+        transport.publish.call_args[1]["callback"]()
+
+        transport.on_mqtt_disconnected_handler()
+        assert timer.call_count == 1
+        timer.call_args[0][1]()
+
+        assert transport.connect.call_count == 2
+
+
 @pytest.mark.describe("IoTHubPipeline - EVENT: C2D Message Received")
 class TestIoTHubPipelineEVENTRecieveC2DMessage(object):
     @pytest.mark.it(
@@ -0,0 +1,61 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import gzip
+import io
+import logging
+import pytest
+import zlib
+from azure.iot.device.iothub.pipeline import message_compression
+
+logging.basicConfig(level=logging.DEBUG)
+
+fake_payload = b'{"temperature": 21.5, "humidity": 40.25}' * 10
+
+
+@pytest.mark.describe("message_compression - .compress()")
+class TestCompress(object):
+    @pytest.mark.it("Compresses the payload in the gzip format")
+    def test_gzip(self):
+        compressed = message_compression.compress(fake_payload, "gzip")
+        assert len(compressed) < len(fake_payload)
+        assert gzip.GzipFile(fileobj=io.BytesIO(compressed)).read() == fake_payload
+
+    @pytest.mark.it("Compresses the payload in the zlib format for deflate")
+    def test_deflate(self):
+        compressed = message_compression.compress(fake_payload, "deflate")
+        assert len(compressed) < len(fake_payload)
+        assert zlib.decompress(compressed) == fake_payload
+
+    @pytest.mark.it("Raises a ValueError for an unsupported compression method")
+    def test_unsupported_method(self):
+        with pytest.raises(ValueError):
+            message_compression.compress(fake_payload, "br")
+
+
+@pytest.mark.describe("message_compression - .decompress()")
+class TestDecompress(object):
+    @pytest.mark.it("Decompresses a payload compressed with .compress()")
+    @pytest.mark.parametrize("method", ["gzip", "deflate"])
+    def test_round_trip(self, method):
+        compressed = message_compression.compress(fake_payload, method)
+        assert message_compression.decompress(compressed, method) == fake_payload
+
+    @pytest.mark.it("Decompresses raw deflate data for deflate")
+    def test_raw_deflate(self):
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(fake_payload) + compressor.flush()
+        assert message_compression.decompress(compressed, "deflate") == fake_payload
+
+    @pytest.mark.it("Raises a zlib.error if the payload is not compressed data")
+    @pytest.mark.parametrize("method", ["gzip", "deflate"])
+    def test_invalid_data(self, method):
+        with pytest.raises(zlib.error):
+            message_compression.decompress(b"not compressed", method)
+
+    @pytest.mark.it("Raises a ValueError for an unsupported compression method")
+    def test_unsupported_method(self):
+        with pytest.raises(ValueError):
+            message_compression.decompress(fake_payload, "br")
@@ -0,0 +1,251 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import datetime
+import logging
+import sqlite3
+import pytest
+import six
+from azure.iot.device.iothub.pipeline.message_store import MessageStore
+from azure.iot.device.iothub.models import Message
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+@pytest.fixture
+def store_path(tmpdir):
+    return str(tmpdir.join("messages.db"))
+
+
+@pytest.fixture
+def store(store_path):
+    store = MessageStore(store_path)
+    yield store
+    store.close()
+
+
+@pytest.mark.describe("MessageStore - Instantiation")
+class TestMessageStoreInstantiation(object):
+    @pytest.mark.it("Creates an empty store if the database file does not exist")
+    @pytest.mark.parametrize("durability", ["full", "normal", "off"])
+    def test_creates_empty_store(self, store_path, durability):
+        store = MessageStore(store_path, durability=durability)
+        assert store.path == store_path
+        assert len(store) == 0
+        assert store.peek(10) == []
+        store.close()
+
+    @pytest.mark.it("Opens the messages previously stored in the database file")
+    def test_reopens_store(self, store_path):
+        store = MessageStore(store_path)
+        store.put(Message("message 1"))
+        store.put(Message("message 2"))
+        store.close()
+
+        store = MessageStore(store_path)
+        assert len(store) == 2
+        assert [m.data for (_, m) in store.peek(10)] == ["message 1", "message 2"]
+        store.close()
+
+    @pytest.mark.it("Opens a database file created before failed attempts were counted")
+    def test_adds_attempts_column(self, store_path):
+        connection = sqlite3.connect(store_path)
+        connection.execute(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "expiry REAL, message TEXT NOT NULL)"
+        )
+        connection.commit()
+        connection.close()
+
+        store = MessageStore(store_path)
+        message_id = store.put(Message("message"))
+        assert store.record_failures([message_id]) == {message_id: 1}
+        store.close()
+
+    @pytest.mark.it("Raises a ValueError if the durability is not 'full', 'normal' or 'off'")
+    def test_invalid_durability(self, store_path):
+        with pytest.raises(ValueError):
+            MessageStore(store_path, durability="extra")
+
+
+@pytest.mark.describe("MessageStore - .put() and .peek()")
+class TestMessageStorePutAndPeek(object):
+    @pytest.mark.it("Returns stored messages with the same data")
+    @pytest.mark.parametrize(
+        "data",
+        [
+            pytest.param(b"\x00\xffbytes", id="bytes"),
+            pytest.param(six.u("text \u00e9"), id="text"),
+            pytest.param({"temperature": 21.5, "tags": ["a", "b"]}, id="JSON"),
+        ],
+    )
+    def test_data(self, store, data):
+        store.put(Message(data))
+        [(_, message)] = store.peek(1)
+        assert message.data == data
+        assert type(message.data) == type(data)
+
+    @pytest.mark.it("Returns stored messages with the same properties")
+    def test_properties(self, store):
+        original = Message(
+            "data",
+            message_id="fake_message_id",
+            content_encoding="utf-8",
+            content_type="application/json",
+            output_name="fake_output",
+            qos=0,
+        )
+        original.custom_properties = {"key": "value"}
+        original.expiry_time_utc = "2100-01-01T00:00:00Z"
+        original.correlation_id = "fake_correlation_id"
+        original.user_id = "fake_user_id"
+        original._iothub_interface_id = "urn:fake:interface:1"
+        store.put(original)
+
+        [(_, message)] = store.peek(1)
+        assert message.message_id == original.message_id
+        assert message.content_encoding == original.content_encoding
+        assert message.content_type == original.content_type
+        assert message.output_name == original.output_name
+        assert message.qos == original.qos
+        assert message.custom_properties == original.custom_properties
+        assert message.expiry_time_utc == original.expiry_time_utc
+        assert message.correlation_id == original.correlation_id
+        assert message.user_id == original.user_id
+        assert message.iothub_interface_id == original.iothub_interface_id
+
+    @pytest.mark.it("Returns up to limit messages, oldest first, with the IDs returned by .put()")
+    def test_order_and_limit(self, store):
+        ids = [store.put(Message("message {}".format(i))) for i in range(5)]
+        peeked = store.peek(3)
+        assert [message_id for (message_id, _) in peeked] == ids[:3]
+        assert [m.data for (_, m) in peeked] == ["message 0", "message 1", "message 2"]
+
+    @pytest.mark.it("Does not remove the messages it returns")
+    def test_peek_does_not_remove(self, store):
+        store.put(Message("message"))
+        store.peek(1)
+        assert len(store) == 1
+        assert len(store.peek(1)) == 1
+
+    @pytest.mark.it("Removes and does not return messages whose expiry_time_utc has passed")
+    @pytest.mark.parametrize(
+        "expiry_time_utc",
+        [
+            pytest.param(datetime.datetime(2000, 1, 1), id="datetime"),
+            pytest.param(datetime.date(2000, 1, 1), id="date"),
+            pytest.param("2000-01-01T00:00:00.000Z", id="ISO 8601 string"),
+        ],
+    )
+    def test_expired(self, store, expiry_time_utc):
+        expired = Message("expired")
+        expired.expiry_time_utc = expiry_time_utc
+        store.put(expired)
+        store.put(Message("not expired"))
+
+        assert [m.data for (_, m) in store.peek(10)] == ["not expired"]
+        assert len(store) == 1
+
+    @pytest.mark.it("Fills the batch with unexpired messages when the oldest messages have expired")
+    def test_expired_fill_batch(self, store):
+        for i in range(3):
+            expired = Message("expired {}".format(i))
+            expired.expiry_time_utc = datetime.datetime(2000, 1, 1)
+            store.put(expired)
+        for i in range(3):
+            store.put(Message("message {}".format(i)))
+
+        assert [m.data for (_, m) in store.peek(2)] == ["message 0", "message 1"]
+        assert len(store) == 3
+
+    @pytest.mark.it("Leaves expired messages which are newer than the messages it returns")
+    def test_expired_not_scanned(self, store):
+        store.put(Message("message"))
+        expired = Message("expired")
+        expired.expiry_time_utc = datetime.datetime(2000, 1, 1)
+        store.put(expired)
+
+        assert [m.data for (_, m) in store.peek(1)] == ["message"]
+        assert len(store) == 2
+
+    @pytest.mark.it("Compares expiry_time_utc with the given current time")
+    def test_expiry_now(self, store):
+        message = Message("message")
+        message.expiry_time_utc = datetime.datetime(2000, 1, 1, 0, 0, 10)
+        store.put(message)
+        epoch_expiry = 946684810
+
+        assert len(store.peek(10, now=epoch_expiry - 1)) == 1
+        assert len(store.peek(10, now=epoch_expiry)) == 0
+
+    @pytest.mark.it("Never expires messages whose expiry_time_utc cannot be parsed")
+    def test_unparseable_expiry(self, store):
+        message = Message("message")
+        message.expiry_time_utc = "not a time"
+        store.put(message)
+        assert len(store.peek(10)) == 1
+
+
+@pytest.mark.describe("MessageStore - .drop_expired()")
+class TestMessageStoreDropExpired(object):
+    @pytest.mark.it("Removes every message whose expiry_time_utc has passed, and returns the count")
+    def test_drop_expired(self, store):
+        for i in range(3):
+            store.put(Message("message {}".format(i)))
+            expired = Message("expired {}".format(i))
+            expired.expiry_time_utc = datetime.datetime(2000, 1, 1)
+            store.put(expired)
+
+        assert store.drop_expired() == 3
+        assert [m.data for (_, m) in store.peek(10)] == ["message 0", "message 1", "message 2"]
+
+    @pytest.mark.it("Uses an index on the expiry time")
+    def test_uses_index(self, store):
+        plan = store._connection.execute(
+            "EXPLAIN QUERY PLAN DELETE FROM messages WHERE expiry IS NOT NULL AND expiry <= ?",
+            (0,),
+        ).fetchall()
+        assert "messages_expiry" in " ".join(str(row) for row in plan)
+
+
+@pytest.mark.describe("MessageStore - .remove()")
+class TestMessageStoreRemove(object):
+    @pytest.mark.it("Removes the messages with the given IDs")
+    def test_remove(self, store):
+        ids = [store.put(Message("message {}".format(i))) for i in range(3)]
+        store.remove([ids[0], ids[2]])
+        assert len(store) == 1
+        assert [m.data for (_, m) in store.peek(10)] == ["message 1"]
+
+    @pytest.mark.it("Ignores IDs which are not in the store")
+    def test_remove_unknown(self, store):
+        store.put(Message("message"))
+        store.remove([1000])
+        assert len(store) == 1
+
+
+@pytest.mark.describe("MessageStore - .record_failures()")
+class TestMessageStoreRecordFailures(object):
+    @pytest.mark.it("Counts the failed attempts to send each message")
+    def test_counts_attempts(self, store):
+        ids = [store.put(Message("message {}".format(i))) for i in range(3)]
+        assert store.record_failures([ids[0], ids[1]]) == {ids[0]: 1, ids[1]: 1}
+        assert store.record_failures([ids[0]]) == {ids[0]: 2}
+        assert len(store) == 3
+
+    @pytest.mark.it("Keeps the count when the store is reopened")
+    def test_persists(self, store_path):
+        store = MessageStore(store_path)
+        message_id = store.put(Message("message"))
+        store.record_failures([message_id])
+        store.close()
+
+        store = MessageStore(store_path)
+        assert store.record_failures([message_id]) == {message_id: 2}
+        store.close()
+
+    @pytest.mark.it("Ignores IDs which are not in the store")
+    def test_unknown(self, store):
+        assert store.record_failures([1000]) == {}
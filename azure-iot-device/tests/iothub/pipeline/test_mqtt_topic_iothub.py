@@ -0,0 +1,255 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+import datetime
+import logging
+import pytest
+from azure.iot.device.iothub.pipeline import mqtt_topic_iothub, constant
+from azure.iot.device.iothub.models import Message
+
+logging.basicConfig(level=logging.DEBUG)
+
+fake_topic = "devices/fake_device/messages/events/"
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    mqtt_topic_iothub._topic_templates.clear()
+    yield
+    mqtt_topic_iothub._topic_templates.clear()
+
+
+def make_message(**kwargs):
+    message = Message("fake_data", output_name=kwargs.pop("output_name", None))
+    custom_properties = kwargs.pop("custom_properties", {})
+    for name, value in kwargs.items():
+        setattr(message, name, value)
+    message.custom_properties.update(custom_properties)
+    return message
+
+
+@pytest.mark.describe("mqtt_topic_iothub - .encode_properties()")
+class TestEncodeProperties(object):
+    @pytest.mark.it("Encodes the system and custom properties of the message onto the topic")
+    @pytest.mark.parametrize(
+        "message,expected_properties",
+        [
+            pytest.param(make_message(), "%24.ct=application%2Fjson&%24.ce=utf-8", id="Defaults"),
+            pytest.param(
+                make_message(content_type=None, content_encoding=None), "", id="No properties"
+            ),
+            pytest.param(
+                make_message(
+                    output_name="fake output",
+                    message_id="fake&id",
+                    correlation_id="fake_cid",
+                    user_id="fake_uid",
+                    to="/fake/to",
+                    _iothub_interface_id="urn:fake",
+                    expiry_time_utc=datetime.datetime(2020, 1, 2, 3, 4, 5),
+                ),
+                "%24.on=fake+output&%24.mid=fake%26id&%24.cid=fake_cid&%24.uid=fake_uid"
+                "&%24.to=%2Ffake%2Fto&%24.ct=application%2Fjson&%24.ce=utf-8"
+                "&%24.ifid=urn%3Afake&%24.exp=2020-01-02T03%3A04%3A05",
+                id="All system properties",
+            ),
+            pytest.param(
+                make_message(
+                    content_type=None,
+                    content_encoding=None,
+                    custom_properties={"fake key": "fake=value", "count": 3},
+                ),
+                "fake+key=fake%3Dvalue&count=3",
+                id="Custom properties only",
+            ),
+            pytest.param(
+                make_message(message_id="fake_id", custom_properties={"$.x": b"fake"}),
+                "%24.mid=fake_id&%24.ct=application%2Fjson&%24.ce=utf-8&%24.x=fake",
+                id="System and custom properties",
+            ),
+        ],
+    )
+    def test_encodes_properties(self, message, expected_properties):
+        assert mqtt_topic_iothub.encode_properties(message, fake_topic) == (
+            fake_topic + expected_properties
+        )
+        # The result is the same when the template is taken from the cache
+        assert mqtt_topic_iothub.encode_properties(message, fake_topic) == (
+            fake_topic + expected_properties
+        )
+
+    @pytest.mark.it("Encodes the values of each message which has the same signature as another")
+    def test_varying_values(self):
+        for i in range(3):
+            message = make_message(message_id="id{}".format(i), custom_properties={"seq": i})
+            assert mqtt_topic_iothub.encode_properties(message, fake_topic) == (
+                fake_topic
+                + "%24.mid=id{}&%24.ct=application%2Fjson&%24.ce=utf-8&seq={}".format(i, i)
+            )
+        assert len(mqtt_topic_iothub._topic_templates) == 1
+
+    @pytest.mark.it("Uses a different template for messages with different constant values")
+    def test_constant_values(self):
+        json_message = make_message()
+        text_message = make_message(content_type="text/plain")
+        assert mqtt_topic_iothub.encode_properties(text_message, fake_topic) == (
+            fake_topic + "%24.ct=text%2Fplain&%24.ce=utf-8"
+        )
+        assert mqtt_topic_iothub.encode_properties(json_message, fake_topic) == (
+            fake_topic + "%24.ct=application%2Fjson&%24.ce=utf-8"
+        )
+        assert len(mqtt_topic_iothub._topic_templates) == 2
+
+    @pytest.mark.it("Evicts the least recently used template when the cache is full")
+    def test_lru_bound(self, mocker):
+        mocker.patch.object(mqtt_topic_iothub, "TOPIC_TEMPLATE_CACHE_SIZE", 2)
+        messages = [make_message(to="/to{}".format(i)) for i in range(3)]
+        mqtt_topic_iothub.encode_properties(messages[0], fake_topic)
+        mqtt_topic_iothub.encode_properties(messages[1], fake_topic)
+        mqtt_topic_iothub.encode_properties(messages[0], fake_topic)
+        mqtt_topic_iothub.encode_properties(messages[2], fake_topic)
+
+        signatures = list(mqtt_topic_iothub._topic_templates)
+        assert signatures == [
+            mqtt_topic_iothub._get_signature(messages[0]),
+            mqtt_topic_iothub._get_signature(messages[2]),
+        ]
+
+    @pytest.mark.it("Encodes the properties without a template if they cannot be in a signature")
+    def test_unhashable_properties(self):
+        message = make_message(content_type=["fake"])
+        assert mqtt_topic_iothub.encode_properties(message, fake_topic) == (
+            mqtt_topic_iothub._encode_properties_uncached(message, fake_topic)
+        )
+        assert len(mqtt_topic_iothub._topic_templates) == 0
+
+
+@pytest.fixture
+def parser():
+    return mqtt_topic_iothub.IncomingTopicParser("fake_device", "fake_module")
+
+
+@pytest.mark.describe("mqtt_topic_iothub - IncomingTopicParser - .parse()")
+class TestIncomingTopicParser(object):
+    @pytest.mark.it("Parses a C2D topic, with its properties uri-decoded")
+    def test_c2d(self, parser):
+        parsed = parser.parse(
+            "devices/fake_device/messages/devicebound/%24.mid=fake_id&%24.to=%2Fdevices%2Ffake"
+            "&fake+key=fake%3Dvalue"
+        )
+        assert parsed.kind == constant.C2D_MSG
+        assert parsed.properties == [
+            ("$.mid", "fake_id"),
+            ("$.to", "/devices/fake"),
+            ("fake key", "fake=value"),
+        ]
+
+    @pytest.mark.it("Parses a C2D topic without properties")
+    @pytest.mark.parametrize(
+        "topic",
+        ["devices/fake_device/messages/devicebound", "devices/fake_device/messages/devicebound/"],
+    )
+    def test_c2d_no_properties(self, parser, topic):
+        parsed = parser.parse(topic)
+        assert parsed.kind == constant.C2D_MSG
+        assert parsed.properties == []
+
+    @pytest.mark.it("Parses an input topic, with its input name and properties")
+    def test_input(self, parser):
+        parsed = parser.parse(
+            "devices/fake_device/modules/fake_module/inputs/fake_input/%24.ct=text%2Fplain"
+        )
+        assert parsed.kind == constant.INPUT_MSG
+        assert parsed.name == "fake_input"
+        assert parsed.properties == [("$.ct", "text/plain")]
+
+    @pytest.mark.it("Parses a method topic, with its method name and request id")
+    def test_method(self, parser):
+        parsed = parser.parse("$iothub/methods/POST/fake_method/?$rid=fake%2Brid")
+        assert parsed.kind == constant.METHODS
+        assert parsed.name == "fake_method"
+        assert parsed.request_id == "fake+rid"
+
+    @pytest.mark.it("Parses a twin response topic, with its status code and request id")
+    def test_twin_response(self, parser):
+        parsed = parser.parse("$iothub/twin/res/204/?$rid=fake_rid&$version=3")
+        assert parsed.kind == constant.TWIN
+        assert parsed.status_code == "204"
+        assert parsed.request_id == "fake_rid"
+        assert parsed.properties == [("$rid", "fake_rid"), ("$version", "3")]
+
+    @pytest.mark.it("Parses a twin desired properties patch topic")
+    def test_twin_patch(self, parser):
+        parsed = parser.parse("$iothub/twin/PATCH/properties/desired/?$version=3")
+        assert parsed.kind == constant.TWIN_PATCHES
+
+    @pytest.mark.it("Returns None for a topic which is not for this device or module")
+    @pytest.mark.parametrize(
+        "topic",
+        [
+            "devices/other_device/messages/devicebound/",
+            "devices/fake_device/messages/deviceboundary/",
+            "devices/fake_device/modules/other_module/inputs/fake_input/",
+            "$iothub/unknown",
+        ],
+    )
+    def test_unknown_topic(self, parser, topic):
+        assert parser.parse(topic) is None
+
+    @pytest.mark.it("Only recognizes input topics if it has a module id")
+    def test_device_parser(self):
+        parser = mqtt_topic_iothub.IncomingTopicParser("fake_device", None)
+        assert parser.parse("devices/fake_device/modules/None/inputs/fake_input/") is None
+        assert parser.parse("devices/fake_device/messages/devicebound/").kind == constant.C2D_MSG
+
+    @pytest.mark.it("Only recognizes method and twin topics if it has no device id")
+    def test_no_device_id(self):
+        parser = mqtt_topic_iothub.IncomingTopicParser()
+        assert parser.parse("devices/fake_device/messages/devicebound/") is None
+        assert parser.parse("$iothub/methods/POST/fake_method/?$rid=1").kind == constant.METHODS
+
+    @pytest.mark.it("Keeps a bounded cache of decoded property keys and values")
+    def test_unquoted_string_cache(self, mocker, parser):
+        mocker.patch.object(mqtt_topic_iothub, "UNQUOTED_STRING_CACHE_SIZE", 2)
+        mocker.patch.object(mqtt_topic_iothub, "_unquoted_strings", {})
+        topic = "devices/fake_device/messages/devicebound/%24.mid=a+b&%24.cid=c%2Fd"
+        for _ in range(2):
+            parsed = parser.parse(topic)
+            assert parsed.properties == [("$.mid", "a b"), ("$.cid", "c/d")]
+            assert len(mqtt_topic_iothub._unquoted_strings) <= 2
+
+    @pytest.mark.it("Raises a ValueError if a method or twin response topic has no request id")
+    @pytest.mark.parametrize(
+        "topic", ["$iothub/methods/POST/fake_method/", "$iothub/twin/res/200/?$version=3"]
+    )
+    def test_missing_request_id(self, parser, topic):
+        with pytest.raises(ValueError):
+            parser.parse(topic)
+
+
+@pytest.mark.describe("mqtt_topic_iothub - .set_message_properties()")
+class TestSetMessageProperties(object):
+    @pytest.mark.it("Sets the system and custom properties of the message")
+    def test_sets_properties(self):
+        message = Message(b"fake_data")
+        mqtt_topic_iothub.set_message_properties(
+            message,
+            [
+                ("$.mid", "fake_id"),
+                ("$.cid", "fake_cid"),
+                ("$.uid", "fake_uid"),
+                ("$.to", "/fake/to"),
+                ("$.ct", "text/plain"),
+                ("$.ce", "utf-16"),
+                ("fake_key", "fake_value"),
+            ],
+        )
+        assert message.message_id == "fake_id"
+        assert message.correlation_id == "fake_cid"
+        assert message.user_id == "fake_uid"
+        assert message.to == "/fake/to"
+        assert message.content_type == "text/plain"
+        assert message.content_encoding == "utf-16"
+        assert message.custom_properties == {"fake_key": "fake_value"}
@@ -3,9 +3,11 @@
 # Licensed under the MIT License. See License.txt in the project root for
 # license information.
 # --------------------------------------------------------------------------
+import datetime
 import functools
 import json
 import logging
+import os
 import pytest
 import sys
 import threading
@@ -14,6 +16,9 @@ from azure.iot.device.exceptions import ServiceError
 from azure.iot.device.common import handle_exceptions
 from azure.iot.device.common.pipeline import pipeline_ops_base
 from azure.iot.device.iothub.pipeline import pipeline_stages_iothub, pipeline_ops_iothub
+from azure.iot.device.iothub.pipeline import message_compression
+from azure.iot.device.iothub.pipeline.message_store import MessageStore
+from azure.iot.device.iothub.models import Message
 from azure.iot.device.iothub.pipeline.exceptions import PipelineError
 from tests.common.pipeline.helpers import (
     assert_callback_succeeded,
@@ -561,3 +566,653 @@ class TestHandleTwinOperationsRunOpWithPatchTwinReportedProperties(StageTestBase
         stage.next.run_op = functools.partial(next_stage_run_op, (stage.next,))
         stage.run_op(op)
         assert_callback_succeeded(op=op)
+
+
+pipeline_stage_test.add_base_pipeline_stage_tests(
+    cls=pipeline_stages_iothub.StoreAndForwardStage,
+    module=this_module,
+    all_ops=all_common_ops + all_iothub_ops,
+    handled_ops=[],
+    all_events=all_common_events + all_iothub_events,
+    handled_events=[],
+    extra_initializer_defaults={"store": None, "sending_count": 0},
+)
+
+
+class StoreAndForwardStageTestBase(StageTestBase):
+    @pytest.fixture
+    def stage(self):
+        return pipeline_stages_iothub.StoreAndForwardStage()
+
+    @pytest.fixture
+    def store_path(self, tmpdir):
+        return str(tmpdir.join("messages.db"))
+
+    @pytest.fixture
+    def config(self, stage, stage_base_configuration, store_path):
+        config = stage.pipeline_root.pipeline_configuration
+        config.message_store_path = store_path
+        yield config
+        if stage.store:
+            stage.store.close()
+
+    @pytest.fixture
+    def stored_messages(self, store_path):
+        """
+        Messages left in the store by a previous run of the client
+        """
+        messages = [Message("stored message {}".format(i)) for i in range(5)]
+        store = MessageStore(store_path)
+        for message in messages:
+            store.put(message)
+        store.close()
+        return messages
+
+    def make_send_op(self, mocker, data="fake message"):
+        return pipeline_ops_iothub.SendD2CMessageOperation(
+            message=Message(data), callback=mocker.MagicMock()
+        )
+
+    def sent_ops(self, stage):
+        return [call[0][0] for call in stage.next._execute_op.call_args_list]
+
+
+send_ops = [
+    pytest.param((pipeline_ops_iothub.SendD2CMessageOperation, None), id="SendD2CMessageOperation"),
+    pytest.param(
+        (pipeline_ops_iothub.SendOutputEventOperation, "fake_output"),
+        id="SendOutputEventOperation",
+    ),
+]
+
+
+@pytest.mark.describe(
+    "StoreAndForwardStage - .run_op() -- called with SendD2CMessageOperation or SendOutputEventOperation"
+)
+class TestStoreAndForwardStageRunOpWithSendOperation(StoreAndForwardStageTestBase):
+    @pytest.fixture(params=send_ops)
+    def op(self, mocker, request):
+        op_class, output_name = request.param
+        return op_class(
+            message=Message("fake message", output_name=output_name), callback=mocker.MagicMock()
+        )
+
+    @pytest.mark.it(
+        "Passes the operation down if the message_store_path configuration option is not set"
+    )
+    def test_no_store(self, stage, op):
+        stage.run_op(op)
+        assert self.sent_ops(stage) == [op]
+        assert stage.store is None
+
+    @pytest.mark.it("Completes the operation once the message has been stored")
+    def test_completes_op(self, stage, config, op):
+        stage.run_op(op)
+        assert_callback_succeeded(op=op)
+        assert len(stage.store) == 1
+
+    @pytest.mark.it("Sends the stored message down in a new operation of the same type")
+    def test_sends_stored_message(self, stage, config, op):
+        stage.run_op(op)
+        sent_op = self.sent_ops(stage)[0]
+        assert sent_op is not op
+        assert isinstance(sent_op, op.__class__)
+        assert sent_op.message.data == op.message.data
+        assert sent_op.message.output_name == op.message.output_name
+
+    @pytest.mark.it("Fails the operation if the message cannot be stored")
+    def test_store_fails(self, mocker, stage, config, op, arbitrary_exception):
+        mocker.patch.object(MessageStore, "put", side_effect=arbitrary_exception)
+        stage.run_op(op)
+        assert_callback_failed(op=op, error=arbitrary_exception)
+        assert self.sent_ops(stage) == []
+
+
+@pytest.mark.describe("StoreAndForwardStage - Sending stored messages")
+class TestStoreAndForwardStageSendStoredMessages(StoreAndForwardStageTestBase):
+    @pytest.mark.it("Removes a message from the store once it has been sent")
+    def test_removes_sent_message(self, mocker, stage, config):
+        stage.run_op(self.make_send_op(mocker))
+        sent_op = self.sent_ops(stage)[0]
+        assert len(stage.store) == 1
+
+        stage.next._complete_op(sent_op)
+
+        assert len(stage.store) == 0
+        assert stage.sending_count == 0
+
+    @pytest.mark.it("Sends messages left in the store by a previous run when the pipeline connects")
+    def test_sends_on_connected(self, stage, config, stored_messages):
+        stage.on_connected()
+        assert [op.message.data for op in self.sent_ops(stage)] == [m.data for m in stored_messages]
+
+    @pytest.mark.it("Sends no more than message_store_batch_size messages at once")
+    def test_batches(self, stage, config, stored_messages):
+        config.message_store_batch_size = 2
+        stage.on_connected()
+
+        for expected_batch in [stored_messages[0:2], stored_messages[2:4], stored_messages[4:]]:
+            batch = self.sent_ops(stage)
+            assert [op.message.data for op in batch] == [m.data for m in expected_batch]
+            assert stage.sending_count == len(batch)
+            stage.next._execute_op.reset_mock()
+            for op in batch:
+                stage.next._complete_op(op)
+
+        assert self.sent_ops(stage) == []
+        assert len(stage.store) == 0
+
+    @pytest.mark.it(
+        "Keeps a message which fails to send in the store, and sends it again when the pipeline connects"
+    )
+    def test_failed_send_waits_for_connection(self, mocker, stage, config, arbitrary_exception):
+        stage.run_op(self.make_send_op(mocker, "message 1"))
+        stage.next._complete_op(self.sent_ops(stage)[0], error=arbitrary_exception)
+        assert len(stage.store) == 1
+
+        # Storing another message does not send while the pipeline is disconnected
+        stage.next._execute_op.reset_mock()
+        stage.run_op(self.make_send_op(mocker, "message 2"))
+        assert self.sent_ops(stage) == []
+        assert len(stage.store) == 2
+
+        stage.on_connected()
+        assert [op.message.data for op in self.sent_ops(stage)] == ["message 1", "message 2"]
+
+    @pytest.mark.it(
+        "Sends a message which failed to send again when another message is stored, if the pipeline is connected"
+    )
+    def test_failed_send_while_connected(self, mocker, stage, config, arbitrary_exception):
+        stage.pipeline_root.connected = True
+        stage.run_op(self.make_send_op(mocker, "message 1"))
+        stage.next._complete_op(self.sent_ops(stage)[0], error=arbitrary_exception)
+
+        stage.next._execute_op.reset_mock()
+        stage.run_op(self.make_send_op(mocker, "message 2"))
+        assert [op.message.data for op in self.sent_ops(stage)] == ["message 1", "message 2"]
+
+    @pytest.mark.it(
+        "Sends a message which failed to send again immediately if the pipeline connected while it was being sent"
+    )
+    def test_failed_send_after_reconnect(self, mocker, stage, config, arbitrary_exception):
+        stage.run_op(self.make_send_op(mocker, "message 1"))
+        sent_op = self.sent_ops(stage)[0]
+        stage.on_connected()
+        stage.next._execute_op.reset_mock()
+
+        stage.next._complete_op(sent_op, error=arbitrary_exception)
+
+        assert [op.message.data for op in self.sent_ops(stage)] == ["message 1"]
+
+    @pytest.mark.it(
+        "Drops a message which has failed to send message_store_max_attempts times, reports the error as a background exception, and sends the messages behind it"
+    )
+    def test_drops_failing_message(
+        self, mocker, stage, config, stored_messages, arbitrary_exception
+    ):
+        mocker.spy(handle_exceptions, "handle_background_exception")
+        config.message_store_batch_size = 1
+        config.message_store_max_attempts = 3
+
+        for _ in range(3):
+            stage.on_connected()
+            [op] = self.sent_ops(stage)
+            assert op.message.data == stored_messages[0].data
+            stage.next._execute_op.reset_mock()
+            stage.next._complete_op(op, error=arbitrary_exception)
+
+        assert handle_exceptions.handle_background_exception.call_args_list == [
+            mocker.call(arbitrary_exception)
+        ]
+        sent = []
+        while self.sent_ops(stage):
+            [op] = self.sent_ops(stage)
+            sent.append(op.message.data)
+            stage.next._execute_op.reset_mock()
+            stage.next._complete_op(op)
+        assert sent == [m.data for m in stored_messages[1:]]
+        assert len(stage.store) == 0
+
+    @pytest.mark.it(
+        "Drops a message which failed to send with a ValueError or TypeError after the first attempt, and reports the error as a background exception"
+    )
+    @pytest.mark.parametrize("error", [ValueError("too large"), TypeError("bad payload")])
+    def test_drops_unsendable_message(self, mocker, stage, config, error):
+        mocker.spy(handle_exceptions, "handle_background_exception")
+        stage.run_op(self.make_send_op(mocker, "message 1"))
+        stage.next._complete_op(self.sent_ops(stage)[0], error=error)
+
+        assert len(stage.store) == 0
+        assert handle_exceptions.handle_background_exception.call_args == mocker.call(error)
+
+        # Sending is not held up waiting for a connection
+        stage.next._execute_op.reset_mock()
+        stage.run_op(self.make_send_op(mocker, "message 2"))
+        assert [op.message.data for op in self.sent_ops(stage)] == ["message 2"]
+
+    @pytest.mark.it("Drops expired messages instead of sending them")
+    def test_drops_expired_messages(self, mocker, stage, config):
+        op = self.make_send_op(mocker)
+        op.message.expiry_time_utc = datetime.datetime(2000, 1, 1)
+        stage.run_op(op)
+
+        assert_callback_succeeded(op=op)
+        assert self.sent_ops(stage) == []
+        assert len(stage.store) == 0
+
+
+@pytest.mark.describe("StoreAndForwardStage - Expired messages")
+class TestStoreAndForwardStageExpiredMessages(StoreAndForwardStageTestBase):
+    @pytest.mark.it("Drops expired messages from the whole store once when sending starts")
+    def test_drops_expired_once_per_drain(self, mocker, stage, config, stored_messages):
+        config.message_store_batch_size = 2
+        drop_expired = mocker.spy(MessageStore, "drop_expired")
+        stage.on_connected()
+        assert drop_expired.call_count == 1
+
+        while self.sent_ops(stage):
+            batch = self.sent_ops(stage)
+            stage.next._execute_op.reset_mock()
+            for op in batch:
+                stage.next._complete_op(op)
+
+        assert len(stage.store) == 0
+        assert drop_expired.call_count == 1
+
+
+@pytest.mark.describe("StoreAndForwardStage - .run_op() -- called with DisconnectOperation")
+class TestStoreAndForwardStageRunOpWithDisconnectOperation(StoreAndForwardStageTestBase):
+    @pytest.fixture
+    def op(self, mocker):
+        return pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock())
+
+    @pytest.mark.it("Passes the operation down, and completes it with the result")
+    def test_passes_down(self, stage, config, op, arbitrary_exception):
+        stage.run_op(op)
+        assert self.sent_ops(stage) == [op]
+        stage.next._complete_op(op, error=arbitrary_exception)
+        assert_callback_failed(op=op, error=arbitrary_exception)
+
+    @pytest.mark.it("Closes the message store once the operation has completed")
+    def test_closes_store(self, mocker, stage, config, op):
+        stage.run_op(self.make_send_op(mocker))
+        stage.next._complete_op(self.sent_ops(stage)[0])
+        store = stage.store
+        close = mocker.spy(store, "close")
+
+        stage.run_op(op)
+        assert close.call_count == 0
+        stage.next._complete_op(op)
+
+        assert close.call_count == 1
+        assert stage.store is None
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Closes the message store once a batch being sent has completed")
+    def test_closes_store_after_batch(self, mocker, stage, config, op):
+        stage.run_op(self.make_send_op(mocker))
+        sent_op = self.sent_ops(stage)[0]
+        close = mocker.spy(stage.store, "close")
+        stage.run_op(op)
+        stage.next._complete_op(op)
+        assert close.call_count == 0
+
+        stage.next._complete_op(sent_op)
+
+        assert close.call_count == 1
+        assert stage.store is None
+
+    @pytest.mark.it("Opens the message store again when it is next needed")
+    def test_reopens_store(self, mocker, stage, config, op):
+        stage.run_op(self.make_send_op(mocker, "message 1"))
+        stage.next._complete_op(self.sent_ops(stage)[0])
+        stage.run_op(op)
+        stage.next._complete_op(op)
+        stage.next._execute_op.reset_mock()
+
+        stage.run_op(self.make_send_op(mocker, "message 2"))
+
+        assert stage.store is not None
+        assert len(stage.store) == 1
+        assert [sent_op.message.data for sent_op in self.sent_ops(stage)] == ["message 2"]
+
+
+pipeline_stage_test.add_base_pipeline_stage_tests(
+    cls=pipeline_stages_iothub.AggregateTelemetryStage,
+    module=this_module,
+    all_ops=all_common_ops + all_iothub_ops,
+    handled_ops=[],
+    all_events=all_common_events + all_iothub_events,
+    handled_events=[],
+    extra_initializer_defaults={
+        "batch_count": 0,
+        "batched_message_count": 0,
+        "batched_byte_count": 0,
+    },
+)
+
+
+@pytest.mark.describe("AggregateTelemetryStage - .run_op() -- called with send operations")
+class TestAggregateTelemetryStage(StageTestBase):
+    @pytest.fixture
+    def stage(self):
+        return pipeline_stages_iothub.AggregateTelemetryStage()
+
+    @pytest.fixture(autouse=True)
+    def timer(self, mocker):
+        return mocker.patch.object(pipeline_stages_iothub, "Timer")
+
+    @pytest.fixture(autouse=True)
+    def now(self, mocker):
+        now = mocker.patch.object(pipeline_stages_iothub, "_now")
+        now.return_value = 1000.0
+        return now
+
+    @pytest.fixture
+    def config(self, stage, stage_base_configuration):
+        config = stage.pipeline_root.pipeline_configuration
+        config.telemetry_batch_max_messages = 3
+        config.telemetry_batch_linger = 1.0
+        return config
+
+    def make_send_op(self, mocker, data='{"temperature": 21}', **kwargs):
+        return pipeline_ops_iothub.SendD2CMessageOperation(
+            message=Message(data, **kwargs), callback=mocker.MagicMock()
+        )
+
+    def sent_ops(self, stage):
+        return [call[0][0] for call in stage.next._execute_op.call_args_list]
+
+    @pytest.mark.it(
+        "Passes the operation down if the telemetry_batch_max_messages configuration option is not set"
+    )
+    def test_not_configured(self, mocker, stage, stage_base_configuration):
+        op = self.make_send_op(mocker)
+        stage.run_op(op)
+        assert self.sent_ops(stage) == [op]
+
+    @pytest.mark.it(
+        "Sends telemetry_batch_max_messages messages as one message with a JSON array payload"
+    )
+    def test_sends_batch(self, mocker, stage, config):
+        ops = [self.make_send_op(mocker, data=json.dumps({"reading": i})) for i in range(3)]
+        ops[1].message.data = ops[1].message.data.encode("utf-8")
+        for op in ops[:2]:
+            stage.run_op(op)
+        assert self.sent_ops(stage) == []
+        stage.run_op(ops[2])
+
+        sent_ops = self.sent_ops(stage)
+        assert len(sent_ops) == 1
+        assert isinstance(sent_ops[0], pipeline_ops_iothub.SendD2CMessageOperation)
+        assert json.loads(sent_ops[0].message.data.decode("utf-8")) == [
+            {"reading": 0},
+            {"reading": 1},
+            {"reading": 2},
+        ]
+        assert sent_ops[0].message.content_type == "application/json"
+        assert sent_ops[0].message.content_encoding == "utf-8"
+
+    @pytest.mark.it("Completes every operation in a batch when the batch has been sent")
+    @pytest.mark.parametrize(
+        "error", [pytest.param(None, id="Success"), pytest.param(PipelineError(), id="Failure")]
+    )
+    def test_completes_ops(self, mocker, stage, config, error):
+        ops = [self.make_send_op(mocker) for _ in range(3)]
+        for op in ops:
+            stage.run_op(op)
+        for op in ops:
+            assert op.callback.call_count == 0
+
+        stage.next._complete_op(self.sent_ops(stage)[0], error=error)
+
+        for op in ops:
+            if error:
+                assert_callback_failed(op=op, error=error)
+            else:
+                assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Sends a batch when it has waited for telemetry_batch_linger seconds")
+    def test_linger(self, mocker, stage, config, timer, now):
+        ops = [self.make_send_op(mocker) for _ in range(2)]
+        for op in ops:
+            stage.run_op(op)
+        assert timer.call_count == 1
+        assert timer.call_args[0][0] == config.telemetry_batch_linger
+
+        now.return_value += config.telemetry_batch_linger
+        timer.call_args[0][1]()
+
+        assert len(self.sent_ops(stage)) == 1
+        assert json.loads(self.sent_ops(stage)[0].message.data.decode("utf-8")) == [
+            {"temperature": 21},
+            {"temperature": 21},
+        ]
+
+    @pytest.mark.it("Sends a batch of one message as the original operation")
+    def test_single_message(self, mocker, stage, config, timer, now):
+        op = self.make_send_op(mocker)
+        stage.run_op(op)
+        now.return_value += config.telemetry_batch_linger
+        timer.call_args[0][1]()
+        assert self.sent_ops(stage) == [op]
+
+    @pytest.mark.it("Runs a single timer, for the deadline of the oldest waiting batch")
+    def test_single_timer(self, mocker, stage, config, timer, now):
+        ops = [self.make_send_op(mocker), self.make_send_op(mocker, qos=0)]
+        stage.run_op(ops[0])
+        now.return_value += config.telemetry_batch_linger / 2
+        stage.run_op(ops[1])
+        assert len(stage._batches) == 2
+        assert timer.call_count == 1
+        assert timer.return_value.start.call_count == 1
+
+        now.return_value += config.telemetry_batch_linger / 2
+        timer.call_args[0][1]()
+
+        assert self.sent_ops(stage) == [ops[0]]
+        assert timer.call_count == 2
+        assert timer.call_args[0][0] == pytest.approx(config.telemetry_batch_linger / 2)
+
+        now.return_value += config.telemetry_batch_linger / 2
+        timer.call_args[0][1]()
+
+        assert self.sent_ops(stage) == ops
+        assert timer.call_count == 2
+
+    @pytest.mark.it("Starts the timer again for the next batch if the first batch was already sent")
+    def test_timer_after_full_batch(self, mocker, stage, config, timer, now):
+        config.telemetry_batch_max_messages = 2
+        stage.run_op(self.make_send_op(mocker))
+        now.return_value += config.telemetry_batch_linger / 2
+        op = self.make_send_op(mocker, qos=0)
+        stage.run_op(op)
+        stage.run_op(self.make_send_op(mocker))
+        assert len(self.sent_ops(stage)) == 1
+
+        now.return_value += config.telemetry_batch_linger / 2
+        timer.call_args[0][1]()
+
+        assert len(self.sent_ops(stage)) == 1
+        assert timer.call_count == 2
+        assert timer.call_args[0][0] == pytest.approx(config.telemetry_batch_linger / 2)
+
+    @pytest.mark.it("Cancels the timer once every waiting batch has been sent")
+    def test_cancels_timer(self, mocker, stage, config, timer):
+        stage.run_op(self.make_send_op(mocker))
+        stage.run_op(pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock()))
+        assert timer.return_value.cancel.call_count == 1
+        assert stage._linger_timer is None
+
+    @pytest.mark.it(
+        "Sends a batch before adding a message which would make it larger than telemetry_batch_max_bytes"
+    )
+    def test_max_bytes(self, mocker, stage, config):
+        config.telemetry_batch_max_bytes = 20
+        ops = [self.make_send_op(mocker, data='"{}"'.format("x" * 10)) for _ in range(2)]
+        for op in ops:
+            stage.run_op(op)
+        assert self.sent_ops(stage) == [ops[0]]
+        assert stage._batches
+
+    @pytest.mark.it("Only combines messages with the same output, QoS and custom properties")
+    def test_compatible_messages(self, mocker, stage, config):
+        ops = [self.make_send_op(mocker), self.make_send_op(mocker, qos=0)]
+        ops[0].message.custom_properties["sensor"] = "a"
+        for op in ops:
+            stage.run_op(op)
+        assert len(stage._batches) == 2
+
+    @pytest.mark.it(
+        "Sends messages which cannot be combined with others on their own, after any waiting batches"
+    )
+    @pytest.mark.parametrize(
+        "data,kwargs,attribute",
+        [
+            pytest.param("not json", {}, None, id="Not JSON"),
+            pytest.param("{}", {"content_type": "text/plain"}, None, id="Not application/json"),
+            pytest.param("{}", {"content_encoding": "utf-16"}, None, id="Not UTF-8"),
+            pytest.param("{}", {"message_id": "fake_id"}, None, id="message_id"),
+            pytest.param("{}", {}, "correlation_id", id="correlation_id"),
+            pytest.param("{}", {}, "expiry_time_utc", id="expiry_time_utc"),
+        ],
+    )
+    def test_unbatchable_message(self, mocker, stage, config, data, kwargs, attribute):
+        batched_op = self.make_send_op(mocker)
+        stage.run_op(batched_op)
+        op = self.make_send_op(mocker, data=data, **kwargs)
+        if attribute:
+            setattr(op.message, attribute, "fake_value")
+        stage.run_op(op)
+        assert self.sent_ops(stage) == [batched_op, op]
+
+    @pytest.mark.it("Sends waiting batches before passing a DisconnectOperation down")
+    def test_disconnect(self, mocker, stage, config):
+        batched_op = self.make_send_op(mocker)
+        stage.run_op(batched_op)
+        op = pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock())
+        stage.run_op(op)
+        assert self.sent_ops(stage) == [batched_op, op]
+
+    @pytest.mark.it("Counts the batches, messages and bytes sent")
+    def test_counts(self, mocker, stage, config):
+        for _ in range(4):
+            stage.run_op(self.make_send_op(mocker, data="1"))
+        stage.run_op(pipeline_ops_base.DisconnectOperation(callback=mocker.MagicMock()))
+        assert stage.batch_count == 2
+        assert stage.batched_message_count == 4
+        assert stage.batched_byte_count == len(b"[1,1,1]") + len(b"[1]")
+
+
+pipeline_stage_test.add_base_pipeline_stage_tests(
+    cls=pipeline_stages_iothub.CompressMessagesStage,
+    module=this_module,
+    all_ops=all_common_ops + all_iothub_ops,
+    handled_ops=[],
+    all_events=all_common_events + all_iothub_events,
+    handled_events=[],
+    extra_initializer_defaults={
+        "compressed_message_count": 0,
+        "uncompressed_byte_count": 0,
+        "compressed_byte_count": 0,
+    },
+)
+
+
+@pytest.mark.describe("CompressMessagesStage - .run_op() -- called with send operations")
+class TestCompressMessagesStage(StageTestBase):
+    @pytest.fixture
+    def stage(self):
+        return pipeline_stages_iothub.CompressMessagesStage()
+
+    @pytest.fixture
+    def config(self, stage, stage_base_configuration):
+        config = stage.pipeline_root.pipeline_configuration
+        config.compression_threshold = 100
+        config.compression_method = "gzip"
+        return config
+
+    @pytest.fixture(params=["SendD2CMessageOperation", "SendOutputEventOperation"])
+    def op_class(self, request):
+        return getattr(pipeline_ops_iothub, request.param)
+
+    def make_send_op(self, mocker, op_class, data=json.dumps([{"temperature": 21}] * 20), **kwargs):
+        return op_class(message=Message(data, **kwargs), callback=mocker.MagicMock())
+
+    def sent_op(self, stage):
+        assert stage.next._execute_op.call_count == 1
+        return stage.next._execute_op.call_args[0][0]
+
+    @pytest.mark.it(
+        "Passes the operation down unchanged if the compression_threshold configuration option is not set"
+    )
+    def test_not_configured(self, mocker, stage, stage_base_configuration, op_class):
+        stage.pipeline_root.pipeline_configuration.compression_threshold = None
+        op = self.make_send_op(mocker, op_class)
+        message = op.message
+        stage.run_op(op)
+        assert self.sent_op(stage) is op
+        assert op.message is message
+
+    @pytest.mark.it(
+        "Sends a compressed copy of the message, with the compression method as its content_encoding"
+    )
+    @pytest.mark.parametrize("method", ["gzip", "deflate"])
+    @pytest.mark.parametrize("as_bytes", [False, True], ids=["str payload", "bytes payload"])
+    def test_compresses(self, mocker, stage, config, op_class, method, as_bytes):
+        config.compression_method = method
+        op = self.make_send_op(mocker, op_class)
+        message = op.message
+        data = message.data
+        if as_bytes:
+            message.data = data = data.encode("utf-8")
+        message.custom_properties["fake_key"] = "fake_value"
+        stage.run_op(op)
+
+        sent_message = self.sent_op(stage).message
+        assert sent_message is not message
+        assert sent_message.content_encoding == method
+        assert sent_message.content_type == "application/json"
+        assert sent_message.custom_properties == {"fake_key": "fake_value"}
+        assert message_compression.decompress(sent_message.data, method) == (
+            data if as_bytes else data.encode("utf-8")
+        )
+        # The message passed in is not changed
+        assert message.data == data
+        assert message.content_encoding == "utf-8"
+
+    @pytest.mark.it("Completes the operation when the compressed message has been sent")
+    def test_completes_op(self, mocker, stage, config, op_class):
+        op = self.make_send_op(mocker, op_class)
+        stage.run_op(op)
+        assert op.callback.call_count == 0
+        stage.next._complete_op(self.sent_op(stage))
+        assert_callback_succeeded(op=op)
+
+    @pytest.mark.it("Sends the message as it is if it cannot be compressed")
+    @pytest.mark.parametrize(
+        "data,kwargs",
+        [
+            pytest.param("x" * 99, {}, id="Smaller than compression_threshold"),
+            pytest.param(os.urandom(200), {}, id="Does not get smaller"),
+            pytest.param("x" * 200, {"content_encoding": "utf-16"}, id="Not UTF-8"),
+            pytest.param("x" * 200, {"content_encoding": "gzip"}, id="Already compressed"),
+            pytest.param(12345, {}, id="Not str or bytes"),
+        ],
+    )
+    def test_not_compressed(self, mocker, stage, config, op_class, data, kwargs):
+        op = self.make_send_op(mocker, op_class, data=data, **kwargs)
+        message = op.message
+        stage.run_op(op)
+        assert self.sent_op(stage).message is message
+        assert message.data == data
+        assert stage.compressed_message_count == 0
+
+    @pytest.mark.it("Counts the messages compressed, and their sizes before and after compression")
+    def test_counts(self, mocker, stage, config, op_class):
+        op = self.make_send_op(mocker, op_class)
+        data = op.message.data
+        stage.run_op(op)
+        assert stage.compressed_message_count == 1
+        assert stage.uncompressed_byte_count == len(data)
+        assert stage.compressed_byte_count == len(self.sent_op(stage).message.data)
@@ -8,6 +8,7 @@ import logging
 import pytest
 import json
 import sys
+import zlib
 import six.moves.urllib as urllib
 from azure.iot.device.common.pipeline import (
     pipeline_events_base,
@@ -126,6 +127,7 @@ ops_handled_by_this_stage = [
     pipeline_ops_iothub.SendMethodResponseOperation,
     pipeline_ops_base.SendIotRequestOperation,
     pipeline_ops_base.EnableFeatureOperation,
+    pipeline_ops_base.EnableFeaturesOperation,
     pipeline_ops_base.DisableFeatureOperation,
 ]
 
@@ -548,6 +550,14 @@ basic_ops = [
         "op_init_kwargs": {"feature_name": constant.C2D_MSG, "callback": None},
         "new_op_class": pipeline_ops_mqtt.MQTTSubscribeOperation,
     },
+    {
+        "op_class": pipeline_ops_base.EnableFeaturesOperation,
+        "op_init_kwargs": {
+            "feature_names": [constant.METHODS, constant.TWIN_PATCHES],
+            "callback": None,
+        },
+        "new_op_class": pipeline_ops_mqtt.MQTTSubscribeOperation,
+    },
     {
         "op_class": pipeline_ops_base.DisableFeatureOperation,
         "op_init_kwargs": {"feature_name": constant.C2D_MSG, "callback": None},
@@ -983,6 +993,105 @@ class TestIoTHubMQTTConverterForPublishOps(IoTHubMQTTConverterStageTestBase):
         assert new_op.payload == params["publish_payload"]
 
 
+
+@pytest.mark.parametrize(
+    "op_class",
+    [pipeline_ops_iothub.SendD2CMessageOperation, pipeline_ops_iothub.SendOutputEventOperation],
+)
+@pytest.mark.describe("IoTHubMQTTConverterStage - .run_op() -- called with telemetry operations")
+class TestIoTHubMQTTConverterTelemetryQoS(IoTHubMQTTConverterStageTestBase):
+    @pytest.mark.it("Publishes with the telemetry_qos of the pipeline configuration by default")
+    @pytest.mark.parametrize("telemetry_qos", [0, 1])
+    def test_configured_qos(
+        self, mocker, stage, stage_configured_for_module, op_class, telemetry_qos
+    ):
+        stage.pipeline_root.pipeline_configuration.telemetry_qos = telemetry_qos
+        op = op_class(
+            message=Message(fake_message_body, output_name=fake_output_name),
+            callback=mocker.MagicMock(),
+        )
+        stage.run_op(op)
+        new_op = stage.next._execute_op.call_args[0][0]
+        assert new_op.qos == telemetry_qos
+
+    @pytest.mark.it("Publishes with the qos of the message, if it has one")
+    @pytest.mark.parametrize("telemetry_qos, message_qos", [(0, 1), (1, 0)])
+    def test_message_qos(
+        self, mocker, stage, stage_configured_for_module, op_class, telemetry_qos, message_qos
+    ):
+        stage.pipeline_root.pipeline_configuration.telemetry_qos = telemetry_qos
+        op = op_class(
+            message=Message(fake_message_body, output_name=fake_output_name, qos=message_qos),
+            callback=mocker.MagicMock(),
+        )
+        stage.run_op(op)
+        new_op = stage.next._execute_op.call_args[0][0]
+        assert new_op.qos == message_qos
+
+
+@pytest.mark.describe("IoTHubMQTTConverterStage - .run_op() -- called with telemetry operations")
+class TestIoTHubMQTTConverterTelemetryReuse(IoTHubMQTTConverterStageTestBase):
+    @pytest.fixture
+    def make_op(self, mocker):
+        def make_op():
+            return pipeline_ops_iothub.SendD2CMessageOperation(
+                message=Message(fake_message_body), callback=mocker.MagicMock()
+            )
+
+        return make_op
+
+    @pytest.mark.it("Reuses the MQTTPublishOperation of a completed telemetry operation")
+    def test_reuses_completed(self, stage, stage_configured_for_device, make_op):
+        op1 = make_op()
+        stage.run_op(op1)
+        publish_op1 = stage.next._execute_op.call_args[0][0]
+        stage.next._complete_op(publish_op1)
+        assert_callback_succeeded(op=op1)
+
+        stage.run_op(make_op())
+        publish_op2 = stage.next._execute_op.call_args[0][0]
+        assert publish_op2 is publish_op1
+        assert not publish_op2.completed
+        assert publish_op2.payload == fake_message_body
+
+    @pytest.mark.it(
+        "Keeps none of the state of the previous telemetry operation in a reused MQTTPublishOperation"
+    )
+    def test_reused_op_state(
+        self, mocker, stage, stage_configured_for_device, make_op, arbitrary_exception
+    ):
+        stage.pipeline_root.pipeline_configuration.telemetry_qos = 0
+        op1 = make_op()
+        stage.run_op(op1)
+        publish_op1 = stage.next._execute_op.call_args[0][0]
+        stage.next._complete_op(publish_op1, error=arbitrary_exception)
+        assert_callback_failed(op=op1, error=arbitrary_exception)
+
+        op2 = pipeline_ops_iothub.SendD2CMessageOperation(
+            message=Message("new body", qos=1), callback=mocker.MagicMock()
+        )
+        stage.run_op(op2)
+        publish_op2 = stage.next._execute_op.call_args[0][0]
+        assert publish_op2 is publish_op1
+        assert not publish_op2.completed
+        assert publish_op2.needs_connection
+        assert publish_op2.payload == "new body"
+        assert publish_op2.qos == 1
+
+        stage.next._complete_op(publish_op2)
+        assert_callback_succeeded(op=op2)
+        assert op1.callback.call_count == 1
+
+    @pytest.mark.it("Does not reuse the MQTTPublishOperation of a telemetry operation in progress")
+    def test_does_not_reuse_in_progress(self, stage, stage_configured_for_device, make_op):
+        stage.run_op(make_op())
+        publish_op1 = stage.next._execute_op.call_args[0][0]
+
+        stage.run_op(make_op())
+        publish_op2 = stage.next._execute_op.call_args[0][0]
+        assert publish_op2 is not publish_op1
+
+
 feature_name_to_subscribe_topic = [
     {
         "stage_type": "device",
@@ -1059,6 +1168,43 @@ class TestIoTHubMQTTConverterWithEnableFeature(IoTHubMQTTConverterStageTestBase)
         assert_callback_failed(op=op, error=KeyError)
 
 
+@pytest.mark.describe("IoTHubMQTTConverterStage - .run_op() -- called with EnableFeatures")
+class TestIoTHubMQTTConverterWithEnableFeatures(IoTHubMQTTConverterStageTestBase):
+    @pytest.mark.it(
+        "Converts all of the feature_names to topics for a single MQTTSubscribeOperation"
+    )
+    def test_converts_feature_names_to_topics(self, mocker, stage, stages_configured_for_both):
+        feature_names = [
+            x["feature_name"]
+            for x in feature_name_to_subscribe_topic
+            if x["stage_type"] == "both" or (x["stage_type"] == "module") == bool(stage.module_id)
+        ]
+        topics = [
+            x["topic"]
+            for x in feature_name_to_subscribe_topic
+            if x["feature_name"] in feature_names
+        ]
+        stage.next._execute_op = mocker.Mock()
+        op = pipeline_ops_base.EnableFeaturesOperation(
+            feature_names=feature_names, callback=mocker.MagicMock()
+        )
+        stage.run_op(op)
+        assert stage.next._execute_op.call_count == 1
+        new_op = stage.next._execute_op.call_args[0][0]
+        assert isinstance(new_op, pipeline_ops_mqtt.MQTTSubscribeOperation)
+        assert new_op.topic == topics
+
+    @pytest.mark.it("Fails on an invalid feature_name")
+    def test_fails_on_invalid_feature_name(self, mocker, stage, stages_configured_for_both):
+        stage.next._execute_op = mocker.Mock()
+        op = pipeline_ops_base.EnableFeaturesOperation(
+            feature_names=[constant.METHODS, invalid_feature_name], callback=mocker.MagicMock()
+        )
+        stage.run_op(op)
+        assert_callback_failed(op=op, error=KeyError)
+        assert stage.next._execute_op.call_count == 0
+
+
 @pytest.fixture
 def add_pipeline_root(stage, mocker):
     root = pipeline_stages_base.PipelineRootStage(mocker.MagicMock())
@@ -1124,6 +1270,48 @@ class TestIoTHubMQTTConverterHandlePipelineEventC2D(IoTHubMQTTConverterStageTest
         new_event = stage.previous.handle_pipeline_event.call_args[0][0]
         assert new_event.message.content_type == fake_content_type
 
+    @pytest.mark.it(
+        "Decompresses the payload of a compressed c2d message if the compression_threshold configuration option is set"
+    )
+    @pytest.mark.parametrize(
+        "compression_threshold,expected_decompressed", [(0, True), (None, False)]
+    )
+    def test_decompresses_c2d_message(
+        self,
+        mocker,
+        stage,
+        stage_configured_for_device,
+        add_pipeline_root,
+        compression_threshold,
+        expected_decompressed,
+    ):
+        stage.pipeline_root.pipeline_configuration.compression_threshold = compression_threshold
+        payload = zlib.compress(b'{"command": "reboot"}')
+        event = pipeline_events_mqtt.IncomingMQTTMessageEvent(
+            topic=fake_c2d_topic + "%24.ce=deflate", payload=payload
+        )
+        stage.handle_pipeline_event(event)
+        new_event = stage.previous.handle_pipeline_event.call_args[0][0]
+        if expected_decompressed:
+            assert new_event.message.data == b'{"command": "reboot"}'
+            assert new_event.message.content_encoding == "utf-8"
+        else:
+            assert new_event.message.data == payload
+            assert new_event.message.content_encoding == "deflate"
+
+    @pytest.mark.it("Leaves the payload of a c2d message which cannot be decompressed as it is")
+    def test_invalid_compressed_c2d_message(
+        self, mocker, stage, stage_configured_for_device, add_pipeline_root
+    ):
+        stage.pipeline_root.pipeline_configuration.compression_threshold = 0
+        event = pipeline_events_mqtt.IncomingMQTTMessageEvent(
+            topic=fake_c2d_topic + "%24.ce=gzip", payload=b"not compressed"
+        )
+        stage.handle_pipeline_event(event)
+        new_event = stage.previous.handle_pipeline_event.call_args[0][0]
+        assert new_event.message.data == b"not compressed"
+        assert new_event.message.content_encoding == "gzip"
+
     @pytest.mark.it("Passes up c2d messages destined for another device")
     def test_if_topic_is_c2d_for_another_device(
         self, mocker, stage, stage_configured_for_device, add_pipeline_root
@@ -1474,7 +1662,7 @@ class TestIotHubMQTTConverterHandlePipelineEventTwinResponse(IoTHubMQTTConverter
         fake_event.topic = fake_topic_name_with_missing_request_id
         stage.handle_pipeline_event(event=fake_event)
         assert unhandled_error_handler.call_count == 1
-        assert isinstance(unhandled_error_handler.call_args[0][0], IndexError)
+        assert isinstance(unhandled_error_handler.call_args[0][0], ValueError)
 
     @pytest.mark.it(
         "Calls the unhandled exception handler if the status code is missing from the topic name"
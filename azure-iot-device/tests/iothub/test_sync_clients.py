@@ -42,6 +42,22 @@ class SharedClientInstantiationTests(object):
 
         assert client._iothub_pipeline is iothub_pipeline
 
+    @pytest.mark.it("Reports the occupancy of the IoTHubPipeline's in-flight window")
+    def test_in_flight_window(self, client_class, iothub_pipeline):
+        iothub_pipeline.in_flight_message_count = 5
+        iothub_pipeline.queued_message_count = 2
+        client = client_class(iothub_pipeline)
+
+        assert client.in_flight_message_count == 5
+        assert client.queued_message_count == 2
+
+    @pytest.mark.it("Reports the number of messages in the IoTHubPipeline's message store")
+    def test_stored_message_count(self, client_class, iothub_pipeline):
+        iothub_pipeline.stored_message_count = 7
+        client = client_class(iothub_pipeline)
+
+        assert client.stored_message_count == 7
+
     @pytest.mark.it("Sets on_connected handler in the IoTHubPipeline")
     def test_sets_on_connected_handler_in_pipeline(self, client_class, iothub_pipeline):
         client = client_class(iothub_pipeline)
@@ -372,6 +388,11 @@ class SharedClientConnectTests(WaitsForEventCompletion):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -417,6 +438,11 @@ class SharedClientDisconnectTests(WaitsForEventCompletion):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -486,6 +512,16 @@ class SharedClientSendD2CMessageTests(WaitsForEventCompletion):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
+            pytest.param(
+                pipeline_exceptions.PipelineBusyError,
+                client_exceptions.ClientBusyError,
+                id="PipelineBusyError->ClientBusyError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -532,6 +568,52 @@ class SharedClientSendD2CMessageTests(WaitsForEventCompletion):
         assert sent_message.data == message_input
 
 
+class SharedClientSendD2CMessagesTests(WaitsForEventCompletion):
+    @pytest.mark.it("Begins a single 'send_messages' IoTHubPipeline operation for all the messages")
+    def test_calls_pipeline_send_messages(self, client, iothub_pipeline, message):
+        messages = [message, Message("other message")]
+        client.send_messages(iter(messages))
+        assert iothub_pipeline.send_messages.call_count == 1
+        assert iothub_pipeline.send_messages.call_args[0][0] == messages
+        assert iothub_pipeline.send_message.call_count == 0
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'send_messages' pipeline operation before returning"
+    )
+    def test_waits_for_pipeline_op_completion(
+        self, mocker, client_manual_cb, iothub_pipeline_manual_cb, message
+    ):
+        self.add_event_completion_checks(
+            mocker=mocker,
+            pipeline_function=iothub_pipeline_manual_cb.send_messages,
+            kwargs={"results": [None]},
+        )
+        client_manual_cb.send_messages([message])
+
+    @pytest.mark.it(
+        "Returns None for each message that was sent, and a client error for each message that failed"
+    )
+    def test_returns_results(self, mocker, client, iothub_pipeline, message):
+        my_pipeline_error = pipeline_exceptions.ConnectionDroppedError()
+
+        def send_messages(messages, callback):
+            callback(results=[None, my_pipeline_error])
+
+        iothub_pipeline.send_messages = mocker.MagicMock(side_effect=send_messages)
+        results = client.send_messages([message, message])
+        assert results[0] is None
+        assert isinstance(results[1], client_exceptions.ConnectionDroppedError)
+        assert results[1].__cause__ is my_pipeline_error
+
+    @pytest.mark.it("Wraps inputs which are not Message objects in Message objects")
+    def test_wraps_data_in_message(self, client, iothub_pipeline, message):
+        client.send_messages([message, "message", 222])
+        sent_messages = iothub_pipeline.send_messages.call_args[0][0]
+        assert sent_messages[0] is message
+        assert [sent_message.data for sent_message in sent_messages[1:]] == ["message", 222]
+        assert all(isinstance(sent_message, Message) for sent_message in sent_messages)
+
+
 class SharedClientReceiveMethodRequestTests(object):
     @pytest.mark.it("Implicitly enables methods feature if not already enabled")
     @pytest.mark.parametrize(
@@ -737,6 +819,11 @@ class SharedClientSendMethodResponseTests(WaitsForEventCompletion):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -760,6 +847,105 @@ class SharedClientSendMethodResponseTests(WaitsForEventCompletion):
         assert e_info.value.__cause__ is my_pipeline_error
 
 
+class SharedClientEnableFeaturesTests(WaitsForEventCompletion):
+    @pytest.fixture
+    def feature_names(self):
+        return [constant.METHODS, constant.TWIN, constant.TWIN_PATCHES]
+
+    @pytest.mark.it(
+        "Begins a single 'enable_features' pipeline operation for the features which are not already enabled"
+    )
+    def test_calls_pipeline_enable_features(self, client, iothub_pipeline, feature_names):
+        iothub_pipeline.feature_enabled.__contains__.return_value = True
+        iothub_pipeline.feature_enabled.__getitem__.side_effect = (
+            lambda feature_name: feature_name == constant.TWIN
+        )  # Only twin will appear enabled
+        client.enable_features(feature_names)
+        assert iothub_pipeline.enable_features.call_count == 1
+        assert iothub_pipeline.enable_features.call_args[0][0] == [
+            constant.METHODS,
+            constant.TWIN_PATCHES,
+        ]
+        assert iothub_pipeline.enable_feature.call_count == 0
+
+    @pytest.mark.it(
+        "Does not begin a pipeline operation if all of the features are already enabled"
+    )
+    def test_all_features_already_enabled(self, client, iothub_pipeline, feature_names):
+        iothub_pipeline.feature_enabled.__contains__.return_value = True
+        iothub_pipeline.feature_enabled.__getitem__.return_value = True
+        client.enable_features(feature_names)
+        assert iothub_pipeline.enable_features.call_count == 0
+
+    @pytest.mark.it(
+        "Waits for the completion of the 'enable_features' pipeline operation before returning"
+    )
+    def test_waits_for_pipeline_op_completion(
+        self, mocker, client_manual_cb, iothub_pipeline_manual_cb, feature_names
+    ):
+        iothub_pipeline_manual_cb.feature_enabled.__contains__.return_value = True
+        iothub_pipeline_manual_cb.feature_enabled.__getitem__.return_value = False
+        self.add_event_completion_checks(
+            mocker=mocker, pipeline_function=iothub_pipeline_manual_cb.enable_features
+        )
+        client_manual_cb.enable_features(feature_names)
+
+    @pytest.mark.it(
+        "Raises a client error if the `enable_features` pipeline operation calls back with a pipeline error"
+    )
+    @pytest.mark.parametrize(
+        "pipeline_error,client_error",
+        [
+            pytest.param(
+                pipeline_exceptions.ConnectionDroppedError,
+                client_exceptions.ConnectionDroppedError,
+                id="ConnectionDroppedError->ConnectionDroppedError",
+            ),
+            pytest.param(
+                pipeline_exceptions.ConnectionFailedError,
+                client_exceptions.ConnectionFailedError,
+                id="ConnectionFailedError->ConnectionFailedError",
+            ),
+            pytest.param(
+                pipeline_exceptions.UnauthorizedError,
+                client_exceptions.CredentialError,
+                id="UnauthorizedError->CredentialError",
+            ),
+            pytest.param(
+                pipeline_exceptions.ProtocolClientError,
+                client_exceptions.ClientError,
+                id="ProtocolClientError->ClientError",
+            ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
+            pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
+        ],
+    )
+    def test_raises_error_on_pipeline_op_error(
+        self,
+        mocker,
+        client_manual_cb,
+        iothub_pipeline_manual_cb,
+        feature_names,
+        pipeline_error,
+        client_error,
+    ):
+        iothub_pipeline_manual_cb.feature_enabled.__contains__.return_value = True
+        iothub_pipeline_manual_cb.feature_enabled.__getitem__.return_value = False
+        my_pipeline_error = pipeline_error()
+        self.add_event_completion_checks(
+            mocker=mocker,
+            pipeline_function=iothub_pipeline_manual_cb.enable_features,
+            kwargs={"error": my_pipeline_error},
+        )
+        with pytest.raises(client_error) as e_info:
+            client_manual_cb.enable_features(feature_names)
+        assert e_info.value.__cause__ is my_pipeline_error
+
+
 class SharedClientGetTwinTests(WaitsForEventCompletion):
     @pytest.fixture
     def patch_get_twin_to_return_fake_twin(self, fake_twin, mocker, iothub_pipeline):
@@ -831,6 +1017,11 @@ class SharedClientGetTwinTests(WaitsForEventCompletion):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -937,6 +1128,11 @@ class SharedClientPatchTwinReportedPropertiesTests(WaitsForEventCompletion):
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -1224,6 +1420,13 @@ class TestIoTHubDeviceClientSendD2CMessage(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .send_messages()")
+class TestIoTHubDeviceClientSendD2CMessages(
+    IoTHubDeviceClientTestsConfig, SharedClientSendD2CMessagesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .receive_message()")
 class TestIoTHubDeviceClientReceiveC2DMessage(IoTHubDeviceClientTestsConfig):
     @pytest.mark.it("Implicitly enables C2D messaging feature if not already enabled")
@@ -1330,6 +1533,13 @@ class TestIoTHubDeviceClientSendMethodResponse(
     pass
 
 
+@pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .enable_features()")
+class TestIoTHubDeviceClientEnableFeatures(
+    IoTHubDeviceClientTestsConfig, SharedClientEnableFeaturesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubDeviceClient (Synchronous) - .get_twin()")
 class TestIoTHubDeviceClientGetTwin(IoTHubDeviceClientTestsConfig, SharedClientGetTwinTests):
     pass
@@ -1915,6 +2125,13 @@ class TestIoTHubNModuleClientSendD2CMessage(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Synchronous) - .send_messages()")
+class TestIoTHubModuleClientSendD2CMessages(
+    IoTHubModuleClientTestsConfig, SharedClientSendD2CMessagesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Synchronous) - .send_message_to_output()")
 class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig, WaitsForEventCompletion):
     @pytest.mark.it("Begins a 'send_output_event' pipeline operation")
@@ -1963,6 +2180,16 @@ class TestIoTHubModuleClientSendToOutput(IoTHubModuleClientTestsConfig, WaitsFor
                 client_exceptions.ClientError,
                 id="ProtocolClientError->ClientError",
             ),
+            pytest.param(
+                pipeline_exceptions.OperationTimeoutError,
+                client_exceptions.OperationTimeoutError,
+                id="OperationTimeoutError->OperationTimeoutError",
+            ),
+            pytest.param(
+                pipeline_exceptions.PipelineBusyError,
+                client_exceptions.ClientBusyError,
+                id="PipelineBusyError->ClientBusyError",
+            ),
             pytest.param(Exception, client_exceptions.ClientError, id="Exception->ClientError"),
         ],
     )
@@ -2136,6 +2363,13 @@ class TestIoTHubModuleClientSendMethodResponse(
     pass
 
 
+@pytest.mark.describe("IoTHubModuleClient (Synchronous) - .enable_features()")
+class TestIoTHubModuleClientEnableFeatures(
+    IoTHubModuleClientTestsConfig, SharedClientEnableFeaturesTests
+):
+    pass
+
+
 @pytest.mark.describe("IoTHubModuleClient (Synchronous) - .get_twin()")
 class TestIoTHubModuleClientGetTwin(IoTHubModuleClientTestsConfig, SharedClientGetTwinTests):
     pass
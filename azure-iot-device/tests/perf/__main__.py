@@ -0,0 +1,13 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Run the pipeline benchmark and regression suite.  See tests/perf/suite.py.
+
+python -m tests.perf --help
+"""
+
+from tests.perf.suite import main
+
+main()
@@ -0,0 +1,171 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of the Paho based MQTTTransport against the native AsyncMQTTTransport.
+
+For each transport this measures:
+  * latency: QoS 1 publishes sent one at a time, reported as p50/p99 milliseconds
+  * throughput: QoS 1 publishes pipelined without waiting for each PUBACK
+  * clients: threads added and time taken to connect many clients at once
+
+    python -m tests.perf.bench_async_transport --messages 2000 --clients 100
+
+The broker stand-in runs in another process.  The asyncio event loop runs on a background
+thread, as it does when the pipeline is driven from an asyncio application.
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from tests.perf.bench_network_loop import start_broker
+
+TRANSPORTS = ["paho", "asyncio"]
+TOPIC = "devices/bench/messages/events/"
+
+
+def create_transport(kind, client_id, loop):
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+    from azure.iot.device.common.async_mqtt_transport import AsyncMQTTTransport
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    kwargs = {
+        "client_id": client_id,
+        "hostname": "localhost",
+        "username": "localhost/" + client_id,
+        "ca_cert": get_ca_cert(),
+    }
+    if kind == "asyncio":
+        transport = AsyncMQTTTransport(loop=loop, **kwargs)
+    else:
+        transport = mqtt_transport.MQTTTransport(**kwargs)
+    transport.connected = threading.Event()
+    transport.disconnected = threading.Event()
+    transport.on_mqtt_connected_handler = transport.connected.set
+    transport.on_mqtt_disconnected_handler = lambda cause: transport.disconnected.set()
+    return transport
+
+
+def connect(transports):
+    for transport in transports:
+        transport.connect(password="password")
+    for transport in transports:
+        if not transport.connected.wait(60):
+            raise RuntimeError("Timed out waiting for connection")
+
+
+def disconnect(transports):
+    for transport in transports:
+        transport.disconnect()
+    for transport in transports:
+        transport.disconnected.wait(60)
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+def measure_latency(transport, messages, payload):
+    samples = []
+    completed = threading.Event()
+    for _ in range(messages):
+        completed.clear()
+        start = time.time()
+        transport.publish(topic=TOPIC, payload=payload, qos=1, callback=completed.set)
+        if not completed.wait(30):
+            raise RuntimeError("Timed out waiting for publish")
+        samples.append((time.time() - start) * 1000)
+    return percentile(samples, 50), percentile(samples, 99)
+
+
+def measure_throughput(transport, messages, payload):
+    lock = threading.Lock()
+    done = threading.Event()
+    remaining = [messages]
+
+    def on_published():
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    start = time.time()
+    for _ in range(messages):
+        transport.publish(topic=TOPIC, payload=payload, qos=1, callback=on_published)
+    if not done.wait(60):
+        raise RuntimeError("Timed out waiting for publishes")
+    return messages / (time.time() - start)
+
+
+def measure_clients(kind, clients, loop):
+    threads_before = threading.active_count()
+    transports = [create_transport(kind, "bench{}".format(i), loop) for i in range(clients)]
+    start = time.time()
+    connect(transports)
+    connect_time = time.time() - start
+    threads_added = threading.active_count() - threads_before
+    disconnect(transports)
+    return threads_added, connect_time
+
+
+def run(kind, port, messages, clients, payload_size):
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+
+    mqtt_transport.DEFAULT_PORT = port
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever)
+    loop_thread.daemon = True
+    loop_thread.start()
+    try:
+        payload = b"x" * payload_size
+        transport = create_transport(kind, "bench", loop)
+        connect([transport])
+        p50, p99 = measure_latency(transport, messages, payload)
+        rate = measure_throughput(transport, messages, payload)
+        disconnect([transport])
+        threads_added, connect_time = measure_clients(kind, clients, loop)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+    return {
+        "transport": kind,
+        "latency_p50_ms": round(p50, 3),
+        "latency_p99_ms": round(p99, 3),
+        "messages_per_second": round(rate),
+        "clients": clients,
+        "threads_added": threads_added,
+        "connect_seconds": round(connect_time, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument("--transport", nargs="+", choices=TRANSPORTS, default=TRANSPORTS)
+    args = parser.parse_args(argv)
+
+    results = []
+    broker, port = start_broker()
+    try:
+        for kind in args.transport:
+            result = run(kind, port, args.messages, args.clients, args.payload_size)
+            results.append(result)
+            print(
+                "{transport}: latency p50={latency_p50_ms}ms p99={latency_p99_ms}ms "
+                "throughput={messages_per_second} messages/s "
+                "clients={clients} threads_added={threads_added} "
+                "connect={connect_seconds}s".format(**result)
+            )
+    finally:
+        broker.terminate()
+        broker.wait()
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of the CPU cost of compressing JSON telemetry against the bytes it saves.
+
+Payloads are JSON arrays of readings like those a device sends (or that a batch of telemetry
+holds), from a single reading up to a payload near the largest message the service accepts.  For
+each payload and compression method, the bytes saved and the CPU time spent compressing (and
+decompressing) it are reported.
+
+    python -m tests.perf.bench_compression --readings 1 10 100 1000 --method gzip deflate
+
+A payload is only worth compressing if its bytes saved are worth more than its CPU time, which
+on a metered link is almost always the case above a few hundred bytes.
+"""
+
+import argparse
+import json
+import random
+import time
+from azure.iot.device.iothub.pipeline import message_compression
+
+METHODS = ["gzip", "deflate"]
+
+
+def make_payload(readings, seed=0):
+    """
+    Return a JSON array of the given number of sensor readings, as UTF-8 bytes
+    """
+    rng = random.Random(seed)
+    start = 1700000000
+    return json.dumps(
+        [
+            {
+                "deviceId": "bench-sensor-{:02d}".format(i % 4),
+                "timestamp": start + i,
+                "temperature": round(rng.uniform(18, 26), 2),
+                "humidity": round(rng.uniform(30, 60), 2),
+                "pressure": round(rng.uniform(990, 1030), 1),
+                "status": rng.choice(["ok", "ok", "ok", "warning"]),
+            }
+            for i in range(readings)
+        ]
+    ).encode("utf-8")
+
+
+def measure(fn, min_time=0.2):
+    """
+    Return the CPU time of one call of fn, in microseconds
+    """
+    count = 0
+    start = time.process_time()
+    elapsed = 0
+    while elapsed < min_time:
+        fn()
+        count += 1
+        elapsed = time.process_time() - start
+    return elapsed / count * 1e6
+
+
+def run(readings, method):
+    payload = make_payload(readings)
+    compressed = message_compression.compress(payload, method)
+    compress_us = measure(lambda: message_compression.compress(payload, method))
+    decompress_us = measure(lambda: message_compression.decompress(compressed, method))
+    saved = len(payload) - len(compressed)
+    return {
+        "readings": readings,
+        "method": method,
+        "bytes": len(payload),
+        "compressed_bytes": len(compressed),
+        "ratio": round(float(len(compressed)) / len(payload), 3),
+        "compress_us": round(compress_us, 1),
+        "decompress_us": round(decompress_us, 1),
+        # CPU time spent per kilobyte saved
+        "us_per_kb_saved": round(compress_us / saved * 1024, 1) if saved > 0 else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--method", nargs="+", choices=METHODS, default=METHODS)
+    args = parser.parse_args(argv)
+
+    results = []
+    for readings in args.readings:
+        for method in args.method:
+            result = run(readings, method)
+            results.append(result)
+            print(
+                "readings={readings} method={method} bytes={bytes} "
+                "compressed_bytes={compressed_bytes} ratio={ratio} compress={compress_us}us "
+                "decompress={decompress_us}us cpu_per_kb_saved={us_per_kb_saved}us".format(**result)
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
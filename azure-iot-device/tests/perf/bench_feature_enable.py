@@ -0,0 +1,83 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of client time-to-ready when enabling features one at a time or all at once.
+
+Time-to-ready is measured from the start of connect() until methods, twin and twin patches
+have all been enabled.  Enabled one at a time, each feature costs a SUBSCRIBE/SUBACK round trip.
+Enabled with enable_features(), they share a single SUBSCRIBE packet.
+
+    python -m tests.perf.bench_feature_enable --runs 10 --ack-delay 0 0.05
+
+The broker stand-in runs in another process.  --ack-delay simulates network latency by
+delaying the broker's acknowledgements.
+"""
+
+import argparse
+import time
+from tests.perf.bench_network_loop import start_broker
+
+MODES = ["sequential", "batched"]
+CONNECTION_STRING = "HostName=localhost;DeviceId=bench;SharedAccessKey=Zm9vYmFy"
+
+
+def time_to_ready(mode):
+    """
+    Connect a client, enable its features, and return the time taken in seconds
+    """
+    from azure.iot.device import IoTHubDeviceClient
+    from azure.iot.device.iothub.pipeline import constant
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    feature_names = [constant.METHODS, constant.TWIN, constant.TWIN_PATCHES]
+    client = IoTHubDeviceClient.create_from_connection_string(
+        CONNECTION_STRING, ca_cert=get_ca_cert()
+    )
+    start = time.time()
+    client.connect()
+    if mode == "batched":
+        client.enable_features(feature_names)
+    else:
+        for feature_name in feature_names:
+            client._enable_feature(feature_name)
+    elapsed = time.time() - start
+    client.disconnect()
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--ack-delay", type=float, nargs="+", default=[0.0, 0.05])
+    parser.add_argument("--mode", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args(argv)
+
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+
+    results = []
+    for ack_delay in args.ack_delay:
+        broker, port = start_broker("--ack-delay", str(ack_delay))
+        mqtt_transport.DEFAULT_PORT = port
+        try:
+            for mode in args.mode:
+                samples = sorted(time_to_ready(mode) for _ in range(args.runs))
+                result = {
+                    "mode": mode,
+                    "ack_delay": ack_delay,
+                    "time_to_ready_ms": round(samples[len(samples) // 2] * 1000, 1),
+                }
+                results.append(result)
+                print(
+                    "mode={mode} ack_delay={ack_delay}s "
+                    "time_to_ready={time_to_ready_ms}ms (median)".format(**result)
+                )
+        finally:
+            broker.terminate()
+            broker.wait()
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of C2D delivery latency while a slow method handler is running.
+
+Every --method-every C2D messages, a method request is received whose handler sleeps for
+--method-ms.  This prints the p50/p99 time from receiving each C2D message to its handler being
+called, first with the handlers on the callback thread of the pipeline, then on a HandlerExecutor.
+
+    python -m tests.perf.bench_handler_executor --messages 2000 --method-ms 20
+"""
+
+import argparse
+import threading
+import time
+from tests.perf import bench_pipeline_dispatch
+
+c2d_topic = "devices/bench/messages/devicebound/%24.mid=fake_id&%24.to=%2Fdevices%2Fbench"
+method_topic = "$iothub/methods/POST/bench_method/?$rid={}"
+
+
+def run(handler_executor, messages, method_every, method_ms):
+    from azure.iot.device.common.pipeline import pipeline_tracing
+
+    pipeline = bench_pipeline_dispatch.create_pipeline()
+    pipeline._pipeline.handler_executor = handler_executor
+    latency = pipeline_tracing.LatencyHistogram()
+    received = threading.Event()
+    receive_times = []
+    count = [0]
+
+    def on_c2d_message_received(message):
+        latency.record(time.time() - receive_times[count[0]])
+        count[0] += 1
+        if count[0] == messages:
+            received.set()
+
+    pipeline.on_c2d_message_received = on_c2d_message_received
+    pipeline.on_method_request_received = lambda request: time.sleep(method_ms / 1000.0)
+    transport = pipeline._pipeline.transport
+    for i in range(messages):
+        if i % method_every == 0:
+            transport.on_mqtt_message_received_handler(method_topic.format(i), b"{}")
+        receive_times.append(time.time())
+        transport.on_mqtt_message_received_handler(c2d_topic, b"payload")
+    if not received.wait(120):
+        raise RuntimeError("Timed out waiting for messages")
+    return latency
+
+
+def main(argv=None):
+    from azure.iot.device.common.handler_executor import HandlerExecutor
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--method-every", type=int, default=100)
+    parser.add_argument("--method-ms", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    result = {"messages": args.messages}
+    executor = HandlerExecutor(max_workers=args.workers)
+    for name, handler_executor in (("callback_thread", None), ("handler_executor", executor)):
+        latency = run(handler_executor, args.messages, args.method_every, args.method_ms)
+        result[name] = {
+            "p50_ms": latency.percentile(50) * 1000,
+            "p99_ms": latency.percentile(99) * 1000,
+        }
+        print("{}: c2d p50={p50_ms:.3f}ms p99={p99_ms:.3f}ms".format(name, **result[name]))
+    executor.shutdown()
+    return result
+
+
+if __name__ == "__main__":
+    main()
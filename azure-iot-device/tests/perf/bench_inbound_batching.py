@@ -0,0 +1,102 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of C2D receive throughput, and how many thread handoffs it costs.
+
+The broker stand-in sends a burst of C2D messages to a connected client, which receives them
+with receive_message().  Incoming messages are handed to the pipeline thread, and from there
+to the callback thread, in batches, so a burst costs far fewer than one handoff per message on
+each thread.  The handoffs are counted with a PipelineTracer.
+
+    python -m tests.perf.bench_inbound_batching --messages 20000
+
+The broker stand-in runs on a thread of this process, so that messages can be injected into it.
+"""
+
+import argparse
+import time
+
+CONNECTION_STRING = "HostName=localhost;DeviceId=bench;SharedAccessKey=Zm9vYmFy"
+C2D_TOPIC = "devices/bench/messages/devicebound/%24.mid=fake_id&%24.to=%2Fdevices%2Fbench"
+
+
+def get_handoff_counts(tracer):
+    """
+    Return the number of functions handed to the pipeline and callback threads so far
+    """
+    summary = tracer.get_summary()
+    return [summary.get("queue/" + name, {}).get("count", 0) for name in ("pipeline", "callback")]
+
+
+def run(broker, messages, payload_size):
+    """
+    Receive the given number of messages, and return (messages per second, pipeline thread
+    handoffs per message, callback thread handoffs per message)
+    """
+    from azure.iot.device import IoTHubDeviceClient
+    from azure.iot.device.common.pipeline.pipeline_tracing import PipelineTracer
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    tracer = PipelineTracer()
+    client = IoTHubDeviceClient.create_from_connection_string(
+        CONNECTION_STRING, ca_cert=get_ca_cert(), tracer=tracer
+    )
+    client.connect()
+    # Enables C2D messages
+    client.receive_message(block=False)
+
+    payload = b"x" * payload_size
+    pipeline_before, callback_before = get_handoff_counts(tracer)
+    start = time.time()
+    for _ in range(messages):
+        broker.publish(C2D_TOPIC, payload)
+    for _ in range(messages):
+        if client.receive_message(timeout=60) is None:
+            raise RuntimeError("Timed out waiting for messages")
+    elapsed = time.time() - start
+    pipeline_after, callback_after = get_handoff_counts(tracer)
+
+    client.disconnect()
+    return (
+        messages / elapsed,
+        (pipeline_after - pipeline_before) / float(messages),
+        (callback_after - callback_before) / float(messages),
+    )
+
+
+def main(argv=None):
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+    from tests.common.fake_mqtt_broker import FakeMQTTBroker
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = []
+    with FakeMQTTBroker() as broker:
+        mqtt_transport.DEFAULT_PORT = broker.port
+        for _ in range(args.runs):
+            rate, pipeline_handoffs, callback_handoffs = run(
+                broker, args.messages, args.payload_size
+            )
+            result = {
+                "messages": args.messages,
+                "messages_per_second": round(rate),
+                "pipeline_handoffs_per_message": round(pipeline_handoffs, 3),
+                "callback_handoffs_per_message": round(callback_handoffs, 3),
+            }
+            results.append(result)
+            print(
+                "messages={messages} throughput={messages_per_second} messages/s "
+                "handoffs/message: pipeline={pipeline_handoffs_per_message} "
+                "callback={callback_handoffs_per_message}".format(**result)
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
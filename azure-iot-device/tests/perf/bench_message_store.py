@@ -0,0 +1,103 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of the disk-backed store-and-forward message queue.
+
+For each durability level this measures:
+  * enqueue: messages stored per second by MessageStore.put
+  * drain: messages per second sent by a client draining a store filled while it was offline
+
+    python -m tests.perf.bench_message_store --messages 5000
+
+The broker stand-in runs in another process.  The store is created in a temporary directory,
+so the results depend on the disk that directory is on.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from tests.perf.bench_network_loop import start_broker
+
+DURABILITY_LEVELS = ["full", "normal", "off"]
+CONNECTION_STRING = "HostName=localhost;DeviceId=bench;SharedAccessKey=Zm9vYmFy"
+
+
+def measure_enqueue(path, durability, messages, payload):
+    from azure.iot.device import Message
+    from azure.iot.device.iothub.pipeline.message_store import MessageStore
+
+    store = MessageStore(path, durability=durability)
+    start = time.time()
+    for _ in range(messages):
+        store.put(Message(payload))
+    elapsed = time.time() - start
+    store.close()
+    return messages / elapsed
+
+
+def measure_drain(path, durability, messages):
+    from azure.iot.device import IoTHubDeviceClient
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    client = IoTHubDeviceClient.create_from_connection_string(
+        CONNECTION_STRING,
+        ca_cert=get_ca_cert(),
+        message_store_path=path,
+        message_store_durability=durability,
+    )
+    start = time.time()
+    client.connect()
+    while client.stored_message_count:
+        if time.time() - start > 120:
+            raise RuntimeError("Timed out draining the message store")
+        time.sleep(0.001)
+    elapsed = time.time() - start
+    client.disconnect()
+    return messages / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument(
+        "--durability", nargs="+", choices=DURABILITY_LEVELS, default=DURABILITY_LEVELS
+    )
+    args = parser.parse_args(argv)
+
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+
+    results = []
+    broker, port = start_broker()
+    mqtt_transport.DEFAULT_PORT = port
+    directory = tempfile.mkdtemp()
+    try:
+        for durability in args.durability:
+            path = os.path.join(directory, "{}.db".format(durability))
+            enqueue_rate = measure_enqueue(path, durability, args.messages, "x" * args.payload_size)
+            drain_rate = measure_drain(path, durability, args.messages)
+            result = {
+                "durability": durability,
+                "messages": args.messages,
+                "enqueue_per_second": round(enqueue_rate),
+                "drain_per_second": round(drain_rate),
+            }
+            results.append(result)
+            print(
+                "durability={durability} messages={messages} "
+                "enqueue={enqueue_per_second} messages/s "
+                "drain={drain_per_second} messages/s".format(**result)
+            )
+    finally:
+        shutil.rmtree(directory)
+        broker.terminate()
+        broker.wait()
+    return results
+
+
+if __name__ == "__main__":
+    main()
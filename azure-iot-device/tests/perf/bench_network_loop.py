@@ -0,0 +1,160 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark comparing a thread per MQTTTransport against a shared MQTTNetworkLoop.
+
+For an increasing number of connected transports, reports the number of threads in the
+process, the resident memory, and the CPU time used while the connections sit idle.
+
+    python -m tests.perf.bench_network_loop --clients 10 100 1000
+
+Each measurement runs in a fresh child process, against a local broker stand-in running in
+another process, so that neither memory nor threads from one run affect the next.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+MODES = ["threads", "loop"]
+
+
+def get_rss_kb():
+    """
+    Return the current resident set size of this process, in KB
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # Peak rather than current RSS, but the best we can do without /proc
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def start_broker(*args):
+    """
+    Start the broker stand-in in a child process and return (process, port)
+    """
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "tests.common.fake_mqtt_broker"] + list(args),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    port = int(proc.stdout.readline().split()[1])
+    return proc, port
+
+
+def run_child(mode, clients, port, idle_seconds, loop_threads):
+    """
+    Connect the given number of transports and measure them.  Runs in the child process.
+    """
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+    from azure.iot.device.common.mqtt_network_loop import MQTTNetworkLoop
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    mqtt_transport.DEFAULT_PORT = port
+    ca_cert = get_ca_cert()
+    network_loop = MQTTNetworkLoop(num_threads=loop_threads) if mode == "loop" else None
+
+    rss_before = get_rss_kb()
+    connected = threading.Semaphore(0)
+    transports = []
+    start = time.time()
+    for i in range(clients):
+        transport = mqtt_transport.MQTTTransport(
+            client_id="bench{}".format(i),
+            hostname="localhost",
+            username="localhost/bench{}".format(i),
+            ca_cert=ca_cert,
+            network_loop=network_loop,
+        )
+        transport.on_mqtt_connected_handler = connected.release
+        transport.on_mqtt_disconnected_handler = lambda cause: None
+        transport.connect(password="password")
+        transports.append(transport)
+    for _ in range(clients):
+        if not connected.acquire(timeout=60):
+            raise RuntimeError("Timed out waiting for connections")
+    connect_seconds = time.time() - start
+
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = time.process_time() - cpu_start
+
+    result = {
+        "mode": mode,
+        "clients": clients,
+        "threads": threading.active_count(),
+        "rss_kb": get_rss_kb(),
+        "rss_kb_per_client": round((get_rss_kb() - rss_before) / float(clients), 1),
+        "connect_seconds": round(connect_seconds, 3),
+        "idle_cpu_percent": round(100.0 * idle_cpu / idle_seconds, 2),
+    }
+
+    for transport in transports:
+        transport.disconnect()
+    if network_loop:
+        network_loop.stop()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--idle-seconds", type=float, default=5.0)
+    parser.add_argument("--loop-threads", type=int, default=1)
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "CLIENTS", "PORT"), help="internal")
+    args = parser.parse_args(argv)
+
+    if args.child:
+        mode, clients, port = args.child
+        result = run_child(mode, int(clients), int(port), args.idle_seconds, args.loop_threads)
+        print(json.dumps(result))
+        return
+
+    broker, port = start_broker()
+    try:
+        results = []
+        for clients in args.clients:
+            for mode in args.modes:
+                output = subprocess.check_output(
+                    [
+                        sys.executable,
+                        "-m",
+                        "tests.perf.bench_network_loop",
+                        "--child",
+                        mode,
+                        str(clients),
+                        str(port),
+                        "--idle-seconds",
+                        str(args.idle_seconds),
+                        "--loop-threads",
+                        str(args.loop_threads),
+                    ],
+                    universal_newlines=True,
+                )
+                result = json.loads(output.strip().splitlines()[-1])
+                results.append(result)
+                print(
+                    "{mode:>8} clients={clients:<6} threads={threads:<6} rss={rss_kb}KB "
+                    "({rss_kb_per_client}KB/client) connect={connect_seconds}s "
+                    "idle_cpu={idle_cpu_percent}%".format(**result)
+                )
+    finally:
+        broker.terminate()
+        broker.wait()
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of the memory allocated for each message sent through the full IoTHubPipeline stack.
+
+The MQTT transport is replaced by a fake, so this measures the pipeline itself:
+  * in flight: the bytes and memory blocks (measured with tracemalloc) that each send_message()
+    holds while it waits for its PUBACK
+  * gc: the number of garbage collections (generation 0) run per 1000 messages, when they are
+    all sent at once
+
+Budgets can be given for CI, in which case this exits with an error if any is exceeded:
+
+    python -m tests.perf.bench_pipeline_allocations --max-bytes 4000 --max-blocks 40
+"""
+
+import argparse
+import gc
+import sys
+import threading
+import time
+import tracemalloc
+from tests.perf.bench_pipeline_dispatch import Counter, FakeMQTTTransport, create_pipeline
+
+
+class HoldingMQTTTransport(FakeMQTTTransport):
+    """
+    Fake transport which holds on to publishes until they are released
+    """
+
+    def __init__(self, **kwargs):
+        super(HoldingMQTTTransport, self).__init__(**kwargs)
+        self.held = []
+        self.hold = False
+        self.lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=1, callback=None):
+        if self.hold:
+            with self.lock:
+                self.held.append(callback)
+        else:
+            callback()
+
+    def release(self):
+        with self.lock:
+            held, self.held = self.held, []
+        for callback in held:
+            callback()
+
+    def wait_for_held(self, count):
+        deadline = time.time() + 120
+        while len(self.held) < count:
+            if time.time() > deadline:
+                raise RuntimeError("Timed out waiting for publishes")
+            time.sleep(0.001)
+
+
+def send(pipeline, messages):
+    from azure.iot.device import Message
+
+    counter = Counter(messages)
+    for i in range(messages):
+        pipeline.send_message(Message("message {}".format(i)), callback=counter)
+    return counter
+
+
+def measure_in_flight(pipeline, messages):
+    """
+    Send messages while holding their publishes in the transport, then release them.  Returns
+    the bytes and blocks allocated per message while they are in flight, and the number of
+    generation 0 garbage collections per 1000 messages for the whole burst.
+    """
+    transport = pipeline._pipeline.transport
+    collections = [0]
+
+    def on_gc(phase, info):
+        if phase == "start" and info["generation"] == 0:
+            collections[0] += 1
+
+    gc.collect()
+    gc.callbacks.append(on_gc)
+    transport.hold = True
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        counter = send(pipeline, messages)
+        transport.wait_for_held(messages)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        transport.hold = False
+        transport.release()
+        if not counter.done.wait(120):
+            raise RuntimeError("Timed out waiting for sends")
+    finally:
+        tracemalloc.stop()
+        transport.hold = False
+        gc.callbacks.remove(on_gc)
+
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats)
+    count = sum(stat.count_diff for stat in stats)
+    return float(size) / messages, float(count) / messages, collections[0] * 1000.0 / messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--max-bytes", type=float, help="budget for bytes per in-flight message")
+    parser.add_argument("--max-blocks", type=float, help="budget for blocks per in-flight message")
+    args = parser.parse_args(argv)
+
+    pipeline = create_pipeline(transport_class=HoldingMQTTTransport)
+    # Warm up, so that caches and pools are filled before measuring
+    measure_in_flight(pipeline, args.messages)
+    bytes_per_message, blocks_per_message, gc_per_1000 = measure_in_flight(pipeline, args.messages)
+
+    result = {
+        "messages": args.messages,
+        "bytes_per_message": round(bytes_per_message, 1),
+        "blocks_per_message": round(blocks_per_message, 1),
+        "gc_per_1000_messages": round(gc_per_1000, 1),
+    }
+    print(
+        "messages={messages} in flight: {bytes_per_message} bytes {blocks_per_message} blocks "
+        "per message, gc: {gc_per_1000_messages} gen0 collections per 1000 messages".format(
+            **result
+        )
+    )
+
+    over_budget = []
+    if args.max_bytes is not None and bytes_per_message > args.max_bytes:
+        over_budget.append("bytes per message {} > {}".format(bytes_per_message, args.max_bytes))
+    if args.max_blocks is not None and blocks_per_message > args.max_blocks:
+        over_budget.append("blocks per message {} > {}".format(blocks_per_message, args.max_blocks))
+    if over_budget:
+        sys.exit("Over budget: " + ", ".join(over_budget))
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of operations and events per second through the full IoTHubPipeline stack.
+
+The MQTT transport is replaced by a fake which completes every publish immediately, so this
+measures the cost of the pipeline itself:
+  * send: send_message() operations, from the client API down to the transport and back
+  * receive: C2D messages, from the transport up to the client handler
+
+    python -m tests.perf.bench_pipeline_dispatch --messages 20000
+"""
+
+import argparse
+import threading
+import time
+
+CONNECTION_STRING = "HostName=localhost;DeviceId=bench;SharedAccessKey=Zm9vYmFy"
+
+
+class FakeMQTTTransport(object):
+    """
+    Stand-in for MQTTTransport which completes everything immediately
+    """
+
+    def __init__(self, **kwargs):
+        self.on_mqtt_connected_handler = None
+        self.on_mqtt_connection_failure_handler = None
+        self.on_mqtt_disconnected_handler = None
+        self.on_mqtt_message_received_handler = None
+
+    def connect(self, password=None):
+        self.on_mqtt_connected_handler()
+
+    def disconnect(self):
+        self.on_mqtt_disconnected_handler()
+
+    def publish(self, topic, payload, qos=1, callback=None):
+        callback()
+
+    def subscribe(self, topic, qos=1, callback=None):
+        callback()
+
+    def unsubscribe(self, topic, callback=None):
+        callback()
+
+
+class Counter(object):
+    """
+    Callable which sets an event once it has been called count times
+    """
+
+    def __init__(self, count):
+        self.remaining = count
+        self.done = threading.Event()
+
+    def __call__(self, *args, **kwargs):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.set()
+
+
+def create_pipeline(transport_class=FakeMQTTTransport):
+    from azure.iot.device.common import config
+    from azure.iot.device.common.evented_callback import EventedCallback
+    from azure.iot.device.common.pipeline import pipeline_stages_mqtt
+    from azure.iot.device.iothub.auth import SymmetricKeyAuthenticationProvider
+    from azure.iot.device.iothub.pipeline import IoTHubPipeline
+
+    pipeline_stages_mqtt.MQTTTransport = transport_class
+    pipeline = IoTHubPipeline(
+        SymmetricKeyAuthenticationProvider.parse(CONNECTION_STRING), config.BasePipelineConfig()
+    )
+    callback = EventedCallback()
+    pipeline.connect(callback=callback)
+    callback.wait_for_completion()
+    return pipeline
+
+
+def measure_send(pipeline, messages):
+    from azure.iot.device import Message
+
+    counter = Counter(messages)
+    start = time.time()
+    for i in range(messages):
+        pipeline.send_message(Message("message {}".format(i)), callback=counter)
+    if not counter.done.wait(120):
+        raise RuntimeError("Timed out waiting for sends")
+    return messages / (time.time() - start)
+
+
+def measure_receive(pipeline, messages):
+    counter = Counter(messages)
+    pipeline.on_c2d_message_received = counter
+    transport = pipeline._pipeline.transport
+    topic = "devices/bench/messages/devicebound/%24.mid=fake_id&%24.to=%2Fdevices%2Fbench"
+    start = time.time()
+    for _ in range(messages):
+        transport.on_mqtt_message_received_handler(topic, b"payload")
+    if not counter.done.wait(120):
+        raise RuntimeError("Timed out waiting for messages")
+    return messages / (time.time() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pipeline = create_pipeline()
+    send_rate = max(measure_send(pipeline, args.messages) for _ in range(args.runs))
+    receive_rate = max(measure_receive(pipeline, args.messages) for _ in range(args.runs))
+    result = {
+        "messages": args.messages,
+        "send_per_second": round(send_rate),
+        "receive_per_second": round(receive_rate),
+    }
+    print(
+        "messages={messages} send={send_per_second} ops/s "
+        "receive={receive_per_second} events/s".format(**result)
+    )
+    return result
+
+
+if __name__ == "__main__":
+    main()
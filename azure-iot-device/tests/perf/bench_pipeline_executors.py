@@ -0,0 +1,109 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of how a busy pipeline affects the other pipelines in the process.
+
+One "noisy" pipeline keeps its pipeline thread busy with slow work, while the other pipelines
+enter their pipeline threads one call at a time.  This reports the p50/p99 latency of those
+calls when all pipelines share the process-wide executors, when each pipeline has its own, and
+when pipelines are sharded across a few shared executors.
+
+    python -m tests.perf.bench_pipeline_executors --pipelines 20 --calls 200
+"""
+
+import argparse
+import threading
+import time
+
+MODES = ["shared", "per-pipeline", "sharded"]
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+def make_roots(mode, pipelines, shards):
+    from azure.iot.device.common import config
+    from azure.iot.device.common.pipeline import pipeline_stages_base, pipeline_thread
+
+    roots = []
+    for i in range(pipelines):
+        root = pipeline_stages_base.PipelineRootStage(config.BasePipelineConfig())
+        if mode == "per-pipeline":
+            root.executors = pipeline_thread.get_pipeline_executors(
+                "device{}".format(i), shards=pipeline_thread.PER_CLIENT
+            )
+        elif mode == "sharded":
+            root.executors = pipeline_thread.get_pipeline_executors(
+                "device{}".format(i), shards=shards
+            )
+        roots.append(root)
+    return roots
+
+
+def run(mode, pipelines, calls, shards, work_ms):
+    from azure.iot.device.common.pipeline import pipeline_thread
+
+    @pipeline_thread.invoke_on_pipeline_thread_nowait
+    def slow_work(stage):
+        time.sleep(work_ms / 1000.0)
+
+    @pipeline_thread.invoke_on_pipeline_thread
+    def quick_work(stage):
+        pass
+
+    roots = make_roots(mode, pipelines, shards)
+    noisy, quiet = roots[0], roots[1:]
+    stop = threading.Event()
+
+    def keep_noisy_pipeline_busy():
+        while not stop.is_set():
+            slow_work(noisy).result()
+
+    noise = threading.Thread(target=keep_noisy_pipeline_busy)
+    noise.daemon = True
+    noise.start()
+
+    samples = []
+    try:
+        for i in range(calls):
+            root = quiet[i % len(quiet)]
+            start = time.time()
+            quick_work(root)
+            samples.append((time.time() - start) * 1000)
+    finally:
+        stop.set()
+        noise.join()
+    return {
+        "mode": mode,
+        "pipelines": pipelines,
+        "latency_p50_ms": round(percentile(samples, 50), 3),
+        "latency_p99_ms": round(percentile(samples, 99), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pipelines", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--work-ms", type=float, default=5.0)
+    parser.add_argument("--mode", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args(argv)
+
+    results = []
+    for mode in args.mode:
+        result = run(mode, args.pipelines, args.calls, args.shards, args.work_ms)
+        results.append(result)
+        print(
+            "mode={mode} pipelines={pipelines} "
+            "latency p50={latency_p50_ms}ms p99={latency_p99_ms}ms".format(**result)
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
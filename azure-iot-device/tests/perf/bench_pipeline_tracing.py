@@ -0,0 +1,62 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of the cost of tracing the full IoTHubPipeline stack, and where its time goes.
+
+This measures send_message() and C2D throughput (as in bench_pipeline_dispatch) with no tracer
+and with a PipelineTracer, then prints the p50/p99 latency of the busiest traced stages.
+
+    python -m tests.perf.bench_pipeline_tracing --messages 20000
+"""
+
+import argparse
+from tests.perf import bench_pipeline_dispatch
+
+
+def run(tracer, messages, runs):
+    pipeline = bench_pipeline_dispatch.create_pipeline()
+    pipeline._pipeline.set_tracer(tracer)
+    send_rate = max(bench_pipeline_dispatch.measure_send(pipeline, messages) for _ in range(runs))
+    receive_rate = max(
+        bench_pipeline_dispatch.measure_receive(pipeline, messages) for _ in range(runs)
+    )
+    return send_rate, receive_rate
+
+
+def main(argv=None):
+    from azure.iot.device.common.pipeline import pipeline_tracing
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="number of histograms to print")
+    args = parser.parse_args(argv)
+
+    tracer = pipeline_tracing.PipelineTracer()
+    untraced_send, untraced_receive = run(None, args.messages, args.runs)
+    traced_send, traced_receive = run(tracer, args.messages, args.runs)
+    result = {
+        "messages": args.messages,
+        "untraced_send_per_second": round(untraced_send),
+        "traced_send_per_second": round(traced_send),
+        "untraced_receive_per_second": round(untraced_receive),
+        "traced_receive_per_second": round(traced_receive),
+        "histograms": tracer.get_summary(),
+    }
+    print(
+        "messages={messages} send={untraced_send_per_second}/{traced_send_per_second} ops/s "
+        "receive={untraced_receive_per_second}/{traced_receive_per_second} events/s "
+        "(untraced/traced)".format(**result)
+    )
+    busiest = sorted(
+        result["histograms"].items(), key=lambda item: item[1]["count"] * item[1]["mean_ms"]
+    )
+    for name, summary in reversed(busiest[-args.top :]):
+        print("  {} count={count} p50={p50_ms:.3f}ms p99={p99_ms:.3f}ms".format(name, **summary))
+    return result
+
+
+if __name__ == "__main__":
+    main()
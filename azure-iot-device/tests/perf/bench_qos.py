@@ -0,0 +1,86 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of telemetry throughput when publishing with QoS 0 and QoS 1.
+
+Each message is published and waited for before the next one is sent, as with a sync client
+calling send_message in a loop.  A QoS 1 publish completes on PUBACK, so it costs a round trip
+to the broker, while a QoS 0 publish completes once it has been written to the socket.
+
+    python -m tests.perf.bench_qos --messages 5000 --ack-delay 0 0.005
+
+The broker stand-in runs in another process.  --ack-delay simulates network latency by
+delaying the broker's acknowledgements.
+"""
+
+import argparse
+import threading
+import time
+from tests.perf.bench_network_loop import start_broker
+
+QOS_LEVELS = [0, 1]
+
+
+def run(port, qos, messages, payload_size):
+    """
+    Publish the given number of messages and return the throughput in messages per second
+    """
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    mqtt_transport.DEFAULT_PORT = port
+    transport = mqtt_transport.MQTTTransport(
+        client_id="bench", hostname="localhost", username="localhost/bench", ca_cert=get_ca_cert()
+    )
+    connected = threading.Event()
+    transport.on_mqtt_connected_handler = connected.set
+    transport.on_mqtt_disconnected_handler = lambda cause: None
+    transport.connect(password="password")
+    if not connected.wait(30):
+        raise RuntimeError("Timed out waiting for connection")
+
+    topic = "devices/bench/messages/events/"
+    payload = b"x" * payload_size
+    completed = threading.Event()
+    start = time.time()
+    for _ in range(messages):
+        completed.clear()
+        transport.publish(topic=topic, payload=payload, qos=qos, callback=completed.set)
+        if not completed.wait(30):
+            raise RuntimeError("Timed out waiting for publish")
+    elapsed = time.time() - start
+
+    transport.disconnect()
+    return messages / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument("--ack-delay", type=float, nargs="+", default=[0.0, 0.005])
+    parser.add_argument("--qos", type=int, nargs="+", choices=QOS_LEVELS, default=QOS_LEVELS)
+    args = parser.parse_args(argv)
+
+    results = []
+    for ack_delay in args.ack_delay:
+        broker, port = start_broker("--ack-delay", str(ack_delay))
+        try:
+            for qos in args.qos:
+                rate = run(port, qos, args.messages, args.payload_size)
+                result = {"qos": qos, "ack_delay": ack_delay, "messages_per_second": round(rate)}
+                results.append(result)
+                print(
+                    "qos={qos} ack_delay={ack_delay}s "
+                    "throughput={messages_per_second} messages/s".format(**result)
+                )
+        finally:
+            broker.terminate()
+            broker.wait()
+    return results
+
+
+if __name__ == "__main__":
+    main()
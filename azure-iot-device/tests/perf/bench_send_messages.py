@@ -0,0 +1,88 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of sending a batch of messages with send_message in a loop and with send_messages.
+
+send_message waits for each message to be acknowledged before the next one is sent, so a loop of
+them costs one round trip per message.  send_messages hands every message to the pipeline at
+once, so their publishes share round trips.
+
+    python -m tests.perf.bench_send_messages --messages 500 --ack-delay 0.1
+
+The broker stand-in runs in another process.  --ack-delay simulates network latency by
+delaying the broker's acknowledgements (0.1 is a 100 ms round trip).
+"""
+
+import argparse
+import time
+from tests.perf.bench_network_loop import start_broker
+
+CONNECTION_STRING = "HostName=localhost;DeviceId=bench;SharedAccessKey=Zm9vYmFy"
+MODES = ["send_message", "send_messages"]
+
+
+def run(mode, messages, payload_size):
+    """
+    Send the given number of messages and return the throughput in messages per second
+    """
+    from azure.iot.device import IoTHubDeviceClient
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    client = IoTHubDeviceClient.create_from_connection_string(
+        CONNECTION_STRING, ca_cert=get_ca_cert()
+    )
+    client.connect()
+
+    payload = "x" * payload_size
+    start = time.time()
+    if mode == "send_message":
+        for _ in range(messages):
+            client.send_message(payload)
+    else:
+        results = client.send_messages([payload] * messages)
+        failed = [result for result in results if result is not None]
+        if failed:
+            raise failed[0]
+    elapsed = time.time() - start
+
+    client.disconnect()
+    return messages / elapsed
+
+
+def main(argv=None):
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--payload-size", type=int, default=256)
+    parser.add_argument("--ack-delay", type=float, default=0.1)
+    parser.add_argument("--mode", nargs="+", choices=MODES, default=MODES)
+    args = parser.parse_args(argv)
+
+    results = []
+    broker, port = start_broker("--ack-delay", str(args.ack_delay))
+    try:
+        mqtt_transport.DEFAULT_PORT = port
+        for mode in args.mode:
+            rate = run(mode, args.messages, args.payload_size)
+            result = {
+                "mode": mode,
+                "messages": args.messages,
+                "ack_delay": args.ack_delay,
+                "messages_per_second": round(rate, 1),
+            }
+            results.append(result)
+            print(
+                "mode={mode} messages={messages} ack_delay={ack_delay}s "
+                "throughput={messages_per_second} messages/s".format(**result)
+            )
+    finally:
+        broker.terminate()
+        broker.wait()
+    return results
+
+
+if __name__ == "__main__":
+    main()
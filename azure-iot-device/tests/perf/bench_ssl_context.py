@@ -0,0 +1,95 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of MQTTTransport startup with and without the SSL context cache.
+
+Creates N transports (without connecting them) using the system trust store, and reports the
+time taken and the resident memory added per transport.
+
+    python -m tests.perf.bench_ssl_context --clients 100 1000
+
+Each measurement runs in a fresh child process so that memory from one run does not affect
+the next.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from tests.perf.bench_network_loop import get_rss_kb
+
+MODES = ["cold", "cached"]
+
+
+def run_child(mode, clients):
+    """
+    Create the given number of transports and measure them.  Runs in the child process.
+    """
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+
+    rss_before = get_rss_kb()
+    transports = []
+    start = time.time()
+    for i in range(clients):
+        if mode == "cold":
+            # Simulates the behavior before the cache existed
+            mqtt_transport.ssl_context_cache.clear()
+        transports.append(
+            mqtt_transport.MQTTTransport(
+                client_id="bench{}".format(i),
+                hostname="localhost",
+                username="localhost/bench{}".format(i),
+            )
+        )
+    elapsed = time.time() - start
+
+    return {
+        "mode": mode,
+        "clients": clients,
+        "seconds": round(elapsed, 3),
+        "ms_per_client": round(1000.0 * elapsed / clients, 3),
+        "rss_kb_per_client": round((get_rss_kb() - rss_before) / float(clients), 1),
+        "cache_misses": mqtt_transport.ssl_context_cache.misses,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "CLIENTS"), help="internal")
+    args = parser.parse_args(argv)
+
+    if args.child:
+        mode, clients = args.child
+        print(json.dumps(run_child(mode, int(clients))))
+        return
+
+    results = []
+    for clients in args.clients:
+        for mode in args.modes:
+            output = subprocess.check_output(
+                [
+                    sys.executable,
+                    "-m",
+                    "tests.perf.bench_ssl_context",
+                    "--child",
+                    mode,
+                    str(clients),
+                ],
+                universal_newlines=True,
+            )
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            print(
+                "{mode:>7} clients={clients:<6} time={seconds}s ({ms_per_client}ms/client) "
+                "rss={rss_kb_per_client}KB/client contexts={cache_misses}".format(**result)
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
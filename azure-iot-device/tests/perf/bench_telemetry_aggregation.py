@@ -0,0 +1,94 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Benchmark of sending many small readings with and without telemetry batching.
+
+Each reading is a ~100 byte JSON message, and all of them are sent with send_messages.  With
+telemetry_batch_max_messages set, readings are combined into batches which are each published
+(and billed) as one message.  The number of publishes the broker stand-in receives is reported
+alongside the throughput.
+
+    python -m tests.perf.bench_telemetry_aggregation --messages 5000 --batch-size 0 100
+
+The broker stand-in runs on a thread of this process, so that it can count the publishes.
+--ack-delay simulates network latency by delaying the broker's acknowledgements.
+"""
+
+import argparse
+import json
+import time
+
+CONNECTION_STRING = "HostName=localhost;DeviceId=bench;SharedAccessKey=Zm9vYmFy"
+
+
+def make_reading(i):
+    return json.dumps(
+        {"sensor": "bench-sensor-01", "sequence": i, "temperature": 21.5, "humidity": 40.25}
+    )
+
+
+def run(broker, messages, batch_size):
+    """
+    Send the given number of readings, and return (messages per second, publishes received by
+    the broker, average messages per batch)
+    """
+    from azure.iot.device import IoTHubDeviceClient
+    from tests.common.fake_mqtt_broker import get_ca_cert
+
+    client = IoTHubDeviceClient.create_from_connection_string(
+        CONNECTION_STRING, ca_cert=get_ca_cert(), telemetry_batch_max_messages=batch_size or None
+    )
+    client.connect()
+
+    readings = [make_reading(i) for i in range(messages)]
+    publishes_before = broker.publish_count
+    start = time.time()
+    results = client.send_messages(readings)
+    elapsed = time.time() - start
+    failed = [result for result in results if result is not None]
+    if failed:
+        raise failed[0]
+    publishes = broker.publish_count - publishes_before
+    average_batch_size = client._iothub_pipeline.average_telemetry_batch_size
+
+    client.disconnect()
+    return messages / elapsed, publishes, average_batch_size
+
+
+def main(argv=None):
+    import azure.iot.device.common.mqtt_transport as mqtt_transport
+    from tests.common.fake_mqtt_broker import FakeMQTTBroker
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument(
+        "--batch-size", type=int, nargs="+", default=[0, 100], help="0 disables batching"
+    )
+    parser.add_argument("--ack-delay", type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    results = []
+    with FakeMQTTBroker(ack_delay=args.ack_delay) as broker:
+        mqtt_transport.DEFAULT_PORT = broker.port
+        for batch_size in args.batch_size:
+            rate, publishes, average_batch_size = run(broker, args.messages, batch_size)
+            result = {
+                "batch_size": batch_size,
+                "messages": args.messages,
+                "messages_per_second": round(rate),
+                "publishes": publishes,
+                "average_batch_size": round(average_batch_size or 1, 1),
+            }
+            results.append(result)
+            print(
+                "batch_size={batch_size} messages={messages} "
+                "throughput={messages_per_second} messages/s publishes={publishes} "
+                "average_batch_size={average_batch_size}".format(**result)
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Microbenchmark of encoding the properties of outgoing messages onto their topic.
+
+encode_properties (with its cache of topic templates) is compared with encoding every property of
+every message, for messages with typical sets of properties.  Each message has its own
+message_id and custom property values, as they would in real telemetry.
+
+    python -m tests.perf.bench_topic_encoding --messages 100000
+"""
+
+import argparse
+import time
+from azure.iot.device.iothub.models import Message
+from azure.iot.device.iothub.pipeline import mqtt_topic_iothub
+
+TOPIC = "devices/bench/messages/events/"
+PROFILES = ["defaults", "message_id", "custom_properties"]
+ENCODERS = {
+    "cached": mqtt_topic_iothub.encode_properties,
+    "uncached": mqtt_topic_iothub._encode_properties_uncached,
+}
+
+
+def make_messages(profile, count):
+    messages = []
+    for i in range(count):
+        message = Message("{}")
+        if profile in ("message_id", "custom_properties"):
+            message.message_id = "bench-{}".format(i)
+        if profile == "custom_properties":
+            message.custom_properties["sensor"] = "bench-sensor-01"
+            message.custom_properties["sequence"] = i
+            message.custom_properties["alert"] = "false"
+        messages.append(message)
+    return messages
+
+
+def run(encoder, messages):
+    """
+    Encode the properties of each message, and return the number encoded per second
+    """
+    encode = ENCODERS[encoder]
+    start = time.time()
+    for message in messages:
+        encode(message, TOPIC)
+    return len(messages) / (time.time() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--profile", nargs="+", choices=PROFILES, default=PROFILES)
+    args = parser.parse_args(argv)
+
+    results = []
+    for profile in args.profile:
+        messages = make_messages(profile, args.messages)
+        for encoder in sorted(ENCODERS):
+            result = {
+                "profile": profile,
+                "encoder": encoder,
+                "ops_per_second": round(run(encoder, messages)),
+            }
+            results.append(result)
+            print("profile={profile} encoder={encoder} ops={ops_per_second}/s".format(**result))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Microbenchmark of parsing the topics of incoming C2D messages with many properties.
+
+The single-pass IncomingTopicParser (as IoTHubMQTTConverterStage uses it) is compared with
+classifying the topic with the is_*_topic checks and then extracting the properties with
+extract_properties_from_topic, each of which splits the topic again.
+
+    python -m tests.perf.bench_topic_parsing --messages 100000 --properties 2 10 30
+"""
+
+import argparse
+import time
+import six.moves.urllib as urllib
+from azure.iot.device.iothub.models import Message
+from azure.iot.device.iothub.pipeline import mqtt_topic_iothub
+
+DEVICE_ID = "bench"
+MODULE_ID = "bench-module"
+
+
+def make_topic(properties):
+    pairs = [
+        ("$.mid", "bench-message-id"),
+        ("$.to", "/devices/bench/messages/devicebound"),
+        ("$.ct", "application/json"),
+        ("$.ce", "utf-8"),
+    ]
+    pairs.extend(("property-{}".format(i), "value {}".format(i)) for i in range(properties))
+    return "devices/{}/messages/devicebound/{}".format(DEVICE_ID, urllib.parse.urlencode(pairs))
+
+
+def parse_with_checks(topic):
+    message = Message(b"{}")
+    if mqtt_topic_iothub.is_c2d_topic(topic, DEVICE_ID):
+        mqtt_topic_iothub.extract_properties_from_topic(topic, message)
+    elif mqtt_topic_iothub.is_input_topic(topic, DEVICE_ID, MODULE_ID):
+        mqtt_topic_iothub.extract_properties_from_topic(topic, message)
+        mqtt_topic_iothub.get_input_name_from_topic(topic)
+    return message
+
+
+def make_parse_with_parser():
+    parser = mqtt_topic_iothub.IncomingTopicParser(DEVICE_ID, MODULE_ID)
+
+    def parse_with_parser(topic):
+        message = Message(b"{}")
+        parsed_topic = parser.parse(topic)
+        mqtt_topic_iothub.set_message_properties(message, parsed_topic.properties)
+        return message
+
+    return parse_with_parser
+
+
+def run(parse, topic, messages):
+    """
+    Parse the topic the given number of times, and return the number parsed per second
+    """
+    start = time.time()
+    for _ in range(messages):
+        parse(topic)
+    return messages / (time.time() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--properties", type=int, nargs="+", default=[2, 10, 30])
+    args = parser.parse_args(argv)
+
+    parsers = [("checks", parse_with_checks), ("parser", make_parse_with_parser())]
+    results = []
+    for properties in args.properties:
+        topic = make_topic(properties)
+        for name, parse in parsers:
+            result = {
+                "properties": properties,
+                "parser": name,
+                "topics_per_second": round(run(parse, topic, args.messages)),
+            }
+            results.append(result)
+            print(
+                "properties={properties} parser={parser} "
+                "throughput={topics_per_second} topics/s".format(**result)
+            )
+    return results
+
+
+if __name__ == "__main__":
+    main()
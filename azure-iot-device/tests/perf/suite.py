@@ -0,0 +1,370 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Pipeline benchmark and regression suite.
+
+Drives IoTHubPipeline and ProvisioningPipeline through a fake MQTT transport which acks every
+publish, and answers every request, straight away on its own "network" thread (as paho would).
+Each scenario runs one operation at a time, and reports:
+  * ops_per_second, p50_ms and p99_ms: throughput and latency of each operation
+  * handoffs_per_op: functions handed to the pipeline and callback threads per operation
+  * retained_blocks_per_op and retained_bytes_per_op: memory (measured with tracemalloc) still
+    allocated per operation once a pass is over, after warming up.  This is what tracemalloc can
+    measure; CPython has no cheap count of every allocation.
+
+The scenarios are:
+  * send_message: send_message(), until the PUBACK
+  * get_twin: get_twin(), until the twin response
+  * method_round_trip: a method request, through the handler, until the method response is
+    published
+  * c2d: a C2D message, until the handler receives it
+  * provisioning_register: a DPS registration request, until the registration response
+
+    python -m tests.perf --ops 2000 --output results.json
+    python -m tests.perf --baseline results.json --tolerance 0.25
+
+With --baseline, this exits with an error if any metric is worse than in the baseline by more
+than the tolerance, so it can gate CI.
+"""
+
+import argparse
+import collections
+import json
+import platform
+import sys
+import threading
+import time
+import tracemalloc
+from six.moves import queue
+from tests.perf.bench_pipeline_dispatch import CONNECTION_STRING, FakeMQTTTransport
+
+PROVISIONING_HOST = "localhost"
+PROVISIONING_KEY = "Zm9vYmFy"
+WAIT_TIMEOUT = 60
+
+# For each metric, whether higher values are better, and the least change that can count as a
+# regression, however large it is relative to the baseline
+METRICS = collections.OrderedDict(
+    [
+        ("ops_per_second", (True, 0)),
+        ("p50_ms", (False, 0.05)),
+        ("p99_ms", (False, 0.2)),
+        ("handoffs_per_op", (False, 0.05)),
+        ("retained_blocks_per_op", (False, 1)),
+    ]
+)
+
+
+def get_request_id(topic):
+    return topic.split("$rid=")[1].split("&")[0]
+
+
+class RespondingMQTTTransport(FakeMQTTTransport):
+    """
+    Fake transport which acks publishes and answers requests on its own thread
+
+    :ivar on_publish: If set, called with the topic of every publish.
+    """
+
+    def __init__(self, **kwargs):
+        super(RespondingMQTTTransport, self).__init__(**kwargs)
+        self.on_publish = None
+        self._queue = queue.Queue()
+        thread = threading.Thread(target=self._run, name="fake-network")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            func, args = self._queue.get()
+            func(*args)
+
+    def receive(self, topic, payload):
+        """
+        Deliver a message to the pipeline from the network thread
+        """
+        self._queue.put((self.on_mqtt_message_received_handler, (topic, payload)))
+
+    def publish(self, topic, payload, qos=1, callback=None):
+        self._queue.put((callback, ()))
+        if topic.startswith("$iothub/twin/GET/"):
+            self.receive("$iothub/twin/res/200/?$rid=" + get_request_id(topic), b"{}")
+        elif topic.startswith("$dps/registrations/PUT/"):
+            self.receive(
+                "$dps/registrations/res/200/?$rid=" + get_request_id(topic),
+                b'{"operationId": "bench", "status": "assigned"}',
+            )
+        if self.on_publish:
+            self._queue.put((self.on_publish, (topic,)))
+
+    def subscribe(self, topic, qos=1, callback=None):
+        self._queue.put((callback, ()))
+
+    def unsubscribe(self, topic, callback=None):
+        self._queue.put((callback, ()))
+
+
+def wait(event):
+    if not event.wait(WAIT_TIMEOUT):
+        raise RuntimeError("Timed out waiting for operation")
+    event.clear()
+
+
+def call_and_wait(func, *args):
+    done = threading.Event()
+    func(*args, callback=lambda *args, **kwargs: done.set())
+    wait(done)
+
+
+def create_iothub_pipeline(*feature_names):
+    from azure.iot.device.common import config
+    from azure.iot.device.common.pipeline import pipeline_stages_mqtt
+    from azure.iot.device.iothub.auth import SymmetricKeyAuthenticationProvider
+    from azure.iot.device.iothub.pipeline import IoTHubPipeline
+
+    pipeline_stages_mqtt.MQTTTransport = RespondingMQTTTransport
+    pipeline = IoTHubPipeline(
+        SymmetricKeyAuthenticationProvider.parse(CONNECTION_STRING), config.BasePipelineConfig()
+    )
+    call_and_wait(pipeline.connect)
+    for feature_name in feature_names:
+        call_and_wait(pipeline.enable_feature, feature_name)
+    return pipeline
+
+
+class SendMessageScenario(object):
+    def __init__(self):
+        self.pipeline = create_iothub_pipeline()
+        self.done = threading.Event()
+
+    def run_one(self):
+        from azure.iot.device import Message
+
+        self.pipeline.send_message(Message("message"), callback=lambda error=None: self.done.set())
+        wait(self.done)
+
+
+class GetTwinScenario(object):
+    def __init__(self):
+        from azure.iot.device.iothub.pipeline import constant
+
+        self.pipeline = create_iothub_pipeline(constant.TWIN)
+        self.done = threading.Event()
+
+    def run_one(self):
+        self.pipeline.get_twin(callback=lambda twin=None, error=None: self.done.set())
+        wait(self.done)
+
+
+class MethodRoundTripScenario(object):
+    def __init__(self):
+        from azure.iot.device.iothub.models import MethodResponse
+        from azure.iot.device.iothub.pipeline import constant
+
+        self.pipeline = create_iothub_pipeline(constant.METHODS)
+        self.done = threading.Event()
+        self.transport = self.pipeline._pipeline.transport
+        self.transport.on_publish = self.on_publish
+        self.request_id = 0
+
+        def on_method_request_received(method_request):
+            self.pipeline.send_method_response(
+                MethodResponse.create_from_method_request(method_request, 200),
+                callback=lambda error=None: None,
+            )
+
+        self.pipeline.on_method_request_received = on_method_request_received
+
+    def on_publish(self, topic):
+        if topic.startswith("$iothub/methods/res/"):
+            self.done.set()
+
+    def run_one(self):
+        self.request_id += 1
+        self.transport.receive("$iothub/methods/POST/bench/?$rid={}".format(self.request_id), b"{}")
+        wait(self.done)
+
+
+class C2DScenario(object):
+    topic = "devices/bench/messages/devicebound/%24.mid=fake_id&%24.to=%2Fdevices%2Fbench"
+
+    def __init__(self):
+        from azure.iot.device.iothub.pipeline import constant
+
+        self.pipeline = create_iothub_pipeline(constant.C2D_MSG)
+        self.done = threading.Event()
+        self.transport = self.pipeline._pipeline.transport
+        self.pipeline.on_c2d_message_received = lambda message: self.done.set()
+
+    def run_one(self):
+        self.transport.receive(self.topic, b"payload")
+        wait(self.done)
+
+
+class ProvisioningRegisterScenario(object):
+    def __init__(self):
+        from azure.iot.device.common import config
+        from azure.iot.device.common.pipeline import pipeline_stages_mqtt
+        from azure.iot.device.provisioning.pipeline import ProvisioningPipeline
+        from azure.iot.device.provisioning.security import SymmetricKeySecurityClient
+
+        pipeline_stages_mqtt.MQTTTransport = RespondingMQTTTransport
+        security_client = SymmetricKeySecurityClient(
+            provisioning_host=PROVISIONING_HOST,
+            registration_id="bench",
+            id_scope="bench_scope",
+            symmetric_key=PROVISIONING_KEY,
+        )
+        self.pipeline = ProvisioningPipeline(security_client, config.BasePipelineConfig())
+        self.done = threading.Event()
+        self.pipeline.on_message_received = lambda *args: self.done.set()
+        call_and_wait(self.pipeline.connect)
+        call_and_wait(self.pipeline.enable_responses)
+        self.request_id = 0
+
+    def run_one(self):
+        self.request_id += 1
+        self.pipeline.send_request(request_id=str(self.request_id), request_payload=" ")
+        wait(self.done)
+
+
+SCENARIOS = collections.OrderedDict(
+    [
+        ("send_message", SendMessageScenario),
+        ("get_twin", GetTwinScenario),
+        ("method_round_trip", MethodRoundTripScenario),
+        ("c2d", C2DScenario),
+        ("provisioning_register", ProvisioningRegisterScenario),
+    ]
+)
+
+
+def percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100.0))
+    return sorted_values[index]
+
+
+def get_handoff_count(tracer):
+    summary = tracer.get_summary()
+    return sum(
+        summary.get("queue/" + name, {}).get("count", 0) for name in ("pipeline", "callback")
+    )
+
+
+def run_scenario(scenario_class, ops):
+    """
+    Run a scenario and return a dict of its metrics
+    """
+    from azure.iot.device.common.pipeline.pipeline_tracing import PipelineTracer
+
+    scenario = scenario_class()
+    # Warm up, so that caches and pools are filled before measuring
+    for _ in range(min(ops, 200)):
+        scenario.run_one()
+
+    latencies = []
+    start = time.time()
+    for _ in range(ops):
+        op_start = time.time()
+        scenario.run_one()
+        latencies.append(time.time() - op_start)
+    elapsed = time.time() - start
+    latencies.sort()
+
+    # Tracing and tracemalloc both slow the pipeline down, so count handoffs and memory in a
+    # separate pass
+    tracer = PipelineTracer()
+    scenario.pipeline._pipeline.set_tracer(tracer)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(ops):
+            scenario.run_one()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        scenario.pipeline._pipeline.set_tracer(None)
+    stats = after.compare_to(before, "filename")
+
+    return {
+        "ops": ops,
+        "ops_per_second": round(ops / elapsed),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "handoffs_per_op": round(get_handoff_count(tracer) / float(ops), 2),
+        "retained_blocks_per_op": round(sum(s.count_diff for s in stats) / float(ops), 2),
+        "retained_bytes_per_op": round(sum(s.size_diff for s in stats) / float(ops), 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results to a baseline, and return a list of descriptions of the metrics which are
+    worse than in the baseline by more than the given fraction
+    """
+    regressions = []
+    for name, metrics in results["scenarios"].items():
+        baseline_metrics = baseline.get("scenarios", {}).get(name)
+        if baseline_metrics is None:
+            continue
+        for metric, (higher_is_better, min_change) in METRICS.items():
+            value = metrics[metric]
+            baseline_value = baseline_metrics.get(metric)
+            if baseline_value is None:
+                continue
+            if higher_is_better:
+                regressed = value < baseline_value * (1 - tolerance)
+            else:
+                regressed = (
+                    value > baseline_value * (1 + tolerance) and value - baseline_value > min_change
+                )
+            if regressed:
+                regressions.append(
+                    "{}.{}: {} (baseline {})".format(name, metric, value, baseline_value)
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.perf", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("--ops", type=int, default=2000, help="operations per scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", help="file to write the results to, as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="fraction by which a metric can be worse than the baseline (default 0.25)",
+    )
+    args = parser.parse_args(argv)
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scenarios": collections.OrderedDict(),
+    }
+    for name in args.scenarios:
+        metrics = run_scenario(SCENARIOS[name], args.ops)
+        results["scenarios"][name] = metrics
+        print(
+            "{:<22} {ops_per_second:>7} ops/s p50={p50_ms}ms p99={p99_ms}ms "
+            "handoffs/op={handoffs_per_op} retained blocks/op={retained_blocks_per_op}".format(
+                name, **metrics
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit("Regressions: " + ", ".join(regressions))
+    return results
@@ -98,7 +98,15 @@ def input_security_client(params_security_clients):
 
 @pytest.fixture
 def pipeline_configuration(mocker):
-    return mocker.MagicMock()
+    pipeline_configuration = mocker.MagicMock()
+    # Use the default (Paho) transport, which is mocked below
+    pipeline_configuration.asyncio_loop = None
+    pipeline_configuration.executor_shards = None
+    pipeline_configuration.tracer = None
+    pipeline_configuration.handler_executor = None
+    pipeline_configuration.auto_reconnect = False
+    pipeline_configuration.connection_state_handler = None
+    return pipeline_configuration
 
 
 # automatically mock the transport for all tests in this file.